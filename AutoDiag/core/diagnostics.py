@@ -42,6 +42,12 @@ except ImportError:
 # Import VCI manager
 try:
     from AutoDiag.core.vci_manager import get_vci_manager, VCITypes, VCIStatus
+    from shared.ecu_scan import READ_DTCS, READ_VIN
+    from shared.uds_did import (
+        DID_ECU_HARDWARE_NUMBER, DID_ECU_SOFTWARE_VERSION, DID_SPARE_PART_NUMBER, DID_VIN,
+        DidReader, decode_did_value
+    )
+    from shared.ecu_did_cache import EcuDidCache
     VCI_MANAGER_AVAILABLE = True
 except ImportError:
     VCI_MANAGER_AVAILABLE = False
@@ -130,6 +136,11 @@ class DiagnosticsController(QObject):
 
         # VCI manager
         self.vci_manager = None
+        self._did_readers: Dict[Tuple[int, int], DidReader] = {}
+        self._did_cache: Optional[EcuDidCache] = None
+        # Latest values pushed by the ECU's periodic DIDs: name -> (name, value, unit)
+        self._periodic_values: Dict[str, Tuple[str, str, str]] = {}
+        self._periodic_units: Dict[str, str] = {}
         if VCI_MANAGER_AVAILABLE:
             self.vci_manager = get_vci_manager()
             self.vci_manager.add_status_callback(self._on_vci_status_change)
@@ -536,6 +547,7 @@ class DiagnosticsController(QObject):
         try:
             if self.live_data_timer:
                 self.live_data_timer.stop()
+            self.stop_periodic_live_data()
             
             self.is_streaming = False
             self._update_status("⏹ Live data stream stopped")
@@ -551,8 +563,8 @@ class DiagnosticsController(QObject):
         """Update live data values from real CAN sources with realtime monitoring"""
         try:
             if self.is_streaming:
-                # Get live data from CAN database only
-                live_data = self._get_live_data_from_can_db()
+                # ECU-pushed periodic DIDs first, then the CAN database
+                live_data = list(self._periodic_values.values()) + self._get_live_data_from_can_db()
 
                 # Update UI table
                 if 'update_live_data_table' in self.ui_callbacks:
@@ -569,6 +581,29 @@ class DiagnosticsController(QObject):
         except Exception as e:
             logger.error(f"Error updating live data: {e}")
     
+    def start_periodic_live_data(self, signals: List[Any], rate: Any = None,
+                                 tx_id: int = 0x7E0, rx_id: int = 0x7E8) -> bool:
+        """
+        Stream ``signals`` (StreamSignal) as periodic DIDs pushed by the ECU
+        into the live data table. False if the ECU only supports polling.
+        """
+        if not self.vci_manager or not self.vci_manager.is_connected():
+            return False
+        self._periodic_values.clear()
+        self._periodic_units = {signal.name: signal.unit for signal in signals}
+        return self.vci_manager.start_periodic_stream(signals, self._on_periodic_values, rate, tx_id, rx_id)
+
+    def stop_periodic_live_data(self):
+        if self.vci_manager and self._periodic_units:
+            self.vci_manager.stop_periodic_stream()
+        self._periodic_units = {}
+        self._periodic_values.clear()
+
+    def _on_periodic_values(self, values: Dict[str, float], timestamp: float):
+        """Called from the VCI listener thread for every periodic message"""
+        for name, value in values.items():
+            self._periodic_values[name] = (name, f"{value:.2f}", self._periodic_units.get(name, ""))
+
     def _get_live_data_from_can_db(self) -> List[Tuple[str, str, str]]:
         """Get live data from CAN database using realtime data"""
         if not self.current_vehicle_db:
@@ -791,7 +826,7 @@ class DiagnosticsController(QObject):
         }
 
     def _scan_all_modules(self) -> List[Dict[str, Any]]:
-        """Scan all standard CAN modules (0x7E0-0x7E7)"""
+        """Scan every responding module (functional discovery, parallel requests)"""
         modules_found = []
         
         # Standard UDS Request IDs
@@ -806,35 +841,34 @@ class DiagnosticsController(QObject):
             0x7E7: "Instrument Panel / Dashboard"
         }
 
-        # Iterate standard functional IDs
-        for tx_id in range(0x7E0, 0x7E8):
-            rx_id = tx_id + 8
+        self._update_status("Scanning all modules...")
+        scan_results = self.vci_manager.scan_ecus(requests=[READ_VIN, READ_DTCS])
+
+        for rx_id, result in sorted(scan_results.items()):
+            tx_id = result.tx_id if result.tx_id is not None else rx_id
             module_name = module_names.get(tx_id, f"Unknown Module ({hex(tx_id)})")
-            
-            # Update status
-            self._update_status(f"Scanning {module_name}...")
-            QCoreApplication.processEvents() # Ensure UI updates
-            
-            try:
-                # Try to read DTCs from this module
-                dtcs = self._read_real_dtcs(tx_id=tx_id, rx_id=rx_id)
-                
-                modules_found.append({
-                    "id": hex(tx_id),
-                    "name": module_name,
-                    "dtcs": dtcs,
-                    "status": "Fault" if dtcs else "OK"
-                })
-            except Exception as e:
-                # Log failure but continue scanning other modules
+            module = {
+                "id": hex(tx_id),
+                "name": module_name,
+                "dtcs": [],
+                "status": "OK"
+            }
+
+            dtc_response = result.positive(READ_DTCS)
+            if dtc_response:
+                module["dtcs"] = self._parse_dtc_response(dtc_response)
+                module["status"] = "Fault" if module["dtcs"] else "OK"
+                logger.info(f"Read {len(module['dtcs'])} DTCs from module {hex(tx_id)}")
+            elif READ_DTCS in result.failed:
                 # Report the failure in the list (Fail-loud)
-                logger.warning(f"Failed to scan {module_name}: {e}")
-                modules_found.append({
-                    "id": hex(tx_id),
-                    "name": module_name,
-                    "dtcs": [],
-                    "status": f"Communication Error"
-                })
+                logger.warning(f"Failed to scan {module_name}: no answer to 0x19")
+                module["status"] = "Communication Error"
+
+            vin_response = result.positive(READ_VIN)
+            if vin_response:
+                module["vin"] = vin_response[3:].decode('ascii', errors='ignore').strip()
+
+            modules_found.append(module)
                  
         return modules_found
 
@@ -1187,7 +1221,8 @@ class DiagnosticsController(QObject):
         Args:
             level: Security level (e.g. 1, 3, 5, etc.)
             algorithm: Callback function(seed: bytes) -> bytes.
-                       If None, a default (seed + 0) algorithm is used.
+                       If None, the algorithm registered for the ECU's
+                       identification is used (seed/key registry).
         """
         # Check tier access for Security Access (usually a Pro/Master feature)
         if not self.enforce_tier_access(self.current_brand, "security_access"):
@@ -1196,11 +1231,8 @@ class DiagnosticsController(QObject):
         if not self.vci_manager or not self.vci_manager.is_connected():
             return False
             
-        if algorithm is None:
-            # Security Hardening: Never allow default bypass
-            logger.error("Security access failed: No algorithm provided")
-            return False
-            
+        # Security Hardening: never a default bypass; without a callback the
+        # registry must know the ECU or the unlock fails
         return self.vci_manager.security_access(level, algorithm)
 
 
@@ -1598,40 +1630,20 @@ class DiagnosticsController(QObject):
         }
 
         try:
-            # Send UDS service 0x22 (Read Data By Identifier) to read ECU info
-            # Common DIDs:
+            # One batched UDS service 0x22 (Read Data By Identifier) request:
             # F190 - VIN
             # F187 - Part Number
             # F189 - Software Version
             # F191 - Hardware Version
-
-            # Read VIN (DID F190)
-            try:
-                vin = self._read_did(0xF190)
-                ecu_info["vin"] = vin if vin else "Unable to read"
-            except Exception:
-                ecu_info["vin"] = "Unable to read"
-
-            # Read Part Number (DID F187)
-            try:
-                part_number = self._read_did(0xF187)
-                ecu_info["part_number"] = part_number if part_number else "Unable to read"
-            except Exception:
-                ecu_info["part_number"] = "Unable to read"
-
-            # Read Software Version (DID F189)
-            try:
-                sw_version = self._read_did(0xF189)
-                ecu_info["software_version"] = sw_version if sw_version else "Unable to read"
-            except Exception:
-                ecu_info["software_version"] = "Unable to read"
-
-            # Read Hardware Version (DID F191)
-            try:
-                hw_version = self._read_did(0xF191)
-                ecu_info["hardware_version"] = hw_version if hw_version else "Unable to read"
-            except Exception:
-                ecu_info["hardware_version"] = "Unable to read"
+            fields = {
+                "vin": DID_VIN,
+                "part_number": DID_SPARE_PART_NUMBER,
+                "software_version": DID_ECU_SOFTWARE_VERSION,
+                "hardware_version": DID_ECU_HARDWARE_NUMBER,
+            }
+            values = self._read_dids(list(fields.values()), cached=True)
+            for key, did in fields.items():
+                ecu_info[key] = values.get(did) or "Unable to read"
 
             ecu_info["ecu_type"] = "Engine Control Module"
             ecu_info["calibration_date"] = datetime.now().strftime("%Y-%m-%d")
@@ -1644,39 +1656,34 @@ class DiagnosticsController(QObject):
 
         return ecu_info
 
-    def _read_did(self, did: int) -> Optional[str]:
+    def _read_did(self, did: int, tx_id: int = 0x7E0, rx_id: int = 0x7E8) -> Optional[str]:
         """Read a Data Identifier from ECU using UDS service 0x22"""
+        return self._read_dids([did], tx_id, rx_id).get(did)
+
+    def _read_dids(self, dids: List[int], tx_id: int = 0x7E0, rx_id: int = 0x7E8,
+                   cached: bool = False) -> Dict[int, str]:
+        """
+        Read several Data Identifiers in as few 0x22 requests as the ECU allows.
+        With ``cached``, identification DIDs come from the per-VIN cache after
+        one validation read.
+        """
+        reader = self._did_readers.get((tx_id, rx_id))
+        if reader is None:
+            def request(payload: bytes) -> Optional[bytes]:
+                return self._send_uds_request(payload[0], list(payload[1:]), tx_id, rx_id)
+            reader = DidReader(request)
+            self._did_readers[(tx_id, rx_id)] = reader
         try:
-            did_high = (did >> 8) & 0xFF
-            did_low = did & 0xFF
-            
-            # Send UDS Service 0x22 (Read Data By Identifier)
-            # Request: 22 [DID_HIGH] [DID_LOW]
-            response = self._send_uds_request(0x22, [did_high, did_low])
-            
-            # Response: 62 [DID_HIGH] [DID_LOW] [DATA...]
-            if response and len(response) >= 3:
-                if response[0] == 0x62:
-                    # Skip service ID (62) and DID bytes (2)
-                    data = response[3:]
-                    
-                    # Try to decode as ASCII first (common for VIN, Part Numbers)
-                    try:
-                        # Filter out non-printable characters for display safety
-                        decoded = data.decode('ascii').strip()
-                        if all(32 <= ord(c) <= 126 for c in decoded):
-                            return decoded
-                    except UnicodeDecodeError:
-                        pass
-                        
-                    # Fallback to hex string if not valid ASCII
-                    return data.hex().upper()
-            
-            return None
+            if cached:
+                if self._did_cache is None:
+                    self._did_cache = EcuDidCache()
+                values = self._did_cache.read(reader, f"{tx_id:X}", dids)
+            else:
+                values = reader.read(dids)
+            return {did: decode_did_value(data) for did, data in values.items()}
         except Exception as e:
-            logger.error(f"Error reading DID 0x{did:04X}: {e}")
-            return None
-
+            logger.error(f"Error reading DIDs {', '.join(f'0x{did:04X}' for did in dids)}: {e}")
+            return {}
 
     def _format_ecu_info(self, ecu_info: Dict[str, Any]) -> str:
         """Format ECU information for display"""
@@ -1,15 +1,27 @@
+import atexit
 import logging
 import threading
 import time
 import os
 import sys
+from pathlib import Path
 from typing import List, Dict, Any, Optional, Callable
 from enum import Enum
 
 # Import J2534 and ISO-TP support
 try:
     from shared.j2534_passthru import J2534PassThru, J2534Protocol, J2534Message, get_passthru_device
-    from shared.isotp_handler import IsoTpHandler
+    from shared.isotp_handler import IsoTpHandler, FUNCTIONAL_ID_11BIT
+    from shared.ecu_scan import ParallelEcuScanner, DEFAULT_SCAN_REQUESTS, physical_scan
+    from shared.uds_session import UdsSessionManager
+    from shared.uds_periodic import PeriodicDidStream, PeriodicRate
+    from shared.uds_transfer import UdsTransferEngine, TransferReport
+    from shared.uds_memory import MemoryDumpEngine, DumpReport
+    from shared.uds_scheduler import UdsRequestScheduler, RequestPriority
+    from shared.uds_did import DidReader
+    from shared.ecu_did_cache import EcuDidCache
+    from shared.seed_key import get_seed_key_registry, unlock
+    from shared.uds_recording import UdsRecorder, UdsReplayTransport
     from AutoDiag.core.j2534_bridge_client import J2534BridgeClient
 except ImportError:
     # Fallback/Mock for environment without shared modules (e.g. testing)
@@ -101,6 +113,21 @@ class VCIManager:
         self.is_scanning = False
         self.active_channel_id = None
         self.active_protocol_name = None
+        # Software ISO-TP handlers per (tx_id, rx_id), reused across requests
+        self._isotp_handlers: Dict[tuple, IsoTpHandler] = {}
+        # 0x78 handling, session/security tracking and idle keep-alive
+        self.uds_sessions = UdsSessionManager(self._uds_send, self._uds_receive)
+        # Priority order (user > flash > live data > keep-alive) and coalescing
+        # of identical requests from different tabs on this channel
+        self.request_scheduler = UdsRequestScheduler(self.uds_sessions.request)
+        self.uds_sessions.defer_keep_alive = self.request_scheduler.busy
+        # Seed/key algorithms by ECU identification and this session's accepted keys
+        self.seed_keys = get_seed_key_registry()
+        # Conversation recorder and the replay transport standing in for a VCI
+        self._recorder: Optional[UdsRecorder] = None
+        self._replay: Optional[UdsReplayTransport] = None
+        # Periodic DID streams (0x2C/0x2A) per response ID
+        self._periodic_streams: Dict[int, PeriodicDidStream] = {}
         
         # Register cleanup on exit to prevent zombie VCI handles
         atexit.register(self.disconnect)
@@ -122,7 +149,7 @@ class VCIManager:
                 logger.error(f"Error in status callback: {e}")
 
         # 2. Emit Signals (if Qt available)
-        if HAS_QT:
+        if hasattr(self, 'status_changed'):
             try:
                 self.status_changed.emit(event, data)
                 
@@ -309,6 +336,12 @@ class VCIManager:
             return True
             
         try:
+            self.stop_periodic_stream()
+            self.uds_sessions.stop_keep_alive()
+            self.uds_sessions.reset()
+            self.seed_keys.reset()
+            self._isotp_handlers.clear()
+            self._replay = None
             if self.connected_vci:
                 if self.connected_vci.device_type == VCITypes.J2534:
                      if self.connected_vci._j2534_device:
@@ -411,10 +444,17 @@ class VCIManager:
             
         return None
 
-    def send_uds_request(self, data: bytes, tx_id: int = 0x7E0, rx_id: int = 0x7E8, timeout_ms: int = 2000) -> Optional[bytes]:
+    def send_uds_request(self, data: bytes, tx_id: int = 0x7E0, rx_id: int = 0x7E8,
+                         timeout_ms: Optional[int] = None,
+                         priority: "RequestPriority" = None) -> Optional[bytes]:
         """
-        Send a UDS request using ISO-TP and return the response data.
+        Send a UDS request using ISO-TP and return the final response data.
         This is the main entry point for diagnostic operations.
+        Response-pending (0x78) replies are waited out with the ECU's P2*;
+        see ``uds_sessions`` for the tracked session and security level.
+        Without ``timeout_ms`` the wait follows the ECU's P2 and observed
+        latency. ``priority`` defaults to a user action; identical read
+        requests already in flight share one bus transaction.
         """
         if not self.connected_vci:
             logger.error("Not connected to VCI")
@@ -425,62 +465,246 @@ class VCIManager:
             if not self.initialize_protocol("ISO15765"):
                 return None
 
-        # Hardware ISO-TP (J2534 ISO15765)
-        if hasattr(self, 'active_protocol_name') and self.active_protocol_name == "ISO15765" and self.connected_vci.device_type == VCITypes.J2534:
+        return self.request_scheduler.submit(data, tx_id, rx_id, timeout_ms,
+                                             priority if priority is not None else RequestPriority.USER)
+
+    def _hardware_isotp(self) -> bool:
+        return (self.active_protocol_name == "ISO15765"
+                and self.connected_vci is not None
+                and self.connected_vci.device_type == VCITypes.J2534)
+
+    def _isotp_handler(self, tx_id: int, rx_id: int) -> IsoTpHandler:
+        handler = self._isotp_handlers.get((tx_id, rx_id))
+        if handler is None:
+            handler = IsoTpHandler(self, tx_id, rx_id)
+            self._isotp_handlers[(tx_id, rx_id)] = handler
+        return handler
+
+    def _uds_send(self, data: bytes, tx_id: int, rx_id: int) -> bool:
+        """Session layer transport: send one UDS request"""
+        if self._replay is not None:
+            sent = self._replay.send(data, tx_id, rx_id)
+        else:
+            sent = self._vci_send(data, tx_id, rx_id)
+        recorder = self._recorder
+        if sent and recorder is not None:
+            recorder.record_request(data, tx_id, rx_id)
+        return sent
+
+    def _uds_receive(self, tx_id: int, rx_id: int, timeout_ms: int) -> Optional[bytes]:
+        """Session layer transport: next complete response from ``rx_id``"""
+        if self._replay is not None:
+            response = self._replay.receive(tx_id, rx_id, timeout_ms)
+        else:
+            response = self._vci_receive(tx_id, rx_id, timeout_ms)
+        recorder = self._recorder
+        if response is not None and recorder is not None:
+            recorder.record_response(rx_id, response)
+        return response
+
+    def _vci_send(self, data: bytes, tx_id: int, rx_id: int) -> bool:
+        if not self.connected_vci:
+            return False
+
+        # Hardware ISO-TP (J2534 ISO15765): the device segments the message
+        if self._hardware_isotp():
             try:
-                # Construct J2534 Message (ID + Data)
-                tx_id_bytes = tx_id.to_bytes(4, 'big')
-                full_data = tx_id_bytes + data
-                
-                msg = J2534Message(J2534Protocol.ISO15765, data=full_data)
-                
-                if self.send_to_channel(msg):
-                    # Read response
-                    # Note: J2534 ReadMsgs for ISO15765 typically returns the reassembled message
-                    # The first 4 bytes are the RxID (e.g. 0x7E8)
-                    response_msg = self.read_message(timeout_ms)
-                    if response_msg and response_msg.data:
-                        if len(response_msg.data) > 4:
-                            return response_msg.data[4:]
-                    return None
-                return None
+                msg = J2534Message(J2534Protocol.ISO15765, data=tx_id.to_bytes(4, 'big') + bytes(data))
+                return self.send_to_channel(msg)
             except Exception as e:
                 logger.error(f"Hardware ISO-TP error: {e}")
-                return None
+                return False
 
         # Software ISO-TP (CAN / ELM327)
-        # Create ISO-TP handler
-        isotp = IsoTpHandler(self, tx_id, rx_id, timeout_ms)
-        
-        # Send
-        if not isotp.send_data(data):
-            logger.error("Failed to send UDS request")
+        return self._isotp_handler(tx_id, rx_id).send_data(data)
+
+    def _vci_receive(self, tx_id: int, rx_id: int, timeout_ms: int) -> Optional[bytes]:
+        if not self.connected_vci:
             return None
-            
-        # Receive
-        response = isotp.receive_data(timeout_ms)
-        return response
+
+        if self._hardware_isotp():
+            # J2534 ReadMsgs for ISO15765 returns reassembled messages;
+            # the first 4 bytes are the RxID. Skip other ECUs' traffic.
+            deadline = time.monotonic() + timeout_ms / 1000.0
+            try:
+                while True:
+                    remaining = int((deadline - time.monotonic()) * 1000)
+                    if remaining <= 0:
+                        return None
+                    response_msg = self.read_message(remaining)
+                    if response_msg is None:
+                        return None
+                    data = response_msg.data
+                    if data and len(data) > 4 and int.from_bytes(data[:4], 'big') == rx_id:
+                        return bytes(data[4:])
+            except Exception as e:
+                logger.error(f"Hardware ISO-TP error: {e}")
+                return None
+
+        return self._isotp_handler(tx_id, rx_id).receive_data(timeout_ms)
+
+    def start_recording(self):
+        """Record every UDS request/response on this channel from now on"""
+        self._recorder = UdsRecorder()
+        logger.info("Recording UDS conversation")
+
+    def stop_recording(self, path) -> Optional[Path]:
+        """Stop recording and save the conversation to ``path``"""
+        recorder, self._recorder = self._recorder, None
+        if recorder is None:
+            return None
+        device = self.connected_vci.name if self.connected_vci else ""
+        return recorder.save(path, device=device)
+
+    def connect_replay(self, path, timing: bool = False) -> bool:
+        """
+        Stand in for a VCI with a recorded conversation: every UDS request
+        is answered from ``path``. ``timing`` replays the recorded delays.
+        """
+        if self.is_connected():
+            self.disconnect()
+        try:
+            self._replay = UdsReplayTransport(path, timing=timing)
+        except (OSError, ValueError) as e:
+            logger.error(f"Cannot replay {path}: {e}")
+            return False
+        device = VCIDevice(f"Replay: {Path(path).name}", VCITypes.SIMULATOR, path=str(path))
+        self.connected_vci = device
+        self.active_protocol_name = "ISO15765"
+        self.active_channel_id = 0
+        self.status = VCIStatus.CONNECTED
+        self._notify_status("connected", device)
+        return True
+
+    def scan_ecus(self, requests=None, functional_id: int = FUNCTIONAL_ID_11BIT,
+                  max_in_flight: int = 8) -> Dict[int, Any]:
+        """
+        Find every ECU with a functional tester present and collect their
+        answers to ``requests`` (default: VIN and DTCs) in parallel.
+        Returns response CAN ID -> EcuScanResult.
+        While recording or replaying, ECUs are scanned one at a time through
+        the session layer instead, so the scan is part of the conversation.
+        """
+        if not self.connected_vci:
+            logger.error("Not connected to VCI")
+            return {}
+
+        # Hold the channel for the whole scan: other requests (live data,
+        # keep-alives, periodic streams) would otherwise interleave with it
+        with self.request_scheduler.turn(RequestPriority.USER), self.uds_sessions.exclusive():
+            if self._recorder is not None or self._replay is not None:
+                return physical_scan(
+                    lambda data, tx_id, rx_id, timeout_ms: self.send_uds_request(data, tx_id, rx_id, timeout_ms),
+                    requests or DEFAULT_SCAN_REQUESTS,
+                    probe_timeout_ms=lambda tx_id, rx_id: self.uds_sessions.response_timeout_ms(
+                        tx_id, rx_id, probe=True))
+
+            # Functional addressing and per-ECU reassembly need raw CAN frames;
+            # hardware ISO-TP channels only deliver one configured ECU
+            hardware_isotp = (self.active_protocol_name == "ISO15765"
+                              and self.connected_vci.device_type == VCITypes.J2534)
+            if self.active_channel_id is None or hardware_isotp:
+                if not self.initialize_protocol("CAN"):
+                    return {}
+
+            scanner = ParallelEcuScanner(self, functional_id=functional_id, max_in_flight=max_in_flight,
+                                         sessions=self.uds_sessions)
+            return scanner.scan(requests or DEFAULT_SCAN_REQUESTS)
+
+    def start_periodic_stream(self, signals, on_values: Callable[[Dict[str, float], float], None],
+                              rate=None, tx_id: int = 0x7E0, rx_id: int = 0x7E8) -> bool:
+        """
+        Have the ECU transmit ``signals`` periodically (UDS 0x2C + 0x2A) and
+        deliver decoded values to ``on_values``. False if the ECU does not
+        support it; keep polling in that case.
+        """
+        if not self.connected_vci:
+            logger.error("Not connected to VCI")
+            return False
+
+        self.stop_periodic_stream(rx_id)
+        stream = PeriodicDidStream(lambda data: self.send_uds_request(data, tx_id, rx_id,
+                                                                      priority=RequestPriority.LIVE_DATA),
+                                   on_values=on_values)
+        self.uds_sessions.add_listener(rx_id, stream.feed)
+        if not stream.start(signals, rate or PeriodicRate.FAST):
+            self.uds_sessions.remove_listener(rx_id, stream.feed)
+            return False
+        self._periodic_streams[rx_id] = stream
+        self.uds_sessions.start_listening(tx_id, rx_id)
+        return True
+
+    def stop_periodic_stream(self, rx_id: Optional[int] = None):
+        """Stop one (or every) periodic DID stream"""
+        for key in [rx_id] if rx_id is not None else list(self._periodic_streams):
+            stream = self._periodic_streams.pop(key, None)
+            if stream is None:
+                continue
+            self.uds_sessions.stop_listening(key)
+            if self.connected_vci:
+                stream.stop()
+            self.uds_sessions.remove_listener(key, stream.feed)
+
+    def transfer_engine(self, tx_id: int = 0x7E0, rx_id: int = 0x7E8) -> "UdsTransferEngine":
+        """0x34/0x36/0x37 engine on this channel, using the ECU's announced P2/P2*"""
+        session = self.uds_sessions.get_session(tx_id, rx_id)
+        return UdsTransferEngine(self._uds_send, self._uds_receive, tx_id, rx_id,
+                                 p2_ms=self.uds_sessions.response_timeout_ms(tx_id, rx_id),
+                                 p2_star_ms=session.p2_star_ms + self.uds_sessions.response_margin_ms)
+
+    def download_to_ecu(self, address: int, data: bytes, tx_id: int = 0x7E0, rx_id: int = 0x7E8,
+                        erase: bool = True, **kwargs) -> "TransferReport":
+        """
+        Erase (optional) and download ``data`` to ``address``. The ECU must
+        already be in the programming session with security access granted.
+        """
+        if not self.connected_vci:
+            logger.error("Not connected to VCI")
+            return TransferReport(success=False, error="Not connected")
+
+        engine = self.transfer_engine(tx_id, rx_id)
+        with self.request_scheduler.turn(RequestPriority.FLASH), self.uds_sessions.exclusive():
+            if erase and not engine.erase(address, len(data)):
+                return TransferReport(success=False, error="Erase failed")
+            return engine.download(address, data, **kwargs)
+
+    def dump_ecu_memory(self, address: int, size: int, output, tx_id: int = 0x7E0, rx_id: int = 0x7E8,
+                        method: str = "auto", **kwargs) -> "DumpReport":
+        """Read ``size`` bytes at ``address`` to ``output`` (path or binary file)"""
+        if not self.connected_vci:
+            logger.error("Not connected to VCI")
+            return DumpReport(success=False, error="Not connected")
+
+        session = self.uds_sessions.get_session(tx_id, rx_id)
+        engine = MemoryDumpEngine(self._uds_send, self._uds_receive, tx_id, rx_id,
+                                  p2_ms=self.uds_sessions.response_timeout_ms(tx_id, rx_id),
+                                  p2_star_ms=session.p2_star_ms + self.uds_sessions.response_margin_ms)
+        with self.request_scheduler.turn(RequestPriority.FLASH), self.uds_sessions.exclusive():
+            return engine.dump(address, size, output, method=method, **kwargs)
 
     def tester_present(self, tx_id: int = 0x7E0, rx_id: int = 0x7E8) -> bool:
         """
         Send Tester Present (Service 0x3E) to keep session alive.
         Sub-function 0x00 (Response Required) or 0x80 (No Response Required)
         """
-        # We usually use 0x80 (No response) for periodic keep-alive to reduce bus load
-        # But here we use 0x00 to verify connection if called manually
-        response = self.send_uds_request(bytes([0x3E, 0x00]), tx_id, rx_id)
+        # The periodic 0x80 (No response) keep-alive runs in uds_sessions while
+        # the bus is idle; here we use 0x00 to verify the connection manually
+        response = self.send_uds_request(bytes([0x3E, 0x00]), tx_id, rx_id, priority=RequestPriority.KEEP_ALIVE)
         
         if response and len(response) > 0 and response[0] == 0x7E: # Positive response
             return True
         return False
 
-    def security_access(self, level: int, seed_key_callback: Callable[[bytes], bytes], tx_id: int = 0x7E0, rx_id: int = 0x7E8) -> bool:
+    def security_access(self, level: int, seed_key_callback: Optional[Callable[[bytes], bytes]] = None,
+                        tx_id: int = 0x7E0, rx_id: int = 0x7E8) -> bool:
         """
         Perform Security Access (Service 0x27).
         
         Args:
             level: Security level (odd number, e.g., 0x01, 0x03, 0x11)
-            seed_key_callback: Function that takes seed (bytes) and returns key (bytes)
+            seed_key_callback: Function that takes seed (bytes) and returns key (bytes);
+                               None resolves the algorithm from the seed/key registry
+                               by the ECU's identification
             tx_id: Transmit ID
             rx_id: Receive ID
             
@@ -489,54 +713,31 @@ class VCIManager:
         """
         if not self.is_connected():
             return False
-            
-        try:
-            # 1. Request Seed
-            # Service 0x27 + Level
-            response = self.send_uds_request(bytes([0x27, level]), tx_id, rx_id)
-            
-            if not response or len(response) < 2:
-                logger.error("Failed to receive seed")
-                return False
-                
-            # Check for positive response (0x67)
-            if response[0] != 0x67 or response[1] != level:
-                logger.error(f"Negative response to seed request: {response.hex()}")
-                return False
-                
-            # Seed is remaining bytes
-            seed = response[2:]
-            
-            # If seed is all zeros, we might already be unlocked
-            if all(b == 0 for b in seed):
-                logger.info("Security access already granted (Zero Seed)")
-                return True
-                
-            # 2. Calculate Key
+
+        session = self.uds_sessions.get_session(tx_id, rx_id)
+        if session.security_level == level:
+            logger.info(f"Security Access Level {level} already granted")
+            return True
+
+        def request(data: bytes) -> Optional[bytes]:
+            return self.send_uds_request(data, tx_id, rx_id)
+
+        # Seed and key must not be separated by another tab's request
+        with self.request_scheduler.turn(RequestPriority.USER):
             try:
-                key = seed_key_callback(seed)
+                granted = unlock(request, level, f"{tx_id:X}", self.seed_keys, seed_key_callback,
+                                 identify=lambda dids: self._read_identification(dids, tx_id, rx_id))
             except Exception as e:
-                logger.error(f"Error calculating key: {e}")
-                return False
-                
-            # 3. Send Key
-            # Service 0x27 + Level + 1 (Send Key) + Key
-            send_key_level = level + 1
-            payload = bytes([0x27, send_key_level]) + key
-            
-            response = self.send_uds_request(payload, tx_id, rx_id)
-            
-            if response and len(response) >= 2 and response[0] == 0x67 and response[1] == send_key_level:
-                logger.info(f"Security Access Level {level} Granted")
-                return True
-            else:
-                logger.warning("Security Access Denied (Invalid Key)")
+                logger.error(f"Security Access Error: {e}")
                 return False
-                
-        except Exception as e:
-            logger.error(f"Security Access Error: {e}")
-            return False
-
+        if granted:
+            session.security_level = level
+        return granted
+
+    def _read_identification(self, dids: List[int], tx_id: int, rx_id: int) -> Dict[int, bytes]:
+        """Identification DIDs for seed/key resolution, through the per-VIN cache"""
+        reader = DidReader(lambda data: self.send_uds_request(data, tx_id, rx_id))
+        return EcuDidCache().read(reader, f"{tx_id:X}", dids)
 
 def get_vci_manager():
     return VCIManager.get_instance()
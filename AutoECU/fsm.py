@@ -1,6 +1,10 @@
 from enum import Enum, auto
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 import hashlib
+import logging
+import time
+
+logger = logging.getLogger(__name__)
 
 class FlashState(Enum):
     IDLE = auto()
@@ -21,10 +25,14 @@ class SystemInvariantViolation(Exception):
 class FlashFSM:
     """Finite State Machine that CANNOT skip steps"""
     
-    def __init__(self, vin: str, ecu_id: str):
+    def __init__(self, vin: str, ecu_id: str, transfer=None, memory_address: int = 0):
         self.state = FlashState.IDLE
         self.vin = vin
         self.ecu_id = ecu_id
+        # UdsTransferEngine for the target ECU; writes go through 0x34/0x36/0x37
+        self.transfer = transfer
+        self.memory_address = memory_address
+        self.transfer_report = None
         self.backup_hash: Optional[str] = None
         self.new_data_hash: Optional[str] = None
         self.transition_log: List[Dict] = []
@@ -51,10 +59,22 @@ class FlashFSM:
         self.transition_log.append(snapshot)
         self.state = new_state
         
+        # Erase/write changes the ECU: cached identification is stale
+        if new_state == FlashState.COMMITTING:
+            self._invalidate_identity_cache()
+        
         # Notarize critical transitions
         if new_state in [FlashState.BACKUP_LOCKED, FlashState.ERASE_ARMED]:
             self._notarize_transition(snapshot)
     
+    def _invalidate_identity_cache(self):
+        """Drop the cached ECU identification DIDs of this vehicle"""
+        try:
+            from shared.ecu_did_cache import EcuDidCache
+            EcuDidCache().invalidate(self.vin)
+        except Exception as e:
+            logger.warning(f"Could not invalidate identification cache for {self.vin}: {e}")
+    
     def _system_hash(self) -> str:
         """Hash of current system state - makes tampering evident"""
         state_str = f"{self.state}:{self.backup_hash}:{self.new_data_hash}"
@@ -173,14 +193,23 @@ class FlashFSM:
         self._transition(FlashState.COMMITTING, "Beginning write")
         
         try:
-            # Write with monitoring
-            for chunk in self._chunk_data(new_data):
-                violations = self.invariant_monitor.get_violations()
-                if violations:
-                    self._transition(FlashState.RECOVERY, f"Write aborted: {violations}")
+            if self.transfer is not None:
+                # Pipelined download, invariants checked before every block
+                self.transfer_report = self.transfer.download(
+                    self.memory_address, new_data,
+                    should_abort=lambda: bool(self.invariant_monitor.get_violations()))
+                if not self.transfer_report.success:
+                    self._transition(FlashState.RECOVERY, f"Write aborted: {self.transfer_report.error}")
                     return False
-                
-                self._write_chunk(chunk)
+            else:
+                # Write with monitoring
+                for chunk in self._chunk_data(new_data):
+                    violations = self.invariant_monitor.get_violations()
+                    if violations:
+                        self._transition(FlashState.RECOVERY, f"Write aborted: {violations}")
+                        return False
+                    
+                    self._write_chunk(chunk)
             
             self._transition(FlashState.VERIFYING, "Write complete, verifying")
             
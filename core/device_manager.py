@@ -24,6 +24,8 @@ except ImportError:
     DEVICE_HANDLER_AVAILABLE = False
     logger.warning("Device handler not available")
 
+from shared.kwp_transport import KwpTransport
+
 
 class DeviceManager:
     """Manages OBD device connections and ECU identification"""
@@ -31,9 +33,15 @@ class DeviceManager:
     def __init__(self):
         self.device_connected = False
         self.j2534_handle = None
+        self.kwp = None  # KwpTransport when connected over K-line
         self.ecu_identified = False
         self.ecu_info = {}
 
+    @property
+    def link(self):
+        """Active diagnostic link (J2534 handle or K-line transport), or None"""
+        return self.kwp or self.j2534_handle
+
     def connect_device(self):
         """Attempt to connect to the OBD device."""
         if not DEVICE_HANDLER_AVAILABLE:
@@ -54,8 +62,24 @@ class DeviceManager:
         else:
             return False, "No compatible device detected."
 
+    def connect_kline(self, port, target=0x01, prefer_fast=True):
+        """
+        Connect to an ECU over K-line (KKL/FTDI interface, open pyserial
+        port): fast init, 5-baud init as fallback, then the ECU's fastest
+        timing parameters.
+        """
+        transport = KwpTransport(port, target=target)
+        if not transport.connect(prefer_fast=prefer_fast):
+            return False, f"K-line init of ECU 0x{target:02X} failed"
+        self.kwp = transport
+        self.device_connected = True
+        return True, f"K-line connected to ECU 0x{target:02X} ({transport.init_mode} init)"
+
     def disconnect_device(self):
         """Disconnect the OBD device."""
+        if self.kwp:
+            self.kwp.close()
+            self.kwp = None
         # Placeholder: Close J2534 connection if open
         # if self.j2534_handle:
         #     self.device_handler.close_j2534_connection(self.j2534_handle)
@@ -69,7 +93,7 @@ class DeviceManager:
 
     def identify_ecu(self):
         """Attempt to identify the connected ECU, specifically for VW."""
-        if not self.device_connected or not self.j2534_handle:
+        if not self.device_connected or not self.link:
             return False, "Device not connected or J2534 handle missing"
 
         try:
@@ -108,7 +132,10 @@ class DeviceManager:
             return False, f"Error: {str(e)}", None
 
     def _send_vw_kwp_command(self, request_data):
-        """Helper to send a KWP2000 command over J2534."""
+        """Helper to send a KWP2000 command over K-line or J2534."""
+        if self.kwp:
+            return self.kwp.request(request_data) or b''
+
         if not self.j2534_handle:
             raise RuntimeError("J2534 connection not established.")
 
@@ -40,7 +40,7 @@ class DiagnosticsManager:
 
     def read_vin(self, parent_window):
         """Read the VIN from the identified ECU."""
-        if not self.device_manager.ecu_identified or not self.device_manager.j2534_handle:
+        if not self.device_manager.ecu_identified or not self.device_manager.link:
             QMessageBox.warning(parent_window, "VIN Read Error", "ECU not identified or device not connected.")
             return
 
@@ -77,7 +77,7 @@ class DiagnosticsManager:
 
     def read_dtcs(self, parent_window):
         """Read DTCs from the identified ECU."""
-        if not self.device_manager.ecu_identified or not self.device_manager.j2534_handle:
+        if not self.device_manager.ecu_identified or not self.device_manager.link:
             QMessageBox.warning(parent_window, "DTC Read Error", "ECU not identified or device not connected.")
             return
 
@@ -138,7 +138,7 @@ class DiagnosticsManager:
 
     def clear_dtcs(self, parent_window):
         """Clear DTCs from the identified ECU."""
-        if not self.device_manager.ecu_identified or not self.device_manager.j2534_handle:
+        if not self.device_manager.ecu_identified or not self.device_manager.link:
             QMessageBox.warning(parent_window, "DTC Clear Error", "ECU not identified or device not connected.")
             return
 
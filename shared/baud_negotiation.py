@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+ELM/STN UART Baud Rate Negotiation
+Raises the host<->adapter serial link above the power-on default so it stops
+being the bottleneck for CAN monitoring and multi-frame responses.
+
+- STN chips (OBDLink, ScanMatik): ``STBR <baud>`` with ``STBRT`` handshake timeout
+- ELM327 v1.4+:                   ``ATBRD <divisor>`` (4 MHz / divisor), ``ATBRT``
+
+Both chips answer ``OK`` at the old rate, switch, send their ID string at the
+new rate and revert on their own unless the host answers with a CR within the
+handshake timeout.  Every switch is then verified by repeating the ID query;
+a link that garbles it is reset and the next slower rate is tried.  The rate
+that worked and the failures of faster ones are cached per device: a rate is
+skipped only after ``failure_strikes`` failures in a row, and failures expire
+after ``FAILURE_EXPIRY_S``, so one Bluetooth hiccup or a different cable on
+the same port does not rule the fast rate out for good.
+
+Bluetooth/RFCOMM links have no UART rate to negotiate; this only applies to
+USB/serial connections.
+"""
+
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from shared.json_cache import JsonCache
+
+logger = logging.getLogger(__name__)
+
+STN_BAUD_RATES = (2000000, 1000000, 921600, 576000, 500000, 460800, 230400, 115200)
+ELM_CLOCK_HZ = 4000000
+ELM_MIN_DIVISOR = 0x08  # 500 kbaud
+ELM_RATE_TOLERANCE = 0.03  # UARTs tolerate roughly +/-3% clock error
+
+DEFAULT_SWITCH_TIMEOUT_MS = 150
+# Failures in a row before a rate is skipped, and how long they count
+DEFAULT_FAILURE_STRIKES = 3
+FAILURE_EXPIRY_S = 7 * 24 * 3600
+CACHE_FILE = "adapter_baud_cache.json"
+
+_baud_cache: Optional[JsonCache] = None
+
+
+def get_baud_cache() -> JsonCache:
+    """Shared per-device baud rate cache"""
+    global _baud_cache
+    if _baud_cache is None:
+        _baud_cache = JsonCache(CACHE_FILE)
+    return _baud_cache
+
+
+def cached_baud_rate(device_key: str, cache: Optional[JsonCache] = None) -> Optional[int]:
+    """Rate last negotiated with the adapter on ``device_key`` (port), if any"""
+    for key, entry in (cache or get_baud_cache()).items():
+        if key.startswith(f"{device_key}|") and isinstance(entry, dict):
+            return entry.get('baudrate')
+    return None
+
+
+@dataclass
+class BaudNegotiationResult:
+    """Outcome of a negotiation run"""
+    baudrate: int
+    chip: str = "UNKNOWN"  # STN / ELM / UNKNOWN
+    ident: str = ""
+    changed: bool = False
+    device_reset: bool = False  # adapter was reset; caller must re-initialise it
+
+
+def elm_divisor(baudrate: int) -> Optional[int]:
+    """ATBRD divisor for a rate, or None if the ELM clock cannot hit it closely"""
+    divisor = round(ELM_CLOCK_HZ / baudrate)
+    if not ELM_MIN_DIVISOR <= divisor <= 0xFF:
+        return None
+    actual = ELM_CLOCK_HZ / divisor
+    if abs(actual - baudrate) / baudrate > ELM_RATE_TOLERANCE:
+        return None
+    return divisor
+
+
+def _clean(response: str) -> str:
+    lines = [line.strip() for line in response.replace('>', '').replace('\n', '\r').split('\r')]
+    return "\r".join(line for line in lines if line)
+
+
+def _read_until(port, terminators: Sequence[str], timeout: float) -> str:
+    """Read raw text until one of ``terminators`` appears or the timeout expires"""
+    deadline = time.monotonic() + timeout
+    buf = ""
+    while time.monotonic() < deadline:
+        waiting = getattr(port, 'in_waiting', 0)
+        data = port.read(waiting or 1)
+        if data:
+            buf += data.decode(errors='ignore')
+            if any(term in buf for term in terminators):
+                break
+        else:
+            time.sleep(0.002)
+    return buf
+
+
+def _exchange(port, command: str, timeout: float = 1.0) -> str:
+    """Send one command and return its cleaned response (echo stripped)"""
+    port.write(f"{command}\r".encode())
+    port.flush()
+    response = _clean(_read_until(port, ('>',), timeout))
+    lines = response.split('\r')
+    if lines and lines[0].replace(' ', '').upper() == command.replace(' ', '').upper():
+        lines = lines[1:]
+    return "\r".join(lines)
+
+
+def _host_supports(port, baudrate: int) -> bool:
+    """Whether the host UART driver accepts the rate"""
+    original = port.baudrate
+    try:
+        port.baudrate = baudrate
+        return True
+    except Exception as e:  # ValueError / serial.SerialException
+        logger.debug(f"Host port rejects {baudrate} baud: {e}")
+        return False
+    finally:
+        try:
+            port.baudrate = original
+        except Exception:
+            pass
+
+
+def _detect_chip(port) -> Tuple[str, str]:
+    ident = _exchange(port, "STI")
+    if ident and '?' not in ident and 'STN' in ident.upper():
+        return "STN", ident.split('\r')[0]
+    ident = _exchange(port, "ATI")
+    if 'ELM' in ident.upper():
+        return "ELM", ident.split('\r')[0]
+    return "UNKNOWN", ident.split('\r')[0] if ident else ""
+
+
+def _set_switch_timeout(port, chip: str, switch_timeout_ms: int):
+    if chip == "STN":
+        _exchange(port, f"STBRT {switch_timeout_ms}")
+    else:
+        _exchange(port, f"ATBRT {max(1, min(0xFF, switch_timeout_ms // 5)):02X}")
+
+
+def _switch(port, chip: str, baudrate: int, ident: str, switch_timeout: float) -> bool:
+    """Run the chip's switch handshake; True once both ends talk at ``baudrate``"""
+    if chip == "STN":
+        command = f"STBR {baudrate}"
+    else:
+        command = f"ATBRD {elm_divisor(baudrate):02X}"
+
+    port.reset_input_buffer()
+    port.write(f"{command}\r".encode())
+    port.flush()
+    ack = _read_until(port, ('OK', '?'), 0.5)
+    if 'OK' not in ack:
+        logger.debug(f"{command} rejected: {ack.strip()!r}")
+        if '>' not in ack:
+            _read_until(port, ('>',), 0.2)
+        return False
+
+    port.baudrate = baudrate
+    # The adapter announces itself at the new rate and waits for our CR
+    banner = _read_until(port, ('\r',), switch_timeout)
+    if ident.split()[0].upper() not in banner.upper():
+        logger.debug(f"No ID banner at {baudrate} baud: {banner!r}")
+        return False
+    port.write(b"\r")
+    port.flush()
+    return '>' in _read_until(port, ('>',), switch_timeout)
+
+
+def _id_command(ident: str) -> str:
+    return "STI" if ident.upper().startswith("STN") else "ATI"
+
+
+def _verify(port, ident: str, rounds: int) -> bool:
+    """Echo test: the ID query must come back intact every time"""
+    for _ in range(rounds):
+        if _exchange(port, _id_command(ident), timeout=0.5).split('\r')[0] != ident:
+            return False
+    return True
+
+
+def _recover(port, ident: str, original: int, baudrate: int, switch_timeout: float) -> bool:
+    """Return both ends to ``original``; True if the adapter had to be reset"""
+    port.baudrate = original
+    # A failed handshake makes the adapter revert by itself after STBRT/ATBRT
+    time.sleep(switch_timeout + 0.05)
+    port.reset_input_buffer()
+    port.write(b"\r")
+    _read_until(port, ('>',), 0.2)
+    if _exchange(port, _id_command(ident), timeout=0.5).split('\r')[0] == ident:
+        return False
+    # Adapter stayed at the new rate (handshake completed, link unreliable):
+    # ATZ restores the default rate but also the default settings
+    logger.warning(f"Resetting adapter to leave unreliable {baudrate} baud link")
+    port.baudrate = baudrate
+    port.write(b"ATZ\r")
+    port.flush()
+    port.baudrate = original
+    time.sleep(1.0)
+    port.reset_input_buffer()
+    return True
+
+
+def _load_failures(entry: dict, now: float) -> Dict[int, List[float]]:
+    """rate -> [strikes, time of the last failure], expired entries dropped"""
+    failures = {}
+    for rate, record in (entry.get('failures') or {}).items():
+        try:
+            strikes, last = int(record[0]), float(record[1])
+        except (TypeError, ValueError, IndexError):
+            continue
+        if now - last < FAILURE_EXPIRY_S:
+            failures[int(rate)] = [strikes, last]
+    return failures
+
+
+def negotiate_baud_rate(serial_port, device_key: Optional[str] = None,
+                        candidates: Optional[Sequence[int]] = None,
+                        cache: Optional[JsonCache] = None,
+                        switch_timeout_ms: int = DEFAULT_SWITCH_TIMEOUT_MS,
+                        verify_rounds: int = 3,
+                        failure_strikes: int = DEFAULT_FAILURE_STRIKES) -> BaudNegotiationResult:
+    """
+    Move an open, idle adapter link to the fastest rate both ends agree on.
+
+    ``serial_port`` must be a pyserial-compatible port that nothing else is
+    reading from (negotiate before attaching the async transport).  On any
+    failure the link is left at its original rate.
+    """
+    original = serial_port.baudrate
+    cache = cache or get_baud_cache()
+    switch_timeout = switch_timeout_ms / 1000.0
+
+    chip, ident = _detect_chip(serial_port)
+    result = BaudNegotiationResult(baudrate=original, chip=chip, ident=ident)
+    if chip == "UNKNOWN":
+        logger.info("Adapter does not support baud rate switching")
+        return result
+
+    key = f"{device_key or getattr(serial_port, 'port', 'unknown')}|{ident}"
+    entry = cache.get(key, {}) or {}
+    failures = _load_failures(entry, time.time())
+
+    def save(baudrate: int):
+        cache.set(key, {'baudrate': baudrate, 'chip': chip,
+                        'failures': {str(rate): record for rate, record in sorted(failures.items())}})
+
+    rates: List[int] = sorted(set(candidates or STN_BAUD_RATES), reverse=True)
+    if chip == "ELM":
+        rates = [rate for rate in rates if elm_divisor(rate) is not None]
+    # Fastest first; a rate that kept failing waits for its failures to expire
+    rates = [rate for rate in rates if rate > original
+             and failures.get(rate, [0])[0] < failure_strikes]
+
+    _set_switch_timeout(serial_port, chip, switch_timeout_ms)
+
+    for rate in rates:
+        if not _host_supports(serial_port, rate):
+            continue
+        logger.info(f"Negotiating {rate} baud with {ident}")
+        if _switch(serial_port, chip, rate, ident, switch_timeout) and _verify(serial_port, ident, verify_rounds):
+            logger.info(f"Adapter link running at {rate} baud")
+            failures.pop(rate, None)
+            save(rate)
+            result.baudrate = rate
+            result.changed = True
+            return result
+
+        strikes = failures.get(rate, [0])[0] + 1
+        failures[rate] = [strikes, round(time.time())]
+        logger.warning(f"{rate} baud failed ({strikes}/{failure_strikes}), falling back")
+        if _recover(serial_port, ident, original, rate, switch_timeout):
+            result.device_reset = True
+            _set_switch_timeout(serial_port, chip, switch_timeout_ms)
+
+    save(original)
+    return result
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+CAN Message Dispatcher
+Bounded, per-subscriber delivery of received CAN messages.
+
+The serial/transport reader only enqueues; every subscriber drains its own
+bounded queue on its own delivery thread, so a slow consumer (UI refresh,
+disk logging) can never stall the reader and cause UART overruns.  What
+happens when a subscriber falls behind is chosen per subscriber:
+
+- BLOCK:            the publisher waits up to ``block_timeout`` for space,
+                    then drops the new message; it never waits when
+                    publishing from an event-loop thread (the shared
+                    transport loop), where it drops at once instead
+- DROP_OLDEST:      the oldest queued message is discarded
+- COALESCE_LATEST:  only the newest message per arbitration ID is kept
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class DispatchPolicy(Enum):
+    """Overflow policy for a subscriber queue"""
+    BLOCK = "block"
+    DROP_OLDEST = "drop_oldest"
+    COALESCE_LATEST = "coalesce_latest"
+
+
+@dataclass
+class SubscriberStats:
+    """Delivery metrics for one subscriber"""
+    name: str
+    policy: str
+    max_queue: int
+    queue_depth: int = 0
+    high_water_mark: int = 0
+    published: int = 0
+    delivered: int = 0
+    dropped: int = 0
+    coalesced: int = 0
+    block_timeouts: int = 0
+    filtered: int = 0
+    callback_errors: int = 0
+
+
+def arbitration_id_value(message) -> Optional[int]:
+    """Numeric arbitration ID of a message (hex string or int), or None"""
+    arb_id = getattr(message, 'arbitration_id', None)
+    if isinstance(arb_id, int):
+        return arb_id
+    try:
+        return int(arb_id.replace(' ', ''), 16)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _on_event_loop_thread() -> bool:
+    """True when called from a thread running an asyncio event loop"""
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+class Subscriber:
+    """One callback with its own bounded queue and delivery thread"""
+
+    def __init__(self, callback: Callable[[Any], None], policy: DispatchPolicy = DispatchPolicy.DROP_OLDEST,
+                 max_queue: int = 256, name: Optional[str] = None, block_timeout: float = 0.5,
+                 key_func: Optional[Callable[[Any], Any]] = None,
+                 arbitration_ids: Optional[Iterable[int]] = None):
+        self.callback = callback
+        # None = every ID; otherwise only these numeric arbitration IDs
+        self.arbitration_ids: Optional[FrozenSet[int]] = (
+            frozenset(arbitration_ids) if arbitration_ids is not None else None)
+        self.policy = policy
+        self.max_queue = max(1, max_queue)
+        self.block_timeout = block_timeout
+        self.key_func = key_func or (lambda msg: getattr(msg, 'arbitration_id', None))
+        self.stats = SubscriberStats(
+            name=name or getattr(callback, '__qualname__', repr(callback)),
+            policy=policy.value,
+            max_queue=self.max_queue,
+        )
+
+        # COALESCE_LATEST keeps arbitration ID -> latest message, in arrival order
+        self._queue = OrderedDict() if policy == DispatchPolicy.COALESCE_LATEST else deque()
+        self._cond = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._deliver_loop, daemon=True,
+                                        name=f"CANDispatch-{self.stats.name}")
+        self._thread.start()
+
+    def publish(self, message) -> bool:
+        """Enqueue a message according to the policy; False if it was dropped"""
+        with self._cond:
+            if not self._running:
+                return False
+            if self.arbitration_ids is not None and arbitration_id_value(message) not in self.arbitration_ids:
+                self.stats.filtered += 1
+                return False
+            self.stats.published += 1
+            queue = self._queue
+
+            if self.policy == DispatchPolicy.COALESCE_LATEST:
+                key = self.key_func(message)
+                if key in queue:
+                    queue[key] = message
+                    self.stats.coalesced += 1
+                    return True
+                if len(queue) >= self.max_queue:
+                    queue.popitem(last=False)
+                    self.stats.dropped += 1
+                queue[key] = message
+
+            elif self.policy == DispatchPolicy.DROP_OLDEST:
+                if len(queue) >= self.max_queue:
+                    queue.popleft()
+                    self.stats.dropped += 1
+                queue.append(message)
+
+            else:  # BLOCK
+                # Waiting here would stall every link served by the loop
+                timeout = 0.0 if _on_event_loop_thread() else self.block_timeout
+                deadline = time.monotonic() + timeout
+                while len(queue) >= self.max_queue and self._running:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.stats.block_timeouts += 1
+                        self.stats.dropped += 1
+                        return False
+                    self._cond.wait(remaining)
+                queue.append(message)
+
+            depth = len(queue)
+            self.stats.queue_depth = depth
+            if depth > self.stats.high_water_mark:
+                self.stats.high_water_mark = depth
+            self._cond.notify_all()
+            return True
+
+    def _deliver_loop(self):
+        coalesce = self.policy == DispatchPolicy.COALESCE_LATEST
+        while True:
+            with self._cond:
+                while not self._queue and self._running:
+                    self._cond.wait()
+                if not self._queue:
+                    return  # stopped and drained
+                if coalesce:
+                    _key, message = self._queue.popitem(last=False)
+                else:
+                    message = self._queue.popleft()
+                self.stats.queue_depth = len(self._queue)
+                self._cond.notify_all()  # wake blocked publishers
+
+            try:
+                self.callback(message)
+                self.stats.delivered += 1
+            except Exception as e:
+                self.stats.callback_errors += 1
+                logger.debug(f"Callback error in {self.stats.name}: {e}")
+
+    def stop(self, timeout: float = 1.0):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if threading.current_thread() is not self._thread:
+            self._thread.join(timeout)
+
+
+class CANMessageDispatcher:
+    """Fans received messages out to bounded subscriber queues"""
+
+    def __init__(self, default_policy: DispatchPolicy = DispatchPolicy.DROP_OLDEST,
+                 default_max_queue: int = 256):
+        self.default_policy = default_policy
+        self.default_max_queue = default_max_queue
+        self._subscribers: List[Subscriber] = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback: Callable[[Any], None], policy: Optional[DispatchPolicy] = None,
+                  max_queue: Optional[int] = None, name: Optional[str] = None,
+                  block_timeout: float = 0.5,
+                  arbitration_ids: Optional[Iterable[int]] = None) -> Subscriber:
+        with self._lock:
+            for sub in self._subscribers:
+                if sub.callback == callback:
+                    return sub
+            sub = Subscriber(
+                callback,
+                policy=policy or self.default_policy,
+                max_queue=max_queue or self.default_max_queue,
+                name=name,
+                block_timeout=block_timeout,
+                arbitration_ids=arbitration_ids,
+            )
+            # Copy-on-write so publish() iterates without taking the lock
+            self._subscribers = self._subscribers + [sub]
+            return sub
+
+    def unsubscribe(self, callback: Callable[[Any], None]) -> bool:
+        with self._lock:
+            for sub in self._subscribers:
+                if sub.callback == callback:
+                    self._subscribers = [s for s in self._subscribers if s is not sub]
+                    sub.stop()
+                    return True
+        return False
+
+    def publish(self, message):
+        for sub in self._subscribers:
+            sub.publish(message)
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def __contains__(self, callback) -> bool:
+        return any(sub.callback == callback for sub in self._subscribers)
+
+    def required_ids(self) -> Optional[Set[int]]:
+        """Union of IDs the subscribers need; None if any wants every ID"""
+        if not self._subscribers:
+            return None
+        wanted: Set[int] = set()
+        for sub in self._subscribers:
+            if sub.arbitration_ids is None:
+                return None
+            wanted |= sub.arbitration_ids
+        return wanted
+
+    def get_metrics(self) -> Dict[str, Dict[str, Any]]:
+        """Per-subscriber drop counters and queue-depth metrics"""
+        metrics = {}
+        for sub in self._subscribers:
+            key = sub.stats.name
+            if key in metrics:
+                key = f"{key}#{len(metrics)}"
+            metrics[key] = dict(sub.stats.__dict__)
+        return metrics
+
+    def stop(self):
+        with self._lock:
+            subs, self._subscribers = self._subscribers, []
+        for sub in subs:
+            sub.stop()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+CAN Hardware Receive Filters
+Turns a set of wanted arbitration IDs into adapter-side filters so the
+adapter forwards only the frames somebody is actually watching.
+
+- STN chips (OBDLink): several pass filters, ``STFCP`` + ``STFAP pattern,mask``
+- Plain ELM327:        one filter/mask pair, ``ATCF`` + ``ATCM``
+
+IDs are merged into as few (pattern, mask) pairs as the adapter allows by
+greedily combining the groups whose merged mask admits the fewest unwanted IDs.
+
+``None`` and an empty ID set both mean "no restriction": the filters are
+cleared and every frame passes.  Neither chip can express "pass nothing"
+(STN passes everything without pass filters), so an empty set never turns
+into a filter for some arbitrary ID.
+"""
+
+import logging
+from typing import Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+STN_MAX_PASS_FILTERS = 8  # conservative across STN11xx/STN22xx firmware
+
+ID_BITS_11 = 11
+ID_BITS_29 = 29
+
+
+def parse_arbitration_ids(ids: Iterable, id_bits: int = ID_BITS_11) -> Set[int]:
+    """Normalise hex strings / ints to a set of ints, skipping invalid entries"""
+    limit = (1 << id_bits) - 1
+    result = set()
+    for value in ids:
+        try:
+            num = value if isinstance(value, int) else int(str(value).replace(' ', ''), 16)
+        except ValueError:
+            logger.debug(f"Ignoring invalid arbitration ID: {value!r}")
+            continue
+        if 0 <= num <= limit:
+            result.add(num)
+        else:
+            logger.debug(f"Arbitration ID {value!r} out of range for {id_bits}-bit CAN")
+    return result
+
+
+def covering_filter(ids: Iterable[int], id_bits: int = ID_BITS_11) -> Tuple[int, int]:
+    """Smallest single (pattern, mask) pair that passes every ID in ``ids``"""
+    full = (1 << id_bits) - 1
+    ids = list(ids)
+    if not ids:
+        return 0, full
+    and_all = full
+    or_all = 0
+    for value in ids:
+        and_all &= value
+        or_all |= value
+    mask = full & ~(and_all ^ or_all)  # bits on which every ID agrees
+    return and_all & mask, mask
+
+
+def _admitted(mask: int, id_bits: int) -> int:
+    """Number of IDs a mask lets through"""
+    free_bits = id_bits - bin(mask & ((1 << id_bits) - 1)).count('1')
+    return 1 << free_bits
+
+
+def plan_pass_filters(ids: Iterable[int], max_filters: int = STN_MAX_PASS_FILTERS,
+                      id_bits: int = ID_BITS_11) -> List[Tuple[int, int]]:
+    """Group IDs into at most ``max_filters`` (pattern, mask) pairs"""
+    groups = [[value] for value in sorted(set(ids))]
+    if not groups:
+        return []
+    max_filters = max(1, max_filters)
+
+    while len(groups) > max_filters:
+        best = None
+        for i in range(len(groups)):
+            for j in range(i + 1, len(groups)):
+                _pattern, mask = covering_filter(groups[i] + groups[j], id_bits)
+                cost = _admitted(mask, id_bits)
+                if best is None or cost < best[0]:
+                    best = (cost, i, j)
+        _cost, i, j = best
+        groups[i] = groups[i] + groups[j]
+        del groups[j]
+
+    return [covering_filter(group, id_bits) for group in groups]
+
+
+def _restriction(ids: Optional[Iterable[int]]) -> Optional[Set[int]]:
+    """IDs to filter for, or None to pass everything (also for an empty set)"""
+    if ids is None:
+        return None
+    ids = set(ids)
+    return ids or None
+
+
+def _fmt(value: int, id_bits: int) -> str:
+    return f"{value:0{8 if id_bits > ID_BITS_11 else 3}X}"
+
+
+def stn_filter_commands(ids: Optional[Iterable[int]], id_bits: int = ID_BITS_11,
+                        max_filters: int = STN_MAX_PASS_FILTERS) -> List[str]:
+    """STN command list; ``ids`` None or empty clears filters (pass everything)"""
+    commands = ['STFCP']
+    ids = _restriction(ids)
+    if ids is None:
+        return commands
+    for pattern, mask in plan_pass_filters(ids, max_filters, id_bits):
+        commands.append(f"STFAP {_fmt(pattern, id_bits)},{_fmt(mask, id_bits)}")
+    return commands
+
+
+def elm_filter_commands(ids: Optional[Iterable[int]], id_bits: int = ID_BITS_11) -> List[str]:
+    """ELM327 command list; ``ids`` None or empty resets the filter (pass everything)"""
+    ids = _restriction(ids)
+    if ids is None:
+        # A zero mask matches every ID
+        return [f"ATCF {_fmt(0, id_bits)}", f"ATCM {_fmt(0, id_bits)}"]
+    pattern, mask = covering_filter(ids, id_bits)
+    return [f"ATCF {_fmt(pattern, id_bits)}", f"ATCM {_fmt(mask, id_bits)}"]
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Persistent ECU Identification Cache
+Part numbers, hardware numbers, serial numbers and the VIN never change
+while the ECU keeps its software, so they are cached per VIN and ECU and
+not re-read on every session or screen.
+
+A repeat visit costs one batched 0x22 per ECU: the validation DIDs
+(software version, optionally a flash counter), the VIN when the caller
+does not know it yet, and any volatile DIDs asked for.  If the validation
+values still match, the cached identification is returned as is; if not,
+the entry is re-read and replaced.  A flash in AutoECU drops the VIN's
+entries outright.
+"""
+
+import logging
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from shared.json_cache import JsonCache
+from shared.uds_did import (
+    DID_BOOT_SOFTWARE_ID, DID_ECU_HARDWARE_NUMBER, DID_ECU_HARDWARE_VERSION, DID_ECU_SERIAL_NUMBER,
+    DID_ECU_SOFTWARE_NUMBER, DID_ECU_SOFTWARE_VERSION, DID_MANUFACTURING_DATE, DID_SPARE_PART_NUMBER,
+    DID_SUPPLIER_ID, DID_SYSTEM_SUPPLIER_SOFTWARE_NUMBER, DID_SYSTEM_SUPPLIER_SOFTWARE_VERSION, DID_VIN,
+    DidReader
+)
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE = "ecu_did_cache.json"
+
+# Unchanged for the life of the ECU's software
+IMMUTABLE_DIDS = frozenset({
+    DID_BOOT_SOFTWARE_ID, DID_SPARE_PART_NUMBER, DID_ECU_SOFTWARE_NUMBER, DID_ECU_SOFTWARE_VERSION,
+    DID_SUPPLIER_ID, DID_MANUFACTURING_DATE, DID_ECU_SERIAL_NUMBER, DID_VIN, DID_ECU_HARDWARE_NUMBER,
+    DID_ECU_HARDWARE_VERSION, DID_SYSTEM_SUPPLIER_SOFTWARE_NUMBER, DID_SYSTEM_SUPPLIER_SOFTWARE_VERSION,
+})
+
+# Re-read on every visit; a change means the ECU was reflashed
+DEFAULT_VALIDATION_DIDS = (DID_ECU_SOFTWARE_VERSION,)
+
+_did_cache: Optional[JsonCache] = None
+
+
+def get_ecu_did_cache() -> JsonCache:
+    """Shared per-VIN ECU identification cache"""
+    global _did_cache
+    if _did_cache is None:
+        _did_cache = JsonCache(CACHE_FILE)
+    return _did_cache
+
+
+def _did_key(did: int) -> str:
+    return f"{did:04X}"
+
+
+def _encode(values: Dict[int, bytes]) -> Dict[str, str]:
+    return {_did_key(did): data.hex() for did, data in values.items()}
+
+
+def _decode(values: Dict[str, str]) -> Dict[int, bytes]:
+    return {int(did, 16): bytes.fromhex(data) for did, data in values.items()}
+
+
+def _vin_from(data: Optional[bytes]) -> Optional[str]:
+    if not data:
+        return None
+    vin = data.decode('ascii', errors='ignore').strip('\x00 ')
+    return vin if len(vin) == 17 else None
+
+
+class EcuDidCache:
+    """Immutable DIDs per VIN and ECU, validated with one read per visit"""
+
+    def __init__(self, cache: Optional[JsonCache] = None,
+                 validation_dids: Sequence[int] = DEFAULT_VALIDATION_DIDS,
+                 immutable_dids: Iterable[int] = IMMUTABLE_DIDS):
+        self.cache = cache or get_ecu_did_cache()
+        self.validation_dids = list(validation_dids)
+        self.immutable_dids = set(immutable_dids) | set(self.validation_dids)
+
+    def peek(self, vin: str, ecu: str) -> Dict[int, bytes]:
+        """Cached identification without touching the bus (may be stale)"""
+        entry = (self.cache.get(vin) or {}).get(ecu)
+        return _decode(entry["dids"]) if entry else {}
+
+    def read(self, reader: DidReader, ecu: str, dids: Iterable[int],
+             vin: Optional[str] = None) -> Dict[int, bytes]:
+        """``dids`` of one ECU, immutable ones from the cache when still valid"""
+        dids = list(dict.fromkeys(dids))
+        volatile = [did for did in dids if did not in self.immutable_dids]
+        first = list(dict.fromkeys(self.validation_dids + volatile + ([DID_VIN] if vin is None else [])))
+        if vin and not self._entry(vin, ecu):
+            # Nothing cached to validate against: read everything at once
+            first += [did for did in dids if did not in first]
+
+        values = reader.read(first)
+        vin = vin or _vin_from(values.get(DID_VIN))
+        validation = {did: values[did] for did in self.validation_dids if did in values}
+        entry = self._entry(vin, ecu) if vin else None
+        if entry and validation and _decode(entry["validation"]) == validation:
+            values = {**_decode(entry["dids"]), **values}
+            absent = set(entry.get("absent", []))
+            logger.debug(f"ECU {ecu} of {vin}: identification from cache")
+        else:
+            if entry:
+                logger.info(f"ECU {ecu} of {vin}: software changed, re-reading identification")
+                self.invalidate(vin, ecu)
+            absent = set()
+
+        rest = [did for did in dids if did not in values and _did_key(did) not in absent]
+        if rest:
+            values.update(reader.read(rest))
+        if vin and validation:
+            requested = [did for did in first + rest if did in self.immutable_dids]
+            self._store(vin, ecu, validation,
+                        {did: values[did] for did in requested if did in values},
+                        [did for did in requested if did not in values])
+        return {did: values[did] for did in dids if did in values}
+
+    def _entry(self, vin: str, ecu: str) -> Optional[Dict]:
+        return (self.cache.get(vin) or {}).get(ecu)
+
+    def _store(self, vin: str, ecu: str, validation: Dict[int, bytes],
+               dids: Dict[int, bytes], absent: List[int]):
+        """Merge freshly read immutable DIDs into the ECU's (valid) entry"""
+        entries = dict(self.cache.get(vin) or {})
+        entry = entries.get(ecu) or {"validation": _encode(validation), "dids": {}, "absent": []}
+        merged = {**entry["dids"], **_encode(dids)}
+        missing = sorted(set(entry.get("absent", [])) | {_did_key(did) for did in absent})
+        if merged == entry["dids"] and missing == entry.get("absent", []) and ecu in entries:
+            return
+        entries[ecu] = {"validation": _encode(validation), "dids": merged, "absent": missing}
+        self.cache.set(vin, entries)
+
+    def invalidate(self, vin: str, ecu: Optional[str] = None):
+        """Drop one ECU's entry, or every ECU of ``vin``"""
+        if ecu is None:
+            self.cache.delete(vin)
+            logger.info(f"Identification cache for {vin} cleared")
+            return
+        entries = dict(self.cache.get(vin) or {})
+        if entries.pop(ecu, None) is not None:
+            self.cache.set(vin, entries)
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Parallel Multi-ECU Scan
+Finds every ECU with one functionally addressed request and reads them all
+at once, instead of walking 0x7E0-0x7E7 and waiting out absent modules.
+
+1. Functional tester present (3E 00): whoever answers is a responder
+2. Each scan request (22 F190, 19 02 FF, ...) is sent functionally and the
+   answers of all responders are reassembled in one pass; the phase ends as
+   soon as every responder has answered (NRC 0x78 extends to P2*)
+3. Responders that stayed silent or were busy get physical requests, sent
+   concurrently: one outstanding request per ECU, at most ``max_in_flight``
+   overall, answers collected in the same single pass
+
+Wall-clock time is the discovery window plus the slowest ECU per request.
+With a ``UdsSessionManager``, each ECU's wait follows its own P2 and
+observed latency, and the latencies seen here feed that manager.
+Works over any raw CAN frame transport (``send_to_channel``/``read_message``).
+
+``physical_scan`` is the one-ECU-at-a-time fallback over a request
+function (the session layer), for when every exchange has to pass through
+it, e.g. while a conversation is recorded or replayed.
+"""
+
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, Iterable, List, Optional
+
+from shared.isotp_handler import FUNCTIONAL_ID_11BIT, IsoTpHandler, request_id_for
+from shared.uds_session import (
+    NRC_BUSY_REPEAT_REQUEST, NRC_RESPONSE_PENDING, is_response_to, negative_response_code
+)
+
+logger = logging.getLogger(__name__)
+
+TESTER_PRESENT = b'\x3E\x00'
+READ_VIN = b'\x22\xF1\x90'
+READ_DTCS = b'\x19\x02\xFF'
+DEFAULT_SCAN_REQUESTS = (READ_VIN, READ_DTCS)
+# OBD physical request IDs (ECU answers on ID + 8)
+PHYSICAL_SCAN_IDS = tuple(range(0x7E0, 0x7E8))
+
+# data, tx_id, rx_id, timeout_ms (None = the ECU's own) -> final response or None
+ScanRequestFunc = Callable[[bytes, int, int, Optional[int]], Optional[bytes]]
+
+@dataclass
+class EcuScanResult:
+    """Everything one ECU answered during a scan"""
+    rx_id: int
+    tx_id: Optional[int]
+    responses: Dict[bytes, bytes] = field(default_factory=dict)  # request -> final response
+    physical: List[bytes] = field(default_factory=list)           # requests that needed physical addressing
+    failed: List[bytes] = field(default_factory=list)             # requests never answered
+
+    def positive(self, request: bytes) -> Optional[bytes]:
+        """Positive response to ``request``, or None"""
+        response = self.responses.get(request)
+        if response and response[0] == request[0] + 0x40:
+            return response
+        return None
+
+
+class ParallelEcuScanner:
+    """Functional discovery plus concurrent physical fan-out on one CAN channel"""
+
+    def __init__(self, transport, functional_id: int = FUNCTIONAL_ID_11BIT,
+                 discovery_timeout_ms: int = 100, p2_timeout_ms: int = 150,
+                 p2_star_timeout_ms: int = 5000, max_in_flight: int = 8, sessions=None):
+        self.transport = transport
+        self.sessions = sessions
+        self.functional_id = functional_id
+        self.discovery_timeout = discovery_timeout_ms / 1000.0
+        self.p2_timeout = p2_timeout_ms / 1000.0
+        self.p2_star_timeout = p2_star_timeout_ms / 1000.0
+        self.max_in_flight = max(1, max_in_flight)
+        # One collector reassembles the answers of every ECU
+        self.collector = IsoTpHandler(transport, functional_id, None, discovery_timeout_ms)
+        self._senders: Dict[int, IsoTpHandler] = {}
+
+    def _sender(self, result: EcuScanResult) -> Optional[IsoTpHandler]:
+        if result.tx_id is None:
+            return None
+        sender = self._senders.get(result.rx_id)
+        if sender is None:
+            sender = IsoTpHandler(self.transport, result.tx_id, result.rx_id)
+            self._senders[result.rx_id] = sender
+        return sender
+
+    def _timeout(self, result: EcuScanResult) -> float:
+        """Seconds to wait for this ECU's first response"""
+        if self.sessions is None or result.tx_id is None:
+            return self.p2_timeout
+        # A scan probes: no first-contact allowance for ECUs not heard from yet
+        return self.sessions.response_timeout_ms(result.tx_id, result.rx_id, probe=True) / 1000.0
+
+    def _record_latency(self, result: EcuScanResult, sent: float, now: float):
+        if self.sessions is not None and result.tx_id is not None:
+            self.sessions.record_latency(result.tx_id, (now - sent) * 1000, result.rx_id)
+
+    def discover(self) -> Dict[int, EcuScanResult]:
+        """ECUs answering a functional tester present, keyed by response ID"""
+        results: Dict[int, EcuScanResult] = {}
+        self.collector.reassembler.reset()
+        if not self.collector.send_data(TESTER_PRESENT):
+            logger.error("Functional tester present could not be sent")
+            return results
+        sent = time.monotonic()
+        deadline = sent + self.discovery_timeout
+        while True:
+            pdu = self.collector.poll_pdu(deadline)
+            if pdu is None:
+                break
+            if is_response_to(TESTER_PRESENT, pdu.data) and pdu.rx_id not in results:
+                results[pdu.rx_id] = EcuScanResult(pdu.rx_id, request_id_for(pdu.rx_id))
+                self._record_latency(results[pdu.rx_id], sent, time.monotonic())
+        logger.info(f"Functional discovery: {len(results)} ECU(s) responded "
+                    f"({', '.join(f'0x{rx:X}' for rx in sorted(results))})")
+        return results
+
+    def scan(self, requests: Iterable[bytes] = DEFAULT_SCAN_REQUESTS) -> Dict[int, EcuScanResult]:
+        """Discover all ECUs and collect their answers to ``requests``"""
+        start = time.monotonic()
+        requests = [bytes(request) for request in requests]
+        results = self.discover()
+        if not results:
+            return results
+
+        physical: Dict[int, Deque[bytes]] = {rx: deque() for rx in results}
+        for request in requests:
+            if self.collector.send_data(request):
+                now = time.monotonic()
+                waiting = {rx: request for rx in results}
+                sent = {rx: now for rx in results}
+                deadlines = {rx: now + self._timeout(result) for rx, result in results.items()}
+                unanswered = self._collect(waiting, deadlines, results, sent)
+            else:
+                unanswered = list(results)
+            for rx in unanswered:
+                physical[rx].append(request)
+
+        self._fan_out(physical, results)
+        logger.info(f"Scanned {len(results)} ECU(s) in {time.monotonic() - start:.3f}s")
+        return results
+
+    def _collect(self, waiting: Dict[int, bytes], deadlines: Dict[int, float],
+                 results: Dict[int, EcuScanResult], sent: Dict[int, float],
+                 on_done: Optional[Callable[[int, bool], None]] = None) -> List[int]:
+        """
+        Collect answers to the outstanding request of every ECU in
+        ``waiting`` until each has a final answer or its deadline passes.
+        ``sent`` holds each request's send time until its first answer.
+        Returns the ECUs that never answered (or were busy).
+        """
+        unanswered: List[int] = []
+
+        def finish(rx: int, answered: bool):
+            del deadlines[rx]
+            sent.pop(rx, None)
+            if not answered:
+                unanswered.append(rx)
+            if on_done:
+                on_done(rx, answered)
+
+        while deadlines:
+            pdu = self.collector.poll_pdu(min(deadlines.values()))
+            now = time.monotonic()
+            if pdu is not None and pdu.rx_id in deadlines:
+                request = waiting[pdu.rx_id]
+                if is_response_to(request, pdu.data):
+                    if pdu.rx_id in sent:
+                        self._record_latency(results[pdu.rx_id], sent.pop(pdu.rx_id), now)
+                    nrc = negative_response_code(request, pdu.data)
+                    if nrc == NRC_RESPONSE_PENDING:
+                        deadlines[pdu.rx_id] = now + self.p2_star_timeout
+                    elif nrc == NRC_BUSY_REPEAT_REQUEST:
+                        finish(pdu.rx_id, False)
+                    else:
+                        results[pdu.rx_id].responses[request] = pdu.data
+                        finish(pdu.rx_id, True)
+            for rx in [rx for rx, deadline in deadlines.items() if deadline <= now]:
+                finish(rx, False)
+        return unanswered
+
+    def _fan_out(self, queues: Dict[int, Deque[bytes]], results: Dict[int, EcuScanResult]):
+        """Physical requests to every ECU concurrently, one outstanding per ECU"""
+        waiting: Dict[int, bytes] = {}
+        deadlines: Dict[int, float] = {}
+        sent: Dict[int, float] = {}
+
+        def launch():
+            for rx, queue in queues.items():
+                if len(deadlines) >= self.max_in_flight:
+                    return
+                if rx in deadlines or not queue:
+                    continue
+                result = results[rx]
+                sender = self._sender(result)
+                request = queue.popleft()
+                result.physical.append(request)
+                if sender is None or not sender.send_data(request):
+                    logger.warning(f"Cannot send physical request to 0x{rx:X}")
+                    result.failed.append(request)
+                    continue
+                waiting[rx] = request
+                sent[rx] = time.monotonic()
+                deadlines[rx] = sent[rx] + self._timeout(result)
+
+        def done(rx: int, answered: bool):
+            if not answered:
+                results[rx].failed.append(waiting[rx])
+            launch()
+
+        launch()
+        self._collect(waiting, deadlines, results, sent, on_done=done)
+
+
+def physical_scan(request: ScanRequestFunc, requests: Iterable[bytes] = DEFAULT_SCAN_REQUESTS,
+                  tx_ids: Iterable[int] = PHYSICAL_SCAN_IDS,
+                  probe_timeout_ms: Optional[Callable[[int, int], int]] = None) -> Dict[int, EcuScanResult]:
+    """
+    Tester present to each physical ID in turn, then ``requests`` to every
+    ECU that answered. ``probe_timeout_ms(tx_id, rx_id)`` bounds the wait
+    for absent IDs. Returns response ID -> EcuScanResult, like ``scan``.
+    """
+    requests = [bytes(item) for item in requests]
+    results: Dict[int, EcuScanResult] = {}
+    for tx_id in tx_ids:
+        rx_id = tx_id + 8
+        timeout = probe_timeout_ms(tx_id, rx_id) if probe_timeout_ms else None
+        response = request(TESTER_PRESENT, tx_id, rx_id, timeout)
+        if not response or not is_response_to(TESTER_PRESENT, response):
+            continue
+        result = results[rx_id] = EcuScanResult(rx_id, tx_id)
+        for item in requests:
+            result.physical.append(item)
+            response = request(item, tx_id, rx_id, None)
+            if response is not None and negative_response_code(item, response) != NRC_BUSY_REPEAT_REQUEST:
+                result.responses[item] = response
+            else:
+                result.failed.append(item)
+    logger.info(f"Physical scan: {len(results)} ECU(s) responded "
+                f"({', '.join(f'0x{rx:X}' for rx in sorted(results))})")
+    return results
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Incremental ELM/STN Response Parser
+Turns the raw ASCII byte stream of an ELM327-compatible adapter into
+``ElmMessage(ecu, payload)`` tuples and typed status results.
+
+Handles, for CAN protocols:
+- headers off, single frame:   ``41 0C 1A F8``
+- headers off, multi-frame:    ``014`` / ``0: 49 02 01 ...`` / ``1: ...``
+- headers on (ATH1), 11/29-bit: ``7E8 10 14 49 02 ...`` / ``7E8 21 ...``
+  (ISO-TP PCI bytes are decoded and frames reassembled per ECU)
+- headers and DLC on (ATH1 + ATD1): ``7E8 8 06 41 00 ...``
+- spaces off (ATS0) in all of the above
+- NO DATA, SEARCHING..., BUFFER FULL, CAN ERROR, STOPPED, ? as ``ElmStatus``
+- multi-frame messages cut short by the prompt as a DATA_ERROR ``ElmStatus``
+
+Bytes may arrive in arbitrary chunks; results are produced as soon as the
+line that completes them arrives.
+"""
+
+import logging
+import re
+from dataclasses import dataclass
+from enum import Enum
+from typing import Dict, List, NamedTuple, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+
+class ElmMessage(NamedTuple):
+    """One complete response: sender (None with headers off) and payload"""
+    ecu: Optional[int]
+    payload: bytes
+
+
+class ElmStatusKind(Enum):
+    """Non-data adapter replies"""
+    OK = "OK"
+    NO_DATA = "NO DATA"
+    SEARCHING = "SEARCHING..."
+    BUFFER_FULL = "BUFFER FULL"
+    CAN_ERROR = "CAN ERROR"
+    BUS_ERROR = "BUS ERROR"
+    DATA_ERROR = "DATA ERROR"
+    STOPPED = "STOPPED"
+    UNABLE_TO_CONNECT = "UNABLE TO CONNECT"
+    UNKNOWN_COMMAND = "?"
+    TEXT = "TEXT"  # anything else (ATI banner, voltages, ...)
+
+
+@dataclass
+class ElmStatus:
+    """Typed non-data reply"""
+    kind: ElmStatusKind
+    text: str
+
+
+ElmResult = Union[ElmMessage, ElmStatus]
+
+# Checked in order against the upper-cased line
+_STATUS_PREFIXES = (
+    ('NO DATA', ElmStatusKind.NO_DATA),
+    ('SEARCHING', ElmStatusKind.SEARCHING),
+    ('BUFFER FULL', ElmStatusKind.BUFFER_FULL),
+    ('CAN ERROR', ElmStatusKind.CAN_ERROR),
+    ('BUS ERROR', ElmStatusKind.BUS_ERROR),
+    ('BUS BUSY', ElmStatusKind.BUS_ERROR),
+    ('FB ERROR', ElmStatusKind.BUS_ERROR),
+    ('<DATA ERROR', ElmStatusKind.DATA_ERROR),
+    ('DATA ERROR', ElmStatusKind.DATA_ERROR),
+    ('STOPPED', ElmStatusKind.STOPPED),
+    ('UNABLE TO CONNECT', ElmStatusKind.UNABLE_TO_CONNECT),
+    ('OK', ElmStatusKind.OK),
+    ('?', ElmStatusKind.UNKNOWN_COMMAND),
+)
+
+_LINE = re.compile(rb'([^\r\n>]*)([\r\n>])')
+_HEX_CHARS = b'0123456789ABCDEFabcdef'
+_HEX_DIGITS = frozenset(_HEX_CHARS)
+
+
+def _is_hex(data: bytes) -> bool:
+    return bool(data) and not data.translate(None, _HEX_CHARS)
+
+
+class _Assembly:
+    __slots__ = ('length', 'data')
+
+    def __init__(self, length: int, data: bytearray):
+        self.length = length
+        self.data = data
+
+
+class ElmResponseParser:
+    """
+    Incremental parser for one adapter stream.
+
+    ``headers`` must match the adapter's ATH setting and ``dlc`` its ATD
+    (DLC column after the header); ``id_bits`` (11 or 29) selects the header
+    width when headers are on.
+    """
+
+    def __init__(self, headers: bool = False, id_bits: int = 11, dlc: bool = False):
+        self.headers = headers
+        self.id_bits = id_bits
+        self.dlc = dlc
+        self._header_chars = 3 if id_bits == 11 else 8
+        self._buffer = bytearray()
+        self._assemblies: Dict[Optional[int], _Assembly] = {}
+        self.prompt_seen = False
+
+    def reset(self):
+        """Drop partial input and unfinished multi-frame messages"""
+        self._buffer.clear()
+        self._assemblies.clear()
+        self.prompt_seen = False
+
+    def feed(self, data: bytes) -> List[ElmResult]:
+        """Consume raw bytes; return every result completed by them"""
+        results: List[ElmResult] = []
+        buffer = self._buffer
+        buffer += data
+        end = max(buffer.rfind(b'\r'), buffer.rfind(b'\n'), buffer.rfind(b'>'))
+        if end < 0:
+            return results
+        complete = bytes(buffer[:end + 1])
+        del buffer[:end + 1]
+        for match in _LINE.finditer(complete):
+            line, terminator = match.groups()
+            if line:
+                self._parse_line(line, results)
+            if terminator == b'>':
+                self.prompt_seen = True
+                self._flush(results)
+        return results
+
+    def parse(self, response: Union[str, bytes]) -> List[ElmResult]:
+        """Parse one complete response (prompt optional)"""
+        if isinstance(response, str):
+            response = response.encode('ascii', errors='ignore')
+        results = self.feed(response)
+        if self._buffer:
+            self._parse_line(bytes(self._buffer), results)
+            self._buffer.clear()
+        self._flush(results)
+        return results
+
+    def messages(self, response: Union[str, bytes]) -> List[ElmMessage]:
+        """Only the data messages of a complete response"""
+        return [r for r in self.parse(response) if isinstance(r, ElmMessage)]
+
+    def _flush(self, results: List[ElmResult]):
+        """Report multi-frame messages cut short by the end of the response"""
+        for ecu, assembly in self._assemblies.items():
+            sender = 'adapter' if ecu is None else f"{ecu:X}"
+            text = (f"Incomplete multi-frame response from {sender}: "
+                    f"{len(assembly.data)}/{assembly.length} bytes")
+            logger.debug(text)
+            results.append(ElmStatus(ElmStatusKind.DATA_ERROR, text))
+        self._assemblies.clear()
+
+    def _parse_line(self, line: bytes, results: List[ElmResult]):
+        line = line.strip()
+        if not line:
+            return
+        compact = line.replace(b' ', b'')
+
+        if self.headers:
+            if self._parse_header_line(compact, results):
+                return
+        else:
+            if self._parse_plain_line(compact, results):
+                return
+
+        text = line.decode('ascii', errors='ignore')
+        upper = text.upper()
+        for prefix, kind in _STATUS_PREFIXES:
+            if upper.startswith(prefix):
+                results.append(ElmStatus(kind, text))
+                return
+        results.append(ElmStatus(ElmStatusKind.TEXT, text))
+
+    def _parse_plain_line(self, compact: bytes, results: List[ElmResult]) -> bool:
+        # "0:4902013147" continuation line (index is one hex digit)
+        if len(compact) > 2 and compact[1] == 0x3A and compact[0] in _HEX_DIGITS:
+            body = compact[2:]
+            if not _is_hex(body) or len(body) % 2:
+                return False
+            assembly = self._assemblies.get(None)
+            if assembly is None:
+                return True  # continuation without a length line; ignore
+            assembly.data += bytes.fromhex(body.decode())
+            if len(assembly.data) >= assembly.length:
+                del self._assemblies[None]
+                results.append(ElmMessage(None, bytes(assembly.data[:assembly.length])))
+            return True
+
+        if not _is_hex(compact):
+            return False
+        if len(compact) == 3:
+            # "014": byte count of the multi-frame message that follows
+            self._assemblies[None] = _Assembly(int(compact, 16), bytearray())
+            return True
+        if len(compact) % 2:
+            return False
+        results.append(ElmMessage(None, bytes.fromhex(compact.decode())))
+        return True
+
+    def _parse_header_line(self, compact: bytes, results: List[ElmResult]) -> bool:
+        width = self._header_chars
+        start = width + 1 if self.dlc else width
+        if len(compact) < start + 2 or (len(compact) - start) % 2 or not _is_hex(compact):
+            return False
+        ecu = int(compact[:width], 16)
+        frame = bytes.fromhex(compact[start:].decode())
+        pci = frame[0] >> 4
+
+        if pci == 0x0:  # single frame
+            size = frame[0] & 0x0F
+            results.append(ElmMessage(ecu, frame[1:1 + size]))
+        elif pci == 0x1 and len(frame) >= 2:  # first frame
+            size = ((frame[0] & 0x0F) << 8) | frame[1]
+            self._assemblies[ecu] = _Assembly(size, bytearray(frame[2:]))
+        elif pci == 0x2:  # consecutive frame
+            assembly = self._assemblies.get(ecu)
+            if assembly is None:
+                return True  # stray CF (its FF was lost or filtered)
+            assembly.data += frame[1:]
+            if len(assembly.data) >= assembly.length:
+                del self._assemblies[ecu]
+                results.append(ElmMessage(ecu, bytes(assembly.data[:assembly.length])))
+        else:
+            # Flow control or non-ISO-TP traffic: pass the raw frame through
+            results.append(ElmMessage(ecu, frame))
+        return True
+
+
+def parse_elm_response(response: Union[str, bytes], headers: bool = False,
+                       id_bits: int = 11, dlc: bool = False) -> List[ElmResult]:
+    """Parse one complete adapter response"""
+    return ElmResponseParser(headers=headers, id_bits=id_bits, dlc=dlc).parse(response)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Latency-Optimised ELM Command Profile
+Trims the fixed overhead of every ELM request/response exchange:
+
+- echo and spaces off (ATE0 / ATS0) - fewer bytes per response
+- aggressive adaptive timing (ATAT2) - shorter wait after the last frame
+- response-count hint - ``010C`` is sent as ``010C1`` once we know one frame
+  answers it, so the adapter returns as soon as that frame arrives instead of
+  sitting out its response timeout
+
+Hints are only used for requests whose frame count has been observed (or, for
+single-PID Mode 01 requests, derived from the number of responding ECUs), and
+are periodically dropped for one request so new responders are noticed.
+"""
+
+import logging
+import re
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+LATENCY_INIT_COMMANDS = [
+    ('ATE0', "Disable echo"),
+    ('ATS0', "Disable spaces"),
+    ('ATAT2', "Aggressive adaptive timing"),
+]
+
+MAX_RESPONSE_HINT = 0xF  # single hex digit
+_HEX_REQUEST = re.compile(r'^(?:[0-9A-F]{2})+$')
+_FRAME_LINE = re.compile(r'^(?:[0-9A-F]:)?[0-9A-F]{4,}$')
+_NO_RESPONSE = ('NO DATA', 'STOPPED', 'ERROR', 'UNABLE', 'BUFFER FULL', '?')
+
+
+def frame_count(response: str) -> int:
+    """Number of CAN frame lines in a raw ELM response (length lines excluded)"""
+    count = 0
+    for line in re.split(r'[\r\n]+', response.upper()):
+        line = line.replace(' ', '').replace('>', '')
+        if _FRAME_LINE.match(line):
+            count += 1
+    return count
+
+
+class ElmLatencyProfile:
+    """Init commands plus per-request response-count hints for one adapter"""
+
+    def __init__(self, enabled: bool = True, relearn_interval: int = 50):
+        self.enabled = enabled
+        self.relearn_interval = relearn_interval
+        self.ecu_count: Optional[int] = None  # responders to Mode 01
+        self._frames: Dict[str, int] = {}
+        self._uses: Dict[str, int] = {}
+
+    def init_commands(self) -> List[tuple]:
+        """(command bytes, description) pairs to send after the adapter reset"""
+        if not self.enabled:
+            return []
+        return [(f"{cmd}\r\n".encode(), desc) for cmd, desc in LATENCY_INIT_COMMANDS]
+
+    def expected_frames(self, command: str) -> Optional[int]:
+        request = command.strip().upper()
+        if request in self._frames:
+            return self._frames[request]
+        # Single-PID Mode 01 answers fit one frame per ECU
+        if self.ecu_count and len(request) == 4 and request.startswith('01'):
+            return self.ecu_count
+        return None
+
+    def prepare(self, command: str) -> str:
+        """Request string to put on the wire (with hint when known)"""
+        request = command.strip().upper().replace(' ', '')
+        if not self.enabled or not _HEX_REQUEST.match(request):
+            return command.strip()
+
+        uses = self._uses.get(request, 0) + 1
+        self._uses[request] = uses
+        if self.relearn_interval and uses % self.relearn_interval == 0:
+            return request  # unhinted now and then, to notice new responders
+
+        frames = self.expected_frames(request)
+        if frames and frames <= MAX_RESPONSE_HINT:
+            return f"{request}{frames:X}"
+        return request
+
+    def observe(self, command: str, sent: str, response: str):
+        """Learn the frame count from a response to ``command`` sent as ``sent``"""
+        request = command.strip().upper().replace(' ', '')
+        if not self.enabled or not _HEX_REQUEST.match(request):
+            return
+
+        upper = (response or "").upper()
+        frames = frame_count(upper)
+        hinted = sent.strip().upper() != request
+        if frames == 0 or any(marker in upper for marker in _NO_RESPONSE):
+            if hinted:
+                # The hint may be stale (ECU gone quiet); relearn without it
+                self._frames.pop(request, None)
+            return
+        if hinted:
+            return  # hinted replies stop at the hint; they cannot reveal more
+        self._frames[request] = frames
+        if request == '0100':
+            self.ecu_count = frames
+            logger.debug(f"{frames} ECU(s) answer Mode 01 requests")
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+ELM Fast Resume
+Reconnects to an adapter that is still powered without ATZ, the full init
+sequence and a fresh protocol search.
+
+Handlers record every setting command they apply (``note``); the resulting
+desired state is cached per device.  On reconnect ``resume`` probes the
+adapter with ATI:
+
+- no valid answer           -> caller falls back to the full reset sequence
+- answer echoed (ATE1)      -> adapter was power-cycled; it holds its power-on
+                               defaults, so only settings that differ are sent
+- answer not echoed         -> adapter was not reset; the protocol is re-checked
+                               (ATDPN) and the header and receive filters, which
+                               another program may have changed and which cost
+                               one short command each, are sent again
+
+When the desired protocol is automatic, the protocol found last time is
+requested first (``ATSP A6``) so the adapter skips the full search.
+"""
+
+import logging
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+from shared.json_cache import JsonCache
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE = "adapter_state_cache.json"
+
+# Exact command forms (spaces removed): ATSW/ATSI/ATSR, ATLP, ATEX... are
+# not settings, so ATS/ATL/ATE only match with their 0/1 argument
+SETTING_PATTERNS = [
+    (re.compile(r'ATCAF[01]'), 'can_formatting'),
+    (re.compile(r'ATCF([0-9A-F]{3}|[0-9A-F]{8})'), 'can_filter'),
+    (re.compile(r'ATCM([0-9A-F]{3}|[0-9A-F]{8})'), 'can_mask'),
+    (re.compile(r'ATSPA?[0-9A-C]'), 'protocol'),
+    (re.compile(r'ATSH([0-9A-F]{3}|[0-9A-F]{6}|[0-9A-F]{8})'), 'header_address'),
+    (re.compile(r'ATST[0-9A-F]{2}'), 'timeout'),
+    (re.compile(r'ATAT[012]'), 'adaptive_timing'),
+    (re.compile(r'ATE[01]'), 'echo'),
+    (re.compile(r'ATL[01]'), 'linefeeds'),
+    (re.compile(r'ATH[01]'), 'headers'),
+    (re.compile(r'ATD[01]'), 'dlc'),
+    (re.compile(r'ATS[01]'), 'spaces'),
+    (re.compile(r'STFCP'), 'stn_filters'),
+    (re.compile(r'STFAP[0-9A-F]+,[0-9A-F]+'), 'stn_filters'),
+]
+
+# ELM327 power-on defaults for the settings we track (protocol is queried)
+POWER_ON_DEFAULTS = {
+    'echo': 'ATE1',
+    'linefeeds': 'ATL1',
+    'headers': 'ATH0',
+    'dlc': 'ATD0',
+    'spaces': 'ATS1',
+    'can_formatting': 'ATCAF1',
+    'adaptive_timing': 'ATAT1',
+    'timeout': 'ATST32',
+    'stn_filters': ['STFCP'],
+}
+
+IDENT_TAGS = ('ELM', 'STN', 'OBDLINK', 'SCANMATIK')
+
+# Re-sent even when the adapter was not reset: cheaper than querying them
+ALWAYS_RESENT = ('header_address', 'can_filter', 'can_mask', 'stn_filters')
+
+_state_cache: Optional[JsonCache] = None
+
+
+def get_state_cache() -> JsonCache:
+    """Shared per-device adapter state cache"""
+    global _state_cache
+    if _state_cache is None:
+        _state_cache = JsonCache(CACHE_FILE)
+    return _state_cache
+
+
+def setting_key(command: str) -> Optional[str]:
+    """Setting a command changes, or None for non-setting commands"""
+    normalized = _normalize(command)
+    for pattern, key in SETTING_PATTERNS:
+        if pattern.fullmatch(normalized):
+            return key
+    return None
+
+
+def _normalize(command: str) -> str:
+    return command.strip().upper().replace(' ', '')
+
+
+def _clean_dpn(response: str) -> str:
+    """Protocol number from an ATDPN reply, e.g. 'A6' (automatic, now 6)"""
+    lines = [line.strip() for line in response.upper().replace('>', '').replace('\n', '\r').split('\r')]
+    lines = [line for line in lines if line and line != 'ATDPN']
+    return lines[0] if lines else ""
+
+
+class ElmResumeState:
+    """Desired adapter settings for one device and the fast-resume probe"""
+
+    def __init__(self, device_key: Optional[str] = None, cache: Optional[JsonCache] = None):
+        self.device_key = device_key
+        self.cache = cache
+        self.desired: Dict[str, Any] = {}
+        self.detected_protocol: Optional[str] = None
+        self.last_resume_commands: List[str] = []
+
+    def _cache(self) -> JsonCache:
+        if self.cache is None:
+            self.cache = get_state_cache()
+        return self.cache
+
+    def set_device(self, device_key: str):
+        """Select the device; loads its cached state when nothing is desired yet"""
+        self.device_key = device_key
+        if not self.desired:
+            entry = self._cache().get(device_key) or {}
+            self.desired = dict(entry.get('desired', {}))
+            self.detected_protocol = entry.get('detected_protocol')
+
+    def reset(self):
+        """Forget the desired state (full init is about to rebuild it)"""
+        self.desired = {}
+
+    def note(self, command: str):
+        """Record a setting command the adapter accepted"""
+        key = setting_key(command)
+        if key is None:
+            return
+        normalized = _normalize(command)
+        if key == 'stn_filters':
+            if normalized == 'STFCP':
+                self.desired[key] = ['STFCP']
+            else:
+                self.desired[key] = list(self.desired.get(key, ['STFCP'])) + [normalized]
+        else:
+            self.desired[key] = normalized
+
+    def save(self):
+        if not self.device_key or not self.desired:
+            return
+        self._cache().set(self.device_key, {
+            'desired': self.desired,
+            'detected_protocol': self.detected_protocol,
+        })
+
+    def _protocol_command(self) -> Optional[str]:
+        wanted = self.desired.get('protocol')
+        if wanted == 'ATSP0' and self.detected_protocol:
+            # Try the protocol found last time before searching
+            return f"ATSPA{self.detected_protocol}"
+        return wanted
+
+    def _protocol_matches(self, dpn: str) -> bool:
+        wanted = self.desired.get('protocol')
+        if not wanted:
+            return True
+        number = wanted[4:].lstrip('A') or '0'
+        if number == '0':
+            return dpn.startswith('A')  # automatic, searching or settled
+        return dpn.lstrip('A') == number
+
+    def resume(self, exchange: Callable[[str, float], str], probe_timeout: float = 0.5) -> bool:
+        """
+        Bring a live adapter to the desired state with the fewest commands.
+
+        ``exchange(command, timeout)`` sends one command and returns the raw
+        response text.  Returns False when the adapter must be fully reset.
+        """
+        self.last_resume_commands = []
+        if not self.desired:
+            return False
+
+        probe = exchange('ATI', probe_timeout) or ""
+        if not any(tag in probe.upper() for tag in IDENT_TAGS):
+            logger.info("Adapter probe failed; full reset required")
+            return False
+
+        from_defaults = 'ATI' in probe.upper()  # echo on -> power-on defaults
+        if from_defaults:
+            current: Dict[str, Any] = dict(POWER_ON_DEFAULTS)
+        else:
+            current = {key: value for key, value in self.desired.items() if key not in ALWAYS_RESENT}
+            if 'protocol' in self.desired:
+                dpn = _clean_dpn(exchange('ATDPN', probe_timeout) or "")
+                if not self._protocol_matches(dpn):
+                    current.pop('protocol', None)
+                elif dpn.startswith('A') and len(dpn) >= 2:
+                    self.detected_protocol = dpn[1:]
+
+        commands: List[str] = []
+        for key, wanted in self.desired.items():
+            if current.get(key) == wanted:
+                continue
+            if key == 'protocol':
+                commands.append(self._protocol_command())
+            elif isinstance(wanted, list):
+                commands.extend(wanted)
+            else:
+                commands.append(wanted)
+        # Echo first, so the remaining replies are parsed without it
+        commands.sort(key=lambda cmd: setting_key(cmd) != 'echo')
+
+        for command in commands:
+            response = exchange(command, probe_timeout) or ""
+            if 'OK' not in response.upper():
+                logger.warning(f"Fast resume: {command} not accepted ({response.strip()!r})")
+                return False
+            self.last_resume_commands.append(command)
+        self.save()
+
+        logger.info(f"Fast resume applied {len(commands)} setting(s)"
+                    f"{' after adapter power cycle' if from_defaults else ''}")
+        return True
+
+    def remember_protocol(self, dpn_response: str):
+        """Store the protocol an automatic search settled on (ATDPN reply)"""
+        dpn = _clean_dpn(dpn_response)
+        if dpn.startswith('A') and len(dpn) >= 2:
+            self.detected_protocol = dpn[1:]
+            self.save()
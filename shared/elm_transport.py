@@ -0,0 +1,515 @@
+#!/usr/bin/env python3
+"""
+ELM/STN Asyncio Transport
+Stream-based command transport shared by the OBDLink MX+, ScanMatik 2 Pro and
+HH OBD Advance handlers.
+
+Each adapter is driven by one ``ElmTransport`` running on a shared event loop
+(``TransportLoop``).  Commands are queued with a future per command and written
+as soon as the adapter's ``>`` prompt frees the link, so no handler needs its
+own sleep-polling read loop or reader thread.  Serial ports are bridged into
+asyncio with a small thread-backed adapter; TCP (WiFi adapters) and Bluetooth
+RFCOMM sockets are served natively by the loop.
+"""
+
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from collections import deque
+from typing import Callable, Deque, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PROMPT = b'>'
+CR = b'\r'
+
+
+class TransportClosedError(ConnectionError):
+    """Raised for commands issued on (or pending at) a closed transport"""
+    pass
+
+
+class TransportLoop:
+    """Shared background event loop serving every ELM transport"""
+
+    _instance = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get_instance() -> 'TransportLoop':
+        with TransportLoop._lock:
+            if TransportLoop._instance is None or not TransportLoop._instance.is_running():
+                TransportLoop._instance = TransportLoop()
+            return TransportLoop._instance
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="ElmTransportLoop")
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def is_running(self) -> bool:
+        return self._thread.is_alive() and not self.loop.is_closed()
+
+    def in_loop_thread(self) -> bool:
+        return threading.current_thread() is self._thread
+
+    def submit(self, coro) -> concurrent.futures.Future:
+        """Schedule a coroutine on the shared loop from any thread"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout: Optional[float] = None):
+        """Run a coroutine on the shared loop and block for its result"""
+        if self.in_loop_thread():
+            raise RuntimeError("TransportLoop.run() called from the transport loop thread")
+        return self.submit(coro).result(timeout)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=2)
+
+
+def get_transport_loop() -> TransportLoop:
+    return TransportLoop.get_instance()
+
+
+class SerialStreamAdapter:
+    """
+    Thread-backed bridge from a blocking pyserial port to asyncio streams.
+    One small reader thread feeds an ``asyncio.StreamReader``; writes are
+    handed to the default executor so the event loop never blocks on the UART.
+    """
+
+    def __init__(self, serial_port, loop: asyncio.AbstractEventLoop, read_size: int = 4096):
+        self.serial_port = serial_port
+        self.loop = loop
+        self.read_size = read_size
+        self.reader: Optional[asyncio.StreamReader] = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._write_lock = threading.Lock()
+
+    def start(self) -> asyncio.StreamReader:
+        """Create the stream reader (must run inside ``loop``) and start pumping"""
+        self.reader = asyncio.StreamReader()
+        # Short port timeout so the reader thread notices close() promptly
+        try:
+            self.serial_port.timeout = 0.05
+        except Exception:
+            pass
+        self._thread = threading.Thread(target=self._read_worker, daemon=True, name="ElmSerialReader")
+        self._thread.start()
+        return self.reader
+
+    def _read_worker(self):
+        reader = self.reader
+        while not self._stop.is_set():
+            try:
+                data = self.serial_port.read(self.serial_port.in_waiting or 1)
+            except Exception as e:
+                if not self._stop.is_set():
+                    logger.error(f"Serial read failed: {e}")
+                break
+            if data:
+                self.loop.call_soon_threadsafe(reader.feed_data, bytes(data))
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(reader.feed_eof)
+
+    # StreamWriter-compatible surface used by ElmTransport
+    def write(self, data: bytes):
+        with self._write_lock:
+            self.serial_port.write(data)
+
+    async def drain(self):
+        await self.loop.run_in_executor(None, self.serial_port.flush)
+
+    def close(self):
+        self._stop.set()
+
+    async def wait_closed(self):
+        if self._thread and self._thread.is_alive():
+            await self.loop.run_in_executor(None, self._thread.join, 1.0)
+
+    def is_closing(self) -> bool:
+        return self._stop.is_set()
+
+
+async def open_serial_stream(serial_port) -> Tuple[asyncio.StreamReader, SerialStreamAdapter]:
+    """Wrap an already-open pyserial port as a (reader, writer) pair"""
+    adapter = SerialStreamAdapter(serial_port, asyncio.get_running_loop())
+    return adapter.start(), adapter
+
+
+async def open_socket_stream(host: Optional[str] = None, port: Optional[int] = None,
+                             sock=None) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """Open a TCP adapter by host/port, or adopt a connected (e.g. RFCOMM) socket"""
+    if sock is not None:
+        sock.setblocking(False)
+        return await asyncio.open_connection(sock=sock)
+    return await asyncio.open_connection(host, port)
+
+
+class _PendingCommand:
+    """Queued ELM command with its completion future"""
+    __slots__ = ('command', 'future', 'expired', 'timer')
+
+    def __init__(self, command: bytes, future: asyncio.Future):
+        self.command = command
+        self.future = future
+        self.expired = False
+        self.timer = None
+
+
+class ElmTransport:
+    """
+    Asyncio command/response transport for ELM327-compatible adapters.
+
+    Commands are queued and written back-to-back as prompts arrive; each
+    ``command()`` call resolves with the text between the command and the
+    next ``>`` prompt.  ELM/STN firmware aborts the running command when a new
+    byte arrives, so ``max_in_flight`` defaults to 1: the next command leaves
+    the host the moment the previous prompt is seen, without any polling delay.
+    """
+
+    def __init__(self, reader, writer, name: str = "ELM", max_in_flight: int = 1,
+                 default_timeout: float = 2.0):
+        self.reader = reader
+        self.writer = writer
+        self.name = name
+        self.max_in_flight = max(1, max_in_flight)
+        self.default_timeout = default_timeout
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Deque[_PendingCommand] = deque()
+        self._in_flight: Deque[_PendingCommand] = deque()
+        self._buffer = bytearray()
+        self._read_task = None
+        self._closed = False
+
+        # Monitor mode (ATMA/STMA): lines go to the callback instead of futures
+        self._monitor_callback: Optional[Callable[[str], None]] = None
+        self._monitor_stopping: Optional[asyncio.Future] = None
+
+        # Statistics
+        self.commands_sent = 0
+        self.timeouts = 0
+        self.monitor_lines = 0
+
+    # ------------------------------------------------------------------ life cycle
+
+    async def start(self) -> 'ElmTransport':
+        self._loop = asyncio.get_running_loop()
+        self._read_task = self._loop.create_task(self._read_loop())
+        return self
+
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._read_task:
+            self._read_task.cancel()
+        self._fail_all(TransportClosedError(f"{self.name} transport closed"))
+        try:
+            self.writer.close()
+            await self.writer.wait_closed()
+        except Exception as e:
+            logger.debug(f"{self.name}: error closing writer: {e}")
+
+    @property
+    def is_closed(self) -> bool:
+        return self._closed
+
+    @property
+    def is_monitoring(self) -> bool:
+        return self._monitor_callback is not None
+
+    # ------------------------------------------------------------------ commands
+
+    def submit(self, command, timeout: Optional[float] = None) -> asyncio.Future:
+        """Queue a command (loop thread only) and return its future"""
+        if self._closed:
+            raise TransportClosedError(f"{self.name} transport closed")
+        if isinstance(command, str):
+            command = command.encode('ascii')
+        command = command.strip(b'\r\n ')
+
+        future = self._loop.create_future()
+        pending = _PendingCommand(command, future)
+        timeout = self.default_timeout if timeout is None else timeout
+        if timeout:
+            pending.timer = self._loop.call_later(timeout, self._expire, pending)
+        self._queue.append(pending)
+        self._pump()
+        return future
+
+    async def command(self, command, timeout: Optional[float] = None) -> str:
+        """Send a command and return the raw response text (prompt stripped)"""
+        return await self.submit(command, timeout)
+
+    def query(self, command, timeout: Optional[float] = None) -> str:
+        """Blocking ``command()`` for callers outside the transport loop"""
+        timeout = self.default_timeout if timeout is None else timeout
+        future = asyncio.run_coroutine_threadsafe(self.command(command, timeout), self._loop)
+        return future.result(timeout + 1.0)
+
+    def query_async(self, command, timeout: Optional[float] = None) -> concurrent.futures.Future:
+        """Thread-safe submit returning a ``concurrent.futures.Future``"""
+        return asyncio.run_coroutine_threadsafe(self.command(command, timeout), self._loop)
+
+    def _pump(self):
+        """Write queued commands while the in-flight window has room"""
+        while (self._queue and len(self._in_flight) < self.max_in_flight
+               and self._monitor_callback is None and not self._closed):
+            pending = self._queue.popleft()
+            if pending.future.done():
+                continue  # cancelled or expired before it was written
+            self._in_flight.append(pending)
+            try:
+                self.writer.write(pending.command + CR)
+                self._loop.create_task(self._drain())
+                self.commands_sent += 1
+            except Exception as e:
+                logger.error(f"{self.name}: write failed: {e}")
+                self._in_flight.remove(pending)
+                self._resolve(pending, exc=TransportClosedError(str(e)))
+
+    async def _drain(self):
+        try:
+            await self.writer.drain()
+        except Exception as e:
+            logger.debug(f"{self.name}: drain failed: {e}")
+
+    def _expire(self, pending: _PendingCommand):
+        """Per-command timeout: fail the future, interrupt the adapter if needed"""
+        if pending.future.done():
+            return
+        self.timeouts += 1
+        pending.expired = True
+        pending.future.set_exception(asyncio.TimeoutError(
+            f"{self.name}: no prompt for {pending.command.decode(errors='ignore')}"))
+        if pending in self._in_flight:
+            # Any byte aborts the running command and forces a '>' prompt,
+            # which then retires the expired entry in order.
+            try:
+                self.writer.write(CR)
+            except Exception:
+                pass
+
+    def _resolve(self, pending: _PendingCommand, result: Optional[str] = None,
+                 exc: Optional[BaseException] = None):
+        if pending.timer:
+            pending.timer.cancel()
+        if pending.future.done():
+            return
+        if exc is not None:
+            pending.future.set_exception(exc)
+        else:
+            pending.future.set_result(result)
+
+    def _fail_all(self, exc: BaseException):
+        while self._in_flight:
+            self._resolve(self._in_flight.popleft(), exc=exc)
+        while self._queue:
+            self._resolve(self._queue.popleft(), exc=exc)
+        if self._monitor_stopping and not self._monitor_stopping.done():
+            self._monitor_stopping.set_exception(exc)
+
+    # ------------------------------------------------------------------ monitor
+
+    async def start_monitor(self, callback: Callable[[str], None], command: str = 'ATMA') -> bool:
+        """Enter monitor mode; every received line is passed to ``callback``"""
+        if self._monitor_callback is not None:
+            return True
+        # Let queued commands finish before the link is taken over
+        while self._in_flight or self._queue:
+            tail = (self._queue or self._in_flight)[-1].future
+            await asyncio.wait({tail})
+        self._monitor_callback = callback
+        self.writer.write(command.encode('ascii') + CR)
+        await self._drain()
+        return True
+
+    async def stop_monitor(self, timeout: float = 2.0) -> bool:
+        """Leave monitor mode by interrupting the adapter and awaiting its prompt"""
+        if self._monitor_callback is None:
+            return True
+        self._monitor_stopping = self._loop.create_future()
+        self.writer.write(CR)
+        await self._drain()
+        try:
+            await asyncio.wait_for(self._monitor_stopping, timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning(f"{self.name}: no prompt after stopping monitor")
+            self._monitor_callback = None
+            return False
+        finally:
+            self._monitor_stopping = None
+            self._pump()
+
+    # ------------------------------------------------------------------ reader
+
+    async def _read_loop(self):
+        try:
+            while not self._closed:
+                data = await self.reader.read(4096)
+                if not data:
+                    break
+                self._feed(data)
+        except asyncio.CancelledError:
+            return
+        except Exception as e:
+            logger.error(f"{self.name}: read loop failed: {e}")
+        if not self._closed:
+            logger.warning(f"{self.name}: link closed by peer")
+            self._closed = True
+            self._fail_all(TransportClosedError(f"{self.name} link lost"))
+
+    def _feed(self, data: bytes):
+        """Split incoming bytes into prompt-terminated responses or monitor lines"""
+        buf = self._buffer
+        buf += data
+
+        if self._monitor_callback is not None:
+            self._feed_monitor()
+            if self._monitor_callback is not None:
+                return
+
+        while True:
+            idx = buf.find(PROMPT)
+            if idx < 0:
+                break
+            chunk = bytes(buf[:idx])
+            del buf[:idx + 1]
+            if not self._in_flight:
+                logger.debug(f"{self.name}: unsolicited response {chunk!r}")
+                continue
+            pending = self._in_flight.popleft()
+            self._resolve(pending, self._clean_response(chunk, pending.command))
+        self._pump()
+
+    def _feed_monitor(self):
+        buf = self._buffer
+        callback = self._monitor_callback
+        while True:
+            prompt = buf.find(PROMPT)
+            cr = buf.find(CR)
+            if prompt >= 0 and (cr < 0 or prompt < cr):
+                # Monitor ended (STOPPED / BUFFER FULL) - back to command mode
+                del buf[:prompt + 1]
+                self._monitor_callback = None
+                if self._monitor_stopping and not self._monitor_stopping.done():
+                    self._monitor_stopping.set_result(True)
+                return
+            if cr < 0:
+                return
+            line = bytes(buf[:cr]).strip()
+            del buf[:cr + 1]
+            if not line or (line == b'STOPPED' and self._monitor_stopping is not None):
+                continue
+            self.monitor_lines += 1
+            try:
+                callback(line.decode('ascii', errors='ignore'))
+            except Exception as e:
+                logger.debug(f"{self.name}: monitor callback error: {e}")
+
+    @staticmethod
+    def _clean_response(chunk: bytes, command: bytes) -> str:
+        """Drop the echoed command (if echo is on) and surrounding whitespace"""
+        text = chunk.decode('ascii', errors='ignore').replace('\n', '')
+        stripped = text.lstrip('\r ')
+        cmd = command.decode('ascii', errors='ignore')
+        if cmd and stripped.startswith(cmd + '\r'):
+            stripped = stripped[len(cmd) + 1:]
+        return stripped.strip('\r ')
+
+
+async def open_elm_transport(serial_port=None, sock=None, host: Optional[str] = None,
+                             port: Optional[int] = None, **kwargs) -> ElmTransport:
+    """Open an ElmTransport over a pyserial port, a connected socket, or host/port"""
+    if serial_port is not None:
+        reader, writer = await open_serial_stream(serial_port)
+    else:
+        reader, writer = await open_socket_stream(host=host, port=port, sock=sock)
+    return await ElmTransport(reader, writer, **kwargs).start()
+
+
+class AsyncTransportMixin:
+    """
+    Routes a handler's ``_send_command``/``_read_response`` through a shared
+    ``ElmTransport`` once one is attached, keeping the handlers' blocking API.
+    """
+
+    transport: Optional[ElmTransport] = None
+    _transport_replies: Optional[Deque[Tuple[concurrent.futures.Future, float]]] = None
+
+    def attach_async_transport(self, serial_port=None, sock=None, host: Optional[str] = None,
+                               port: Optional[int] = None, name: Optional[str] = None) -> bool:
+        """Serve this handler's link from the shared transport loop"""
+        try:
+            loop = get_transport_loop()
+            self.transport = loop.run(open_elm_transport(
+                serial_port=serial_port, sock=sock, host=host, port=port,
+                name=name or getattr(self, 'device_name', 'ELM')), timeout=5.0)
+            self._transport_replies = deque()
+            logger.info(f"Async transport attached for {self.transport.name}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to attach async transport: {e}")
+            self.transport = None
+            return False
+
+    def detach_async_transport(self):
+        if self.transport:
+            try:
+                get_transport_loop().run(self.transport.close(), timeout=3.0)
+            except Exception as e:
+                logger.debug(f"Error closing async transport: {e}")
+            self.transport = None
+            self._transport_replies = None
+
+    def _transport_send(self, command: bytes, timeout: Optional[float] = None) -> bool:
+        """
+        Queue a command; ``timeout`` is the reply deadline the caller will
+        later read with (the transport's default when omitted).
+        """
+        if timeout is None:
+            timeout = self.transport.default_timeout
+        try:
+            reply = self.transport.query_async(command, timeout)
+        except Exception as e:
+            logger.error(f"Failed to queue command: {e}")
+            return False
+        if self._transport_replies is None:
+            self._transport_replies = deque()
+        self._transport_replies.append((reply, timeout))
+        return True
+
+    def _transport_read(self, timeout: float = 2.0) -> str:
+        """
+        Replies to every command sent since the last read, oldest first and
+        each ending with its prompt - what the serial path would have buffered.
+        """
+        replies = self._transport_replies
+        if not replies:
+            return ""
+        if len(replies) > 1:
+            logger.debug(f"Reading {len(replies)} queued replies together")
+        texts = []
+        while replies:
+            reply, sent_timeout = replies.popleft()
+            try:
+                texts.append(reply.result(max(timeout, sent_timeout) + 1.0) + "\r>")
+            except Exception as e:
+                logger.debug(f"Async transport read failed: {e}")
+        return "".join(texts)
+        try:
+            # Keep the historical "response ends with a prompt" contract
+            return reply.result(timeout + 1.0) + "\r>"
+        except Exception as e:
+            logger.debug(f"Async transport read failed: {e}")
+            return ""
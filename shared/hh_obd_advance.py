@@ -14,6 +14,13 @@ from dataclasses import dataclass
 from enum import Enum
 import re
 
+from shared.elm_parser import ElmResponseParser
+from shared.elm_profile import ElmLatencyProfile
+from shared.elm_resume import ElmResumeState
+from shared.elm_transport import AsyncTransportMixin
+from shared.obd_pids import PID_DEFINITIONS
+from shared.pid_discovery import SupportedPidsMixin
+
 logger = logging.getLogger(__name__)
 
 
@@ -40,16 +47,22 @@ class OBDDeviceInfo:
     baudrate: int = 38400
 
 
-class HHOBDAdvanceHandler:
+class HHOBDAdvanceHandler(SupportedPidsMixin, AsyncTransportMixin):
     """HH OBD Advance device handler with enhanced OBDII detection"""
     
-    def __init__(self, mock_mode: bool = False):
+    def __init__(self, mock_mode: bool = False, use_async_transport: bool = False):
         self.mock_mode = mock_mode
+        self.device_name = "HH OBD Advance"
+        self.use_async_transport = use_async_transport
         self.detected_devices: List[OBDDeviceInfo] = []
         self.connected_device: Optional[OBDDeviceInfo] = None
         self.serial_connection = None
         self.connection_lock = threading.Lock()
-        
+        # ATE0/ATS0/ATAT2 plus response-count hints on OBD requests
+        self.latency_profile = ElmLatencyProfile()
+        self.response_parser = ElmResponseParser(headers=True, dlc=True)  # init sets ATH1 and ATD1
+        # Applied settings, cached per port for reset-free reconnects
+        self.resume_state = ElmResumeState()
         # Common OBDII device patterns
         self.obdii_patterns = [
             r'OBDII',
@@ -250,12 +263,17 @@ class HHOBDAdvanceHandler:
                     stopbits=serial.STOPBITS_ONE
                 )
                 
+                if self.use_async_transport:
+                    self.attach_async_transport(serial_port=self.serial_connection)
+                
                 # Initialize device
+                self.resume_state.set_device(f"serial:{target_device.port}")
                 if self._initialize_obdii_device():
                     self.connected_device = target_device
                     logger.info(f"Connected to OBDII device: {target_device.name} on {target_device.port}")
                     return True
                 else:
+                    self.detach_async_transport()
                     self.serial_connection.close()
                     self.serial_connection = None
                     return False
@@ -264,8 +282,18 @@ class HHOBDAdvanceHandler:
                 logger.error(f"Failed to connect to OBDII device: {e}")
                 return False
     
-    def _initialize_obdii_device(self) -> bool:
+    def _exchange(self, command: str, timeout: float = 1.0) -> str:
+        """Send one command and return the raw response"""
+        if not self._send_command(f"{command}\r".encode('ascii'), timeout):
+            return ""
+        return self._read_response(timeout) or ""
+
+    def _initialize_obdii_device(self, allow_resume: bool = True) -> bool:
         """Initialize OBDII device with proper AT commands"""
+        if allow_resume and self.resume_state.resume(self._exchange):
+            logger.info("OBDII device resumed without reset")
+            return True
+        self.resume_state.reset()
         try:
             # Send initialization sequence
             init_commands = [
@@ -276,13 +304,17 @@ class HHOBDAdvanceHandler:
                 (b'ATSP0\r\n', "Auto protocol select"),
                 (b'ATAT2\r\n', "Adaptive timing 2"),
                 (b'ATST62\r\n', "Set timeout to 62 * 4ms = 248ms"),
-                (b'ATD1\r\n', "Set default settings")
+                (b'ATD1\r\n', "Display DLC")
             ]
+            # Latency settings (spaces off, ATAT2) on top of the sequence above
+            init_commands += self.latency_profile.init_commands()
             
             for cmd, description in init_commands:
                 logger.debug(f"Sending {description}...")
-                self._send_command(cmd)
+                if self._send_command(cmd):
+                    self.resume_state.note(cmd.decode())
                 time.sleep(0.3)
+            self.resume_state.save()
             
             # Test connection with ATSH command
             self._send_command(b'ATSH\r\n')
@@ -300,12 +332,15 @@ class HHOBDAdvanceHandler:
             logger.error(f"Error initializing OBDII device: {e}")
             return False
     
-    def _send_command(self, command: bytes) -> bool:
+    def _send_command(self, command: bytes, timeout: Optional[float] = None) -> bool:
         """Send command to connected OBDII device"""
         try:
             if not self.serial_connection:
                 return False
             
+            if self.transport:
+                return self._transport_send(command, timeout)
+            
             self.serial_connection.write(command)
             return True
         except Exception as e:
@@ -318,6 +353,9 @@ class HHOBDAdvanceHandler:
             if not self.serial_connection:
                 return None
             
+            if self.transport:
+                return self._transport_read(timeout).strip()
+            
             start_time = time.time()
             response = ""
             
@@ -342,20 +380,23 @@ class HHOBDAdvanceHandler:
         
         try:
             # Format command for OBDII device
-            obd_command = f"{command}\r\n".encode('utf-8')
+            wire_command = self.latency_profile.prepare(command)
+            obd_command = f"{wire_command}\r\n".encode('utf-8')
             
             # Send command
-            if not self._send_command(obd_command):
+            if not self._send_command(obd_command, timeout=2.0):
                 return {"success": False, "error": "Failed to send command"}
             
             # Read response
             response = self._read_response(timeout=2.0)
+            self.latency_profile.observe(command, wire_command, response)
             
             if response:
                 return {
                     "success": True,
                     "command": command,
                     "response": response,
+                    "messages": self.response_parser.messages(response),
                     "device": self.connected_device.name,
                     "timestamp": time.time()
                 }
@@ -371,6 +412,8 @@ class HHOBDAdvanceHandler:
             return {"success": False, "error": "No OBDII device connected"}
         
         results = {}
+        if not self._pids_discovered:
+            self.discover_supported_pids()
         
         # Standard OBD PIDs
         standard_pids = [
@@ -387,11 +430,16 @@ class HHOBDAdvanceHandler:
         ]
         
         for pid, description in standard_pids:
+            if not self._pid_supported(pid):
+                logger.debug(f"Skipping unsupported PID {pid} ({description})")
+                continue
             result = self.execute_obd_command(pid)
             if result.get("success"):
                 results[pid] = {
                     "description": description,
                     "value": result.get("response", ""),
+                    "decoded": self._decode_mode01(pid, result.get("messages", [])),
+                    "unit": PID_DEFINITIONS[int(pid[2:], 16)].unit,
                     "timestamp": time.time()
                 }
         
@@ -426,11 +474,13 @@ class HHOBDAdvanceHandler:
     
     def disconnect(self):
         """Disconnect from OBDII device"""
+        self.forget_supported_pids()
         with self.connection_lock:
             if self.serial_connection:
                 try:
                     self._send_command(b'ATZ\r\n')  # Reset before disconnect
                     time.sleep(0.5)
+                    self.detach_async_transport()
                     self.serial_connection.close()
                 except:
                     pass
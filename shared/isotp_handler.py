@@ -2,13 +2,47 @@
 """
 ISO-TP (ISO 15765-2) Protocol Handler
 Provides Segmentation and Reassembly (SAR) for UDS over CAN.
+
+Flow control is honoured in both directions:
+- sending: the receiver's BS and STmin from every FC are obeyed, a new FC is
+  awaited after each block, FC.WAIT is accepted up to ``max_wait_frames``
+  times and FC.OVFLW aborts the transfer
+- receiving: the BS/STmin of the ECU's ``FlowControlConfig`` are advertised,
+  a new FC.CTS is sent after each block, oversized messages get FC.OVFLW
+
+Consecutive frames are paced against ``time.perf_counter`` deadlines: the
+handler sleeps for the coarse part and busy-waits the last stretch, so
+sub-millisecond STmin values (0xF1-0xF9) are met without oversleeping.
+
+Reception goes through ``IsoTpReassembler``, which keeps independent state
+per (CAN ID, addressing mode) in a single pass over the incoming frames, so
+a functionally addressed request (0x7DF, 0x18DB33F1) can collect complete
+replies from every ECU at once.  11-bit normal and 29-bit normal-fixed
+(0x18DA<target><source>) addressing are supported.
+
+ISO 15765-2:2016 extensions: messages over 4095 bytes use the 32-bit
+escape length in the First Frame (``10 00 LL LL LL LL``), and with CAN FD
+(``FlowControlConfig.tx_dl`` up to 64) single frames carry up to 62 bytes
+and every consecutive frame 63, so large transfers need far fewer frames
+and flow-control round trips.  Reception accepts both automatically;
+``max_rx_length`` bounds what an ECU may send.
+
+The per-frame paths do not allocate: outgoing frames are written into
+preallocated J2534 message buffers (slices of a ``memoryview`` of the
+payload), and incoming messages into a ``bytearray`` sized from the First
+Frame.  Transports must therefore consume a message's data before
+``send_to_channel`` returns, as J2534 PassThruWriteMsgs does.
 """
 
+import math
 import time
 import logging
-from typing import List, Optional, Tuple, Union
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple, Union
 from enum import Enum
 
+from shared.j2534_passthru import J2534Message, J2534Protocol
+
 logger = logging.getLogger(__name__)
 
 class IsoTpFrameType(Enum):
@@ -17,28 +51,343 @@ class IsoTpFrameType(Enum):
     CONSECUTIVE_FRAME = 2
     FLOW_CONTROL = 3
 
+# Plain ints for the per-frame paths (Enum attribute access is slow)
+_SINGLE_FRAME = IsoTpFrameType.SINGLE_FRAME.value
+_FIRST_FRAME = IsoTpFrameType.FIRST_FRAME.value
+_CONSECUTIVE_FRAME = IsoTpFrameType.CONSECUTIVE_FRAME.value
+# Smallest valid FF_DL: anything shorter fits a classic CAN Single Frame
+MIN_FF_DL = 8
+
+class FlowStatus(Enum):
+    CONTINUE_TO_SEND = 0
+    WAIT = 1
+    OVERFLOW = 2
+
+# Valid CAN / CAN FD frame data lengths
+CAN_FRAME_SIZES = (8, 12, 16, 20, 24, 32, 48, 64)
+FF_DL_12BIT_MAX = 0xFFF  # longer messages need the 32-bit escape length
+DEFAULT_FD_PADDING = 0xCC  # CAN FD frames must be padded to a valid length
+
+# STmin values 0x80-0xF0 and 0xFA-0xFF are reserved; ISO 15765-2 says to
+# treat them as the longest valid separation time
+ST_MIN_RESERVED_SECONDS = 0.127
+
+
+def decode_st_min(raw: int) -> float:
+    """STmin byte of a flow-control frame -> separation time in seconds"""
+    if raw <= 0x7F:
+        return raw / 1000.0
+    if 0xF1 <= raw <= 0xF9:
+        return (raw - 0xF0) / 10000.0
+    return ST_MIN_RESERVED_SECONDS
+
+
+def encode_st_min(seconds: float) -> int:
+    """Separation time in seconds -> smallest STmin byte that guarantees it"""
+    if seconds <= 0:
+        return 0x00
+    if seconds <= 0.0009:
+        return 0xF0 + max(1, math.ceil(round(seconds * 10000, 6)))
+    return min(0x7F, math.ceil(round(seconds * 1000, 6)))
+
+
+def pace_until(deadline: float, spin: float = 0.002):
+    """
+    Block until ``time.perf_counter()`` reaches ``deadline``.
+    time.sleep may overshoot by a scheduler tick, so the last ``spin``
+    seconds are busy-waited.
+    """
+    remaining = deadline - time.perf_counter()
+    if remaining > spin:
+        time.sleep(remaining - spin)
+    while time.perf_counter() < deadline:
+        pass
+
+
+@dataclass
+class FlowControlConfig:
+    """Flow-control parameters used towards one ECU"""
+    block_size: int = 0            # BS we advertise when receiving (0 = no further FC)
+    st_min: int = 0x00             # raw STmin byte we advertise when receiving
+    max_wait_frames: int = 10      # N_WFTmax: FC.WAIT frames accepted when sending
+    fc_timeout_ms: int = 1000      # N_Bs: wait for a flow-control frame
+    cf_timeout_ms: int = 1000      # N_Cr: wait for the next consecutive frame
+    max_rx_length: int = 4095      # longer incoming messages are refused with FC.OVFLW
+    padding: Optional[int] = 0xAA  # None = send frames unpadded
+    tx_dl: int = 8                 # frame data length we send: 8 = classic CAN, 12-64 = CAN FD
+
+
+_flow_control_configs: Dict[int, FlowControlConfig] = {}
+
+
+def frame_size_for(length: int) -> int:
+    """Smallest valid CAN / CAN FD data length that holds ``length`` bytes"""
+    for size in CAN_FRAME_SIZES:
+        if size >= length:
+            return size
+    raise ValueError(f"{length} bytes do not fit in a CAN FD frame")
+
+
+def set_flow_control_config(ecu_tx_id: int, config: FlowControlConfig):
+    """Use ``config`` for every handler that talks to the ECU on ``ecu_tx_id``"""
+    _flow_control_configs[ecu_tx_id] = config
+
+
+def get_flow_control_config(ecu_tx_id: int) -> FlowControlConfig:
+    """Flow-control parameters for an ECU (defaults when none were set)"""
+    return _flow_control_configs.get(ecu_tx_id) or FlowControlConfig()
+
+
+# --- Addressing ---
+
+CAN_29BIT_ID = 0x00000100  # J2534 TxFlags/RxStatus bit for 29-bit identifiers
+
+FUNCTIONAL_ID_11BIT = 0x7DF
+FUNCTIONAL_ID_29BIT = 0x18DB33F1
+TESTER_ADDRESS = 0xF1
+
+_PHYSICAL_29BIT = 0x18DA0000
+_FUNCTIONAL_29BIT = 0x18DB0000
+_PRIORITY_PGN_MASK = 0x1FFF0000
+
+
+class AddressingMode(Enum):
+    NORMAL_11BIT = "11bit"
+    NORMAL_FIXED_29BIT = "29bit_normal_fixed"
+
+
+def addressing_mode(can_id: int) -> AddressingMode:
+    return AddressingMode.NORMAL_FIXED_29BIT if can_id > 0x7FF else AddressingMode.NORMAL_11BIT
+
+
+def is_functional_id(can_id: int) -> bool:
+    return can_id == FUNCTIONAL_ID_11BIT or (can_id & _PRIORITY_PGN_MASK) == _FUNCTIONAL_29BIT
+
+
+def physical_ids_29bit(ecu_address: int, tester_address: int = TESTER_ADDRESS) -> Tuple[int, int]:
+    """(request ID, response ID) of an ECU with normal-fixed addressing"""
+    return (_PHYSICAL_29BIT | (ecu_address << 8) | tester_address,
+            _PHYSICAL_29BIT | (tester_address << 8) | ecu_address)
+
+
+def is_response_id(can_id: int, tester_address: int = TESTER_ADDRESS) -> bool:
+    """True for IDs ECUs answer the tester on (0x7E8-0x7EF, 0x18DA<tester>xx)"""
+    if can_id > 0x7FF:
+        return (can_id & 0x1FFFFF00) == (_PHYSICAL_29BIT | (tester_address << 8))
+    return 0x7E8 <= can_id <= 0x7EF
+
+
+def request_id_for(response_id: int) -> Optional[int]:
+    """Physical request ID paired with an ECU's response ID, or None if unknown"""
+    if response_id > 0x7FF:
+        if (response_id & _PRIORITY_PGN_MASK) != _PHYSICAL_29BIT:
+            return None
+        target = (response_id >> 8) & 0xFF
+        source = response_id & 0xFF
+        return _PHYSICAL_29BIT | (source << 8) | target
+    if 0x7E8 <= response_id <= 0x7EF:
+        return response_id - 8
+    return None
+
+
+# --- Reassembly ---
+
+@dataclass
+class IsoTpPdu:
+    """One complete message and the CAN ID it arrived on"""
+    rx_id: int
+    mode: AddressingMode
+    data: bytes
+
+
+class _RxSession:
+    __slots__ = ('tx_id', 'config', 'length', 'data', 'received', 'next_sn', 'block_left',
+                 'cf_timeout', 'expires')
+
+    def __init__(self, tx_id: int, config: FlowControlConfig, length: int, first: memoryview, now: float):
+        self.tx_id = tx_id
+        self.config = config
+        self.length = length
+        self.data = bytearray(length)
+        self.received = min(len(first), length)
+        self.data[:self.received] = first[:self.received]
+        self.next_sn = 1
+        self.block_left = config.block_size
+        self.cf_timeout = config.cf_timeout_ms / 1000.0
+        self.expires = now + self.cf_timeout
+
+
+class IsoTpReassembler:
+    """
+    Reassembles messages from any number of senders in one pass.
+
+    Each (CAN ID, addressing mode) has its own session; flow control for a
+    sender goes to ``flow_control_id(rx_id)`` through ``send_flow_control``
+    with the parameters of ``config_for(tx_id)``.
+    """
+
+    def __init__(self, send_flow_control: Callable[[int, bytes], bool],
+                 config_for: Callable[[int], FlowControlConfig] = get_flow_control_config,
+                 flow_control_id: Callable[[int], Optional[int]] = request_id_for):
+        self.send_flow_control = send_flow_control
+        self.config_for = config_for
+        self.flow_control_id = flow_control_id
+        self._sessions: Dict[Tuple[int, AddressingMode], _RxSession] = {}
+
+    @property
+    def active(self) -> bool:
+        return bool(self._sessions)
+
+    def reset(self):
+        self._sessions.clear()
+
+    def next_expiry(self) -> Optional[float]:
+        """Monotonic time the oldest unfinished message times out (N_Cr)"""
+        if not self._sessions:
+            return None
+        return min(session.expires for session in self._sessions.values())
+
+    def expire(self, now: Optional[float] = None) -> List[int]:
+        """Drop messages whose next CF is overdue; returns their CAN IDs"""
+        now = time.monotonic() if now is None else now
+        expired = [key for key, session in self._sessions.items() if session.expires <= now]
+        for key in expired:
+            session = self._sessions.pop(key)
+            logger.error(f"ISO-TP: Timeout waiting for CF from 0x{key[0]:X} "
+                         f"({session.received}/{session.length} bytes)")
+        return [key[0] for key in expired]
+
+    def _flow_control(self, tx_id: int, config: FlowControlConfig, status: FlowStatus) -> bool:
+        payload = bytes([0x30 | status.value, config.block_size & 0xFF, config.st_min & 0xFF])
+        return self.send_flow_control(tx_id, payload)
+
+    def feed(self, can_id: int, payload: Union[bytes, memoryview],
+             now: Optional[float] = None) -> Optional[IsoTpPdu]:
+        """Consume one frame; returns the message it completes, if any"""
+        if not payload:
+            return None
+        mode = AddressingMode.NORMAL_FIXED_29BIT if can_id > 0x7FF else AddressingMode.NORMAL_11BIT
+        key = (can_id, mode)
+        pci_byte = payload[0]
+        frame_type = pci_byte >> 4
+
+        if frame_type == _SINGLE_FRAME:
+            self._sessions.pop(key, None)
+            length = pci_byte & 0x0F
+            header = 1
+            if length == 0: # CAN FD or escaped
+                length = payload[1] if len(payload) >= 2 else 0
+                header = 2
+            if length == 0 or header + length > len(payload):
+                logger.warning(f"ISO-TP: Malformed Single Frame from 0x{can_id:X}: {bytes(payload).hex()}")
+                return None
+            return IsoTpPdu(can_id, mode, bytes(payload[header:header+length]))
+
+        if frame_type == _FIRST_FRAME:
+            self._sessions.pop(key, None)
+            tx_id = self.flow_control_id(can_id)
+            if tx_id is None:
+                logger.warning(f"ISO-TP: No flow-control ID for 0x{can_id:X}; ignoring First Frame")
+                return None
+            config = self.config_for(tx_id)
+            length = ((pci_byte & 0x0F) << 8) | payload[1] if len(payload) >= 2 else 0
+            header = 2
+            if length == 0 and len(payload) >= 6:
+                # Escape sequence: 32-bit FF_DL
+                length = int.from_bytes(payload[2:6], 'big')
+                header = 6
+            if length < MIN_FF_DL:
+                # Would have fit a Single Frame (or no length at all): no flow control
+                logger.warning(f"ISO-TP: Malformed First Frame from 0x{can_id:X}: {bytes(payload).hex()}")
+                return None
+            if length > config.max_rx_length:
+                logger.error(f"ISO-TP: Refusing {length}-byte message from 0x{can_id:X} "
+                             f"(limit {config.max_rx_length})")
+                self._flow_control(tx_id, config, FlowStatus.OVERFLOW)
+                return None
+            now = time.monotonic() if now is None else now
+            self._sessions[key] = _RxSession(tx_id, config, length, memoryview(payload)[header:], now)
+            self._flow_control(tx_id, config, FlowStatus.CONTINUE_TO_SEND)
+            return None
+
+        if frame_type == _CONSECUTIVE_FRAME:
+            session = self._sessions.get(key)
+            if session is None:
+                return None  # stray CF (its FF was lost, refused or timed out)
+            sn = pci_byte & 0x0F
+            if sn != session.next_sn:
+                logger.error(f"ISO-TP: SN Mismatch from 0x{can_id:X} (Exp: {session.next_sn}, Got: {sn}); "
+                             f"aborting reception")
+                del self._sessions[key]
+                return None
+
+            received = session.received
+            chunk_len = min(session.length - received, len(payload) - 1)
+            session.data[received:received+chunk_len] = memoryview(payload)[1:1+chunk_len]
+            session.received = received + chunk_len
+            session.next_sn = (sn + 1) & 0x0F
+            session.expires = (time.monotonic() if now is None else now) + session.cf_timeout
+            if session.received >= session.length:
+                del self._sessions[key]
+                return IsoTpPdu(can_id, mode, bytes(session.data))
+
+            if session.block_left:
+                session.block_left -= 1
+                if session.block_left == 0:
+                    self._flow_control(session.tx_id, session.config, FlowStatus.CONTINUE_TO_SEND)
+                    session.block_left = session.config.block_size
+        return None  # flow control frames are consumed by the sender
+
+
 class IsoTpHandler:
     """
     Handles ISO 15765-2 protocol (Segmentation and Reassembly).
-    Works with any transport that provides send_can_frame and read_can_frame methods.
+    Works with any transport that provides send_to_channel and read_message methods.
     """
     
-    def __init__(self, transport_interface, tx_id: int, rx_id: int, timeout_ms: int = 1000):
+    def __init__(self, transport_interface, tx_id: int, rx_id: Optional[int], timeout_ms: int = 1000,
+                 config: Optional[FlowControlConfig] = None):
         """
-        :param transport_interface: Object with send_message(id, data) and read_message(timeout)
-        :param tx_id: CAN ID to transmit on (e.g., 0x7E0)
-        :param rx_id: CAN ID to listen to (e.g., 0x7E8)
+        :param transport_interface: Object with send_to_channel(msg) and read_message(timeout_ms)
+        :param tx_id: CAN ID to transmit on (e.g., 0x7E0, or 0x7DF / 0x18DB33F1 functional)
+        :param rx_id: CAN ID to listen to (e.g., 0x7E8); None accepts every ECU response ID
         :param timeout_ms: Default timeout for operations
+        :param config: Flow-control parameters (default: the ECU's registered config)
         """
         self.transport = transport_interface
         self.tx_id = tx_id
         self.rx_id = rx_id
         self.timeout = timeout_ms / 1000.0
+        self.config = config or get_flow_control_config(tx_id)
+        self.reassembler = IsoTpReassembler(self._send_flow_control, self._config_for,
+                                            self._flow_control_id)
+        self._tx_frames: Dict[Tuple[int, int], J2534Message] = {}
+        pad_byte = self.config.padding if self.config.padding is not None else DEFAULT_FD_PADDING
+        self._padding = memoryview(bytes([pad_byte]) * CAN_FRAME_SIZES[-1])
+        self.tx_dl = self.config.tx_dl
+        if self.tx_dl not in CAN_FRAME_SIZES:
+            logger.error(f"ISO-TP: Invalid TX_DL {self.tx_dl}; using classic CAN frames")
+            self.tx_dl = 8
+        # Largest payload a Single Frame carries (escaped SF_DL on CAN FD)
+        self.max_single_frame = 7 if self.tx_dl == 8 else self.tx_dl - 2
         
-        # ISO-TP Constants
-        self.block_size = 0  # 0 = Send all without waiting for FC (unless ECU specifies otherwise)
-        self.st_min = 0      # Minimum separation time
-        self.max_wft = 0     # Max wait frame transmissions
+        # Flow control last granted by the receiver while sending
+        self.block_size = 0  # 0 = Send all without waiting for another FC
+        self.st_min = 0.0    # Minimum separation time (ms)
+        self.max_wft = self.config.max_wait_frames
+
+    def _config_for(self, tx_id: int) -> FlowControlConfig:
+        return self.config if tx_id == self.tx_id else get_flow_control_config(tx_id)
+
+    def _flow_control_id(self, rx_id: int) -> Optional[int]:
+        if rx_id == self.rx_id and not is_functional_id(self.tx_id):
+            return self.tx_id
+        return request_id_for(rx_id)
+
+    def _accepts(self, can_id: int) -> bool:
+        if self.rx_id is None:
+            return is_response_id(can_id)
+        return can_id == self.rx_id
 
     def send_data(self, data: bytes) -> bool:
         """
@@ -46,8 +395,11 @@ class IsoTpHandler:
         """
         length = len(data)
         
-        if length <= 7:
+        if length <= self.max_single_frame:
             return self._send_single_frame(data)
+        elif is_functional_id(self.tx_id):
+            logger.error("ISO-TP: Functional requests must fit in a Single Frame")
+            return False
         else:
             return self._send_multi_frame(data)
 
@@ -55,208 +407,220 @@ class IsoTpHandler:
         """
         Receive data using ISO-TP (handles reassembly)
         """
+        pdus = self.receive_pdus(timeout_ms, expected=1)
+        return pdus[0].data if pdus else None
+
+    def receive_all(self, timeout_ms: Optional[int] = None,
+                    expected: Optional[int] = None) -> Dict[int, List[bytes]]:
+        """
+        Collect complete messages from every responding ECU (e.g. after a
+        functional request) until the timeout or ``expected`` messages.
+        Returns rx_id -> messages in arrival order.
+        """
+        responses: Dict[int, List[bytes]] = {}
+        for pdu in self.receive_pdus(timeout_ms, expected):
+            responses.setdefault(pdu.rx_id, []).append(pdu.data)
+        return responses
+
+    def receive_pdus(self, timeout_ms: Optional[int] = None,
+                     expected: Optional[int] = None) -> List[IsoTpPdu]:
+        """
+        Reassemble frames from all accepted IDs in one pass.  The timeout is
+        for the first frame of a message; a message in progress may run on
+        as long as its CFs keep arriving within N_Cr.
+        """
         timeout = (timeout_ms / 1000.0) if timeout_ms else self.timeout
-        start_time = time.time()
+        deadline = time.monotonic() + timeout
+        self.reassembler.reset()
+        pdus: List[IsoTpPdu] = []
         
-        # Wait for First Frame or Single Frame
-        while time.time() - start_time < timeout:
-            msg = self.transport.read_message(timeout_ms=int((timeout - (time.time() - start_time)) * 1000))
-            
-            if not msg or not msg.data:
+        while expected is None or len(pdus) < expected:
+            pdu = self.poll_pdu(deadline)
+            if pdu is None:
+                break
+            pdus.append(pdu)
+        return pdus
+
+    def poll_pdu(self, deadline: float) -> Optional[IsoTpPdu]:
+        """
+        Next complete message from an accepted ID, or None once ``deadline``
+        (monotonic) passes with nothing in progress.  Unfinished messages
+        carry over between calls, so callers can interleave sends.
+        """
+        reassembler = self.reassembler
+        while True:
+            wait_until = max(deadline, reassembler.next_expiry()) if reassembler.active else deadline
+            frame = self._read_raw(wait_until)
+            if frame is None:
+                # Nothing before the deadline or an N_Cr timeout: drop stale messages
+                reassembler.expire()
+                if not reassembler.active and time.monotonic() >= deadline:
+                    return None
                 continue
-                
-            # Filter by ID if transport doesn't do it for us
-            # Note: J2534Message data usually includes the 4-byte CAN ID at the start for ISO15765
-            # We need to adapt based on the transport's data format.
-            # Assuming transport returns (can_id, data_bytes) or just data_bytes if filtered.
-            # For this implementation, let's assume the transport abstraction returns JUST the CAN payload
-            # or we need to parse it. 
-            # Let's assume the transport deals with the raw J2534 format and gives us the relevant bytes.
-            # Actually, looking at J2534PassThru, read_message returns a J2534Message with .data
-            # .data includes CAN ID (4 bytes) + Payload.
-            
-            can_id_bytes = msg.data[:4]
-            payload = msg.data[4:]
-            
-            can_id = int.from_bytes(can_id_bytes, 'big')
-            
-            # Simple check for 11-bit ID match (ignoring flags for now)
-            if (can_id & 0x7FF) != (self.rx_id & 0x7FF):
+            can_id, payload = frame
+            if not self._accepts(can_id):
                 continue
-                
-            pci_byte = payload[0]
-            frame_type = (pci_byte & 0xF0) >> 4
-            
-            if frame_type == IsoTpFrameType.SINGLE_FRAME.value:
-                length = pci_byte & 0x0F
-                if length == 0: # CAN FD or escaped
-                    length = payload[1]
-                    return payload[2:2+length]
-                return payload[1:1+length]
-                
-            elif frame_type == IsoTpFrameType.FIRST_FRAME.value:
-                return self._handle_first_frame(payload)
-                
-        return None
+            pdu = reassembler.feed(can_id, payload)
+            if pdu is not None:
+                return pdu
+
+    def _read_raw(self, deadline: float) -> Optional[Tuple[int, bytes]]:
+        """Next (CAN ID, payload) from the bus, or None once ``deadline`` (monotonic) passes"""
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            msg = self.transport.read_message(timeout_ms=max(1, int(remaining * 1000)))
+            if not msg or len(msg.data) < 5:
+                continue
+            # J2534 ISO15765/CAN data is the 4-byte CAN ID followed by the payload
+            data = msg.data
+            can_id = ((data[0] << 24) | (data[1] << 16) | (data[2] << 8) | data[3]) & 0x1FFFFFFF
+            return can_id, memoryview(data)[4:]
+
+    def _read_frame(self, deadline: float) -> Optional[bytes]:
+        """Next frame payload from rx_id, or None once ``deadline`` (monotonic) passes"""
+        while True:
+            frame = self._read_raw(deadline)
+            if frame is None:
+                return None
+            if self._accepts(frame[0]):
+                return frame[1]
+
+    def _frame(self, can_id: int, used: int) -> J2534Message:
+        """
+        Reusable message for a frame with ``used`` bytes of PCI + data.
+        The buffer holds the CAN ID and is padded to 8 bytes if padding is
+        on; CAN FD frames are always padded to the next valid length.
+        """
+        if used > 8:
+            size = frame_size_for(used)
+        else:
+            size = used if self.config.padding is None else 8
+        msg = self._tx_frames.get((can_id, size))
+        if msg is None:
+            buffer = bytearray(4 + size)
+            buffer[:4] = can_id.to_bytes(4, 'big')
+            tx_flags = CAN_29BIT_ID if can_id > 0x7FF else 0
+            msg = J2534Message(J2534Protocol.ISO15765, tx_flags=tx_flags, data=buffer)
+            self._tx_frames[(can_id, size)] = msg
+        if used < size:
+            msg.data[4 + used:] = self._padding[:size - used]
+        return msg
 
     def _send_single_frame(self, data: bytes) -> bool:
         """Send a Single Frame (SF)"""
-        # PCI: 0x0L (L = Length)
-        pci = 0x00 | len(data)
-        payload = bytes([pci]) + data
-        # Pad with 0xAA or 0x00 to 8 bytes (standard practice, though not strictly required by all ECUs)
-        padding = b'\xAA' * (8 - len(payload))
-        full_payload = payload + padding
-        
-        return self._send_can_frame(full_payload)
+        length = len(data)
+        if length <= 7:
+            # PCI: 0x0L (L = Length)
+            msg = self._frame(self.tx_id, 1 + length)
+            buffer = msg.data
+            buffer[4] = length
+            buffer[5:5+length] = data
+        else:
+            # CAN FD escape: PCI 0x00, then SF_DL in the second byte
+            msg = self._frame(self.tx_id, 2 + length)
+            buffer = msg.data
+            buffer[4] = 0x00
+            buffer[5] = length
+            buffer[6:6+length] = data
+        return self.transport.send_to_channel(msg)
 
     def _send_multi_frame(self, data: bytes) -> bool:
         """Send a Multi-Frame message (FF + CFs)"""
         length = len(data)
+        view = memoryview(data)
         
-        # 1. Send First Frame (FF)
-        # PCI: 0x1L LL (L = Length, 12 bits)
-        pci_hi = 0x10 | ((length >> 8) & 0x0F)
-        pci_lo = length & 0xFF
+        frame_size = self.tx_dl
+        cf_data = frame_size - 1
         
-        # First 6 bytes of data
-        payload = bytes([pci_hi, pci_lo]) + data[:6]
-        if not self._send_can_frame(payload):
-            return False
-            
-        # 2. Wait for Flow Control (FC)
-        if not self._wait_for_flow_control():
-            logger.error("ISO-TP: Timeout waiting for Flow Control")
+        # 1. Send First Frame (FF), always a full frame
+        msg = self._frame(self.tx_id, frame_size)
+        buffer = msg.data
+        if length <= FF_DL_12BIT_MAX:
+            # PCI: 0x1L LL (L = Length, 12 bits)
+            buffer[4] = 0x10 | ((length >> 8) & 0x0F)
+            buffer[5] = length & 0xFF
+            header = 2
+        else:
+            # PCI: 0x10 00 + 32-bit length (escape sequence)
+            buffer[4:10] = b'\x10\x00' + length.to_bytes(4, 'big')
+            header = 6
+        offset = frame_size - header
+        buffer[4+header:4+frame_size] = view[:offset]
+        if not self.transport.send_to_channel(msg):
             return False
             
-        # 3. Send Consecutive Frames (CF)
-        offset = 6
+        # 2. Send Consecutive Frames (CF), one block per Flow Control (FC)
         sn = 1 # Sequence Number (starts at 1)
+        last_sent = None
+        send = self.transport.send_to_channel
         
         while offset < length:
-            chunk = data[offset:offset+7]
-            pci = 0x20 | (sn & 0x0F)
-            payload = bytes([pci]) + chunk
-            
-            # Pad last frame
-            if len(payload) < 8:
-                payload += b'\xAA' * (8 - len(payload))
-                
-            if not self._send_can_frame(payload):
+            if not self._wait_for_flow_control():
                 return False
-                
-            offset += 7
-            sn = (sn + 1) & 0x0F
+            separation = self.st_min / 1000.0
+            block_left = self.block_size or -1
+            # STmin separates every pair of CFs, across block boundaries too
+            next_send = last_sent + separation if last_sent is not None else 0.0
             
-            # STmin delay
-            if self.st_min > 0:
-                time.sleep(self.st_min / 1000.0)
+            while offset < length and block_left != 0:
+                if separation:
+                    pace_until(next_send)
+                chunk_len = min(cf_data, length - offset)
+                if chunk_len < cf_data:
+                    msg = self._frame(self.tx_id, 1 + chunk_len)
+                    buffer = msg.data
+                buffer[4] = 0x20 | sn
+                buffer[5:5+chunk_len] = view[offset:offset+chunk_len]
+                if not send(msg):
+                    return False
+                last_sent = time.perf_counter()
+                next_send = last_sent + separation
+                    
+                offset += chunk_len
+                sn = (sn + 1) & 0x0F
+                block_left -= 1
                 
         return True
 
     def _wait_for_flow_control(self) -> bool:
-        """Wait for Flow Control (FC) frame"""
-        start_time = time.time()
-        while time.time() - start_time < 1.0: # 1s timeout for FC
-            msg = self.transport.read_message(timeout_ms=100)
-            if not msg: continue
-            
-            can_id = int.from_bytes(msg.data[:4], 'big')
-            if (can_id & 0x7FF) != (self.rx_id & 0x7FF): continue
+        """Wait for a Flow Control (FC) frame granting the next block"""
+        wait_frames = 0
+        deadline = time.monotonic() + self.config.fc_timeout_ms / 1000.0
+        while True:
+            payload = self._read_frame(deadline)
+            if payload is None:
+                logger.error("ISO-TP: Timeout waiting for Flow Control")
+                return False
             
-            payload = msg.data[4:]
             pci = payload[0]
-            frame_type = (pci & 0xF0) >> 4
-            
-            if frame_type == IsoTpFrameType.FLOW_CONTROL.value:
-                flow_status = pci & 0x0F
-                if flow_status == 0: # Continue to send
-                    self.block_size = payload[1]
-                    st_min_raw = payload[2]
-                    
-                    # Parse STmin
-                    if st_min_raw <= 0x7F:
-                        self.st_min = st_min_raw # ms
-                    elif 0xF1 <= st_min_raw <= 0xF9:
-                        self.st_min = (st_min_raw - 0xF0) * 0.1 # 100us units
-                    else:
-                        self.st_min = 0
-                        
-                    return True
-                elif flow_status == 1: # Wait
-                    time.sleep(0.1)
-                    continue
-                elif flow_status == 2: # Overflow
-                    logger.error("ISO-TP: FC Overflow")
+            if (pci & 0xF0) >> 4 != IsoTpFrameType.FLOW_CONTROL.value:
+                continue
+                
+            flow_status = pci & 0x0F
+            if flow_status == FlowStatus.CONTINUE_TO_SEND.value:
+                if len(payload) < 3:
+                    logger.error("ISO-TP: Truncated Flow Control frame")
                     return False
-                    
-        return False
+                self.block_size = payload[1]
+                self.st_min = decode_st_min(payload[2]) * 1000.0
+                return True
+            elif flow_status == FlowStatus.WAIT.value:
+                wait_frames += 1
+                if wait_frames > self.max_wft:
+                    logger.error(f"ISO-TP: More than {self.max_wft} FC.WAIT frames; aborting")
+                    return False
+                # Every FC.WAIT restarts the N_Bs timer
+                deadline = time.monotonic() + self.config.fc_timeout_ms / 1000.0
+            elif flow_status == FlowStatus.OVERFLOW.value:
+                logger.error("ISO-TP: FC Overflow")
+                return False
+            else:
+                logger.error(f"ISO-TP: Invalid flow status {flow_status}")
+                return False
 
-    def _handle_first_frame(self, payload: bytes) -> Optional[bytes]:
-        """Handle First Frame and reception of Consecutive Frames"""
-        # Parse Length
-        length = ((payload[0] & 0x0F) << 8) | payload[1]
-        data = bytearray(payload[2:])
-        
-        # Send Flow Control (CTS - Clear To Send)
-        # PCI: 30 00 00 (FC, BS=0, STmin=0)
-        fc_frame = b'\x30\x00\x00' + (b'\xAA' * 5)
-        self._send_can_frame(fc_frame)
-        
-        # Receive Consecutive Frames
-        next_sn = 1
-        start_time = time.time()
-        
-        while len(data) < length:
-            if time.time() - start_time > self.timeout:
-                logger.error("ISO-TP: Timeout waiting for CF")
-                return None
-                
-            msg = self.transport.read_message(timeout_ms=int(self.timeout * 1000))
-            if not msg: continue
-            
-            can_id = int.from_bytes(msg.data[:4], 'big')
-            if (can_id & 0x7FF) != (self.rx_id & 0x7FF): continue
-            
-            cf_payload = msg.data[4:]
-            pci = cf_payload[0]
-            frame_type = (pci & 0xF0) >> 4
-            
-            if frame_type == IsoTpFrameType.CONSECUTIVE_FRAME.value:
-                sn = pci & 0x0F
-                if sn != next_sn:
-                    logger.warning(f"ISO-TP: SN Mismatch (Exp: {next_sn}, Got: {sn})")
-                    # In strict mode we might abort, but let's try to continue or just log
-                
-                chunk_len = min(7, length - len(data))
-                data.extend(cf_payload[1:1+chunk_len])
-                next_sn = (next_sn + 1) & 0x0F
-                
-        return bytes(data)
-
-    def _send_can_frame(self, payload: bytes) -> bool:
-        """Helper to wrap transport send"""
-        # Construct J2534 CAN frame (ID + Data)
-        # Assuming 11-bit ID for now
-        can_id_bytes = self.tx_id.to_bytes(4, 'big')
-        full_data = can_id_bytes + payload
-        
-        # We need a dummy message object structure that the transport expects
-        # The transport abstraction needs to be compatible.
-        # For now, we assume the transport has a simple 'send_raw(data)' or we construct the J2534Message here
-        # But J2534Message requires imports. Let's make this class dependent on the protocol.
-        
-        # Ideally, we should import J2534Message here or pass a factory.
-        # To keep it simple, we'll assume the transport has a 'send_can(id, data)' method
-        # OR we just pass the raw bytes if the transport expects that.
-        
-        # Let's try to use the 'send_message' signature from J2534PassThru
-        # It expects a J2534Message object.
-        
-        from shared.j2534_passthru import J2534Message, J2534Protocol
-        
-        msg = J2534Message(J2534Protocol.ISO15765, data=full_data)
-        # We need the channel_id. The transport interface should probably hold the channel_id.
-        
+    def _send_flow_control(self, tx_id: int, payload: bytes) -> bool:
+        msg = self._frame(tx_id, len(payload))
+        msg.data[4:4+len(payload)] = payload
         return self.transport.send_to_channel(msg)
-
@@ -344,8 +344,12 @@ class J2534PassThru(ABC):
             logger.error(f"Cannot send message: Invalid channel {channel_id}")
             return False
 
-        # The data must be mutable for the C function
-        data_buffer = create_string_buffer(message.data)
+        # The data must be mutable for the C function; bytearrays (reused
+        # ISO-TP frame buffers) are passed without a copy
+        if isinstance(message.data, bytearray):
+            data_buffer = (ctypes.c_ubyte * len(message.data)).from_buffer(message.data)
+        else:
+            data_buffer = create_string_buffer(message.data)
         
         msg = PASSTHRU_MSG(
             ProtocolID=message.protocol.value,
@@ -358,7 +362,8 @@ class J2534PassThru(ABC):
         status = self.dll_handle.PassThruWriteMsgs(channel_id, byref(msg), byref(num_msgs), timeout_ms)
         
         if status == J2534Status.NOERROR.value:
-            logger.debug(f"Sent {len(message.data)} bytes on channel {channel_id}: {message.data.hex()}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Sent {len(message.data)} bytes on channel {channel_id}: {message.data.hex()}")
             return True
         else:
             logger.error(f"Failed to write message. Status: {status}. Error: {self.get_last_error()}")
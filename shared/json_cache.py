@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+DiagAutoClinicOS - Persistent JSON Cache
+Small key/value store under the application data directory for facts that
+are expensive to rediscover on every connect (negotiated baud rates, adapter
+state, supported PIDs, static ECU identifiers).
+"""
+
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _get_app_data_dir() -> Path:
+    try:
+        from config import APP_DATA_DIR  # type: ignore
+        return APP_DATA_DIR
+    except ImportError:
+        fallback = Path(os.path.expanduser("~")) / ".dacos"
+        fallback.mkdir(parents=True, exist_ok=True)
+        return fallback
+
+
+class JsonCache:
+    """Thread-safe JSON file cache; writes are atomic (temp file + replace)"""
+
+    def __init__(self, filename: str, path: Optional[Path] = None):
+        self.path = Path(path) if path else _get_app_data_dir() / filename
+        self._lock = threading.Lock()
+        self._data: Optional[Dict[str, Any]] = None
+
+    def _load(self) -> Dict[str, Any]:
+        if self._data is None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._data = json.load(f)
+            except FileNotFoundError:
+                self._data = {}
+            except Exception as e:
+                logger.warning(f"Discarding unreadable cache {self.path}: {e}")
+                self._data = {}
+        return self._data
+
+    def _save(self):
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._data, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logger.error(f"Failed to write cache {self.path}: {e}")
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            return self._load().get(key, default)
+
+    def items(self) -> List[Tuple[str, Any]]:
+        with self._lock:
+            return list(self._load().items())
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._load()[key] = value
+            self._save()
+
+    def delete(self, key: str):
+        with self._lock:
+            if self._load().pop(key, None) is not None:
+                self._save()
+
+    def clear(self):
+        with self._lock:
+            self._data = {}
+            self._save()
@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+KWP2000 K-Line Transport (ISO 14230-2/-3)
+Request/response over a K-line interface (KKL/FTDI cable, pyserial port)
+driven by the timing the ECU actually uses instead of fixed sleeps:
+
+- fast init (25 ms low / 25 ms high wake-up + StartCommunication), with
+  5-baud init of the ECU address as the fallback; the key bytes decide
+  header format and normal/extended default timing
+- P1-P4 are honoured: P4 between request bytes, P2 for the start of a
+  response, P3 before the next request (measured from the last byte on
+  the line, not slept blindly), P1 between response bytes; a response is
+  complete as soon as its length byte says so
+- AccessTimingParameters (0x83) can switch to the fastest limits the ECU
+  reports
+- one request may get several responses (functional requests answered by
+  more than one ECU, 0x78 response pending followed by the answer); all of
+  them are collected until P2 passes in silence
+- ``send``/``receive`` match the session layer's transport, so
+  ``UdsSessionManager`` can drive a K-line ECU as well
+
+The port needs the pyserial subset ``read``, ``write``, ``timeout``,
+``baudrate``, ``break_condition`` and ``reset_input_buffer``.  Interfaces
+echo every transmitted byte on the single wire; the echo is read back
+and compared (``echo=False`` for interfaces that suppress it).
+"""
+
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Iterator, List, Optional
+
+from shared.uds_session import NEGATIVE_RESPONSE, NRC_RESPONSE_PENDING
+
+logger = logging.getLogger(__name__)
+
+K_LINE_BAUDRATE = 10400
+TESTER_ADDRESS = 0xF1
+OBD_FUNCTIONAL_ADDRESS = 0x33
+
+SID_START_COMMUNICATION = 0x81
+SID_STOP_COMMUNICATION = 0x82
+SID_ACCESS_TIMING_PARAMETERS = 0x83
+ATP_READ_LIMITS = 0x00
+ATP_SET_PARAMETERS = 0x03
+POSITIVE_RESPONSE_OFFSET = 0x40
+
+# Format byte: A1 A0 address mode, L5..L0 length (0 = separate length byte)
+ADDRESS_PHYSICAL = 0x80
+ADDRESS_FUNCTIONAL = 0xC0
+MAX_LENGTH_IN_FORMAT = 0x3F
+
+# Initialisation (ms)
+IDLE_BEFORE_INIT_MS = 300      # W5 / Tidle: bus idle before any wake-up
+FAST_INIT_LOW_MS = 25          # TiniL
+FAST_INIT_WAKEUP_MS = 50       # TWuP
+FIVE_BAUD_BIT_MS = 200
+W1_MAX_MS = 300                # address byte end -> 0x55 sync
+W2_W3_MAX_MS = 40              # sync -> KB1 -> KB2
+W4_MIN_MS = 25                 # KB2 -> inverted KB2 (and -> inverted address)
+W4_MAX_MS = 50
+KWP2000_KB2 = 0x8F
+
+# One byte on the wire at 10400 baud (start + 8 data + stop)
+BYTE_MS = 10 * 1000 / K_LINE_BAUDRATE
+
+
+def checksum(data: bytes) -> int:
+    return sum(data) & 0xFF
+
+
+def encode_message(data: bytes, target: Optional[int] = None, source: int = TESTER_ADDRESS,
+                   functional: bool = False, length_in_format: bool = True) -> bytes:
+    """Header + data + checksum; without ``target`` a header without addresses"""
+    length = len(data)
+    if length > 0xFF:
+        raise ValueError(f"KWP2000 message too long: {length} bytes")
+    mode = 0 if target is None else (ADDRESS_FUNCTIONAL if functional else ADDRESS_PHYSICAL)
+    short = length_in_format and 0 < length <= MAX_LENGTH_IN_FORMAT
+    header = bytearray([mode | (length if short else 0)])
+    if target is not None:
+        header += bytes([target, source])
+    if not short:
+        header.append(length)
+    frame = bytes(header) + bytes(data)
+    return frame + bytes([checksum(frame)])
+
+
+@dataclass
+class KeyBytes:
+    """KB1/KB2 from StartCommunication or 5-baud init"""
+    kb1: int
+    kb2: int
+
+    @property
+    def length_in_format(self) -> bool:
+        return bool(self.kb1 & 0x01)      # AL0
+
+    @property
+    def length_byte(self) -> bool:
+        return bool(self.kb1 & 0x02)      # AL1
+
+    @property
+    def address_header(self) -> bool:
+        return bool(self.kb1 & 0x08)      # HB1
+
+    @property
+    def extended_timing(self) -> bool:
+        return bool(self.kb1 & 0x10)      # TP0
+
+    @property
+    def is_kwp2000(self) -> bool:
+        return self.kb2 == KWP2000_KB2
+
+
+@dataclass
+class KwpTiming:
+    """P1-P4 in ms (ISO 14230-2 normal timing defaults)"""
+    p1_max_ms: float = 20
+    p2_min_ms: float = 25
+    p2_max_ms: float = 50
+    p3_min_ms: float = 55
+    p3_max_ms: float = 5000
+    p4_min_ms: float = 5
+
+    @classmethod
+    def extended(cls) -> "KwpTiming":
+        return cls(p2_min_ms=0, p2_max_ms=1000, p3_min_ms=0, p3_max_ms=5000, p4_min_ms=0)
+
+    @classmethod
+    def from_parameters(cls, data: bytes, p1_max_ms: float = 20) -> "KwpTiming":
+        """P2min P2max P3min P3max P4min as sent in an 0x83 response"""
+        p2_min, p2_max, p3_min, p3_max, p4_min = data[:5]
+        return cls(p1_max_ms=p1_max_ms, p2_min_ms=p2_min * 0.5, p2_max_ms=min(p2_max, 0xF0) * 25,
+                   p3_min_ms=p3_min * 0.5, p3_max_ms=p3_max * 250, p4_min_ms=p4_min * 0.5)
+
+    def to_parameters(self) -> bytes:
+        return bytes([min(0xFF, round(self.p2_min_ms * 2)), min(0xF0, round(self.p2_max_ms / 25)),
+                      min(0xFF, round(self.p3_min_ms * 2)), min(0xFF, round(self.p3_max_ms / 250)),
+                      min(0xFF, round(self.p4_min_ms * 2))])
+
+
+@dataclass
+class KwpMessage:
+    """One response as received"""
+    data: bytes
+    source: Optional[int] = None
+    target: Optional[int] = None
+
+    @property
+    def pending(self) -> bool:
+        return len(self.data) >= 3 and self.data[0] == NEGATIVE_RESPONSE and self.data[2] == NRC_RESPONSE_PENDING
+
+
+def _sleep_until(deadline: float):
+    remaining = deadline - time.monotonic()
+    if remaining > 0:
+        time.sleep(remaining)
+
+
+class KwpTransport:
+    """KWP2000 over one K-line port"""
+
+    def __init__(self, port, target: int = OBD_FUNCTIONAL_ADDRESS, tester: int = TESTER_ADDRESS,
+                 functional: Optional[bool] = None, echo: bool = True,
+                 five_baud_bit_ms: float = FIVE_BAUD_BIT_MS):
+        self.port = port
+        self.target = target
+        self.tester = tester
+        # The OBD address 0x33 is functional; ECU addresses are physical
+        self.functional = target == OBD_FUNCTIONAL_ADDRESS if functional is None else functional
+        self.echo = echo
+        self.five_baud_bit_ms = five_baud_bit_ms
+        self.timing = KwpTiming()
+        self.key_bytes: Optional[KeyBytes] = None
+        self.init_mode: Optional[str] = None
+        self.connected = False
+        self.negotiated = False       # last init was followed by a timing change
+        self._last_activity = 0.0     # monotonic time of the last byte on the line
+        self._lock = threading.RLock()
+
+    # -- line level ----------------------------------------------------------
+
+    def _read_bytes(self, count: int, first_timeout_ms: float) -> bytes:
+        """Up to ``count`` bytes: the first within ``first_timeout_ms``, the rest within P1 each"""
+        buffer = bytearray()
+        timeout_ms = first_timeout_ms
+        while len(buffer) < count:
+            self.port.timeout = timeout_ms / 1000
+            chunk = self.port.read(count - len(buffer))
+            if not chunk:
+                break
+            buffer += chunk
+            self._last_activity = time.monotonic()
+            timeout_ms = (self.timing.p1_max_ms + BYTE_MS) * (count - len(buffer))
+        return bytes(buffer)
+
+    def _write(self, frame: bytes) -> bool:
+        """Send with P4 between bytes and check the echo"""
+        try:
+            if self.timing.p4_min_ms > 0 and len(frame) > 1:
+                for index, byte in enumerate(frame):
+                    if index:
+                        time.sleep(self.timing.p4_min_ms / 1000)
+                    self.port.write(bytes([byte]))
+            else:
+                self.port.write(frame)
+        except Exception as e:
+            logger.error(f"K-line write failed: {e}")
+            return False
+        self._last_activity = time.monotonic()
+        if not self.echo:
+            return True
+        echo = self._read_bytes(len(frame), len(frame) * (BYTE_MS + self.timing.p4_min_ms) + 50)
+        if echo != frame:
+            logger.warning(f"K-line echo mismatch (collision?): sent {frame.hex()}, read {echo.hex()}")
+            return False
+        return True
+
+    def _drain(self) -> bool:
+        """Discard bytes already on the line (late extra responses); True if any"""
+        self.port.timeout = 0
+        data = self.port.read(4096)
+        if data:
+            self._last_activity = time.monotonic()
+            logger.debug(f"Discarding {len(data)} late byte(s): {data.hex()}")
+        return bool(data)
+
+    def _wait_p3(self):
+        """P3min since the last byte on the line; anything arriving meanwhile restarts it"""
+        while True:
+            _sleep_until(self._last_activity + self.timing.p3_min_ms / 1000)
+            if not self._drain():
+                return
+
+    def _read_message(self, timeout_ms: float) -> Optional[KwpMessage]:
+        """Next complete message whose first byte arrives within ``timeout_ms``"""
+        while True:
+            fmt = self._read_bytes(1, timeout_ms)
+            if not fmt:
+                return None
+            mode, length = fmt[0] & 0xC0, fmt[0] & MAX_LENGTH_IN_FORMAT
+            header_rest = (2 if mode else 0) + (0 if length else 1)
+            header = fmt + self._read_bytes(header_rest, self.timing.p1_max_ms + BYTE_MS)
+            if len(header) < 1 + header_rest:
+                logger.warning(f"Incomplete K-line header: {header.hex()}")
+                return None
+            if not length:
+                length = header[-1]
+            body = self._read_bytes(length + 1, self.timing.p1_max_ms + BYTE_MS)
+            frame = header + body
+            if len(body) < length + 1:
+                logger.warning(f"Incomplete K-line message: {frame.hex()}")
+                return None
+            if checksum(frame[:-1]) != frame[-1]:
+                logger.warning(f"K-line checksum error: {frame.hex()}")
+                return None
+            target, source = (header[1], header[2]) if mode else (None, None)
+            if target is not None and target != self.tester:
+                # Another tester's traffic; the next byte may start ours
+                timeout_ms = self.timing.p2_max_ms
+                continue
+            return KwpMessage(bytes(body[:-1]), source, target)
+
+    # -- initialisation ------------------------------------------------------
+
+    def _start(self, key_bytes: KeyBytes, mode: str):
+        self.key_bytes = key_bytes
+        self.timing = KwpTiming.extended() if key_bytes.extended_timing else KwpTiming()
+        self.init_mode = mode
+        self.connected = True
+        logger.info(f"K-line {mode} init to 0x{self.target:02X}: KB1 0x{key_bytes.kb1:02X} "
+                     f"KB2 0x{key_bytes.kb2:02X} ({'KWP2000' if key_bytes.is_kwp2000 else 'ISO 9141'})")
+
+    def _encode(self, data: bytes) -> bytes:
+        key_bytes = self.key_bytes
+        addressed = key_bytes is None or key_bytes.address_header or not key_bytes.length_in_format
+        return encode_message(data, self.target if addressed else None, self.tester, self.functional,
+                              key_bytes is None or key_bytes.length_in_format)
+
+    def fast_init(self) -> bool:
+        """Wake-up pattern, StartCommunication, key bytes from the 0xC1 response"""
+        with self._lock:
+            self.connected = False
+            self.key_bytes = None
+            self.timing = KwpTiming()
+            _sleep_until(self._last_activity + IDLE_BEFORE_INIT_MS / 1000)
+            self.port.baudrate = K_LINE_BAUDRATE
+            self.port.reset_input_buffer()
+            start = time.monotonic()
+            self.port.break_condition = True
+            _sleep_until(start + FAST_INIT_LOW_MS / 1000)
+            self.port.break_condition = False
+            _sleep_until(start + FAST_INIT_WAKEUP_MS / 1000)
+            if not self._write(self._encode(bytes([SID_START_COMMUNICATION]))):
+                return False
+            message = self._read_message(self.timing.p2_max_ms)
+            if (message is None or len(message.data) < 3
+                    or message.data[0] != SID_START_COMMUNICATION + POSITIVE_RESPONSE_OFFSET):
+                logger.info(f"Fast init of 0x{self.target:02X} not answered")
+                self._last_activity = time.monotonic()
+                return False
+            self._start(KeyBytes(message.data[1] & 0x7F, message.data[2]), "fast")
+            return True
+
+    def five_baud_init(self) -> bool:
+        """Address at 5 baud, 0x55 sync, key bytes, inverted KB2, inverted address"""
+        with self._lock:
+            self.connected = False
+            self.key_bytes = None
+            self.timing = KwpTiming()
+            _sleep_until(self._last_activity + IDLE_BEFORE_INIT_MS / 1000)
+            self.port.reset_input_buffer()
+            # Start bit, 8 data bits LSB first, stop bit; break = line low
+            bits = [0] + [(self.target >> i) & 1 for i in range(8)] + [1]
+            start = time.monotonic()
+            for index, bit in enumerate(bits):
+                self.port.break_condition = not bit
+                _sleep_until(start + (index + 1) * self.five_baud_bit_ms / 1000)
+            self.port.baudrate = K_LINE_BAUDRATE
+
+            sync = self._read_bytes(1, W1_MAX_MS)
+            if sync != b'\x55':
+                logger.info(f"5-baud init of 0x{self.target:02X}: no sync ({sync.hex() or 'nothing'})")
+                self._last_activity = time.monotonic()
+                return False
+            key_bytes = self._read_bytes(2, W2_W3_MAX_MS)
+            if len(key_bytes) < 2:
+                logger.warning("5-baud init: key bytes missing")
+                return False
+            _sleep_until(self._last_activity + W4_MIN_MS / 1000)
+            if not self._write(bytes([key_bytes[1] ^ 0xFF])):
+                return False
+            inverted = self._read_bytes(1, W4_MAX_MS + 10)
+            if inverted != bytes([self.target ^ 0xFF]):
+                logger.warning(f"5-baud init: expected inverted address, got {inverted.hex() or 'nothing'}")
+                return False
+            self._start(KeyBytes(key_bytes[0] & 0x7F, key_bytes[1]), "5-baud")
+            return True
+
+    def connect(self, prefer_fast: bool = True, negotiate: bool = True) -> bool:
+        """Fast init (else 5-baud), then the fastest timing the ECU allows"""
+        if not ((prefer_fast and self.fast_init()) or self.five_baud_init()):
+            logger.error(f"K-line init of 0x{self.target:02X} failed")
+            return False
+        self.negotiated = negotiate and self.negotiate_timing()
+        return True
+
+    def negotiate_timing(self) -> bool:
+        """Read the ECU's timing limits (83 00) and switch to them (83 03)"""
+        limits = self.request(bytes([SID_ACCESS_TIMING_PARAMETERS, ATP_READ_LIMITS]))
+        if not limits or limits[0] != SID_ACCESS_TIMING_PARAMETERS + POSITIVE_RESPONSE_OFFSET or len(limits) < 7:
+            logger.debug("AccessTimingParameters not supported; keeping default timing")
+            return False
+        timing = KwpTiming.from_parameters(limits[2:7], self.timing.p1_max_ms)
+        response = self.request(bytes([SID_ACCESS_TIMING_PARAMETERS, ATP_SET_PARAMETERS]) + timing.to_parameters())
+        if not response or response[0] != SID_ACCESS_TIMING_PARAMETERS + POSITIVE_RESPONSE_OFFSET:
+            logger.debug(f"Timing change refused: {response.hex() if response else 'no response'}")
+            return False
+        self.timing = timing
+        logger.info(f"K-line timing: P2 {timing.p2_min_ms:g}-{timing.p2_max_ms:g} ms, "
+                    f"P3 {timing.p3_min_ms:g}-{timing.p3_max_ms:g} ms, P4 {timing.p4_min_ms:g} ms")
+        return True
+
+    def close(self):
+        """StopCommunication (best effort)"""
+        with self._lock:
+            if self.connected:
+                self.request(bytes([SID_STOP_COMMUNICATION]))
+            self.connected = False
+
+    # -- requests ------------------------------------------------------------
+
+    def send(self, data: bytes, tx_id: Optional[int] = None, rx_id: Optional[int] = None) -> bool:
+        """
+        Send one request after P3min; re-initialises a link idle past P3max,
+        negotiating timing again if it was (a new init restores the defaults)
+        """
+        with self._lock:
+            idle_ms = (time.monotonic() - self._last_activity) * 1000
+            if not self.connected or idle_ms > self.timing.p3_max_ms:
+                if self.connected:
+                    logger.info(f"K-line idle for {idle_ms:.0f} ms; initialising again")
+                if not self.connect(prefer_fast=self.init_mode != "5-baud", negotiate=self.negotiated):
+                    return False
+            self._wait_p3()
+            return self._write(self._encode(bytes(data)))
+
+    def receive(self, tx_id: Optional[int] = None, rx_id: Optional[int] = None,
+                timeout_ms: Optional[float] = None) -> Optional[bytes]:
+        """Next response (including 0x78) within ``timeout_ms`` (default P2max)"""
+        with self._lock:
+            message = self._read_message(timeout_ms if timeout_ms is not None else self.timing.p2_max_ms)
+            return message.data if message else None
+
+    def _responses(self) -> Iterator[KwpMessage]:
+        """Every response to the request just sent, until P2max of silence (P3max after 0x78)"""
+        timeout_ms = self.timing.p2_max_ms
+        while True:
+            message = self._read_message(timeout_ms)
+            if message is None:
+                return
+            yield message
+            timeout_ms = self.timing.p3_max_ms if message.pending else self.timing.p2_max_ms
+
+    def request(self, data: bytes) -> Optional[bytes]:
+        """Final response to ``data``; any further responses are dropped before the next request"""
+        with self._lock:
+            if not self.send(data):
+                return None
+            for message in self._responses():
+                if not message.pending:
+                    return message.data
+            logger.warning(f"No K-line response from 0x{self.target:02X} to {bytes(data[:3]).hex()}")
+            return None
+
+    def request_all(self, data: bytes) -> List[KwpMessage]:
+        """Every final response to ``data`` (e.g. several ECUs answering a functional request)"""
+        with self._lock:
+            if not self.send(data):
+                return []
+            return [message for message in self._responses() if not message.pending]
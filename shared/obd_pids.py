@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+SAE J1979 Mode 01 PID Table
+Data lengths of the standard PIDs, needed to pack several PIDs into one
+request (``01 0C 0D 05``) and split the combined ``41 ...`` reply, and the
+table-driven decoder: every formula below is compiled once at import into a
+plain function of the data bytes A, B, C, D, E.
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+MODE01_REQUEST = 0x01
+MODE01_RESPONSE = 0x41
+MAX_PIDS_PER_REQUEST = 6  # J1979 limit for CAN
+
+# PID -> number of data bytes in the reply
+PID_DATA_LENGTHS: Dict[int, int] = {
+    0x00: 4, 0x01: 4, 0x02: 2, 0x03: 2, 0x04: 1, 0x05: 1, 0x06: 1, 0x07: 1,
+    0x08: 1, 0x09: 1, 0x0A: 1, 0x0B: 1, 0x0C: 2, 0x0D: 1, 0x0E: 1, 0x0F: 1,
+    0x10: 2, 0x11: 1, 0x12: 1, 0x13: 1, 0x14: 2, 0x15: 2, 0x16: 2, 0x17: 2,
+    0x18: 2, 0x19: 2, 0x1A: 2, 0x1B: 2, 0x1C: 1, 0x1D: 1, 0x1E: 1, 0x1F: 2,
+    0x20: 4, 0x21: 2, 0x22: 2, 0x23: 2, 0x24: 4, 0x25: 4, 0x26: 4, 0x27: 4,
+    0x28: 4, 0x29: 4, 0x2A: 4, 0x2B: 4, 0x2C: 1, 0x2D: 1, 0x2E: 1, 0x2F: 1,
+    0x30: 1, 0x31: 2, 0x32: 2, 0x33: 1, 0x34: 4, 0x35: 4, 0x36: 4, 0x37: 4,
+    0x38: 4, 0x39: 4, 0x3A: 4, 0x3B: 4, 0x3C: 2, 0x3D: 2, 0x3E: 2, 0x3F: 2,
+    0x40: 4, 0x41: 4, 0x42: 2, 0x43: 2, 0x44: 2, 0x45: 1, 0x46: 1, 0x47: 1,
+    0x48: 1, 0x49: 1, 0x4A: 1, 0x4B: 1, 0x4C: 1, 0x4D: 2, 0x4E: 2, 0x4F: 4,
+    0x50: 4, 0x51: 1, 0x52: 1, 0x53: 2, 0x54: 2, 0x55: 2, 0x56: 2, 0x57: 2,
+    0x58: 2, 0x59: 2, 0x5A: 1, 0x5B: 1, 0x5C: 1, 0x5D: 2, 0x5E: 2, 0x5F: 1,
+    0x60: 4, 0x61: 1, 0x62: 1, 0x63: 2, 0x64: 5, 0x65: 2, 0x66: 5, 0x67: 3,
+    0x80: 4, 0xA0: 4, 0xC0: 4,
+}
+
+
+def pid_data_length(pid: int) -> Optional[int]:
+    return PID_DATA_LENGTHS.get(pid)
+
+
+def build_mode01_request(pids: List[int]) -> bytes:
+    """``01 <pid> [<pid> ...]`` for up to six PIDs"""
+    if not 1 <= len(pids) <= MAX_PIDS_PER_REQUEST:
+        raise ValueError(f"Mode 01 requests carry 1-{MAX_PIDS_PER_REQUEST} PIDs, got {len(pids)}")
+    return bytes([MODE01_REQUEST] + list(pids))
+
+
+def split_mode01_response(payload: bytes) -> Dict[int, bytes]:
+    """Split a (possibly multi-PID) ``41 ...`` reply into PID -> data bytes"""
+    values: Dict[int, bytes] = {}
+    if not payload or payload[0] != MODE01_RESPONSE:
+        return values
+    index = 1
+    while index < len(payload):
+        pid = payload[index]
+        length = PID_DATA_LENGTHS.get(pid)
+        if length is None or index + 1 + length > len(payload):
+            logger.debug(f"Cannot split Mode 01 reply at PID 0x{pid:02X}: {payload.hex()}")
+            break
+        values[pid] = bytes(payload[index + 1:index + 1 + length])
+        index += 1 + length
+    return values
+
+
+@dataclass(frozen=True)
+class PidDefinition:
+    """Name, unit and compiled formula of one Mode 01 PID"""
+    pid: int
+    name: str
+    unit: str
+    formula: str
+    decode: Callable[..., Any]
+
+
+def _compile(formula: str) -> Callable[..., Any]:
+    code = compile(f"lambda A=0, B=0, C=0, D=0, E=0: {formula}", "<J1979 formula>", "eval")
+    return eval(code, {"__builtins__": {}})
+
+
+_O2_VOLTAGE_TRIM = "(A / 200, B * 100 / 128 - 100)"
+_O2_LAMBDA_VOLTAGE = "(2 * (256 * A + B) / 65536, 8 * (256 * C + D) / 65536)"
+_O2_LAMBDA_CURRENT = "(2 * (256 * A + B) / 65536, (256 * C + D) / 256 - 128)"
+_PERCENT = "A * 100 / 255"
+_TRIM = "A * 100 / 128 - 100"
+
+# (pid, name, unit, formula)
+_PID_FORMULAS = [
+    (0x04, "Calculated engine load", "%", _PERCENT),
+    (0x05, "Engine coolant temperature", "°C", "A - 40"),
+    (0x06, "Short term fuel trim bank 1", "%", _TRIM),
+    (0x07, "Long term fuel trim bank 1", "%", _TRIM),
+    (0x08, "Short term fuel trim bank 2", "%", _TRIM),
+    (0x09, "Long term fuel trim bank 2", "%", _TRIM),
+    (0x0A, "Fuel pressure", "kPa", "3 * A"),
+    (0x0B, "Intake manifold absolute pressure", "kPa", "A"),
+    (0x0C, "Engine speed", "rpm", "(256 * A + B) / 4"),
+    (0x0D, "Vehicle speed", "km/h", "A"),
+    (0x0E, "Timing advance", "°", "A / 2 - 64"),
+    (0x0F, "Intake air temperature", "°C", "A - 40"),
+    (0x10, "MAF air flow rate", "g/s", "(256 * A + B) / 100"),
+    (0x11, "Throttle position", "%", _PERCENT),
+    *[(0x14 + i, f"Oxygen sensor {i + 1} voltage / short term trim", "V/%", _O2_VOLTAGE_TRIM) for i in range(8)],
+    (0x1F, "Run time since engine start", "s", "256 * A + B"),
+    (0x21, "Distance traveled with MIL on", "km", "256 * A + B"),
+    (0x22, "Fuel rail pressure (vacuum)", "kPa", "0.079 * (256 * A + B)"),
+    (0x23, "Fuel rail gauge pressure", "kPa", "10 * (256 * A + B)"),
+    *[(0x24 + i, f"Oxygen sensor {i + 1} lambda / voltage", "ratio/V", _O2_LAMBDA_VOLTAGE) for i in range(8)],
+    (0x2C, "Commanded EGR", "%", _PERCENT),
+    (0x2D, "EGR error", "%", _TRIM),
+    (0x2E, "Commanded evaporative purge", "%", _PERCENT),
+    (0x2F, "Fuel tank level input", "%", _PERCENT),
+    (0x30, "Warm-ups since codes cleared", "count", "A"),
+    (0x31, "Distance traveled since codes cleared", "km", "256 * A + B"),
+    (0x32, "Evap system vapor pressure", "Pa", "(256 * A + B - (65536 if A & 0x80 else 0)) / 4"),
+    (0x33, "Absolute barometric pressure", "kPa", "A"),
+    *[(0x34 + i, f"Oxygen sensor {i + 1} lambda / current", "ratio/mA", _O2_LAMBDA_CURRENT) for i in range(8)],
+    (0x3C, "Catalyst temperature bank 1 sensor 1", "°C", "(256 * A + B) / 10 - 40"),
+    (0x3D, "Catalyst temperature bank 2 sensor 1", "°C", "(256 * A + B) / 10 - 40"),
+    (0x3E, "Catalyst temperature bank 1 sensor 2", "°C", "(256 * A + B) / 10 - 40"),
+    (0x3F, "Catalyst temperature bank 2 sensor 2", "°C", "(256 * A + B) / 10 - 40"),
+    (0x42, "Control module voltage", "V", "(256 * A + B) / 1000"),
+    (0x43, "Absolute load value", "%", "(256 * A + B) * 100 / 255"),
+    (0x44, "Commanded air-fuel equivalence ratio", "ratio", "2 * (256 * A + B) / 65536"),
+    (0x45, "Relative throttle position", "%", _PERCENT),
+    (0x46, "Ambient air temperature", "°C", "A - 40"),
+    (0x47, "Absolute throttle position B", "%", _PERCENT),
+    (0x48, "Absolute throttle position C", "%", _PERCENT),
+    (0x49, "Accelerator pedal position D", "%", _PERCENT),
+    (0x4A, "Accelerator pedal position E", "%", _PERCENT),
+    (0x4B, "Accelerator pedal position F", "%", _PERCENT),
+    (0x4C, "Commanded throttle actuator", "%", _PERCENT),
+    (0x4D, "Time run with MIL on", "min", "256 * A + B"),
+    (0x4E, "Time since trouble codes cleared", "min", "256 * A + B"),
+    (0x51, "Fuel type", "code", "A"),
+    (0x52, "Ethanol fuel", "%", _PERCENT),
+    (0x59, "Fuel rail absolute pressure", "kPa", "10 * (256 * A + B)"),
+    (0x5A, "Relative accelerator pedal position", "%", _PERCENT),
+    (0x5B, "Hybrid battery pack remaining life", "%", _PERCENT),
+    (0x5C, "Engine oil temperature", "°C", "A - 40"),
+    (0x5D, "Fuel injection timing", "°", "(256 * A + B) / 128 - 210"),
+    (0x5E, "Engine fuel rate", "L/h", "(256 * A + B) / 20"),
+    (0x61, "Driver's demand engine torque", "%", "A - 125"),
+    (0x62, "Actual engine torque", "%", "A - 125"),
+    (0x63, "Engine reference torque", "Nm", "256 * A + B"),
+]
+
+PID_DEFINITIONS: Dict[int, PidDefinition] = {
+    pid: PidDefinition(pid, name, unit, formula, _compile(formula))
+    for pid, name, unit, formula in _PID_FORMULAS
+}
+
+SUPPORTED_PID_BITMAPS = tuple(range(0x00, 0xE0, 0x20))  # 0x00, 0x20, ... 0xC0
+
+
+def decode_pid(pid: int, data: bytes) -> Any:
+    """Decoded value of a PID reply, or None if the PID has no formula"""
+    definition = PID_DEFINITIONS.get(pid)
+    if definition is None:
+        return None
+    try:
+        return definition.decode(*data)
+    except TypeError:
+        logger.debug(f"PID 0x{pid:02X}: unexpected data length {len(data)}")
+        return None
+
+
+def decode_supported_bitmap(base_pid: int, data: bytes) -> Set[int]:
+    """PIDs flagged in a 0x00/0x20/... bitmap reply (bit 7 of A = base + 1)"""
+    value = int.from_bytes(data[:4], 'big')
+    return {base_pid + bit + 1 for bit in range(32) if value & (1 << (31 - bit))}
+
+
+def decode_vin(payload: bytes) -> Optional[str]:
+    """VIN from a ``49 02 01 ...`` (Mode 09 PID 02) reply"""
+    if len(payload) < 20 or payload[0] != 0x49 or payload[1] != 0x02:
+        return None
+    vin = payload[3:20].decode('ascii', errors='ignore').strip('\x00 ')
+    return vin if len(vin) == 17 else None
@@ -7,12 +7,19 @@ Bluetooth-based CAN bus sniffer for automotive diagnostics
 import logging
 import time
 import threading
-from typing import Optional, List, Dict, Callable, Tuple
+from typing import Optional, List, Dict, Callable, Tuple, Iterable, Set
 from enum import Enum
 from dataclasses import dataclass
 from collections import deque
 import re
 
+from shared.can_dispatch import CANMessageDispatcher, DispatchPolicy
+from shared.can_filters import (
+    ID_BITS_11, ID_BITS_29, elm_filter_commands, parse_arbitration_ids, stn_filter_commands
+)
+from shared.elm_resume import ElmResumeState
+from shared.elm_transport import AsyncTransportMixin, get_transport_loop
+
 logger = logging.getLogger(__name__)
 
 
@@ -58,12 +65,21 @@ class CANMessage:
         return cls(time.time(), "", "", raw_msg)
 
 
-class OBDLinkMXPlus:
+class OBDLinkMXPlus(AsyncTransportMixin):
     """OBDLink MX+ CAN Bus Sniffer with Bluetooth Support"""
     
-    def __init__(self, mock_mode: bool = False, device_name: str = "OBDLink MX+"):
+    def __init__(self, mock_mode: bool = False, device_name: str = "OBDLink MX+",
+                 use_async_transport: bool = False, negotiate_baud: bool = True):
         self.mock_mode = mock_mode
         self.device_name = device_name
+        # Serve serial links from the shared asyncio transport loop
+        # (Bluetooth links always use it - RFCOMM has no blocking reader)
+        self.use_async_transport = use_async_transport
+        # Raise USB/serial links to the fastest UART rate the adapter verifies
+        self.negotiate_baud = negotiate_baud
+        self.baud_negotiation = None
+        # Settings we applied, cached per device for reset-free reconnects
+        self.resume_state = ElmResumeState()
         self.is_connected = False
         self.is_monitoring = False
         self.current_protocol = OBDLinkProtocol.AUTO
@@ -75,7 +91,13 @@ class OBDLinkMXPlus:
         
         # CAN bus monitoring
         self.message_buffer = deque(maxlen=1000)
-        self.callbacks = []
+        # Callbacks run from bounded per-subscriber queues, never on the reader
+        self.dispatcher = CANMessageDispatcher()
+        
+        # Hardware receive filters (STN pass filters, ELM ATCF/ATCM fallback)
+        self.supports_stn_filters = True  # MX+ is STN-based; cleared if STFAP is rejected
+        self.active_filter_ids: Optional[Set[int]] = None  # None = pass everything
+        self.active_filter_commands: List[str] = []
         self.monitor_thread = None
         self._stop_monitor = threading.Event()
         
@@ -266,7 +288,11 @@ class OBDLinkMXPlus:
             self.bluetooth_address = mac_address
             self.is_connected = True
             
+            if not self.attach_async_transport(sock=self.rfcomm_socket):
+                logger.warning("Async transport unavailable - Bluetooth responses will not be read")
+            
             # Initialize device
+            self.resume_state.set_device(f"bt:{mac_address}")
             return self._initialize_device()
             
         except ImportError:
@@ -285,6 +311,13 @@ class OBDLinkMXPlus:
             return True
 
         baudrates = [115200, 38400, 9600, 500000, 2000000] if baudrate is None else [baudrate]
+        if baudrate is None:
+            # A still-powered adapter keeps the rate negotiated last time
+            from shared.baud_negotiation import cached_baud_rate
+            cached = cached_baud_rate(port)
+            if cached:
+                baudrates = [cached] + [rate for rate in baudrates if rate != cached]
+        self.resume_state.set_device(f"serial:{port}")
 
         for rate in baudrates:
             logger.info(f"Attempting to connect to OBDLink MX+ on {port} at {rate} baud")
@@ -306,12 +339,19 @@ class OBDLinkMXPlus:
 
                 # Initialize device
                 init_success = self._initialize_device()
+                if init_success and self.negotiate_baud and baudrate is None:
+                    init_success = self._negotiate_baud_rate(port)
+
+                if init_success and self.use_async_transport:
+                    self.attach_async_transport(serial_port=self.serial_port)
+
                 if init_success:
                     logger.info(f"Successfully connected and initialized OBDLink MX+ on {port}")
                     self.is_connected = True
                     return True
                 else:
                     logger.warning(f"Device initialization failed on {port} at {rate} baud")
+                    self.detach_async_transport()
                     self.serial_port.close()
                     self.serial_port = None
             
@@ -320,19 +360,45 @@ class OBDLinkMXPlus:
                 return False
             except Exception as e:
                 logger.error(f"Serial connection failed on {port} at {rate} baud: {e}")
+                self.detach_async_transport()
                 if self.serial_port:
                     self.serial_port.close()
                     self.serial_port = None
         
         return False
     
-    def _initialize_device(self) -> bool:
-        """Initialize OBDLink MX+ device"""
+    def _negotiate_baud_rate(self, port: str) -> bool:
+        """Switch the initialised serial link to the fastest verified rate"""
+        from shared.baud_negotiation import negotiate_baud_rate
+
+        try:
+            self.baud_negotiation = negotiate_baud_rate(self.serial_port, device_key=port)
+        except Exception as e:
+            logger.warning(f"Baud rate negotiation failed, staying at {self.serial_port.baudrate}: {e}")
+            return True
+        if self.baud_negotiation.device_reset:
+            # The fallback path reset the adapter; restore our settings
+            return self._initialize_device()
+        return True
+
+    def _exchange(self, command: str, timeout: float = 1.0) -> str:
+        """Send one command and return the raw response"""
+        if not self._send_command(f"{command}\r".encode('ascii'), timeout):
+            return ""
+        return self._read_response(timeout)
+
+    def _initialize_device(self, allow_resume: bool = True) -> bool:
+        """Initialize OBDLink MX+ device (fast resume first, ATZ if that fails)"""
         if self.mock_mode:
             logger.info("[MOCK] Device initialized")
             return True
 
+        if allow_resume and self.resume_state.resume(self._exchange):
+            logger.info("OBDLink MX+ resumed without reset")
+            return True
+
         logger.info("Starting OBDLink MX+ device initialization")
+        self.resume_state.reset()
         try:
             # Send initialization commands
             # ATZ needs more time to recover
@@ -340,8 +406,8 @@ class OBDLinkMXPlus:
             self._send_command(b'ATZ\r\n')
             time.sleep(2.0)  # Wait 2 seconds for reset
             
-            # Flush any boot messages
-            if self.serial_port:
+            # Flush any boot messages (the async transport consumes them in order)
+            if self.serial_port and not self.transport:
                 self.serial_port.reset_input_buffer()
 
             commands = [
@@ -357,6 +423,7 @@ class OBDLinkMXPlus:
                 if not success:
                     logger.error(f"Failed to send command: {cmd.decode().strip()}")
                     return False
+                self.resume_state.note(cmd.decode())
                 time.sleep(0.5)
                 
                 # specific check for ATI
@@ -364,6 +431,8 @@ class OBDLinkMXPlus:
                     response = self._read_response()
                     logger.info(f"Device Info (ATI): {response.strip()}")
 
+            self.resume_state.save()
+
             # Check device response (STP is standard for OBDLink)
             logger.debug("Checking device identification")
             self._send_command(b'ATI\r\n')
@@ -424,11 +493,16 @@ class OBDLinkMXPlus:
             ]
             
             for cmd in commands:
-                self._send_command(cmd)
+                if self._send_command(cmd):
+                    self.resume_state.note(cmd.decode())
                 time.sleep(0.2)
+            self.resume_state.save()
             
             self.current_protocol = protocol
             logger.info(f"CAN sniffing configured for {protocol.value}")
+            
+            # Only forward what the active subscriptions need
+            self.update_hardware_filters(force=True)
             return True
             
         except Exception as e:
@@ -448,6 +522,14 @@ class OBDLinkMXPlus:
             return True
         
         try:
+            if self.transport:
+                # Monitor lines are delivered on the shared transport loop
+                get_transport_loop().run(
+                    self.transport.start_monitor(self._on_monitor_line, 'ATMA'), timeout=5.0)
+                self.is_monitoring = True
+                logger.info("CAN bus monitoring started (async transport)")
+                return True
+            
             # Start monitor mode
             self._send_command(b'ATMA\r\n')
             
@@ -476,14 +558,7 @@ class OBDLinkMXPlus:
                 can_msg = CANMessage.parse_raw_message(message)
                 
                 if can_msg.arbitration_id:  # Valid message
-                    self.message_buffer.append(can_msg)
-                    
-                    # Notify callbacks
-                    for callback in self.callbacks:
-                        try:
-                            callback(can_msg)
-                        except Exception as e:
-                            logger.debug(f"Callback error: {e}")
+                    self._dispatch_message(can_msg)
                 
                 self.mock_message_index += 1
                 time.sleep(0.1)  # 10Hz message rate
@@ -498,16 +573,7 @@ class OBDLinkMXPlus:
                 if self.serial_port and self.serial_port.in_waiting:
                     data = self.serial_port.readline().decode(errors='ignore').strip()
                     if data:
-                        can_msg = CANMessage.parse_raw_message(data)
-                        if can_msg.arbitration_id:  # Valid message
-                            self.message_buffer.append(can_msg)
-                            
-                            # Notify callbacks
-                            for callback in self.callbacks:
-                                try:
-                                    callback(can_msg)
-                                except Exception as e:
-                                    logger.debug(f"Callback error: {e}")
+                        self._on_monitor_line(data)
                 
                 time.sleep(0.01)  # 100Hz polling
                 
@@ -515,6 +581,17 @@ class OBDLinkMXPlus:
                 logger.error(f"CAN monitoring error: {e}")
                 time.sleep(0.1)
     
+    def _on_monitor_line(self, line: str):
+        """Handle one monitor-mode line from the reader thread or transport loop"""
+        can_msg = CANMessage.parse_raw_message(line)
+        if can_msg.arbitration_id:  # Valid message
+            self._dispatch_message(can_msg)
+    
+    def _dispatch_message(self, can_msg: CANMessage):
+        """Buffer a received message and queue it for subscribers"""
+        self.message_buffer.append(can_msg)
+        self.dispatcher.publish(can_msg)
+    
     def stop_monitoring(self) -> bool:
         """Stop CAN bus monitoring"""
         if not self.is_monitoring:
@@ -526,6 +603,12 @@ class OBDLinkMXPlus:
             return True
         
         try:
+            if self.transport:
+                get_transport_loop().run(self.transport.stop_monitor(), timeout=5.0)
+                self.is_monitoring = False
+                logger.info("CAN bus monitoring stopped")
+                return True
+            
             # Stop monitoring
             self._send_command(b'\r\n')  # Send any character to stop
             time.sleep(0.1)
@@ -592,14 +675,105 @@ class OBDLinkMXPlus:
             'recent_messages': len([msg for msg in self.message_buffer if time.time() - msg.timestamp < 10])
         }
     
-    def add_message_callback(self, callback: Callable[[CANMessage], None]):
-        """Add callback for real-time message processing"""
-        self.callbacks.append(callback)
+    def add_message_callback(self, callback: Callable[[CANMessage], None],
+                             policy: DispatchPolicy = DispatchPolicy.DROP_OLDEST,
+                             max_queue: int = 256, name: Optional[str] = None,
+                             arbitration_ids: Optional[Iterable] = None,
+                             categories: Optional[Iterable[str]] = None):
+        """
+        Add callback for real-time message processing.
+        
+        The callback runs on its own dispatcher thread fed by a bounded queue;
+        ``policy`` decides what happens when its queue is full: DROP_OLDEST
+        (the default), COALESCE_LATEST per arbitration ID for display-only
+        consumers, or BLOCK, which waits briefly for space and then drops -
+        and never waits while frames arrive on the shared transport loop.
+        Drops are counted in ``get_dispatch_metrics()``.
+        
+        ``arbitration_ids`` and/or vehicle-profile ``categories`` (e.g.
+        ``['engine', 'brakes']``) restrict the subscription; the adapter's
+        hardware filters are reprogrammed to the union of all subscriptions.
+        Without either, the callback receives every frame.
+        """
+        wanted = self._resolve_subscription_ids(arbitration_ids, categories)
+        self.dispatcher.subscribe(callback, policy=policy, max_queue=max_queue, name=name,
+                                  arbitration_ids=wanted)
+        self.update_hardware_filters()
     
     def remove_message_callback(self, callback: Callable[[CANMessage], None]):
         """Remove message callback"""
-        if callback in self.callbacks:
-            self.callbacks.remove(callback)
+        if self.dispatcher.unsubscribe(callback):
+            self.update_hardware_filters()
+    
+    def get_dispatch_metrics(self) -> Dict[str, Dict]:
+        """Per-callback drop counters and queue-depth metrics"""
+        return self.dispatcher.get_metrics()
+    
+    def _id_bits(self) -> int:
+        return ID_BITS_29 if self.current_protocol == OBDLinkProtocol.ISO15765_29BIT else ID_BITS_11
+    
+    def _resolve_subscription_ids(self, arbitration_ids: Optional[Iterable],
+                                  categories: Optional[Iterable[str]]) -> Optional[Set[int]]:
+        """Map explicit IDs and profile categories to numeric IDs (None = all)"""
+        if arbitration_ids is None and categories is None:
+            return None
+        
+        wanted = list(arbitration_ids or [])
+        if categories:
+            profile_ids = (self.current_vehicle_profile or {}).get('arbitration_ids', {})
+            for category in categories:
+                if category not in profile_ids:
+                    logger.warning(f"Category '{category}' not in active vehicle profile")
+                wanted.extend(profile_ids.get(category, []))
+        return parse_arbitration_ids(wanted, self._id_bits())
+    
+    def update_hardware_filters(self, force: bool = False) -> bool:
+        """
+        Program adapter receive filters for the IDs the subscriptions need.
+        STN pass filters are tried first; ELM327 ATCF/ATCM is the fallback.
+        """
+        wanted = self.dispatcher.required_ids()
+        if not force and wanted == self.active_filter_ids:
+            return True
+        
+        id_bits = self._id_bits()
+        if self.supports_stn_filters:
+            commands = stn_filter_commands(wanted, id_bits)
+        else:
+            commands = elm_filter_commands(wanted, id_bits)
+        
+        if not self.is_connected or self.mock_mode:
+            # Remember the plan; it is applied on the next configure_can_sniffing()
+            self.active_filter_ids = wanted
+            self.active_filter_commands = commands
+            if self.mock_mode:
+                logger.info(f"[MOCK] Hardware filters: {commands}")
+            return True
+        
+        was_monitoring = self.is_monitoring
+        if was_monitoring:
+            self.stop_monitoring()
+        try:
+            for command in commands:
+                self._send_command(f"{command}\r".encode('ascii'), timeout=1.0)
+                response = self._read_response(timeout=1.0)
+                if '?' in response and self.supports_stn_filters:
+                    logger.info("Adapter rejected STN filters - falling back to ATCF/ATCM")
+                    self.supports_stn_filters = False
+                    return self.update_hardware_filters(force=True)
+                self.resume_state.note(command)
+            self.resume_state.save()
+            
+            self.active_filter_ids = wanted
+            self.active_filter_commands = commands
+            logger.info(f"Hardware filters programmed: {commands}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to program hardware filters: {e}")
+            return False
+        finally:
+            if was_monitoring:
+                self.start_monitoring()
     
     def clear_buffer(self):
         """Clear the message buffer"""
@@ -616,6 +790,8 @@ class OBDLinkMXPlus:
             return
         
         try:
+            self.detach_async_transport()
+            
             if self.rfcomm_socket:
                 self.rfcomm_socket.close()
                 self.rfcomm_socket = None
@@ -630,9 +806,11 @@ class OBDLinkMXPlus:
         except Exception as e:
             logger.error(f"Error during disconnection: {e}")
     
-    def _send_command(self, command: bytes) -> bool:
+    def _send_command(self, command: bytes, timeout: Optional[float] = None) -> bool:
         """Send command to device"""
         try:
+            if self.transport:
+                return self._transport_send(command, timeout)
             if self.serial_port:
                 self.serial_port.write(command)
                 self.serial_port.flush()
@@ -648,6 +826,8 @@ class OBDLinkMXPlus:
     def _read_response(self, timeout: float = 2.0) -> str:
         """Read response from device"""
         try:
+            if self.transport:
+                return self._transport_read(timeout)
             if self.serial_port:
                 start_time = time.time()
                 response = ""
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Supported-PID Discovery
+Reads the Mode 01 support bitmaps (PIDs 0x00, 0x20, 0x40, ...) of every
+responding ECU, following each ECU's chain only as far as it reports further
+bitmaps, and caches the result per VIN and ECU.  Callers then never request
+a PID the ECU does not support, so no time is lost waiting out NO DATA.
+
+``SupportedPidsMixin`` gives ELM-style handlers (``execute_obd_command``
+returning parsed ``messages``) discovery, gating, Mode 01 decoding and a
+per-PID rate live-data poller (``pid_scheduler``).
+"""
+
+import logging
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from shared.json_cache import JsonCache
+from shared.obd_pids import (
+    MODE01_REQUEST, MODE01_RESPONSE, SUPPORTED_PID_BITMAPS, decode_pid, decode_supported_bitmap, decode_vin
+)
+from shared.pid_scheduler import PidPollScheduler, ValueCallback, elm_request_func
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE = "supported_pids_cache.json"
+
+# request bytes -> [(ecu address or None, response payload), ...]
+MultiRequestFunc = Callable[[bytes], Sequence[Tuple[Optional[int], bytes]]]
+
+_pid_cache: Optional[JsonCache] = None
+
+
+def get_supported_pid_cache() -> JsonCache:
+    """Shared per-VIN supported PID cache"""
+    global _pid_cache
+    if _pid_cache is None:
+        _pid_cache = JsonCache(CACHE_FILE)
+    return _pid_cache
+
+
+def _ecu_key(ecu: Optional[int]) -> str:
+    return "default" if ecu is None else f"{ecu:X}"
+
+
+def _ecu_from_key(key: str) -> Optional[int]:
+    return None if key == "default" else int(key, 16)
+
+
+def discover_supported_pids(request_func: MultiRequestFunc, vin: Optional[str] = None,
+                            cache: Optional[JsonCache] = None,
+                            refresh: bool = False) -> Dict[Optional[int], Set[int]]:
+    """Supported Mode 01 PIDs per ECU, from the cache when the VIN is known"""
+    cache = cache or get_supported_pid_cache()
+    if vin and not refresh:
+        cached = cache.get(vin)
+        if cached:
+            logger.debug(f"Supported PIDs for {vin} loaded from cache")
+            return {_ecu_from_key(key): set(pids) for key, pids in cached.items()}
+
+    supported: Dict[Optional[int], Set[int]] = {}
+    pending: Optional[Set[Optional[int]]] = None  # None = every ECU that answers
+    for base in SUPPORTED_PID_BITMAPS:
+        try:
+            replies = request_func(bytes([MODE01_REQUEST, base]))
+        except Exception as e:
+            logger.debug(f"Bitmap request 0x{base:02X} failed: {e}")
+            replies = []
+
+        answered: Set[Optional[int]] = set()
+        for ecu, payload in replies:
+            if len(payload) < 6 or payload[0] != MODE01_RESPONSE or payload[1] != base:
+                continue
+            if pending is not None and ecu not in pending:
+                continue
+            supported.setdefault(ecu, set()).update(decode_supported_bitmap(base, payload[2:6]))
+            answered.add(ecu)
+
+        pending = {ecu for ecu in answered if base + 0x20 in supported[ecu]}
+        if not pending:
+            break
+
+    if supported:
+        logger.info("Supported PIDs discovered: " + ", ".join(
+            f"{_ecu_key(ecu)}={len(pids)}" for ecu, pids in supported.items()))
+        if vin:
+            cache.set(vin, {_ecu_key(ecu): sorted(pids) for ecu, pids in supported.items()})
+    return supported
+
+
+def supported_union(supported: Dict[Optional[int], Set[int]]) -> Set[int]:
+    """PIDs at least one ECU supports (bitmap PIDs excluded)"""
+    union: Set[int] = set()
+    for pids in supported.values():
+        union |= pids
+    return union - set(SUPPORTED_PID_BITMAPS)
+
+
+def elm_multi_request_func(handler) -> MultiRequestFunc:
+    """Adapt an ELM-style handler (``execute_obd_command``) for discovery"""
+    def request(data: bytes) -> List[Tuple[Optional[int], bytes]]:
+        result = handler.execute_obd_command(data.hex().upper())
+        if not result.get("success"):
+            return []
+        return [(message.ecu, message.payload) for message in result.get("messages", [])]
+    return request
+
+
+class SupportedPidsMixin:
+    """Supported Mode 01 PIDs of the connected vehicle for an ELM-style handler"""
+
+    supported_pids: Optional[Set[int]] = None  # None until discovered (or nothing answered)
+    _pids_discovered: bool = False
+    live_data_scheduler: Optional[PidPollScheduler] = None
+
+    def _pid_supported(self, pid: str) -> bool:
+        if self.supported_pids is None or not pid.startswith('01'):
+            return True
+        return int(pid[2:], 16) in self.supported_pids
+
+    @staticmethod
+    def _decode_mode01(pid: str, messages) -> Optional[Any]:
+        for message in messages:
+            if message.payload[:2] == bytes.fromhex(f"41{pid[2:]}"):
+                return decode_pid(message.payload[1], message.payload[2:])
+        return None
+
+    def discover_supported_pids(self, vin: Optional[str] = None, refresh: bool = False,
+                                cache: Optional[JsonCache] = None) -> Set[int]:
+        """Read (or load cached) Mode 01 support bitmaps for the connected vehicle"""
+        if vin is None:
+            vin_result = self.execute_obd_command("0902")
+            for message in vin_result.get("messages", []) if vin_result.get("success") else []:
+                vin = decode_vin(message.payload)
+                if vin:
+                    break
+        supported = discover_supported_pids(elm_multi_request_func(self), vin=vin, cache=cache, refresh=refresh)
+        self.supported_pids = supported_union(supported) if supported else None
+        self._pids_discovered = True
+        return self.supported_pids or set()
+
+    def forget_supported_pids(self):
+        """Another vehicle may be next (e.g. on disconnect)"""
+        self.stop_live_data()
+        self.supported_pids = None
+        self._pids_discovered = False
+
+    def _live_data_pid(self, key: str) -> Optional[int]:
+        """Mode 01 PID of a live-data parameter name (``obd_pids``) or command like ``010C``"""
+        command = getattr(self, 'obd_pids', {}).get(key.lower(), key).upper()
+        if len(command) != 4 or not command.startswith('01'):
+            return None
+        try:
+            return int(command[2:], 16)
+        except ValueError:
+            return None
+
+    def create_live_data_scheduler(self, rates: Dict[str, Tuple[float, int]],
+                                   on_value: Optional[ValueCallback] = None) -> PidPollScheduler:
+        """Poll live-data parameters at their own (rate_hz, priority)"""
+        if not self._pids_discovered:
+            self.discover_supported_pids()
+        scheduler = PidPollScheduler(elm_request_func(self), on_value=on_value,
+                                     supported_pids=self.supported_pids)
+        for key, (rate_hz, priority) in rates.items():
+            pid = self._live_data_pid(key)
+            if pid is None:
+                logger.warning(f"No Mode 01 PID for live-data parameter '{key}'")
+                continue
+            scheduler.add_pid(pid, rate_hz, priority)
+        return scheduler
+
+    def start_live_data(self, rates: Dict[str, Tuple[float, int]],
+                        on_value: Optional[ValueCallback] = None) -> PidPollScheduler:
+        """
+        Poll ``rates`` in the background until ``stop_live_data`` (or the
+        vehicle is forgotten).  ``execute_obd_command`` is not serialised, so
+        send nothing else through the handler while it runs
+        """
+        self.stop_live_data()
+        self.live_data_scheduler = self.create_live_data_scheduler(rates, on_value)
+        self.live_data_scheduler.start()
+        return self.live_data_scheduler
+
+    def stop_live_data(self):
+        if self.live_data_scheduler is not None:
+            self.live_data_scheduler.stop()
+            self.live_data_scheduler = None
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Priority-Based OBD PID Polling Scheduler
+Polls each Mode 01 PID at its own target rate instead of round-robin at one
+shared rate, so slow values (coolant temperature) stop stealing bandwidth
+from fast ones (RPM, boost).
+
+- The request budget is measured, not configured: an EWMA of the observed
+  round-trip time and of PIDs carried per request gives PID polls/second.
+- When targets exceed the budget, capacity is granted by priority; lower
+  priorities are slowed down (never below ``min_share`` of their target).
+- Due PIDs are served earliest-deadline-first and packed up to six per
+  request; PIDs due within half a period ride along for free.
+- PIDs outside ``supported_pids`` (see ``pid_discovery``) are never polled.
+- ``report()`` gives target, granted and achieved rate per PID.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Set
+
+from shared.obd_pids import (
+    MAX_PIDS_PER_REQUEST, build_mode01_request, pid_data_length, split_mode01_response
+)
+
+logger = logging.getLogger(__name__)
+
+# request bytes -> Mode 01 response payload (41 ...), or None on no answer
+RequestFunc = Callable[[bytes], Optional[bytes]]
+ValueCallback = Callable[[int, bytes, float], None]
+
+
+@dataclass
+class PidSchedule:
+    """Polling state of one PID"""
+    pid: int
+    target_hz: float
+    priority: int = 0
+    granted_hz: float = 0.0
+    deadline: float = 0.0
+    polls: int = 0
+    responses: int = 0
+    misses: int = 0
+    last_poll: Optional[float] = None
+    last_value: Optional[bytes] = None
+    last_update: Optional[float] = None
+    samples: Deque[float] = field(default_factory=deque)
+
+    @property
+    def period(self) -> float:
+        rate = self.granted_hz or self.target_hz
+        return 1.0 / rate if rate > 0 else float('inf')
+
+
+class PidPollScheduler:
+    """Earliest-deadline-first Mode 01 poller with a measured request budget"""
+
+    def __init__(self, request_func: RequestFunc, on_value: Optional[ValueCallback] = None,
+                 max_pids_per_request: int = MAX_PIDS_PER_REQUEST, min_share: float = 0.05,
+                 rate_window: float = 5.0, initial_rtt: float = 0.05,
+                 supported_pids: Optional[Iterable[int]] = None,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.request_func = request_func
+        self.on_value = on_value
+        self.max_pids_per_request = max(1, min(MAX_PIDS_PER_REQUEST, max_pids_per_request))
+        self.min_share = min_share
+        self.rate_window = rate_window
+        self.supported_pids: Optional[Set[int]] = set(supported_pids) if supported_pids is not None else None
+        self.clock = clock
+        self.sleep = sleep
+
+        self.rtt_ewma = initial_rtt
+        self.pids_per_request_ewma = 1.0
+        self.requests = 0
+        self._alpha = 0.2
+        self._schedules: Dict[int, PidSchedule] = {}
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    # -- configuration ------------------------------------------------------
+
+    def add_pid(self, pid: int, rate_hz: float, priority: int = 0) -> bool:
+        if self.supported_pids is not None and pid not in self.supported_pids:
+            logger.info(f"PID 0x{pid:02X} not supported by the ECU; not scheduling it")
+            return False
+        if pid_data_length(pid) is None:
+            logger.warning(f"PID 0x{pid:02X} has no known length; it will be polled alone")
+        with self._lock:
+            self._schedules[pid] = PidSchedule(pid=pid, target_hz=rate_hz, priority=priority,
+                                               deadline=self.clock())
+            self._rebalance()
+        return True
+
+    def remove_pid(self, pid: int):
+        with self._lock:
+            self._schedules.pop(pid, None)
+            self._rebalance()
+
+    def set_rate(self, pid: int, rate_hz: float, priority: Optional[int] = None):
+        with self._lock:
+            schedule = self._schedules.get(pid)
+            if schedule is None:
+                return
+            schedule.target_hz = rate_hz
+            if priority is not None:
+                schedule.priority = priority
+            self._rebalance()
+
+    @property
+    def capacity_hz(self) -> float:
+        """PID polls per second the link currently sustains"""
+        return self.pids_per_request_ewma / max(self.rtt_ewma, 1e-4)
+
+    def _rebalance(self):
+        """Grant rates by priority within the measured capacity"""
+        remaining = self.capacity_hz
+        ordered = sorted(self._schedules.values(), key=lambda s: (-s.priority, -s.target_hz))
+        for schedule in ordered:
+            floor = schedule.target_hz * self.min_share
+            granted = max(min(schedule.target_hz, remaining), floor)
+            raised = granted > schedule.granted_hz
+            schedule.granted_hz = granted
+            remaining = max(0.0, remaining - granted)
+            if raised and schedule.last_poll is not None:
+                # A raised grant takes effect now, not after the old period
+                schedule.deadline = min(schedule.deadline, schedule.last_poll + schedule.period)
+
+    # -- scheduling ---------------------------------------------------------
+
+    def next_batch(self, now: Optional[float] = None) -> List[int]:
+        """PIDs for the next request: due ones EDF, plus nearly-due riders"""
+        now = self.clock() if now is None else now
+        with self._lock:
+            due = [s for s in self._schedules.values() if s.deadline <= now]
+            if not due:
+                return []
+            due.sort(key=lambda s: (s.deadline, -s.priority))
+            anchor = due[0]
+            if pid_data_length(anchor.pid) is None:
+                return [anchor.pid]
+
+            batch = [anchor]
+            riders = [s for s in self._schedules.values()
+                      if s is not anchor and pid_data_length(s.pid) is not None
+                      and s.deadline - now <= s.period / 2]
+            riders.sort(key=lambda s: (s.deadline, -s.priority))
+            for schedule in riders:
+                if len(batch) >= self.max_pids_per_request:
+                    break
+                batch.append(schedule)
+            return [s.pid for s in batch]
+
+    def time_until_due(self, now: Optional[float] = None) -> Optional[float]:
+        now = self.clock() if now is None else now
+        with self._lock:
+            if not self._schedules:
+                return None
+            return max(0.0, min(s.deadline for s in self._schedules.values()) - now)
+
+    def poll_once(self) -> bool:
+        """Send one request if anything is due; False when idle"""
+        batch = self.next_batch()
+        if not batch:
+            return False
+
+        start = self.clock()
+        try:
+            payload = self.request_func(build_mode01_request(batch))
+        except Exception as e:
+            logger.debug(f"PID request failed: {e}")
+            payload = None
+        end = self.clock()
+        values = split_mode01_response(payload) if payload else {}
+
+        with self._lock:
+            self.requests += 1
+            self.rtt_ewma += self._alpha * ((end - start) - self.rtt_ewma)
+            self.pids_per_request_ewma += self._alpha * (len(batch) - self.pids_per_request_ewma)
+            for pid in batch:
+                schedule = self._schedules.get(pid)
+                if schedule is None:
+                    continue
+                schedule.polls += 1
+                schedule.last_poll = end
+                schedule.deadline = max(schedule.deadline + schedule.period, end)
+                data = values.get(pid)
+                if data is None:
+                    schedule.misses += 1
+                    continue
+                schedule.responses += 1
+                schedule.last_value = data
+                schedule.last_update = end
+                schedule.samples.append(end)
+                while schedule.samples and end - schedule.samples[0] > self.rate_window:
+                    schedule.samples.popleft()
+            self._rebalance()
+
+        if self.on_value:
+            for pid, data in values.items():
+                if pid in batch:
+                    try:
+                        self.on_value(pid, data, end)
+                    except Exception as e:
+                        logger.debug(f"PID value callback error: {e}")
+        return True
+
+    def run_for(self, duration: float):
+        """Poll in the calling thread for ``duration`` seconds"""
+        stop_at = self.clock() + duration
+        while self.clock() < stop_at:
+            if not self.poll_once():
+                wait = self.time_until_due()
+                if wait is None:
+                    break
+                self.sleep(min(wait, max(0.0, stop_at - self.clock())) or 0.001)
+
+    # -- background polling -------------------------------------------------
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True, name="PIDScheduler")
+        self._thread.start()
+
+    def stop(self, timeout: float = 2.0):
+        self._running = False
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while self._running:
+            if not self.poll_once():
+                wait = self.time_until_due()
+                self.sleep(min(wait if wait is not None else 0.1, 0.1) or 0.001)
+
+    # -- reporting ----------------------------------------------------------
+
+    def achieved_hz(self, pid: int, now: Optional[float] = None) -> float:
+        now = self.clock() if now is None else now
+        with self._lock:
+            schedule = self._schedules.get(pid)
+            if schedule is None:
+                return 0.0
+            samples = [t for t in schedule.samples if now - t <= self.rate_window]
+        if len(samples) < 2:
+            return 0.0
+        span = samples[-1] - samples[0]
+        if span <= 0:
+            # Coarse clock (~15.6 ms ticks on Windows): all samples in one tick
+            return len(samples) / self.rate_window
+        return (len(samples) - 1) / span
+
+    def report(self) -> Dict[int, Dict[str, float]]:
+        """Per-PID target, granted and achieved rate"""
+        now = self.clock()
+        with self._lock:
+            pids = list(self._schedules.values())
+        return {
+            s.pid: {
+                'priority': s.priority,
+                'target_hz': s.target_hz,
+                'granted_hz': round(s.granted_hz, 3),
+                'achieved_hz': round(self.achieved_hz(s.pid, now), 3),
+                'polls': s.polls,
+                'misses': s.misses,
+            }
+            for s in pids
+        }
+
+
+def elm_request_func(handler) -> RequestFunc:
+    """Adapt an ELM-style handler (``execute_obd_command``) to the scheduler"""
+    def request(data: bytes) -> Optional[bytes]:
+        result = handler.execute_obd_command(data.hex().upper())
+        for message in result.get("messages", []) if result.get("success") else []:
+            if message.payload[:1] == b'\x41':
+                return message.payload
+        return None
+    return request
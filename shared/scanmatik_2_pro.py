@@ -15,6 +15,12 @@ from dataclasses import dataclass
 from enum import Enum
 import serial.tools.list_ports
 
+from shared.elm_parser import ElmResponseParser
+from shared.elm_profile import ElmLatencyProfile
+from shared.elm_resume import ElmResumeState
+from shared.elm_transport import AsyncTransportMixin
+from shared.pid_discovery import SupportedPidsMixin
+
 logger = logging.getLogger(__name__)
 
 
@@ -98,16 +104,23 @@ class ScanMatikDeviceInfo:
             ]
 
 
-class ScanMatik2Pro:
+class ScanMatik2Pro(SupportedPidsMixin, AsyncTransportMixin):
     """ScanMatik 2 Pro device handler with comprehensive diagnostic capabilities"""
     
-    def __init__(self, mock_mode: bool = False, device_name: str = "ScanMatik 2 Pro"):
+    def __init__(self, mock_mode: bool = False, device_name: str = "ScanMatik 2 Pro",
+                 use_async_transport: bool = False):
         self.mock_mode = mock_mode
         self.device_name = device_name
+        self.use_async_transport = use_async_transport
         self.detected_devices: List[ScanMatikDeviceInfo] = []
         self.connected_device: Optional[ScanMatikDeviceInfo] = None
         self.serial_connection = None
         self.connection_lock = threading.Lock()
+        # ATE0/ATS0/ATAT2 plus response-count hints on OBD requests
+        self.latency_profile = ElmLatencyProfile()
+        self.response_parser = ElmResponseParser(headers=True)  # init sets ATH1
+        # Applied settings, cached per port for reset-free reconnects
+        self.resume_state = ElmResumeState()
         
         # Device identification patterns
         self.scanmatik_patterns = [
@@ -345,12 +358,17 @@ class ScanMatik2Pro:
                     stopbits=serial.STOPBITS_ONE
                 )
                 
+                if self.use_async_transport:
+                    self.attach_async_transport(serial_port=self.serial_connection)
+                
                 # Initialize device
+                self.resume_state.set_device(f"serial:{target_device.port}")
                 if self._initialize_device():
                     self.connected_device = target_device
                     logger.info(f"Connected to ScanMatik device: {target_device.name} on {target_device.port}")
                     return True
                 else:
+                    self.detach_async_transport()
                     self.serial_connection.close()
                     self.serial_connection = None
                     return False
@@ -359,8 +377,18 @@ class ScanMatik2Pro:
                 logger.error(f"Failed to connect to ScanMatik device: {e}")
                 return False
     
-    def _initialize_device(self) -> bool:
+    def _exchange(self, command: str, timeout: float = 1.0) -> str:
+        """Send one command and return the raw response"""
+        if not self._send_command(f"{command}\r".encode('ascii'), timeout):
+            return ""
+        return self._read_response(timeout) or ""
+
+    def _initialize_device(self, allow_resume: bool = True) -> bool:
         """Initialize ScanMatik device with proper commands"""
+        if allow_resume and self.resume_state.resume(self._exchange):
+            logger.info("ScanMatik device resumed without reset")
+            return True
+        self.resume_state.reset()
         try:
             # Standard initialization sequence
             init_sequence = [
@@ -373,11 +401,14 @@ class ScanMatik2Pro:
                 (b'ATST62\r\n', "Set timeout"),
                 (b'ATSHA7E0\r\n', "Set ECU address")
             ]
+            init_sequence += self.latency_profile.init_commands()
             
             for cmd, description in init_sequence:
                 logger.debug(f"Sending {description}...")
-                self._send_command(cmd)
+                if self._send_command(cmd):
+                    self.resume_state.note(cmd.decode())
                 time.sleep(0.3)
+            self.resume_state.save()
             
             # Test connection
             self._send_command(b'AT\r\n')
@@ -395,7 +426,7 @@ class ScanMatik2Pro:
             logger.error(f"Error initializing ScanMatik device: {e}")
             return False
     
-    def _send_command(self, command: bytes) -> bool:
+    def _send_command(self, command: bytes, timeout: Optional[float] = None) -> bool:
         """Send command to connected ScanMatik device"""
         try:
             if self.mock_mode:
@@ -405,6 +436,9 @@ class ScanMatik2Pro:
             if not self.serial_connection:
                 return False
             
+            if self.transport:
+                return self._transport_send(command, timeout)
+            
             self.serial_connection.write(command)
             self.serial_connection.flush()
             return True
@@ -423,6 +457,9 @@ class ScanMatik2Pro:
             if not self.serial_connection:
                 return None
             
+            if self.transport:
+                return self._transport_read(timeout).strip()
+            
             start_time = time.time()
             response = ""
             
@@ -448,19 +485,22 @@ class ScanMatik2Pro:
         
         try:
             # Format and send command
-            obd_command = f"{command}\r\n".encode('utf-8')
+            wire_command = self.latency_profile.prepare(command)
+            obd_command = f"{wire_command}\r\n".encode('utf-8')
             
-            if not self._send_command(obd_command):
+            if not self._send_command(obd_command, timeout=3.0):
                 return {"success": False, "error": "Failed to send command"}
             
             # Read response
             response = self._read_response(timeout=3.0)
+            self.latency_profile.observe(command, wire_command, response)
             
             if response:
                 return {
                     "success": True,
                     "command": command,
                     "response": response,
+                    "messages": self.response_parser.messages(response),
                     "device": self.connected_device.name,
                     "protocol": "OBD-II",
                     "timestamp": time.time()
@@ -489,7 +529,7 @@ class ScanMatik2Pro:
             command_hex = uds_request.hex().upper()
             at_command = f"ATCA{command_hex}\r\n"  # Custom AT command for UDS
             
-            if not self._send_command(at_command.encode()):
+            if not self._send_command(at_command.encode(), timeout=5.0):
                 return {"success": False, "error": "Failed to send UDS command"}
             
             response = self._read_response(timeout=5.0)
@@ -521,12 +561,16 @@ class ScanMatik2Pro:
         
         for param in parameters:
             pid = self.obd_pids.get(param.lower())
+            if pid and not self._pid_supported(pid):
+                logger.debug(f"Skipping unsupported PID {pid} ({param})")
+                continue
             if pid:
                 result = self.execute_obd_command(pid)
                 if result.get("success"):
                     results[param] = {
                         "pid": pid,
                         "value": result.get("response", ""),
+                        "decoded": self._decode_mode01(pid, result.get("messages", [])),
                         "timestamp": time.time()
                     }
         
@@ -597,6 +641,7 @@ class ScanMatik2Pro:
     
     def disconnect(self):
         """Disconnect from ScanMatik device"""
+        self.forget_supported_pids()
         with self.connection_lock:
             if self.mock_mode:
                 logger.info("[MOCK] Disconnected from ScanMatik device")
@@ -607,6 +652,7 @@ class ScanMatik2Pro:
                 try:
                     self._send_command(b'ATZ\r\n')  # Reset before disconnect
                     time.sleep(0.5)
+                    self.detach_async_transport()
                     self.serial_connection.close()
                 except:
                     pass
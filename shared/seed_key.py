@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Seed/Key Algorithm Registry (UDS 0x27 SecurityAccess)
+One place to look up how an ECU turns a seed into a key, instead of every
+tool path carrying its own callback:
+
+- algorithms are registered by name; rules pick one from the ECU's
+  identification DIDs (supplier F18A, part number F187, a variant DID,
+  ...), the most specific matching rule wins
+- the algorithm is resolved once per ECU and kept until ``reset()``
+- keys the ECU accepted are kept per ECU, level and seed for the session,
+  so a static-seed ECU unlocked again during a long coding job needs no
+  key computation (or key server round trip); a level that is already
+  unlocked needs no request at all
+- ``unlock`` runs the requestSeed/sendKey exchange over any request
+  function and is what VCIManager.security_access uses
+"""
+
+import logging
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from shared.uds_did import DID_SPARE_PART_NUMBER, DID_SUPPLIER_ID
+
+logger = logging.getLogger(__name__)
+
+SID_SECURITY_ACCESS = 0x27
+NRC_INVALID_KEY = 0x35
+
+# seed, level -> key
+KeyFunc = Callable[[bytes, int], bytes]
+# request -> final response or None
+RequestFunc = Callable[[bytes], Optional[bytes]]
+
+
+@dataclass
+class KeyAlgorithm:
+    """A named seed-to-key computation, optionally limited to some levels"""
+    name: str
+    compute: KeyFunc
+    levels: Optional[Tuple[int, ...]] = None
+
+    def supports(self, level: int) -> bool:
+        return self.levels is None or level in self.levels
+
+
+@dataclass
+class AlgorithmRule:
+    """Selects ``algorithm`` when every DID in ``match`` starts with the given bytes"""
+    algorithm: str
+    match: Dict[int, bytes] = field(default_factory=dict)
+
+    def matches(self, identification: Dict[int, bytes]) -> bool:
+        return all(did in identification and identification[did].startswith(prefix)
+                   for did, prefix in self.match.items())
+
+
+def xor_algorithm(mask: int) -> KeyFunc:
+    """Key = seed XOR ``mask`` (mask repeated over the seed length)"""
+    def compute(seed: bytes, level: int) -> bytes:
+        mask_bytes = mask.to_bytes(max(1, (mask.bit_length() + 7) // 8), 'big')
+        return bytes(b ^ mask_bytes[i % len(mask_bytes)] for i, b in enumerate(seed))
+    return compute
+
+
+class SeedKeyRegistry:
+    """Key algorithms by ECU identification, plus this session's accepted keys"""
+
+    def __init__(self):
+        self.algorithms: Dict[str, KeyAlgorithm] = {}
+        self.rules: List[AlgorithmRule] = []
+        self._resolved: Dict[str, Optional[KeyAlgorithm]] = {}
+        self._keys: Dict[Tuple[str, int, bytes], bytes] = {}
+
+    def register(self, name: str, compute: KeyFunc, levels: Optional[Tuple[int, ...]] = None,
+                 supplier: Optional[bytes] = None, part_number: Optional[bytes] = None,
+                 match: Optional[Dict[int, bytes]] = None):
+        """Add an algorithm and, if any criteria are given, the rule selecting it"""
+        self.algorithms[name] = KeyAlgorithm(name, compute, levels)
+        criteria = dict(match or {})
+        if supplier is not None:
+            criteria[DID_SUPPLIER_ID] = supplier
+        if part_number is not None:
+            criteria[DID_SPARE_PART_NUMBER] = part_number
+        if criteria:
+            self.add_rule(name, criteria)
+
+    def add_rule(self, algorithm: str, match: Dict[int, bytes]):
+        self.rules.append(AlgorithmRule(algorithm, dict(match)))
+        self._resolved.clear()
+
+    @property
+    def identification_dids(self) -> List[int]:
+        """DIDs the rules look at; read these to resolve an ECU"""
+        return sorted({did for rule in self.rules for did in rule.match})
+
+    def resolve(self, identification: Dict[int, bytes], level: Optional[int] = None) -> Optional[KeyAlgorithm]:
+        """Most specific algorithm whose rule matches ``identification``"""
+        candidates = [rule for rule in self.rules if rule.matches(identification)
+                      and rule.algorithm in self.algorithms
+                      and (level is None or self.algorithms[rule.algorithm].supports(level))]
+        if not candidates:
+            return None
+        best = max(candidates, key=lambda rule: (len(rule.match), sum(map(len, rule.match.values()))))
+        return self.algorithms[best.algorithm]
+
+    def algorithm_for(self, ecu: str, identify: Callable[[List[int]], Dict[int, bytes]],
+                      level: Optional[int] = None) -> Optional[KeyAlgorithm]:
+        """Resolve once per ECU; ``identify`` reads the identification DIDs"""
+        if ecu not in self._resolved:
+            algorithm = self.resolve(identify(self.identification_dids)) if self.rules else None
+            self._resolved[ecu] = algorithm
+            logger.info(f"ECU {ecu}: seed/key algorithm {algorithm.name if algorithm else 'not found'}")
+        algorithm = self._resolved[ecu]
+        if algorithm is not None and level is not None and not algorithm.supports(level):
+            return None
+        return algorithm
+
+    # -- accepted keys -------------------------------------------------------
+
+    def cached_key(self, ecu: str, level: int, seed: bytes) -> Optional[bytes]:
+        return self._keys.get((ecu, level, bytes(seed)))
+
+    def remember_key(self, ecu: str, level: int, seed: bytes, key: bytes):
+        self._keys[(ecu, level, bytes(seed))] = bytes(key)
+
+    def forget_key(self, ecu: str, level: int, seed: bytes):
+        self._keys.pop((ecu, level, bytes(seed)), None)
+
+    def reset(self):
+        """Forget resolved algorithms and accepted keys (e.g. after disconnect)"""
+        self._resolved.clear()
+        self._keys.clear()
+
+
+_registry: Optional[SeedKeyRegistry] = None
+
+
+def get_seed_key_registry() -> SeedKeyRegistry:
+    """Shared registry that tool paths register their algorithms with"""
+    global _registry
+    if _registry is None:
+        _registry = SeedKeyRegistry()
+    return _registry
+
+
+def unlock(request: RequestFunc, level: int, ecu: str, registry: SeedKeyRegistry,
+           seed_key_callback: Optional[Callable[[bytes], bytes]] = None,
+           identify: Optional[Callable[[List[int]], Dict[int, bytes]]] = None) -> bool:
+    """
+    requestSeed / sendKey for ``level`` (odd). The key comes from the
+    session's accepted keys, else ``seed_key_callback``, else the registry
+    algorithm resolved through ``identify``. Resolution (which may read
+    DIDs) happens before requestSeed: many ECUs drop the seed on any
+    request between the two and answer sendKey with NRC 0x24.
+    """
+    compute: Optional[Callable[[bytes], bytes]] = seed_key_callback
+    if compute is None and identify is not None:
+        algorithm = registry.algorithm_for(ecu, identify, level)
+        if algorithm is not None:
+            compute = lambda value: algorithm.compute(value, level)
+
+    response = request(bytes([SID_SECURITY_ACCESS, level]))
+    if not response or len(response) < 2:
+        logger.error("Failed to receive seed")
+        return False
+    if response[0] != SID_SECURITY_ACCESS + 0x40 or response[1] != level:
+        logger.error(f"Negative response to seed request: {response.hex()}")
+        return False
+
+    seed = response[2:]
+    # A zero seed means the level is already unlocked
+    if all(b == 0 for b in seed):
+        logger.info("Security access already granted (Zero Seed)")
+        return True
+
+    key = registry.cached_key(ecu, level, seed)
+    if key is not None:
+        logger.debug(f"ECU {ecu}: reusing accepted key for level 0x{level:02X}")
+    else:
+        if compute is None:
+            logger.error(f"No seed/key algorithm for ECU {ecu}, level 0x{level:02X}")
+            return False
+        try:
+            key = bytes(compute(seed))
+        except Exception as e:
+            logger.error(f"Error calculating key: {e}")
+            return False
+
+    response = request(bytes([SID_SECURITY_ACCESS, level + 1]) + key)
+    if response and len(response) >= 2 and response[0] == SID_SECURITY_ACCESS + 0x40 and response[1] == level + 1:
+        registry.remember_key(ecu, level, seed, key)
+        logger.info(f"Security Access Level {level} Granted")
+        return True
+
+    registry.forget_key(ecu, level, seed)
+    if response and len(response) >= 3 and response[2] == NRC_INVALID_KEY:
+        logger.warning("Security Access Denied (Invalid Key)")
+    else:
+        logger.warning(f"Security Access Denied: {response.hex() if response else 'no response'}")
+    return False
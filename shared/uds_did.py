@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Batched UDS ReadDataByIdentifier (0x22)
+Reads many DIDs per request (``22 F187 F189 F190 ...``) instead of one
+round trip each, and splits the concatenated ``62 <DID> <data> <DID>
+<data> ...`` reply using a DID length table.
+
+- Lengths come from the table below, the caller, or are learned from
+  replies (a DID's length is fixed per ECU).  A DID of unknown
+  length is only ever placed last in a batch, where its data runs to the
+  end of the reply.
+- The batch size starts at the ECU's known limit (or ``max_dids``) and is
+  halved on NRC 0x13 (incorrect length) or 0x14 (response too long); the
+  probed limit is kept for the next read.
+- DIDs the ECU does not support are missing from the result; once the ECU
+  has left one out of a positive reply (or refused it with NRC 0x31) it is
+  not requested again.
+"""
+
+import logging
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+READ_DATA_BY_IDENTIFIER = 0x22
+READ_DATA_BY_IDENTIFIER_RESPONSE = 0x62
+NEGATIVE_RESPONSE = 0x7F
+NRC_INCORRECT_MESSAGE_LENGTH = 0x13
+NRC_RESPONSE_TOO_LONG = 0x14
+NRC_REQUEST_OUT_OF_RANGE = 0x31
+BATCH_TOO_LARGE_NRCS = (NRC_INCORRECT_MESSAGE_LENGTH, NRC_RESPONSE_TOO_LONG)
+
+DEFAULT_MAX_DIDS = 8
+
+# ISO 14229-1 identification DIDs
+DID_BOOT_SOFTWARE_ID = 0xF180
+DID_ACTIVE_DIAGNOSTIC_SESSION = 0xF186
+DID_SPARE_PART_NUMBER = 0xF187
+DID_ECU_SOFTWARE_NUMBER = 0xF188
+DID_ECU_SOFTWARE_VERSION = 0xF189
+DID_SUPPLIER_ID = 0xF18A
+DID_MANUFACTURING_DATE = 0xF18B
+DID_ECU_SERIAL_NUMBER = 0xF18C
+DID_VIN = 0xF190
+DID_ECU_HARDWARE_NUMBER = 0xF191
+DID_ECU_HARDWARE_VERSION = 0xF193
+DID_SYSTEM_SUPPLIER_SOFTWARE_NUMBER = 0xF194
+DID_SYSTEM_SUPPLIER_SOFTWARE_VERSION = 0xF195
+
+ECU_IDENTIFICATION_DIDS = (
+    DID_SPARE_PART_NUMBER, DID_ECU_SOFTWARE_NUMBER, DID_ECU_SOFTWARE_VERSION,
+    DID_ECU_SERIAL_NUMBER, DID_VIN, DID_ECU_HARDWARE_NUMBER,
+    DID_SYSTEM_SUPPLIER_SOFTWARE_VERSION,
+)
+
+# DID -> data bytes, where the standard fixes it; the rest are manufacturer
+# defined and learned per ECU
+DID_DATA_LENGTHS: Dict[int, int] = {
+    DID_ACTIVE_DIAGNOSTIC_SESSION: 1,
+    DID_MANUFACTURING_DATE: 3,
+    DID_VIN: 17,
+}
+
+# request bytes -> response payload, or None on no answer
+RequestFunc = Callable[[bytes], Optional[bytes]]
+
+
+def build_read_request(dids: List[int]) -> bytes:
+    """``22 <DID> [<DID> ...]``"""
+    request = bytearray([READ_DATA_BY_IDENTIFIER])
+    for did in dids:
+        request += did.to_bytes(2, 'big')
+    return bytes(request)
+
+
+def split_read_response(payload: bytes, requested: List[int],
+                        lengths: Dict[int, int]) -> Optional[Dict[int, bytes]]:
+    """
+    Split a ``62 ...`` reply into DID -> data bytes.  Returns None when the
+    reply cannot be walked (an unexpected DID, or a DID of unknown length
+    that is not the last one).
+    """
+    if not payload or payload[0] != READ_DATA_BY_IDENTIFIER_RESPONSE:
+        return None
+    values: Dict[int, bytes] = {}
+    index = 1
+    while index < len(payload):
+        if index + 2 > len(payload):
+            return None
+        did = int.from_bytes(payload[index:index + 2], 'big')
+        if did not in requested or did in values:
+            logger.debug(f"Unexpected DID 0x{did:04X} in reply: {payload.hex()}")
+            return None
+        index += 2
+        length = lengths.get(did)
+        if length is None:
+            if did != requested[-1]:
+                return None
+            length = len(payload) - index
+        if index + length > len(payload):
+            return None
+        values[did] = bytes(payload[index:index + length])
+        index += length
+    return values
+
+
+def decode_did_value(data: bytes) -> str:
+    """Printable ASCII (VIN, part numbers) as text, anything else as hex"""
+    try:
+        decoded = data.decode('ascii').strip('\x00 ')
+        if decoded and all(32 <= ord(c) <= 126 for c in decoded):
+            return decoded
+    except UnicodeDecodeError:
+        pass
+    return data.hex().upper()
+
+
+class DidReader:
+    """Batched 0x22 reader for one ECU, remembering its limit and DID lengths"""
+
+    def __init__(self, request_func: RequestFunc, max_dids: int = DEFAULT_MAX_DIDS,
+                 lengths: Optional[Dict[int, int]] = None):
+        self.request_func = request_func
+        self.max_dids = max(1, max_dids)
+        self.lengths: Dict[int, int] = dict(DID_DATA_LENGTHS)
+        if lengths:
+            self.lengths.update(lengths)
+        self.unsupported: Set[int] = set()
+        self.requests = 0
+
+    def plan(self, dids: List[int]) -> List[List[int]]:
+        """Batches of at most ``max_dids``, unknown-length DIDs last in a batch"""
+        known = [did for did in dids if did in self.lengths]
+        unknown = [did for did in dids if did not in self.lengths]
+        batches = [known[i:i + self.max_dids] for i in range(0, len(known), self.max_dids)]
+        open_batches = [batch for batch in batches if len(batch) < self.max_dids]
+        for did in unknown:
+            if open_batches:
+                open_batches.pop().append(did)
+            else:
+                batches.append([did])
+        return batches
+
+    def read(self, dids: Iterable[int]) -> Dict[int, bytes]:
+        """DID -> data for every DID the ECU returned"""
+        pending = [did for did in dict.fromkeys(dids) if did not in self.unsupported]
+        values: Dict[int, bytes] = {}
+        while pending:
+            batch = self.plan(pending)[0]
+            pending = [did for did in pending if did not in batch]
+            result = self._read_batch(batch)
+            if result is None:
+                # Batch too large: shrink the limit and plan again
+                self.max_dids = max(1, len(batch) // 2)
+                logger.info(f"ECU rejected {len(batch)} DIDs per request; limit now {self.max_dids}")
+                pending = batch + pending
+                continue
+            values.update(result)
+        return values
+
+    def _read_batch(self, batch: List[int]) -> Optional[Dict[int, bytes]]:
+        """Values of one batch; None when the batch must be split"""
+        request = build_read_request(batch)
+        self.requests += 1
+        try:
+            response = self.request_func(request)
+        except Exception as e:
+            logger.debug(f"DID request {request.hex()} failed: {e}")
+            response = None
+        if not response:
+            return {}
+
+        if response[0] == NEGATIVE_RESPONSE:
+            nrc = response[2] if len(response) >= 3 else None
+            if nrc in BATCH_TOO_LARGE_NRCS and len(batch) > 1:
+                return None
+            logger.debug(f"DIDs {', '.join(f'{d:04X}' for d in batch)} refused (NRC 0x{nrc or 0:02X})")
+            if nrc == NRC_REQUEST_OUT_OF_RANGE:
+                # 0x31 to a batch means none of its DIDs is supported
+                self.unsupported.update(batch)
+            return {}
+
+        if len(batch) == 1 and response[0] == READ_DATA_BY_IDENTIFIER_RESPONSE:
+            did = batch[0]
+            if response[1:3] != did.to_bytes(2, 'big'):
+                return {}
+            data = bytes(response[3:])
+            if did not in self.lengths:
+                self.lengths[did] = len(data)
+            return {did: data}
+
+        values = split_read_response(response, batch, self.lengths)
+        if values is not None:
+            for did, data in values.items():
+                self.lengths.setdefault(did, len(data))
+            self.unsupported.update(did for did in batch if did not in values)
+            return values
+
+        # Reply could not be walked: read the batch one DID at a time, which
+        # also learns the lengths for the next batched read
+        logger.debug(f"Cannot split batched reply {response.hex()}; reading DIDs singly")
+        values = {}
+        for did in batch:
+            values.update(self._read_batch([did]) or {})
+        return values
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Bulk ECU Memory Dump (UDS 0x23, or 0x35/0x36/0x37 upload)
+Reads calibration/EEPROM areas in the largest pieces the ECU allows and
+streams them straight to disk with a running SHA-256 and CRC-32.
+
+- RequestUpload is used where the ECU supports it; blocks are sized from
+  the ``maxNumberOfBlockLength`` in its 0x75 response and an unanswered
+  block is requested again with the same block sequence counter
+- otherwise ReadMemoryByAddress, with the widest addressAndLengthFormat
+  the ECU accepts and reads as large as one ISO-TP message carries
+- a read is only split on an NRC that says it was too big (0x13, 0x14,
+  0x31); the reduced size is kept for the rest of the area
+"""
+
+import hashlib
+import logging
+import time
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Callable, List, Optional, Tuple, Union
+
+from shared.uds_session import negative_response_code
+from shared.uds_transfer import (
+    RETRY_NRCS, SID_REQUEST_TRANSFER_EXIT, SID_REQUEST_UPLOAD, SID_TRANSFER_DATA, UdsTransferEngine,
+    encode_address_and_length, parse_max_block_length
+)
+
+logger = logging.getLogger(__name__)
+
+SID_READ_MEMORY_BY_ADDRESS = 0x23
+NRC_INCORRECT_MESSAGE_LENGTH = 0x13
+NRC_RESPONSE_TOO_LONG = 0x14
+NRC_REQUEST_OUT_OF_RANGE = 0x31
+SPLIT_NRCS = (NRC_INCORRECT_MESSAGE_LENGTH, NRC_RESPONSE_TOO_LONG, NRC_REQUEST_OUT_OF_RANGE)
+
+# ISO-TP 12-bit length minus the 0x63 response SID
+MAX_READ_CLASSIC = 4094
+# Length of the read that probes the addressAndLengthFormat
+PROBE_READ = 16
+
+# (address bytes, size bytes), widest first
+ADDRESS_LENGTH_FORMATS: List[Tuple[int, int]] = [(4, 4), (4, 2), (3, 2), (4, 1), (2, 2), (3, 1), (2, 1)]
+
+Output = Union[str, Path, BinaryIO]
+
+
+@dataclass
+class DumpReport:
+    """Outcome, throughput and checksums of one memory dump"""
+    success: bool
+    method: str = ""
+    bytes: int = 0
+    requests: int = 0
+    splits: int = 0
+    read_size: int = 0
+    seconds: float = 0.0
+    sha256: str = ""
+    crc32: int = 0
+    error: str = ""
+
+    @property
+    def kbps(self) -> float:
+        return self.bytes / self.seconds / 1024 if self.seconds > 0 else 0.0
+
+
+class _Sink:
+    """File writer with running checksums"""
+
+    def __init__(self, output: Output):
+        self._owned = not hasattr(output, 'write')
+        self.file = open(output, 'wb') if self._owned else output
+        self.sha256 = hashlib.sha256()
+        self.crc32 = 0
+        self.bytes = 0
+
+    def write(self, data: bytes):
+        self.file.write(data)
+        self.sha256.update(data)
+        self.crc32 = zlib.crc32(data, self.crc32)
+        self.bytes += len(data)
+
+    def close(self):
+        if self._owned:
+            self.file.close()
+        else:
+            self.file.flush()
+
+
+class MemoryDumpEngine(UdsTransferEngine):
+    """Reads memory areas of one ECU to disk"""
+
+    def __init__(self, *args, max_read: int = MAX_READ_CLASSIC, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_read = max_read
+        self.address_format: Optional[Tuple[int, int]] = None
+
+    def dump(self, address: int, size: int, output: Output, method: str = "auto",
+             progress: Optional[Callable[[int, int], None]] = None) -> DumpReport:
+        """
+        Dump ``size`` bytes at ``address`` to ``output`` (path or binary file).
+        ``method``: "upload", "read" (0x23) or "auto" (upload, else 0x23).
+        """
+        start = time.perf_counter()
+        sink = _Sink(output)
+        report = DumpReport(success=False)
+        try:
+            block = None
+            if method in ("auto", "upload"):
+                block = self._request_upload(address, size)
+                if block is None and method == "upload":
+                    report.error = "RequestUpload refused"
+            if block is not None:
+                report.method = "upload"
+                self._upload(block, size, sink, report, progress)
+            elif method in ("auto", "read"):
+                report.method = "read"
+                self._read_by_address(address, size, sink, report, progress)
+        finally:
+            sink.close()
+
+        report.bytes = sink.bytes
+        report.sha256 = sink.sha256.hexdigest()
+        report.crc32 = sink.crc32
+        report.seconds = time.perf_counter() - start
+        report.success = not report.error and report.bytes == size
+        if report.success:
+            logger.info(f"Dumped {size} bytes at 0x{address:X} via {report.method} in {report.seconds:.2f}s "
+                        f"({report.kbps:.1f} KB/s, {report.requests} requests, sha256 {report.sha256[:16]})")
+        else:
+            logger.error(f"Dump of 0x{address:X}+{size} failed after {report.bytes} bytes: {report.error}")
+        return report
+
+    # -- 0x35 / 0x36 / 0x37 ----------------------------------------------------
+
+    def _request_upload(self, address: int, size: int) -> Optional[int]:
+        """0x35; TransferData payload size the ECU sends, or None if refused"""
+        request = bytes([SID_REQUEST_UPLOAD, 0x00]) + encode_address_and_length(address, size)
+        response = self._request(request)
+        if not self._positive(request, response):
+            logger.info(f"RequestUpload refused: {response.hex() if response else 'no response'}")
+            return None
+        max_length = parse_max_block_length(response)
+        if not max_length or max_length < 3:
+            logger.error(f"Invalid maxNumberOfBlockLength in {response.hex()}")
+            return None
+        return max_length - 2
+
+    def _upload(self, block: int, size: int, sink: _Sink, report: DumpReport,
+                progress: Optional[Callable[[int, int], None]]):
+        report.read_size = block
+        counter = 1
+        while sink.bytes < size:
+            request = bytes([SID_TRANSFER_DATA, counter])
+            attempts = 0
+            while True:
+                report.requests += 1
+                response = self._await_block(request) if self._send(request) else None
+                if self._positive(request, response):
+                    break
+                nrc = negative_response_code(request, response) if response else None
+                attempts += 1
+                if attempts > self.max_retries or nrc not in RETRY_NRCS:
+                    report.error = f"Upload block {counter} failed: {response.hex() if response else 'no response'}"
+                    return
+                logger.warning(f"Requesting upload block 0x{counter:02X} again, attempt {attempts}")
+            if len(response) <= 2:
+                report.error = f"Upload block {counter} carried no data"
+                return
+            sink.write(response[2:2 + size - sink.bytes])
+            if progress:
+                progress(sink.bytes, size)
+            counter = (counter + 1) & 0xFF
+
+        request = bytes([SID_REQUEST_TRANSFER_EXIT])
+        response = self._request(request)
+        if not self._positive(request, response):
+            report.error = f"RequestTransferExit failed: {response.hex() if response else 'no response'}"
+
+    # -- 0x23 -----------------------------------------------------------------
+
+    def _read(self, address: int, length: int, fmt: Tuple[int, int]) -> Optional[bytes]:
+        request = bytes([SID_READ_MEMORY_BY_ADDRESS]) + encode_address_and_length(address, length, *fmt)
+        return self._request(request)
+
+    def _probe_format(self, address: int, size: int) -> Optional[Tuple[Tuple[int, int], bytes]]:
+        """Widest addressAndLengthFormat the ECU answers, with the probe read's data"""
+        length = min(PROBE_READ, size)
+        end = address + size
+        for fmt in ADDRESS_LENGTH_FORMATS:
+            if end > 1 << (8 * fmt[0]):
+                continue
+            response = self._read(address, length, fmt)
+            if response and response[0] == SID_READ_MEMORY_BY_ADDRESS + 0x40 and len(response) == length + 1:
+                logger.debug(f"0x23 format: {fmt[0]}-byte address, {fmt[1]}-byte size")
+                return fmt, response[1:]
+        return None
+
+    def _read_by_address(self, address: int, size: int, sink: _Sink, report: DumpReport,
+                         progress: Optional[Callable[[int, int], None]]):
+        position = address
+        if self.address_format is None:
+            probe = self._probe_format(address, size)
+            report.requests += 1
+            if probe is None:
+                report.error = "No addressAndLengthFormat accepted"
+                return
+            self.address_format, data = probe
+            sink.write(data)
+            position += len(data)
+
+        size_limit = (1 << (8 * self.address_format[1])) - 1
+        read_size = min(self.max_read, size_limit)
+        while sink.bytes < size:
+            length = min(read_size, size - sink.bytes)
+            report.requests += 1
+            response = self._read(position, length, self.address_format)
+            if response and response[0] == SID_READ_MEMORY_BY_ADDRESS + 0x40 and len(response) == length + 1:
+                sink.write(response[1:])
+                position += length
+                report.read_size = read_size
+                if progress:
+                    progress(sink.bytes, size)
+                continue
+
+            nrc = negative_response_code(bytes([SID_READ_MEMORY_BY_ADDRESS]), response) if response else None
+            if nrc in SPLIT_NRCS and length > 1:
+                read_size = length // 2
+                report.splits += 1
+                logger.debug(f"0x23 of {length} bytes at 0x{position:X} refused (NRC 0x{nrc:02X}); "
+                             f"reading {read_size} bytes")
+                continue
+            report.error = (f"Read of {length} bytes at 0x{position:X} failed: "
+                            f"{response.hex() if response else 'no response'}")
+            return
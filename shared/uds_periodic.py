@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Periodic DID Streaming (UDS 0x2C / 0x2A)
+Instead of polling 0x22 from the host, the wanted values are bundled into
+dynamically defined DIDs (0x2C defineByIdentifier, F200-F2FF) and the ECU
+is asked to transmit them by itself at slow, medium or fast rate (0x2A).
+Every periodic message (``6A <pDID> <data>``) is decoded straight into
+named values; the bus carries no requests at all while streaming.
+
+Periodic messages must fit one CAN frame, so signals are packed into as
+many dynamic DIDs as needed (5 data bytes each on classic CAN).  ECUs that
+refuse 0x2C or 0x2A make ``start`` return False; callers keep polling.
+"""
+
+import logging
+import time
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SID_DYNAMICALLY_DEFINE_DID = 0x2C
+DEFINE_BY_IDENTIFIER = 0x01
+CLEAR_DYNAMIC_DID = 0x03
+SID_READ_PERIODIC_DID = 0x2A
+PERIODIC_RESPONSE = 0x6A
+STOP_SENDING = 0x04
+POSITIVE_RESPONSE_OFFSET = 0x40
+
+PERIODIC_DID_BASE = 0xF200
+# Single CAN frame: PCI byte, 6A, periodic DID low byte
+MAX_PERIODIC_DATA_CLASSIC = 5
+
+# request bytes -> final response payload, or None on no answer
+RequestFunc = Callable[[bytes], Optional[bytes]]
+# name -> decoded value, timestamp
+ValuesCallback = Callable[[Dict[str, float], float], None]
+
+
+class PeriodicRate(Enum):
+    """0x2A transmission modes (actual periods are ECU defined)"""
+    SLOW = 0x01
+    MEDIUM = 0x02
+    FAST = 0x03
+
+
+@dataclass
+class StreamSignal:
+    """``size`` bytes at 1-based ``position`` of source DID ``did``, scaled"""
+    name: str
+    did: int
+    position: int = 1
+    size: int = 1
+    scale: float = 1.0
+    offset: float = 0.0
+    unit: str = ""
+    signed: bool = False
+
+    def decode(self, data: bytes) -> float:
+        return int.from_bytes(data, 'big', signed=self.signed) * self.scale + self.offset
+
+
+@dataclass
+class PeriodicDefinition:
+    """One dynamically defined DID and the signals packed into it"""
+    periodic_id: int                 # low byte; the DID is F2xx
+    signals: List[StreamSignal] = field(default_factory=list)
+    messages: int = 0
+    last_update: Optional[float] = None
+
+    @property
+    def did(self) -> int:
+        return PERIODIC_DID_BASE | self.periodic_id
+
+    @property
+    def size(self) -> int:
+        return sum(signal.size for signal in self.signals)
+
+    def define_request(self) -> bytes:
+        request = bytearray([SID_DYNAMICALLY_DEFINE_DID, DEFINE_BY_IDENTIFIER])
+        request += self.did.to_bytes(2, 'big')
+        for signal in self.signals:
+            request += signal.did.to_bytes(2, 'big') + bytes([signal.position, signal.size])
+        return bytes(request)
+
+    def decode(self, data: bytes) -> Dict[str, float]:
+        values: Dict[str, float] = {}
+        index = 0
+        for signal in self.signals:
+            if index + signal.size > len(data):
+                break
+            values[signal.name] = signal.decode(data[index:index + signal.size])
+            index += signal.size
+        return values
+
+
+def pack_signals(signals: Iterable[StreamSignal], max_data: int = MAX_PERIODIC_DATA_CLASSIC,
+                 first_periodic_id: int = 0x00) -> List[PeriodicDefinition]:
+    """First-fit signals into as few periodic DIDs of ``max_data`` bytes as possible"""
+    definitions: List[PeriodicDefinition] = []
+    for signal in signals:
+        if signal.size > max_data:
+            logger.warning(f"{signal.name}: {signal.size} bytes do not fit a periodic message")
+            continue
+        target = next((d for d in definitions if d.size + signal.size <= max_data), None)
+        if target is None:
+            target = PeriodicDefinition(first_periodic_id + len(definitions))
+            definitions.append(target)
+        target.signals.append(signal)
+    return definitions
+
+
+class PeriodicDidStream:
+    """Defines, starts, decodes and stops one ECU's periodic DIDs"""
+
+    def __init__(self, request_func: RequestFunc, on_values: Optional[ValuesCallback] = None,
+                 max_data: int = MAX_PERIODIC_DATA_CLASSIC, first_periodic_id: int = 0x00):
+        self.request_func = request_func
+        self.on_values = on_values
+        self.max_data = max_data
+        self.first_periodic_id = first_periodic_id
+        self.definitions: Dict[int, PeriodicDefinition] = {}
+        self.values: Dict[str, float] = {}
+        self.rate: Optional[PeriodicRate] = None
+
+    @property
+    def active(self) -> bool:
+        return self.rate is not None
+
+    def _request(self, request: bytes) -> Optional[bytes]:
+        try:
+            return self.request_func(request)
+        except Exception as e:
+            logger.debug(f"Periodic DID request {request.hex()} failed: {e}")
+            return None
+
+    def start(self, signals: Iterable[StreamSignal], rate: PeriodicRate = PeriodicRate.FAST) -> bool:
+        """Define the dynamic DIDs and ask the ECU to send them at ``rate``"""
+        self.stop()
+        definitions = pack_signals(signals, self.max_data, self.first_periodic_id)
+        if not definitions:
+            return False
+
+        for definition in definitions:
+            response = self._request(definition.define_request())
+            if not response or response[0] != SID_DYNAMICALLY_DEFINE_DID + POSITIVE_RESPONSE_OFFSET:
+                logger.info(f"ECU refused dynamic DID 0x{definition.did:04X}: "
+                            f"{response.hex() if response else 'no response'}")
+                self._clear(self.definitions.values())
+                self.definitions = {}
+                return False
+            self.definitions[definition.periodic_id] = definition
+
+        request = bytes([SID_READ_PERIODIC_DID, rate.value]) + bytes(self.definitions)
+        response = self._request(request)
+        if not response or response[0] != PERIODIC_RESPONSE:
+            logger.info(f"ECU refused periodic transmission: {response.hex() if response else 'no response'}")
+            self._clear(self.definitions.values())
+            self.definitions = {}
+            return False
+
+        self.rate = rate
+        # Type 1 periodic data can arrive before the 0x2A confirmation
+        if len(response) > 2:
+            self.feed(response)
+        logger.info(f"Streaming {sum(len(d.signals) for d in self.definitions.values())} signal(s) "
+                    f"in {len(self.definitions)} periodic DID(s) at {rate.name.lower()} rate")
+        return True
+
+    def stop(self) -> bool:
+        """Stop transmission and clear the dynamic definitions"""
+        if not self.definitions:
+            return True
+        stopped = True
+        if self.rate is not None:
+            response = self._request(bytes([SID_READ_PERIODIC_DID, STOP_SENDING]) + bytes(self.definitions))
+            stopped = bool(response) and response[0] == PERIODIC_RESPONSE
+            self.rate = None
+        self._clear(self.definitions.values())
+        self.definitions = {}
+        return stopped
+
+    def _clear(self, definitions: Iterable[PeriodicDefinition]):
+        for definition in list(definitions):
+            self._request(bytes([SID_DYNAMICALLY_DEFINE_DID, CLEAR_DYNAMIC_DID]) + definition.did.to_bytes(2, 'big'))
+
+    def feed(self, message: bytes, timestamp: Optional[float] = None) -> bool:
+        """Decode one periodic message (``6A <pDID> <data>``); False if not ours"""
+        if len(message) < 3 or message[0] != PERIODIC_RESPONSE:
+            return False
+        definition = self.definitions.get(message[1])
+        if definition is None:
+            return False
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        values = definition.decode(message[2:])
+        definition.messages += 1
+        definition.last_update = timestamp
+        self.values.update(values)
+        if self.on_values and values:
+            try:
+                self.on_values(values, timestamp)
+            except Exception as e:
+                logger.debug(f"Periodic value callback error: {e}")
+        return True
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+UDS Conversation Record & Replay
+Captures what goes over the session layer's transport and plays it back
+without a vehicle or VCI, for offline benchmarks and regression tests of
+whole flows (scan, DTC read/clear, coding).
+
+- ``UdsRecorder`` wraps a ``SendFunc``/``ReceiveFunc`` pair and stores
+  every request with the responses that followed it and their delay
+- recordings are gzip-compressed JSON lines: a header, then one line per
+  request with hex payloads and millisecond offsets
+- ``UdsReplayTransport`` is a drop-in transport that answers from a
+  recording: first by ECU and exact payload (repeated requests get the
+  recorded answers in order, the last one repeats), then by ECU and
+  service; anything else stays unanswered
+- with ``timing=True`` answers arrive after their recorded delay and a
+  receive shorter than that times out, so latency-sensitive behaviour
+  (0x78 chains, P2 misses) is reproduced
+"""
+
+import gzip
+import json
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Tuple, Union
+
+from shared.uds_session import ReceiveFunc, SendFunc
+
+logger = logging.getLogger(__name__)
+
+RECORDING_FORMAT = "uds-recording"
+RECORDING_VERSION = 1
+
+
+@dataclass
+class RecordedExchange:
+    """One request and everything its ECU sent until the next request"""
+    time_ms: float                   # since the recording started
+    tx_id: int
+    rx_id: int
+    request: bytes
+    responses: List[Tuple[float, bytes]] = field(default_factory=list)  # (ms after request, data)
+
+    def to_json(self) -> Dict:
+        return {"t": round(self.time_ms, 3), "tx": self.tx_id, "rx": self.rx_id, "req": self.request.hex(),
+                "res": [[round(delay, 3), data.hex()] for delay, data in self.responses]}
+
+    @classmethod
+    def from_json(cls, entry: Dict) -> "RecordedExchange":
+        return cls(entry["t"], entry["tx"], entry["rx"], bytes.fromhex(entry["req"]),
+                   [(delay, bytes.fromhex(data)) for delay, data in entry.get("res", [])])
+
+
+def save_recording(path: Union[str, Path], exchanges: List[RecordedExchange], **metadata) -> Path:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        header = {"format": RECORDING_FORMAT, "version": RECORDING_VERSION, "exchanges": len(exchanges)}
+        f.write(json.dumps({**header, **metadata}, separators=(',', ':')) + "\n")
+        for exchange in exchanges:
+            f.write(json.dumps(exchange.to_json(), separators=(',', ':')) + "\n")
+    return path
+
+
+def load_recording(path: Union[str, Path]) -> List[RecordedExchange]:
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        header = json.loads(f.readline() or "{}")
+        if header.get("format") != RECORDING_FORMAT:
+            raise ValueError(f"{path} is not a UDS recording")
+        return [RecordedExchange.from_json(json.loads(line)) for line in f if line.strip()]
+
+
+class UdsRecorder:
+    """Records a transport's traffic as request/response exchanges"""
+
+    def __init__(self):
+        self.exchanges: List[RecordedExchange] = []
+        self._start = time.monotonic()
+        self._sent_at: Dict[int, float] = {}
+        self._last: Dict[int, RecordedExchange] = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, send: SendFunc, receive: ReceiveFunc) -> Tuple[SendFunc, ReceiveFunc]:
+        """Recording versions of ``send`` and ``receive``"""
+        def recording_send(data: bytes, tx_id: int, rx_id: int) -> bool:
+            sent = send(data, tx_id, rx_id)
+            if sent:
+                self.record_request(data, tx_id, rx_id)
+            return sent
+
+        def recording_receive(tx_id: int, rx_id: int, timeout_ms: int) -> Optional[bytes]:
+            response = receive(tx_id, rx_id, timeout_ms)
+            if response is not None:
+                self.record_response(rx_id, response)
+            return response
+
+        return recording_send, recording_receive
+
+    def record_request(self, data: bytes, tx_id: int, rx_id: int):
+        now = time.monotonic()
+        exchange = RecordedExchange((now - self._start) * 1000, tx_id, rx_id, bytes(data))
+        with self._lock:
+            self.exchanges.append(exchange)
+            self._last[rx_id] = exchange
+            self._sent_at[rx_id] = now
+
+    def record_response(self, rx_id: int, data: bytes):
+        now = time.monotonic()
+        with self._lock:
+            exchange = self._last.get(rx_id)
+            if exchange is None:
+                return
+            exchange.responses.append(((now - self._sent_at[rx_id]) * 1000, bytes(data)))
+
+    def save(self, path: Union[str, Path], **metadata) -> Path:
+        with self._lock:
+            exchanges = list(self.exchanges)
+        path = save_recording(path, exchanges, **metadata)
+        logger.info(f"Saved {len(exchanges)} UDS exchanges to {path}")
+        return path
+
+
+class UdsReplayTransport:
+    """Session layer transport that answers from a recording"""
+
+    def __init__(self, recording: Union[str, Path, List[RecordedExchange]], timing: bool = False):
+        exchanges = load_recording(recording) if isinstance(recording, (str, Path)) else list(recording)
+        self.timing = timing
+        self._exact: Dict[Tuple[int, bytes], Deque[RecordedExchange]] = {}
+        self._service: Dict[Tuple[int, int], Deque[RecordedExchange]] = {}
+        for exchange in exchanges:
+            self._exact.setdefault((exchange.tx_id, exchange.request), deque()).append(exchange)
+            self._service.setdefault((exchange.tx_id, exchange.request[0]), deque()).append(exchange)
+        self._pending: Dict[int, Deque[Tuple[float, bytes]]] = {}
+        self._lock = threading.Lock()
+        self.matched = 0
+        self.by_service = 0
+        self.unmatched = 0
+
+    @staticmethod
+    def _next(queue: Optional[Deque[RecordedExchange]]) -> Optional[RecordedExchange]:
+        if not queue:
+            return None
+        # The last recorded answer keeps answering (e.g. a polling loop running longer)
+        return queue.popleft() if len(queue) > 1 else queue[0]
+
+    def send(self, data: bytes, tx_id: int, rx_id: int) -> bool:
+        data = bytes(data)
+        with self._lock:
+            exchange = self._next(self._exact.get((tx_id, data)))
+            if exchange is not None:
+                self.matched += 1
+            else:
+                exchange = self._next(self._service.get((tx_id, data[0]))) if data else None
+                if exchange is not None:
+                    self.by_service += 1
+                else:
+                    self.unmatched += 1
+                    logger.debug(f"Replay: no recorded answer for {data[:4].hex()} to 0x{tx_id:X}")
+                    return True
+            now = time.monotonic()
+            pending = self._pending.setdefault(rx_id, deque())
+            for delay, response in exchange.responses:
+                pending.append((now + delay / 1000 if self.timing else now, response))
+        return True
+
+    def receive(self, tx_id: int, rx_id: int, timeout_ms: int) -> Optional[bytes]:
+        with self._lock:
+            pending = self._pending.get(rx_id)
+            due = pending[0][0] if pending else None
+        if due is None:
+            if self.timing:
+                time.sleep(timeout_ms / 1000)
+            return None
+        if self.timing:
+            wait = due - time.monotonic()
+            if wait > timeout_ms / 1000:
+                time.sleep(timeout_ms / 1000)
+                return None
+            if wait > 0:
+                time.sleep(wait)
+        with self._lock:
+            return self._pending[rx_id].popleft()[1]
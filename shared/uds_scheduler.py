@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+UDS Request Scheduler
+Orders the requests every tab sends through one VCI channel:
+
+- priority classes: user action > flash > live data > keep-alive; the
+  highest waiting class gets the channel next, FIFO within a class
+- identical read-only requests (same ECU, same bytes) that are already
+  queued or on the bus are coalesced: the second caller waits for the
+  first one's response instead of sending again, and a higher-priority
+  caller lifts the shared request to its own class
+- multi-request operations (flash download, memory dump) hold the channel
+  with ``turn()``; requests from the holding thread run straight through
+- per-class queue depth and wait time are kept in ``stats``
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Services whose identical requests may share one response
+COALESCE_SERVICES = (0x19, 0x22, 0x23, 0x3E)
+
+# data, tx_id, rx_id, timeout_ms -> final response or None
+ExecuteFunc = Callable[[bytes, int, int, Optional[int]], Optional[bytes]]
+
+
+class RequestPriority(IntEnum):
+    """Lower value goes first"""
+    USER = 0
+    FLASH = 1
+    LIVE_DATA = 2
+    KEEP_ALIVE = 3
+
+
+@dataclass
+class PriorityStats:
+    """Counters of one priority class"""
+    requests: int = 0
+    coalesced: int = 0
+    waiting: int = 0
+    max_waiting: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+    @property
+    def avg_wait_ms(self) -> float:
+        served = self.requests - self.coalesced
+        return self.total_wait / served * 1000 if served > 0 else 0.0
+
+
+class _Ticket:
+    __slots__ = ('priority', 'klass', 'seq', 'done', 'response')
+
+    def __init__(self, priority: RequestPriority, seq: int):
+        self.priority = priority
+        self.klass = priority            # class the wait is accounted to
+        self.seq = seq
+        self.done = threading.Event()
+        self.response: Optional[bytes] = None
+
+    def __lt__(self, other: "_Ticket") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class UdsRequestScheduler:
+    """Priority queue with request coalescing in front of one channel"""
+
+    def __init__(self, execute: ExecuteFunc):
+        self.execute = execute
+        self.stats: Dict[RequestPriority, PriorityStats] = {p: PriorityStats() for p in RequestPriority}
+        self._cond = threading.Condition()
+        self._queue: List[_Ticket] = []
+        self._seq = itertools.count()
+        self._owner: Optional[int] = None
+        self._in_flight: Dict[Tuple[int, int, bytes], _Ticket] = {}
+
+    def busy(self) -> bool:
+        """Channel held or requests waiting for it"""
+        return self._owner is not None or bool(self._queue)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Per-class queue depth and wait time, e.g. for a status view"""
+        with self._cond:
+            return {priority.name: {"requests": s.requests, "coalesced": s.coalesced,
+                                    "queue_depth": s.waiting, "max_queue_depth": s.max_waiting,
+                                    "avg_wait_ms": round(s.avg_wait_ms, 2),
+                                    "max_wait_ms": round(s.max_wait * 1000, 2)}
+                    for priority, s in self.stats.items()}
+
+    def reset_stats(self):
+        with self._cond:
+            for priority in RequestPriority:
+                waiting = self.stats[priority].waiting
+                self.stats[priority] = PriorityStats(waiting=waiting, max_waiting=waiting)
+
+    # -- channel turns -------------------------------------------------------
+
+    def _enqueue(self, priority: RequestPriority) -> _Ticket:
+        """Queue a ticket; caller holds ``_cond``"""
+        ticket = _Ticket(priority, next(self._seq))
+        heapq.heappush(self._queue, ticket)
+        stats = self.stats[priority]
+        stats.waiting += 1
+        stats.max_waiting = max(stats.max_waiting, stats.waiting)
+        return ticket
+
+    def _wait_turn(self, ticket: _Ticket):
+        start = time.monotonic()
+        with self._cond:
+            while self._owner is not None or self._queue[0] is not ticket:
+                self._cond.wait()
+            heapq.heappop(self._queue)
+            self._owner = threading.get_ident()
+            stats = self.stats[ticket.klass]
+            stats.waiting -= 1
+            waited = time.monotonic() - start
+            stats.total_wait += waited
+            stats.max_wait = max(stats.max_wait, waited)
+
+    def _release(self):
+        with self._cond:
+            self._owner = None
+            self._cond.notify_all()
+
+    @contextmanager
+    def turn(self, priority: RequestPriority = RequestPriority.FLASH):
+        """Hold the channel for a multi-request operation"""
+        if self._owner == threading.get_ident():
+            yield
+            return
+        with self._cond:
+            self.stats[priority].requests += 1
+            ticket = self._enqueue(priority)
+        self._wait_turn(ticket)
+        try:
+            yield
+        finally:
+            self._release()
+
+    # -- requests ------------------------------------------------------------
+
+    def submit(self, data: bytes, tx_id: int, rx_id: int, timeout_ms: Optional[int] = None,
+               priority: RequestPriority = RequestPriority.USER) -> Optional[bytes]:
+        """Send ``data`` when its class is next, or share an identical request's response"""
+        if self._owner == threading.get_ident():
+            with self._cond:
+                self.stats[priority].requests += 1
+            return self.execute(data, tx_id, rx_id, timeout_ms)
+
+        key = (tx_id, rx_id, bytes(data)) if data and data[0] in COALESCE_SERVICES else None
+        with self._cond:
+            stats = self.stats[priority]
+            stats.requests += 1
+            shared = self._in_flight.get(key) if key else None
+            if shared is not None:
+                stats.coalesced += 1
+                if priority < shared.priority and shared in self._queue:
+                    shared.priority = priority
+                    heapq.heapify(self._queue)
+                    self._cond.notify_all()
+            else:
+                ticket = self._enqueue(priority)
+                if key:
+                    self._in_flight[key] = ticket
+
+        if shared is not None:
+            logger.debug(f"Coalesced {data[:3].hex()} for 0x{tx_id:X} with a request in flight")
+            shared.done.wait()
+            return shared.response
+
+        self._wait_turn(ticket)
+        try:
+            ticket.response = self.execute(data, tx_id, rx_id, timeout_ms)
+        finally:
+            with self._cond:
+                if key:
+                    self._in_flight.pop(key, None)
+            ticket.done.set()
+            self._release()
+        return ticket.response
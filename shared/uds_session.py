@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+UDS Session Layer
+Sits between diagnostic code and the ISO-TP transport:
+
+- waits out NRC 0x78 (response pending) with the P2* the ECU announced in
+  its DiagnosticSessionControl (0x10) response, instead of failing or
+  relying on huge blanket timeouts
+- tracks the active diagnostic session and unlocked security level per
+  ECU from the responses that pass through (0x10, 0x11, 0x27)
+- derives each ECU's response timeout from its P2 and a rolling latency
+  percentile: never below P2, longer for ECUs observed to be slower; an
+  ECU that has answered before gets one grace wait after a miss, so a
+  late answer widens its timeout instead of failing every request; until
+  an ECU has answered or announced its P2, the first request waits the
+  conservative first-contact timeout (probes such as a scan opt out)
+- keeps non-default sessions open with a suppress-positive-response tester
+  present (3E 80), sent only when the ECU's link has been idle for the
+  keep-alive interval, never in the middle of another request; the timer
+  thread starts with the first non-default session; ``defer_keep_alive``
+  lets a request scheduler hold it back while other requests are queued
+- hands messages that answer no outstanding request (periodic data, 0x6A)
+  to per-ECU listeners, and can listen for them between requests
+"""
+
+import logging
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+NEGATIVE_RESPONSE = 0x7F
+POSITIVE_RESPONSE_OFFSET = 0x40
+NRC_BUSY_REPEAT_REQUEST = 0x21
+NRC_RESPONSE_PENDING = 0x78
+
+SID_DIAGNOSTIC_SESSION_CONTROL = 0x10
+SID_ECU_RESET = 0x11
+SID_SECURITY_ACCESS = 0x27
+SID_TESTER_PRESENT = 0x3E
+SUPPRESS_POSITIVE_RESPONSE = 0x80
+
+DEFAULT_SESSION = 0x01
+TESTER_PRESENT_SUPPRESSED = bytes([SID_TESTER_PRESENT, SUPPRESS_POSITIVE_RESPONSE])
+
+# ISO 14229-2 defaults until the ECU announces its own values
+DEFAULT_P2_MS = 50
+DEFAULT_P2_STAR_MS = 5000
+
+# Response latencies kept per ECU and the percentile the timeout follows
+LATENCY_WINDOW = 32
+LATENCY_PERCENTILE = 95
+MIN_LATENCY_SAMPLES = 5
+LATENCY_HEADROOM = 1.5
+# Grace wait after a miss, as a multiple of the timeout (capped at P2*)
+LATE_RESPONSE_FACTOR = 4
+# First request to an ECU of unknown timing: adapter/bridge latency included
+FIRST_CONTACT_TIMEOUT_MS = 2000
+
+# data, tx_id, rx_id -> sent
+SendFunc = Callable[[bytes, int, int], bool]
+# tx_id, rx_id, timeout_ms -> next response from rx_id or None
+ReceiveFunc = Callable[[int, int, int], Optional[bytes]]
+# unsolicited message from an ECU
+ListenerFunc = Callable[[bytes], None]
+
+
+def is_response_to(request: bytes, response: bytes) -> bool:
+    """Positive or negative response to ``request``'s service"""
+    if not response:
+        return False
+    if response[0] == request[0] + POSITIVE_RESPONSE_OFFSET:
+        return True
+    return len(response) >= 2 and response[0] == NEGATIVE_RESPONSE and response[1] == request[0]
+
+
+def negative_response_code(request: bytes, response: bytes) -> Optional[int]:
+    if len(response) >= 3 and response[0] == NEGATIVE_RESPONSE and response[1] == request[0]:
+        return response[2]
+    return None
+
+
+@dataclass
+class EcuSession:
+    """Session state of one ECU, as seen from its responses"""
+    tx_id: int
+    rx_id: int
+    session: int = DEFAULT_SESSION
+    security_level: int = 0          # 0 = locked, else the unlocked seed level
+    p2_ms: int = DEFAULT_P2_MS
+    p2_star_ms: int = DEFAULT_P2_STAR_MS
+    last_activity: float = 0.0       # monotonic time of the last request/response
+    keep_alives: int = 0
+    # ms from request to the first response (final or 0x78), most recent last
+    latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=LATENCY_WINDOW))
+    timeouts: int = 0
+    p2_announced: bool = False       # P2/P2* taken from a 0x10 response
+
+    @property
+    def needs_keep_alive(self) -> bool:
+        return self.session != DEFAULT_SESSION
+
+    @property
+    def contacted(self) -> bool:
+        """The ECU's timing is known: it has answered or announced P2"""
+        return self.p2_announced or bool(self.latencies)
+
+    def latency_percentile(self, percentile: float = LATENCY_PERCENTILE) -> Optional[float]:
+        """Nearest-rank percentile of the recent latencies, None until enough samples"""
+        if len(self.latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[max(0, math.ceil(percentile / 100 * len(ordered)) - 1)]
+
+    def response_timeout_ms(self, margin_ms: int = 0, probe: bool = False) -> int:
+        """
+        P2, raised to the observed latency percentile with headroom, at most
+        P2*. Before first contact the first-contact timeout (at most P2*),
+        unless ``probe`` asks for the bare P2 (e.g. a scan of absent IDs).
+        """
+        if not self.contacted and not probe:
+            return min(FIRST_CONTACT_TIMEOUT_MS, self.p2_star_ms) + margin_ms
+        timeout = self.p2_ms + margin_ms
+        observed = self.latency_percentile()
+        if observed is not None:
+            timeout = max(timeout, math.ceil(observed * LATENCY_HEADROOM) + margin_ms)
+        return min(timeout, self.p2_star_ms + margin_ms)
+
+
+class UdsSessionManager:
+    """Request/response with 0x78 handling, session tracking and keep-alive"""
+
+    def __init__(self, send: SendFunc, receive: ReceiveFunc, keep_alive_interval: float = 2.0,
+                 response_margin_ms: int = 50, max_pending: int = 100, auto_keep_alive: bool = True):
+        self.send = send
+        self.receive = receive
+        self.keep_alive_interval = keep_alive_interval
+        self.response_margin_ms = response_margin_ms
+        self.max_pending = max_pending
+        self.auto_keep_alive = auto_keep_alive
+        self.sessions: Dict[int, EcuSession] = {}
+        self._bus_lock = threading.RLock()
+        self._requests_in_flight = 0
+        # True while requests wait for the bus elsewhere (keep-alive yields to them)
+        self.defer_keep_alive: Optional[Callable[[], bool]] = None
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+        self._listeners: Dict[int, List[ListenerFunc]] = {}
+        self._listen_threads: Dict[int, Tuple[threading.Thread, threading.Event]] = {}
+
+    def get_session(self, tx_id: int, rx_id: Optional[int] = None) -> EcuSession:
+        session = self.sessions.get(tx_id)
+        if session is None:
+            session = EcuSession(tx_id=tx_id, rx_id=rx_id if rx_id is not None else tx_id + 8)
+            self.sessions[tx_id] = session
+        elif rx_id is not None:
+            session.rx_id = rx_id
+        return session
+
+    def reset(self):
+        """Forget all ECU state (e.g. after disconnect)"""
+        self.sessions.clear()
+
+    # -- requests ------------------------------------------------------------
+
+    def request(self, data: bytes, tx_id: int = 0x7E0, rx_id: int = 0x7E8,
+                timeout_ms: Optional[int] = None) -> Optional[bytes]:
+        """
+        Send ``data`` and return the final response, waiting through any
+        number of 0x78 replies (each restarts the P2* timer).
+        ``timeout_ms`` overrides the ECU's adaptive wait for the first response.
+        """
+        ecu = self.get_session(tx_id, rx_id)
+        with self._bus_lock:
+            self._requests_in_flight += 1
+            try:
+                response = self._request(ecu, data, tx_id, rx_id, timeout_ms)
+            finally:
+                self._requests_in_flight -= 1
+        if response is not None:
+            self._observe(ecu, data, response)
+        return response
+
+    @contextmanager
+    def exclusive(self):
+        """Hold the bus for a multi-request operation (flash download, upload)"""
+        with self._bus_lock:
+            self._requests_in_flight += 1
+            try:
+                yield
+            finally:
+                self._requests_in_flight -= 1
+
+    def response_timeout_ms(self, tx_id: int, rx_id: Optional[int] = None, probe: bool = False) -> int:
+        """Wait for the first response from this ECU (``probe``: no first-contact allowance)"""
+        return self.get_session(tx_id, rx_id).response_timeout_ms(self.response_margin_ms, probe)
+
+    def record_latency(self, tx_id: int, latency_ms: float, rx_id: Optional[int] = None):
+        """Latency observed outside ``request`` (e.g. by a parallel scan)"""
+        self.get_session(tx_id, rx_id).latencies.append(latency_ms)
+
+    def _request(self, ecu: EcuSession, data: bytes, tx_id: int, rx_id: int,
+                 timeout_ms: Optional[int]) -> Optional[bytes]:
+        ecu.last_activity = time.monotonic()
+        if not self.send(data, tx_id, rx_id):
+            logger.error("Failed to send UDS request")
+            return None
+
+        sent = ecu.last_activity
+        adaptive = timeout_ms is None
+        timeout = ecu.response_timeout_ms(self.response_margin_ms) if adaptive else timeout_ms
+        # An ECU that has answered before may just be slower than observed so far
+        grace = adaptive and bool(ecu.latencies)
+        pending = 0
+        while True:
+            response = self.receive(tx_id, rx_id, timeout)
+            ecu.last_activity = time.monotonic()
+            if response is None:
+                if grace and not pending:
+                    grace = False
+                    extra = min(timeout * (LATE_RESPONSE_FACTOR - 1), ecu.p2_star_ms)
+                    logger.debug(f"No response from 0x{tx_id:X} within {timeout} ms; waiting {extra} ms more")
+                    timeout = extra
+                    continue
+                ecu.timeouts += 1
+                logger.warning(f"No response from 0x{tx_id:X} to {data[:3].hex()} within {timeout} ms")
+                return None
+            if not is_response_to(data, response):
+                if not self._dispatch(rx_id, response):
+                    logger.debug(f"Ignoring unrelated response from 0x{rx_id:X}: {response.hex()}")
+                continue
+            if not pending:
+                ecu.latencies.append((ecu.last_activity - sent) * 1000)
+            if negative_response_code(data, response) != NRC_RESPONSE_PENDING:
+                return response
+            pending += 1
+            if pending > self.max_pending:
+                logger.error(f"0x{tx_id:X} kept answering 'response pending'; giving up")
+                return None
+            timeout = ecu.p2_star_ms + self.response_margin_ms
+            logger.debug(f"0x{tx_id:X} response pending ({pending}); waiting {timeout} ms")
+
+    def _observe(self, ecu: EcuSession, request: bytes, response: bytes):
+        """Update the ECU's session state from a positive response"""
+        if response[0] != request[0] + POSITIVE_RESPONSE_OFFSET or len(response) < 2:
+            return
+        service = request[0]
+        if service == SID_DIAGNOSTIC_SESSION_CONTROL:
+            ecu.session = response[1] & 0x7F
+            ecu.security_level = 0  # a session change always re-locks
+            if len(response) >= 6:
+                ecu.p2_ms = int.from_bytes(response[2:4], 'big')
+                ecu.p2_star_ms = int.from_bytes(response[4:6], 'big') * 10
+                ecu.p2_announced = True
+            logger.info(f"0x{ecu.tx_id:X} in session 0x{ecu.session:02X} "
+                        f"(P2 {ecu.p2_ms} ms, P2* {ecu.p2_star_ms} ms)")
+            if ecu.needs_keep_alive and self.auto_keep_alive:
+                self.start_keep_alive()
+        elif service == SID_ECU_RESET:
+            ecu.session = DEFAULT_SESSION
+            ecu.security_level = 0
+            ecu.p2_ms, ecu.p2_star_ms = DEFAULT_P2_MS, DEFAULT_P2_STAR_MS
+            ecu.p2_announced = False
+        elif service == SID_SECURITY_ACCESS and response[1] % 2 == 0:
+            # Positive sendKey response: level = sendKey sub-function - 1
+            ecu.security_level = response[1] - 1
+            logger.info(f"0x{ecu.tx_id:X} security level 0x{ecu.security_level:02X} unlocked")
+
+    # -- keep-alive ----------------------------------------------------------
+
+    def send_keep_alive(self, ecu: EcuSession) -> bool:
+        """Tester present with suppressed positive response (no reply awaited)"""
+        with self._bus_lock:
+            ecu.last_activity = time.monotonic()
+            ecu.keep_alives += 1
+            return self.send(TESTER_PRESENT_SUPPRESSED, ecu.tx_id, ecu.rx_id)
+
+    def keep_alive_due(self, now: Optional[float] = None):
+        """Send tester present to every non-default-session ECU idle for an interval"""
+        now = time.monotonic() if now is None else now
+        for ecu in list(self.sessions.values()):
+            if not ecu.needs_keep_alive or now - ecu.last_activity < self.keep_alive_interval:
+                continue
+            # Another request in progress keeps the session alive by itself
+            if self._requests_in_flight or (self.defer_keep_alive and self.defer_keep_alive()):
+                return
+            seen = ecu.last_activity
+            with self._bus_lock:
+                if self._requests_in_flight or ecu.last_activity != seen:
+                    continue
+                self.send_keep_alive(ecu)
+
+    def start_keep_alive(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True, name="UdsKeepAlive")
+        self._thread.start()
+
+    def stop_keep_alive(self, timeout: float = 2.0):
+        self._running = False
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while self._running:
+            try:
+                self.keep_alive_due()
+            except Exception as e:
+                logger.debug(f"Keep-alive error: {e}")
+            time.sleep(self.keep_alive_interval / 4)
+
+    # -- unsolicited messages ------------------------------------------------
+
+    def add_listener(self, rx_id: int, callback: ListenerFunc):
+        callbacks = self._listeners.setdefault(rx_id, [])
+        if callback not in callbacks:
+            callbacks.append(callback)
+
+    def remove_listener(self, rx_id: int, callback: ListenerFunc):
+        callbacks = self._listeners.get(rx_id, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+    def _dispatch(self, rx_id: int, message: bytes) -> bool:
+        callbacks = self._listeners.get(rx_id)
+        if not callbacks:
+            return False
+        for callback in list(callbacks):
+            try:
+                callback(message)
+            except Exception as e:
+                logger.debug(f"Listener error for 0x{rx_id:X}: {e}")
+        return True
+
+    def poll_unsolicited(self, tx_id: int, rx_id: int, timeout_ms: int) -> bool:
+        """Receive one message outside any request and hand it to the listeners"""
+        with self._bus_lock:
+            message = self.receive(tx_id, rx_id, timeout_ms)
+        return message is not None and self._dispatch(rx_id, message)
+
+    def start_listening(self, tx_id: int, rx_id: int, poll_ms: int = 20):
+        """Poll for unsolicited messages from ``rx_id`` whenever no request is running"""
+        if rx_id in self._listen_threads:
+            return
+        stop = threading.Event()
+        thread = threading.Thread(target=self._listen, args=(tx_id, rx_id, poll_ms, stop),
+                                  daemon=True, name=f"UdsListener-{rx_id:X}")
+        self._listen_threads[rx_id] = (thread, stop)
+        thread.start()
+
+    def stop_listening(self, rx_id: Optional[int] = None, timeout: float = 2.0):
+        for key in [rx_id] if rx_id is not None else list(self._listen_threads):
+            entry = self._listen_threads.pop(key, None)
+            if entry is None:
+                continue
+            thread, stop = entry
+            stop.set()
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+
+    def _listen(self, tx_id: int, rx_id: int, poll_ms: int, stop: threading.Event):
+        while not stop.is_set():
+            try:
+                self.poll_unsolicited(tx_id, rx_id, poll_ms)
+            except Exception as e:
+                logger.debug(f"Listener poll error: {e}")
+            # Let a waiting request take the bus between polls
+            time.sleep(0.001)
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+UDS Download Engine (0x34 / 0x36 / 0x37)
+Flashes a memory area with RequestDownload, TransferData and
+RequestTransferExit:
+
+- blocks are sized from the ``maxNumberOfBlockLength`` the ECU returns in
+  its 0x34 response, not from a fixed chunk size
+- the next TransferData message is built (sliced, run through the
+  optional ``encode_block`` hook) while the ECU is still processing the
+  current one, so host work overlaps ECU write time
+- NRC 0x78 (response pending) is waited out with P2* during erase and
+  transfer
+- a block that is not answered (or answered "busy") is repeated with the
+  same block sequence counter; ECUs acknowledge a repeated counter without
+  writing twice
+- ``TransferReport`` gives effective KB/s against the link's theoretical
+  ISO-TP payload rate
+
+Works over the session layer's transport (``SendFunc``/``ReceiveFunc``);
+hold ``UdsSessionManager.exclusive()`` around a transfer.
+"""
+
+import logging
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from shared.uds_session import (
+    NRC_BUSY_REPEAT_REQUEST, NRC_RESPONSE_PENDING, POSITIVE_RESPONSE_OFFSET, ReceiveFunc, SendFunc,
+    is_response_to, negative_response_code
+)
+
+logger = logging.getLogger(__name__)
+
+SID_ROUTINE_CONTROL = 0x31
+START_ROUTINE = 0x01
+ROUTINE_ERASE_MEMORY = 0xFF00
+SID_REQUEST_DOWNLOAD = 0x34
+SID_REQUEST_UPLOAD = 0x35
+SID_TRANSFER_DATA = 0x36
+SID_REQUEST_TRANSFER_EXIT = 0x37
+# No answer at all (None) is retried as well
+RETRY_NRCS = (None, NRC_BUSY_REPEAT_REQUEST)
+
+DEFAULT_ADDRESS_BYTES = 4
+DEFAULT_SIZE_BYTES = 4
+
+# Classic CAN frame bits without data and stuff bits (SOF ... IFS)
+CAN_FRAME_OVERHEAD_BITS = 47
+CAN_FRAME_OVERHEAD_BITS_29BIT = 67
+
+
+def encode_address_and_length(address: int, size: int, address_bytes: int = DEFAULT_ADDRESS_BYTES,
+                              size_bytes: int = DEFAULT_SIZE_BYTES) -> bytes:
+    """addressAndLengthFormatIdentifier + memoryAddress + memorySize"""
+    return (bytes([(size_bytes << 4) | address_bytes])
+            + address.to_bytes(address_bytes, 'big') + size.to_bytes(size_bytes, 'big'))
+
+
+def parse_max_block_length(response: bytes) -> Optional[int]:
+    """``maxNumberOfBlockLength`` from a 0x74/0x75 response"""
+    if len(response) < 2:
+        return None
+    length = response[1] >> 4
+    if length == 0 or len(response) < 2 + length:
+        return None
+    return int.from_bytes(response[2:2 + length], 'big')
+
+
+def isotp_payload_rate(bitrate: int, frame_size: int = 8, extended_id: bool = False) -> float:
+    """Upper bound of ISO-TP payload bytes/s on classic CAN (CFs only, no STmin)"""
+    overhead = CAN_FRAME_OVERHEAD_BITS_29BIT if extended_id else CAN_FRAME_OVERHEAD_BITS
+    frames_per_second = bitrate / (overhead + 8 * frame_size)
+    return frames_per_second * (frame_size - 1)
+
+
+@dataclass
+class TransferReport:
+    """Outcome and throughput of one transfer"""
+    success: bool
+    bytes: int = 0
+    blocks: int = 0
+    retries: int = 0
+    pending: int = 0
+    block_size: int = 0
+    seconds: float = 0.0
+    theoretical_bps: float = 0.0
+    error: str = ""
+
+    @property
+    def kbps(self) -> float:
+        return self.bytes / self.seconds / 1024 if self.seconds > 0 else 0.0
+
+    @property
+    def efficiency(self) -> float:
+        """Effective rate as a fraction of the link's theoretical rate"""
+        if not self.theoretical_bps or self.seconds <= 0:
+            return 0.0
+        return self.bytes / self.seconds / self.theoretical_bps
+
+
+class UdsTransferEngine:
+    """Erase and download for one ECU over a send/receive transport"""
+
+    def __init__(self, send: SendFunc, receive: ReceiveFunc, tx_id: int = 0x7E0, rx_id: int = 0x7E8,
+                 p2_ms: int = 150, p2_star_ms: int = 5000, max_retries: int = 3,
+                 max_pending: int = 200, bitrate: int = 500000, frame_size: int = 8):
+        self.send = send
+        self.receive = receive
+        self.tx_id = tx_id
+        self.rx_id = rx_id
+        self.p2_ms = p2_ms
+        self.p2_star_ms = p2_star_ms
+        self.max_retries = max_retries
+        self.max_pending = max_pending
+        self.theoretical_bps = isotp_payload_rate(bitrate, frame_size, extended_id=tx_id > 0x7FF)
+        self.pending = 0
+
+    # -- request/response ----------------------------------------------------
+
+    def _send(self, data: bytes) -> bool:
+        try:
+            return self.send(data, self.tx_id, self.rx_id)
+        except Exception as e:
+            logger.debug(f"Send failed: {e}")
+            return False
+
+    def _await(self, request: bytes) -> Optional[bytes]:
+        """Final response to ``request`` (already sent), through any 0x78"""
+        timeout = self.p2_ms
+        pending = 0
+        while True:
+            response = self.receive(self.tx_id, self.rx_id, timeout)
+            if response is None:
+                return None
+            if not is_response_to(request, response):
+                continue
+            if negative_response_code(request, response) != NRC_RESPONSE_PENDING:
+                return response
+            pending += 1
+            self.pending += 1
+            if pending > self.max_pending:
+                logger.error(f"0x{self.tx_id:X} stayed 'response pending' on {request[:2].hex()}")
+                return None
+            timeout = self.p2_star_ms
+
+    def _await_block(self, message: bytes) -> Optional[bytes]:
+        """Answer to a TransferData block, skipping late answers to earlier blocks"""
+        while True:
+            response = self._await(message)
+            if (response and response[0] == SID_TRANSFER_DATA + POSITIVE_RESPONSE_OFFSET
+                    and response[1:2] != message[1:2]):
+                continue
+            return response
+
+    def _request(self, request: bytes) -> Optional[bytes]:
+        return self._await(request) if self._send(request) else None
+
+    @staticmethod
+    def _positive(request: bytes, response: Optional[bytes]) -> bool:
+        return bool(response) and response[0] == request[0] + POSITIVE_RESPONSE_OFFSET
+
+    # -- operations ----------------------------------------------------------
+
+    def erase(self, address: int, size: int, routine_id: int = ROUTINE_ERASE_MEMORY) -> bool:
+        """RoutineControl erase (31 01 FF00 ...); erasing usually answers 0x78 for a while"""
+        request = (bytes([SID_ROUTINE_CONTROL, START_ROUTINE]) + routine_id.to_bytes(2, 'big')
+                   + encode_address_and_length(address, size))
+        response = self._request(request)
+        if not self._positive(request, response):
+            logger.error(f"Erase of 0x{address:X}+{size} failed: {response.hex() if response else 'no response'}")
+            return False
+        # Optional routine status record: 0 = correct result
+        return len(response) < 5 or response[4] == 0x00
+
+    def request_download(self, address: int, size: int, data_format: int = 0x00) -> Optional[int]:
+        """0x34; returns the TransferData payload size the ECU accepts"""
+        request = bytes([SID_REQUEST_DOWNLOAD, data_format]) + encode_address_and_length(address, size)
+        response = self._request(request)
+        if not self._positive(request, response):
+            logger.error(f"RequestDownload refused: {response.hex() if response else 'no response'}")
+            return None
+        max_length = parse_max_block_length(response)
+        if not max_length or max_length < 3:
+            logger.error(f"Invalid maxNumberOfBlockLength in {response.hex()}")
+            return None
+        # maxNumberOfBlockLength counts the SID and the block sequence counter
+        return max_length - 2
+
+    def download(self, address: int, data: bytes, data_format: int = 0x00,
+                 encode_block: Optional[Callable[[bytes], bytes]] = None,
+                 should_abort: Optional[Callable[[], bool]] = None,
+                 max_block_size: Optional[int] = None,
+                 progress: Optional[Callable[[int, int], None]] = None) -> TransferReport:
+        """RequestDownload, all TransferData blocks, RequestTransferExit"""
+        start = time.perf_counter()
+        self.pending = 0
+        report = TransferReport(success=False, theoretical_bps=self.theoretical_bps)
+
+        block_size = self.request_download(address, len(data), data_format)
+        if block_size is None:
+            report.error = "RequestDownload refused"
+            return report
+        if max_block_size:
+            block_size = min(block_size, max_block_size)
+        report.block_size = block_size
+        logger.info(f"Downloading {len(data)} bytes to 0x{address:X} in {block_size}-byte blocks")
+
+        view = memoryview(data)
+        offsets = range(0, len(data), block_size)
+
+        def build(index: int) -> Optional[bytearray]:
+            if index >= len(offsets):
+                return None
+            chunk = bytes(view[offsets[index]:offsets[index] + block_size])
+            if encode_block:
+                chunk = encode_block(chunk)
+            message = bytearray(2 + len(chunk))
+            message[0] = SID_TRANSFER_DATA
+            message[1] = (index + 1) & 0xFF
+            message[2:] = chunk
+            return message
+
+        current = build(0)
+        index = 0
+        while current is not None:
+            if should_abort and should_abort():
+                report.error = "Aborted"
+                break
+            upcoming = None
+            prepared = False
+            attempts = 0
+            while True:
+                sent = self._send(current)
+                if sent and not prepared:
+                    # Prepare the next block while the ECU writes this one
+                    upcoming = build(index + 1)
+                    prepared = True
+                response = self._await_block(current) if sent else None
+                if self._positive(current, response):
+                    break
+                nrc = negative_response_code(current, response) if response else None
+                attempts += 1
+                if attempts > self.max_retries or nrc not in RETRY_NRCS:
+                    report.error = (f"Block {index + 1} failed: "
+                                    f"{response.hex() if response else 'no response'}")
+                    break
+                report.retries += 1
+                logger.warning(f"Repeating block {index + 1} (counter 0x{current[1]:02X}), attempt {attempts}")
+            if report.error:
+                break
+            report.blocks += 1
+            report.bytes += min(block_size, len(data) - offsets[index])
+            if progress:
+                progress(report.bytes, len(data))
+            index += 1
+            current = upcoming if prepared else build(index)
+
+        if not report.error:
+            request = bytes([SID_REQUEST_TRANSFER_EXIT])
+            response = self._request(request)
+            if self._positive(request, response):
+                report.success = True
+            else:
+                report.error = f"RequestTransferExit failed: {response.hex() if response else 'no response'}"
+
+        report.pending = self.pending
+        report.seconds = time.perf_counter() - start
+        if report.success:
+            logger.info(f"Downloaded {report.bytes} bytes in {report.seconds:.2f}s: {report.kbps:.1f} KB/s "
+                        f"({report.efficiency:.0%} of {report.theoretical_bps / 1024:.1f} KB/s link limit)")
+        else:
+            logger.error(f"Download to 0x{address:X} failed: {report.error}")
+        return report
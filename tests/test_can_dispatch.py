@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+tests/test_can_dispatch.py – Bounded CAN callback dispatch.
+
+Verifies that slow subscribers never stall the publisher and that each
+overflow policy accounts for what it discards.  All tests are marked ``unit``.
+"""
+
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+
+def _msg(arb_id, data):
+    from shared.obdlink_mxplus import CANMessage
+    return CANMessage(timestamp=time.time(), arbitration_id=arb_id, data=data, raw_message=f"{arb_id} {data}")
+
+
+def _wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.005)
+    return False
+
+
+@pytest.mark.unit
+def test_drop_oldest_does_not_stall_publisher():
+    """A blocked consumer costs the publisher nothing; overflow is counted."""
+    from shared.can_dispatch import CANMessageDispatcher, DispatchPolicy
+
+    gate = threading.Event()
+    received = []
+
+    def slow(msg):
+        gate.wait()
+        received.append(msg.data)
+
+    dispatcher = CANMessageDispatcher()
+    dispatcher.subscribe(slow, policy=DispatchPolicy.DROP_OLDEST, max_queue=4, name="slow")
+
+    start = time.monotonic()
+    for i in range(100):
+        dispatcher.publish(_msg("7E8", f"{i:02X}"))
+    assert time.monotonic() - start < 0.5
+
+    stats = dispatcher.get_metrics()["slow"]
+    assert stats["published"] == 100
+    assert stats["high_water_mark"] == 4
+    assert stats["dropped"] >= 95
+
+    gate.set()
+    assert _wait_for(lambda: dispatcher.get_metrics()["slow"]["queue_depth"] == 0)
+    assert received[-1] == "63"  # newest message survives
+    dispatcher.stop()
+
+
+@pytest.mark.unit
+def test_coalesce_latest_keeps_newest_per_id():
+    """COALESCE_LATEST keeps only the latest frame for each arbitration ID."""
+    from shared.can_dispatch import CANMessageDispatcher, DispatchPolicy
+
+    gate = threading.Event()
+    received = []
+
+    def consumer(msg):
+        gate.wait()
+        received.append((msg.arbitration_id, msg.data))
+
+    dispatcher = CANMessageDispatcher()
+    dispatcher.subscribe(consumer, policy=DispatchPolicy.COALESCE_LATEST, max_queue=8, name="ui")
+    # The first frame is taken by the delivery thread and parked on the gate
+    dispatcher.publish(_msg("100", "00"))
+    assert _wait_for(lambda: dispatcher.get_metrics()["ui"]["queue_depth"] == 0)
+    for i in range(1, 10):
+        dispatcher.publish(_msg("7E8", f"{i:02X}"))
+        dispatcher.publish(_msg("7E9", f"{i:02X}"))
+
+    gate.set()
+    assert _wait_for(lambda: len(received) == 3)
+    assert received[1:] == [("7E8", "09"), ("7E9", "09")]
+    assert dispatcher.get_metrics()["ui"]["coalesced"] == 16
+    dispatcher.stop()
+
+
+@pytest.mark.unit
+def test_block_policy_is_lossless():
+    """BLOCK applies backpressure instead of dropping while space frees in time."""
+    from shared.can_dispatch import CANMessageDispatcher, DispatchPolicy
+
+    received = []
+
+    def logger_cb(msg):
+        time.sleep(0.001)
+        received.append(msg.data)
+
+    dispatcher = CANMessageDispatcher()
+    dispatcher.subscribe(logger_cb, policy=DispatchPolicy.BLOCK, max_queue=2, name="disk", block_timeout=2.0)
+    for i in range(20):
+        dispatcher.publish(_msg("7E8", str(i)))
+
+    assert _wait_for(lambda: len(received) == 20)
+    assert received == [str(i) for i in range(20)]
+    assert dispatcher.get_metrics()["disk"]["dropped"] == 0
+    dispatcher.stop()
+
+
+@pytest.mark.unit
+def test_block_policy_never_waits_on_an_event_loop():
+    """Publishing from a loop thread drops at once rather than stalling the loop."""
+    import asyncio
+    from shared.can_dispatch import CANMessageDispatcher, DispatchPolicy
+
+    release = threading.Event()
+    dispatcher = CANMessageDispatcher()
+    dispatcher.subscribe(lambda msg: release.wait(2), policy=DispatchPolicy.BLOCK,
+                         max_queue=1, name="stuck", block_timeout=2.0)
+
+    async def publish_burst():
+        start = time.monotonic()
+        for i in range(5):
+            dispatcher.publish(_msg("7E8", str(i)))
+        return time.monotonic() - start
+
+    assert asyncio.run(publish_burst()) < 0.5
+    assert dispatcher.get_metrics()["stuck"]["dropped"] >= 3
+    release.set()
+    dispatcher.stop()
+
+
+@pytest.mark.unit
+def test_pass_filter_planning_covers_wanted_ids():
+    """Merged STN pass filters admit every wanted ID and stay within the limit."""
+    from shared.can_filters import covering_filter, elm_filter_commands, plan_pass_filters, stn_filter_commands
+
+    wanted = {0x7E0, 0x7E8, 0x7E1, 0x7E9, 0x730, 0x735, 0x720, 0x725, 0x740, 0x745}
+    filters = plan_pass_filters(wanted, max_filters=4)
+    assert len(filters) <= 4
+    for arb_id in wanted:
+        assert any(arb_id & mask == pattern for pattern, mask in filters)
+
+    assert covering_filter([0x7E8]) == (0x7E8, 0x7FF)
+    assert stn_filter_commands([0x7E8]) == ["STFCP", "STFAP 7E8,7FF"]
+    assert stn_filter_commands(None) == ["STFCP"]
+    # An empty set means no restriction on both chips, like None
+    assert stn_filter_commands(set()) == ["STFCP"]
+    assert elm_filter_commands(set()) == elm_filter_commands(None) == ["ATCF 000", "ATCM 000"]
+
+
+@pytest.mark.unit
+def test_obdlink_filters_follow_subscriptions():
+    """Subscribing by profile category narrows filters; a catch-all clears them."""
+    from shared.obdlink_mxplus import OBDLinkMXPlus
+
+    obd = OBDLinkMXPlus(mock_mode=True)
+    obd.set_vehicle_profile("generic_ford")
+
+    def engine_cb(msg):
+        pass
+
+    def everything_cb(msg):
+        pass
+
+    obd.add_message_callback(engine_cb, categories=["engine"])
+    assert obd.active_filter_ids == {0x7E8, 0x7E0}
+
+    obd.add_message_callback(everything_cb)
+    assert obd.active_filter_ids is None
+
+    obd.remove_message_callback(everything_cb)
+    assert obd.active_filter_ids == {0x7E8, 0x7E0}
+    obd.dispatcher.stop()
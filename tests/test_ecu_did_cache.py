@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+tests/test_ecu_did_cache.py – persistent per-VIN ECU identification cache.
+
+A fake ECU answers batched 0x22 requests; the cache lives in a temporary
+JSON file.  All tests are marked ``unit``.
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+VIN = b'WVWZZZ1KZAW000001'
+
+
+class FakeEcu:
+    def __init__(self):
+        self.data = {
+            0xF187: b'8V0907115B',
+            0xF189: b'0042',
+            0xF18C: b'SN123456789',
+            0xF190: VIN,
+            0xF191: b'HW07',
+            0x1000: b'\x1F\x40',     # volatile
+        }
+        self.requests = []
+
+    def __call__(self, request):
+        self.requests.append(request)
+        dids = [int.from_bytes(request[i:i + 2], 'big') for i in range(1, len(request), 2)]
+        response = bytearray([0x62])
+        for did in dids:
+            if did in self.data:
+                response += did.to_bytes(2, 'big') + self.data[did]
+        return bytes(response) if len(response) > 1 else b'\x7F\x22\x31'
+
+
+def _requested(requests):
+    return sorted({int.from_bytes(r[i:i + 2], 'big') for r in requests for i in range(1, len(r), 2)})
+
+
+IDENTIFICATION = [0xF190, 0xF187, 0xF189, 0xF191, 0xF18C, 0xF195]
+
+
+@pytest.mark.unit
+def test_repeat_visit_is_one_validation_read(tmp_path):
+    from shared.ecu_did_cache import EcuDidCache
+    from shared.json_cache import JsonCache
+    from shared.uds_did import DidReader
+
+    store = JsonCache("ids.json", path=tmp_path / "ids.json")
+    ecu = FakeEcu()
+    first = EcuDidCache(store).read(DidReader(ecu), "7E0", IDENTIFICATION + [0x1000])
+    assert first[0xF187] == b'8V0907115B' and first[0x1000] == b'\x1F\x40'
+    assert 0xF195 not in first
+
+    # New session: new reader, cache reloaded from disk
+    ecu.requests.clear()
+    cache = EcuDidCache(JsonCache("ids.json", path=tmp_path / "ids.json"))
+    reader = DidReader(ecu)
+    second = cache.read(reader, "7E0", IDENTIFICATION)
+    assert second == {did: data for did, data in first.items() if did != 0x1000}
+    # Only the validation DID and the VIN (cache key) are on the bus
+    assert len(ecu.requests) == 1
+    assert _requested(ecu.requests) == [0xF189, 0xF190]
+
+    # Volatile DIDs ride along in the validation read and are never cached
+    ecu.requests.clear()
+    ecu.data[0x1000] = b'\x20\x00'
+    third = cache.read(reader, "7E0", IDENTIFICATION + [0x1000])
+    assert third == {**second, 0x1000: b'\x20\x00'}
+    assert len(ecu.requests) == 1
+    assert cache.peek(VIN.decode(), "7E0")[0xF18C] == b'SN123456789'
+
+
+@pytest.mark.unit
+def test_software_change_and_flash_invalidate(tmp_path):
+    from shared.ecu_did_cache import EcuDidCache
+    from shared.json_cache import JsonCache
+    from shared.uds_did import DidReader
+
+    cache = EcuDidCache(JsonCache("ids.json", path=tmp_path / "ids.json"))
+    ecu = FakeEcu()
+    cache.read(DidReader(ecu), "7E0", IDENTIFICATION, vin=VIN.decode())
+
+    # Reflashed elsewhere: new software version and part number
+    ecu.data.update({0xF189: b'0043', 0xF187: b'8V0907115C'})
+    ecu.requests.clear()
+    values = cache.read(DidReader(ecu), "7E0", IDENTIFICATION, vin=VIN.decode())
+    assert values[0xF187] == b'8V0907115C'
+    assert 0xF187 in _requested(ecu.requests)
+    assert cache.peek(VIN.decode(), "7E0")[0xF189] == b'0043'
+
+    cache.invalidate(VIN.decode())
+    assert cache.peek(VIN.decode(), "7E0") == {}
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+tests/test_ecu_scan.py – functional discovery and parallel multi-ECU scan.
+
+A simulated CAN bus answers requests from several ECUs after per-ECU
+delays, with real ISO-TP framing (multi-frame answers wait for the
+tester's flow control).  All tests are marked ``unit``.
+"""
+
+import heapq
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+
+class SimulatedEcu:
+    """UDS server answering after ``delay`` seconds"""
+
+    def __init__(self, tx_id, delay, answers, functional=True, pending=None):
+        self.tx_id = tx_id
+        self.rx_id = tx_id + 8
+        self.delay = delay
+        self.answers = answers          # request -> response
+        self.functional = functional    # answers functional 0x19 requests
+        self.pending = pending or {}    # request -> extra seconds after NRC 0x78
+        self.requests = []
+
+    def handle(self, request, functional):
+        """[(delay, response), ...] for one request"""
+        self.requests.append((request, functional))
+        if request == b'\x3E\x00':
+            return [(self.delay, b'\x7E\x00')]
+        if functional and not self.functional and request[0] == 0x19:
+            return []
+        response = self.answers.get(request, bytes([0x7F, request[0], 0x31]))
+        if request in self.pending:
+            return [(self.delay, bytes([0x7F, request[0], 0x78])),
+                    (self.delay + self.pending[request], response)]
+        return [(self.delay, response)]
+
+
+class SimulatedCanBus:
+    """Raw CAN transport in front of several simulated ECUs"""
+
+    def __init__(self, ecus):
+        self.ecus = {ecu.tx_id: ecu for ecu in ecus}
+        self.events = []
+        self.waiting_fc = {}
+        self.sequence = 0
+
+    def _schedule(self, at, can_id, payload):
+        self.sequence += 1
+        heapq.heappush(self.events, (at, self.sequence, can_id, payload))
+
+    def _respond(self, ecu, at, response):
+        if len(response) <= 7:
+            self._schedule(at, ecu.rx_id, bytes([len(response)]) + response)
+            return
+        self._schedule(at, ecu.rx_id, bytes([0x10 | (len(response) >> 8), len(response) & 0xFF]) + response[:6])
+        cfs = [bytes([0x20 | ((i + 1) & 0x0F)]) + response[offset:offset + 7]
+               for i, offset in enumerate(range(6, len(response), 7))]
+        self.waiting_fc[ecu.tx_id] = cfs
+
+    def send_to_channel(self, msg):
+        can_id = int.from_bytes(msg.data[:4], 'big')
+        payload = bytes(msg.data[4:])
+        now = time.monotonic()
+        if payload[0] >> 4 == 3:
+            for cf in self.waiting_fc.pop(can_id, []):
+                self._schedule(now + 0.0005, can_id + 8, cf)
+            return True
+        request = payload[1:1 + (payload[0] & 0x0F)]
+        targets = self.ecus.values() if can_id == 0x7DF else [self.ecus[can_id]] if can_id in self.ecus else []
+        for ecu in targets:
+            for delay, response in ecu.handle(request, can_id == 0x7DF):
+                # Framed when due (can_id None), so CFs follow their own FF
+                self._schedule(now + delay, None, (ecu, response))
+        return True
+
+    def read_message(self, timeout_ms=1000):
+        from shared.j2534_passthru import J2534Message, J2534Protocol
+
+        deadline = time.monotonic() + timeout_ms / 1000.0
+        while True:
+            now = time.monotonic()
+            if self.events and self.events[0][0] <= now:
+                _, _, can_id, payload = heapq.heappop(self.events)
+                if can_id is None:
+                    ecu, response = payload
+                    self._respond(ecu, now, response)
+                    continue
+                return J2534Message(J2534Protocol.ISO15765, data=can_id.to_bytes(4, 'big') + payload)
+            wake = min(deadline, self.events[0][0]) if self.events else deadline
+            if wake <= now:
+                return None
+            time.sleep(wake - now)
+
+
+VIN = b'WVWZZZ1JZXW000001'
+
+
+def _vehicle():
+    from shared.ecu_scan import READ_DTCS, READ_VIN
+
+    return [
+        SimulatedEcu(0x7E0, 0.020, {READ_VIN: b'\x62\xF1\x90' + VIN,
+                                    READ_DTCS: b'\x59\x02\xFF\x01\x30\x00\x2F\x04\x20\x00\x08'}),
+        SimulatedEcu(0x7E1, 0.040, {READ_DTCS: b'\x59\x02\xFF'}),
+        SimulatedEcu(0x7E2, 0.060, {READ_DTCS: b'\x59\x02\xFF\xC1\x23\x00\x09'}, functional=False),
+        SimulatedEcu(0x7E3, 0.030, {READ_DTCS: b'\x59\x02\xFF'}, pending={READ_DTCS: 0.150}),
+    ]
+
+
+@pytest.mark.unit
+def test_scan_finds_all_ecus_in_parallel():
+    from shared.ecu_scan import READ_DTCS, READ_VIN, ParallelEcuScanner
+
+    ecus = _vehicle()
+    bus = SimulatedCanBus(ecus)
+    start = time.monotonic()
+    results = ParallelEcuScanner(bus).scan()
+    elapsed = time.monotonic() - start
+
+    assert sorted(results) == [0x7E8, 0x7E9, 0x7EA, 0x7EB]
+    assert results[0x7E8].positive(READ_VIN) == b'\x62\xF1\x90' + VIN
+    assert results[0x7E8].positive(READ_DTCS)[3:] == b'\x01\x30\x00\x2F\x04\x20\x00\x08'
+    assert results[0x7E9].positive(READ_VIN) is None              # NRC 0x31
+    assert results[0x7E9].responses[READ_VIN] == b'\x7F\x22\x31'
+    assert results[0x7EB].positive(READ_DTCS) == b'\x59\x02\xFF'  # after NRC 0x78
+
+    # Only the ECU ignoring functional 0x19 needed a physical request
+    assert results[0x7EA].physical == [READ_DTCS]
+    assert results[0x7EA].positive(READ_DTCS) == b'\x59\x02\xFF\xC1\x23\x00\x09'
+    assert all(not results[rx].physical for rx in (0x7E8, 0x7E9, 0x7EB))
+    assert (READ_DTCS, False) in ecus[2].requests
+
+    # Discovery window + slowest ECU per request, not the sum over ECUs
+    sequential = sum(ecu.delay for ecu in ecus) * 3 + 0.150
+    assert elapsed < sequential
+
+
+@pytest.mark.unit
+def test_physical_fan_out_respects_in_flight_limit():
+    from shared.ecu_scan import ParallelEcuScanner, READ_DTCS
+
+    ecus = [SimulatedEcu(0x7E0 + i, 0.050, {READ_DTCS: b'\x59\x02\xFF'}, functional=False) for i in range(4)]
+    bus = SimulatedCanBus(ecus)
+    scanner = ParallelEcuScanner(bus, p2_timeout_ms=100, max_in_flight=2)
+    start = time.monotonic()
+    results = scanner.scan([READ_DTCS])
+    fan_out = time.monotonic() - start - 0.1 - 0.1  # discovery window + functional P2
+
+    assert all(result.positive(READ_DTCS) for result in results.values())
+    assert all(result.physical == [READ_DTCS] for result in results.values())
+    # Two waves of two concurrent requests
+    assert 0.09 < fan_out < 0.2
+
+
+@pytest.mark.unit
+def test_scan_latencies_feed_session_timeouts():
+    from shared.ecu_scan import ParallelEcuScanner
+    from shared.uds_session import UdsSessionManager
+
+    sessions = UdsSessionManager(lambda *args: False, lambda *args: None, auto_keep_alive=False)
+    sessions.get_session(0x7E1).p2_ms = 10       # announced earlier by a 0x10 response
+    results = ParallelEcuScanner(SimulatedCanBus(_vehicle()), sessions=sessions).scan()
+
+    assert sorted(results) == [0x7E8, 0x7E9, 0x7EA, 0x7EB]
+    # Discovery plus two scan requests: one sample each
+    assert len(sessions.get_session(0x7E0).latencies) == 3
+    assert all(latency < 100 for latency in sessions.get_session(0x7E0).latencies)
+    assert sessions.response_timeout_ms(0x7E1) == 10 + sessions.response_margin_ms
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+tests/test_elm_parser.py – Incremental ELM/STN response parser.
+
+Covers every response layout the handlers see (headers on/off, spaces on/off,
+multi-frame continuation) plus the typed status replies.  The benchmark test
+is marked ``benchmark``; the rest are ``unit``.
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+VIN = b"1G1JC5444R7252367"
+
+VIN_PLAIN = (
+    "014\r"
+    "0: 49 02 01 31 47 31\r"
+    "1: 4A 43 35 34 34 34 52\r"
+    "2: 37 32 35 32 33 36 37\r\r>"
+)
+
+VIN_HEADERS = (
+    "7E8 10 14 49 02 01 31 47 31\r"
+    "7E8 21 4A 43 35 34 34 34 52\r"
+    "7E8 22 37 32 35 32 33 36 37\r\r>"
+)
+
+# 0x19 02 reply with 12 DTC records (3 bytes + status each), two ECUs answering
+DTC_RECORDS = bytes([0x59, 0x02, 0xFF]) + bytes(
+    b for i in range(12) for b in (0x01, 0x30 + i, 0x00, 0x2F))
+
+
+def _isotp_lines(ecu: str, payload: bytes) -> str:
+    lines = [f"{ecu} 1{len(payload) >> 8:X} {len(payload) & 0xFF:02X} " + payload[:6].hex(" ").upper()]
+    rest, seq = payload[6:], 1
+    while rest:
+        lines.append(f"{ecu} 2{seq & 0xF:X} " + rest[:7].hex(" ").upper())
+        rest, seq = rest[7:], seq + 1
+    return "\r".join(lines)
+
+
+@pytest.mark.unit
+def test_single_and_multi_frame_without_headers():
+    from shared.elm_parser import ElmMessage, parse_elm_response
+
+    assert parse_elm_response("41 0C 1A F8\r\r>") == [ElmMessage(None, bytes.fromhex("410C1AF8"))]
+    assert parse_elm_response("410C1AF8\r\r>") == [ElmMessage(None, bytes.fromhex("410C1AF8"))]
+    assert parse_elm_response(VIN_PLAIN) == [ElmMessage(None, bytes.fromhex("490201") + VIN)]
+    assert parse_elm_response(VIN_PLAIN.replace(" ", "")) == [ElmMessage(None, bytes.fromhex("490201") + VIN)]
+
+
+@pytest.mark.unit
+def test_headers_reassemble_per_ecu():
+    from shared.elm_parser import ElmMessage, parse_elm_response
+
+    reply = "7E8 06 41 00 BE 3F A8 13\r7E9 06 41 00 98 18 80 10\r\r>"
+    assert parse_elm_response(reply, headers=True) == [
+        ElmMessage(0x7E8, bytes.fromhex("4100BE3FA813")),
+        ElmMessage(0x7E9, bytes.fromhex("410098188010")),
+    ]
+    assert parse_elm_response(VIN_HEADERS, headers=True) == [ElmMessage(0x7E8, bytes.fromhex("490201") + VIN)]
+
+    # DLC column on (ATD1), 11- and 29-bit, spaces on and off
+    reply = "7E8 8 06 41 00 BE 3F A8 13\r7E98064100981880 10\r\r>"
+    assert parse_elm_response(reply, headers=True, dlc=True) == [
+        ElmMessage(0x7E8, bytes.fromhex("4100BE3FA813")),
+        ElmMessage(0x7E9, bytes.fromhex("410098188010")),
+    ]
+    assert parse_elm_response("18 DA F1 10 8 06 41 00 BE 3F A8 13\r>", headers=True, id_bits=29, dlc=True) == [
+        ElmMessage(0x18DAF110, bytes.fromhex("4100BE3FA813"))]
+
+    # Interleaved multi-frame replies from two ECUs, 29-bit, spaces off
+    a = _isotp_lines("18DAF110", DTC_RECORDS).split("\r")
+    b = _isotp_lines("18DAF118", DTC_RECORDS[:20]).split("\r")
+    interleaved = [line for pair in zip(a, b) for line in pair] + a[len(b):]
+    results = parse_elm_response("\r".join(interleaved).replace(" ", "") + "\r>", headers=True, id_bits=29)
+    assert sorted(results) == sorted([ElmMessage(0x18DAF110, DTC_RECORDS), ElmMessage(0x18DAF118, DTC_RECORDS[:20])])
+
+
+@pytest.mark.unit
+def test_status_replies_are_typed():
+    from shared.elm_parser import ElmStatusKind, parse_elm_response
+
+    kinds = [r.kind for r in parse_elm_response("SEARCHING...\rNO DATA\r\r>")]
+    assert kinds == [ElmStatusKind.SEARCHING, ElmStatusKind.NO_DATA]
+    for text, kind in (("BUFFER FULL", ElmStatusKind.BUFFER_FULL), ("CAN ERROR", ElmStatusKind.CAN_ERROR),
+                       ("?", ElmStatusKind.UNKNOWN_COMMAND), ("ELM327 v1.5", ElmStatusKind.TEXT)):
+        assert parse_elm_response(f"{text}\r\r>", headers=True)[0].kind == kind
+
+
+@pytest.mark.unit
+def test_truncated_multi_frame_is_a_data_error():
+    """A multi-frame message cut short by the prompt is reported, not returned as data."""
+    from shared.elm_parser import ElmMessage, ElmStatus, ElmStatusKind, parse_elm_response
+
+    results = parse_elm_response("7E8 10 14 49 02 01 31 47 31\r\r>", headers=True)
+    assert not any(isinstance(r, ElmMessage) for r in results)
+    assert len(results) == 1 and isinstance(results[0], ElmStatus)
+    assert results[0].kind == ElmStatusKind.DATA_ERROR
+    assert "7E8" in results[0].text and "6/20" in results[0].text
+
+    plain = parse_elm_response("014\r0: 49 02 01 31 47 31\r\r>")
+    assert [r.kind for r in plain] == [ElmStatusKind.DATA_ERROR]
+
+
+@pytest.mark.unit
+def test_incremental_feed_in_arbitrary_chunks():
+    from shared.elm_parser import ElmMessage, ElmResponseParser
+
+    parser = ElmResponseParser(headers=True)
+    data = VIN_HEADERS.encode()
+    results = []
+    for i in range(0, len(data), 5):
+        results.extend(parser.feed(data[i:i + 5]))
+    assert results == [ElmMessage(0x7E8, bytes.fromhex("490201") + VIN)]
+    assert parser.prompt_seen
+
+
+@pytest.mark.benchmark
+def test_parser_benchmark():
+    """A full VIN or 0x19 DTC reply parses in microseconds."""
+    from shared.elm_parser import ElmResponseParser
+
+    dtc_reply = (_isotp_lines("7E8", DTC_RECORDS) + "\r\r>").encode()
+    for name, reply, headers in (("0902 VIN", VIN_PLAIN.encode(), False),
+                                 ("0902 VIN headers", VIN_HEADERS.encode(), True),
+                                 ("19 02 DTCs", dtc_reply, True)):
+        parser = ElmResponseParser(headers=headers)
+        runs = 2000
+        start = time.perf_counter()
+        for _ in range(runs):
+            parser.feed(reply)
+        per_parse_us = (time.perf_counter() - start) / runs * 1e6
+        assert per_parse_us < 500  # generous bound for slow CI machines
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+tests/test_elm_transport.py – ELM/STN adapter transport and protocol helpers.
+
+An in-process fake adapter answers over a socket pair (or a fake serial port),
+so these tests need no hardware.  All tests are marked ``unit``.
+"""
+
+import asyncio
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+
+class FakeElmAdapter:
+    """Minimal ELM327 command interpreter for a socket peer"""
+
+    def __init__(self, responses=None):
+        self.responses = {"ATI": "ELM327 v1.5", "0100": "41 00 BE 3F A8 13"}
+        self.responses.update(responses or {})
+        self.received = []
+        self.monitor_lines = ["7E8 03 41 05 80", "7E8 04 41 0D 32"]
+
+    def reply(self, command: str) -> bytes:
+        self.received.append(command)
+        if command in ("ATMA", "STMA"):
+            return "".join(f"{line}\r" for line in self.monitor_lines).encode()
+        if command == "":
+            return b"STOPPED\r\r>"
+        return f"{self.responses.get(command, 'OK')}\r\r>".encode()
+
+
+def _serve_socket(sock, adapter):
+    buf = b""
+    while True:
+        try:
+            data = sock.recv(1024)
+        except OSError:
+            return
+        if not data:
+            return
+        buf += data
+        while b"\r" in buf:
+            line, buf = buf.split(b"\r", 1)
+            sock.sendall(adapter.reply(line.decode().strip()))
+
+
+@pytest.fixture
+def socket_transport():
+    from shared.elm_transport import get_transport_loop, open_elm_transport
+
+    host_sock, peer_sock = socket.socketpair()
+    adapter = FakeElmAdapter()
+    threading.Thread(target=_serve_socket, args=(peer_sock, adapter), daemon=True).start()
+    loop = get_transport_loop()
+    transport = loop.run(open_elm_transport(sock=host_sock, name="fake"), timeout=5)
+    yield transport, adapter
+    loop.run(transport.close(), timeout=5)
+    peer_sock.close()
+
+
+@pytest.mark.unit
+def test_transport_pipelines_commands_in_order(socket_transport):
+    """Queued commands resolve with their own responses, in submission order."""
+    from shared.elm_transport import get_transport_loop
+
+    transport, adapter = socket_transport
+
+    async def burst():
+        futures = [transport.submit(cmd) for cmd in ("ATE0", "ATI", "0100")]
+        return await asyncio.gather(*futures)
+
+    results = get_transport_loop().run(burst(), timeout=5)
+    assert results == ["OK", "ELM327 v1.5", "41 00 BE 3F A8 13"]
+    assert adapter.received == ["ATE0", "ATI", "0100"]
+
+
+@pytest.mark.unit
+def test_transport_blocking_query(socket_transport):
+    """query() is usable from threads outside the transport loop."""
+    transport, _adapter = socket_transport
+    assert transport.query("ATI", timeout=2) == "ELM327 v1.5"
+
+
+@pytest.mark.unit
+def test_transport_monitor_stream(socket_transport):
+    """Monitor lines reach the callback and stop_monitor returns to command mode."""
+    from shared.elm_transport import get_transport_loop
+
+    transport, adapter = socket_transport
+    loop = get_transport_loop()
+    lines = []
+    got_both = threading.Event()
+
+    def on_line(line):
+        lines.append(line)
+        if len(lines) == 2:
+            got_both.set()
+
+    loop.run(transport.start_monitor(on_line), timeout=5)
+    assert got_both.wait(2)
+    assert loop.run(transport.stop_monitor(), timeout=5) is True
+    assert lines == adapter.monitor_lines
+    assert transport.query("ATI", timeout=2) == "ELM327 v1.5"
+
+
+@pytest.mark.unit
+def test_mixin_queues_replies_and_honours_send_timeout(socket_transport):
+    """Unread replies are kept in order; a send's own timeout outlives the default."""
+    from shared.elm_transport import AsyncTransportMixin
+
+    transport, adapter = socket_transport
+    adapter.responses["SLOW"] = "SLOW DONE"
+    reply = adapter.reply
+
+    def slow_reply(command):
+        if command == "SLOW":
+            time.sleep(0.4)
+        return reply(command)
+
+    adapter.reply = slow_reply
+    transport.default_timeout = 0.1
+
+    handler = AsyncTransportMixin()
+    handler.transport = transport
+    assert handler._transport_send(b"ATE0\r", timeout=1.0)
+    assert handler._transport_send(b"ATI\r", timeout=1.0)
+    assert handler._transport_read(timeout=1.0) == "OK\r>ELM327 v1.5\r>"
+
+    assert handler._transport_send(b"SLOW\r", timeout=2.0)
+    assert handler._transport_read(timeout=2.0) == "SLOW DONE\r>"
+    assert handler._transport_read() == ""
+
+
+@pytest.mark.unit
+def test_serial_stream_adapter():
+    """Serial ports are bridged into the loop by the thread-backed adapter."""
+    from shared.elm_transport import get_transport_loop, open_elm_transport
+
+    class FakeSerial:
+        def __init__(self):
+            self.adapter = FakeElmAdapter()
+            self.pending = b""
+            self.lock = threading.Lock()
+            self.ready = threading.Event()
+            self.timeout = 1
+
+        @property
+        def in_waiting(self):
+            return len(self.pending)
+
+        def read(self, size=1):
+            if not self.ready.wait(self.timeout):
+                return b""
+            with self.lock:
+                data, self.pending = self.pending[:size], self.pending[size:]
+                if not self.pending:
+                    self.ready.clear()
+            return data
+
+        def write(self, data):
+            with self.lock:
+                self.pending += self.adapter.reply(data.decode().strip())
+                self.ready.set()
+
+        def flush(self):
+            pass
+
+    loop = get_transport_loop()
+    transport = loop.run(open_elm_transport(serial_port=FakeSerial(), name="serial"), timeout=5)
+    try:
+        assert transport.query("0100", timeout=2) == "41 00 BE 3F A8 13"
+    finally:
+        loop.run(transport.close(), timeout=5)
+
+
+class FakeStnSerial:
+    """STN adapter behind a UART: bytes only survive when both ends agree on the rate"""
+
+    DEFAULT_BAUD = 115200
+
+    def __init__(self, max_supported=2000000, max_reliable=1000000):
+        self.port = "/dev/ttyFAKE0"
+        self.baudrate = self.DEFAULT_BAUD
+        self.timeout = 0
+        self.device_baud = self.DEFAULT_BAUD
+        self.max_supported = max_supported
+        self.max_reliable = max_reliable
+        self.switch_timeout = 0.1
+        self.chunks = []  # (baud the bytes were sent at, bytes)
+        self.commands = []
+        self.handshake = None  # (old baud, deadline) while waiting for the host CR
+        self.banner_sent = False
+
+    def _expire(self):
+        if self.handshake and time.monotonic() > self.handshake[1]:
+            self.device_baud = self.handshake[0]
+            self.handshake = None
+
+    def _send(self, text):
+        self.chunks.append((self.device_baud, text.encode()))
+
+    @property
+    def in_waiting(self):
+        return sum(len(data) for _baud, data in self.chunks)
+
+    def read(self, size=1):
+        self._expire()
+        if self.handshake and self.baudrate == self.device_baud and not self.banner_sent:
+            self.banner_sent = True
+            self._send("STN1110 v5.0\r")
+        out = b""
+        while self.chunks and len(out) < size:
+            baud, data = self.chunks.pop(0)
+            if baud == self.baudrate:
+                out += data  # mismatched chunks are line noise
+        return out
+
+    def write(self, data):
+        self._expire()
+        if self.baudrate != self.device_baud:
+            return
+        for command in data.decode().split("\r")[:-1]:
+            self._command(command.strip())
+
+    def _command(self, command):
+        self.commands.append(command)
+        if self.handshake:
+            self.handshake = None
+            self._send(">")
+        elif command.startswith("STBR "):
+            rate = int(command.split()[1])
+            if rate > self.max_supported:
+                self._send("?\r\r>")
+                return
+            self._send("OK\r")
+            self.handshake = (self.device_baud, time.monotonic() + self.switch_timeout)
+            self.device_baud = rate
+            self.banner_sent = False  # sent once the host listens at the new rate
+        elif command == "STI":
+            ident = "STN1110 v5.0" if self.device_baud <= self.max_reliable else "STN1\x01\x7f0 v5"
+            self._send(f"{ident}\r\r>")
+        elif command == "ATI":
+            self._send("ELM327 v1.4b\r\r>")
+        elif command == "ATZ":
+            self.device_baud = self.DEFAULT_BAUD
+            self._send("\r\rELM327 v1.4b\r\r>")
+        elif command.startswith("STBRT"):
+            self.switch_timeout = int(command.split()[1]) / 1000.0
+            self._send("OK\r\r>")
+        else:
+            self._send("\r>")
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        self.chunks.clear()
+
+
+@pytest.mark.unit
+def test_baud_negotiation_falls_back_and_caches(tmp_path):
+    """An unreliable top rate is abandoned after repeated failures, until they expire."""
+    from shared.baud_negotiation import FAILURE_EXPIRY_S, negotiate_baud_rate
+    from shared.json_cache import JsonCache
+
+    cache = JsonCache("baud.json", path=tmp_path / "baud.json")
+
+    def negotiate():
+        port = FakeStnSerial()
+        result = negotiate_baud_rate(port, cache=cache, switch_timeout_ms=50, verify_rounds=2,
+                                     failure_strikes=2)
+        return port, result
+
+    port, result = negotiate()
+    assert result.chip == "STN"
+    assert result.baudrate == 1000000 and port.baudrate == port.device_baud == 1000000
+    assert result.device_reset is True  # 2 Mbaud handshake passed, echo test did not
+
+    # One failure is not enough to give up on 2 Mbaud
+    port, result = negotiate()
+    assert [c for c in port.commands if c.startswith("STBR ")] == ["STBR 2000000", "STBR 1000000"]
+
+    port, result = negotiate()
+    assert result.baudrate == 1000000 and not result.device_reset
+    assert [c for c in port.commands if c.startswith("STBR ")] == ["STBR 1000000"]
+
+    # Expired failures: 2 Mbaud is tried again
+    (key, entry), = cache.items()
+    entry['failures'] = {rate: [strikes, last - FAILURE_EXPIRY_S]
+                         for rate, (strikes, last) in entry['failures'].items()}
+    cache.set(key, entry)
+    port, result = negotiate()
+    assert [c for c in port.commands if c.startswith("STBR ")][0] == "STBR 2000000"
+
+
+@pytest.mark.unit
+def test_baud_negotiation_keeps_rate_when_nothing_faster_works(tmp_path):
+    """Rejected rates leave the link at its original speed."""
+    from shared.baud_negotiation import negotiate_baud_rate
+    from shared.json_cache import JsonCache
+
+    cache = JsonCache("baud.json", path=tmp_path / "baud.json")
+    port = FakeStnSerial(max_supported=115200)
+    result = negotiate_baud_rate(port, cache=cache, switch_timeout_ms=50)
+    assert result.baudrate == 115200 and not result.changed
+    assert port.baudrate == port.device_baud == 115200
+
+
+@pytest.mark.unit
+def test_latency_profile_response_count_hints():
+    """Hints appear once the frame count is known and are dropped when stale."""
+    from shared.elm_profile import ElmLatencyProfile, frame_count
+
+    assert frame_count("7E8 06 41 00 BE 3F A8 13\r7E9 06 41 00 98 18 80 10\r\r>") == 2
+    assert frame_count("014\r0:490201314731\r1:4A433534343452\r2:37323532333637") == 3
+
+    profile = ElmLatencyProfile(relearn_interval=0)
+    assert profile.prepare("0902") == "0902"
+    assert profile.prepare("ATRV") == "ATRV"
+
+    profile.observe("0100", profile.prepare("0100"), "7E8064100BE3FA813\r7E9064100981880\r")
+    assert profile.ecu_count == 2
+    assert profile.prepare("010C") == "010C2"  # derived from responder count
+
+    profile.observe("0902", "0902", "014\r0:490201314731\r1:4A433534343452\r2:37323532333637")
+    sent = profile.prepare("0902")
+    assert sent == "09023"
+    profile.observe("0902", sent, "NO DATA")
+    assert profile.prepare("0902") == "0902"
+
+
+class FakeElmSettings:
+    """ELM327 settings state answering exchange(command, timeout) calls"""
+
+    def __init__(self, echo=True, protocol="A6", alive=True):
+        self.echo = echo
+        self.protocol = protocol
+        self.alive = alive
+        self.sent = []
+
+    def exchange(self, command, timeout):
+        if not self.alive:
+            return ""
+        self.sent.append(command)
+        prefix = f"{command}\r" if self.echo else ""
+        if command == "ATI":
+            return f"{prefix}ELM327 v1.5\r\r>"
+        if command == "ATDPN":
+            return f"{prefix}{self.protocol}\r\r>"
+        if command.startswith("ATE"):
+            self.echo = command == "ATE1"
+        if command.startswith("ATSP"):
+            self.protocol = command[4:]
+        return f"{prefix}OK\r\r>"
+
+
+@pytest.mark.unit
+def test_fast_resume_sends_only_deltas(tmp_path):
+    """A live adapter is brought to the cached state without ATZ."""
+    from shared.elm_resume import ElmResumeState
+    from shared.json_cache import JsonCache
+
+    cache = JsonCache("state.json", path=tmp_path / "state.json")
+    first = ElmResumeState(cache=cache)
+    first.set_device("serial:/dev/ttyUSB0")
+    assert first.resume(FakeElmSettings().exchange) is False  # nothing cached yet
+    # ATSW/ATLP/ATSI share a prefix with settings but are not settings
+    for command in ("ATE0", "ATL0", "ATH1", "ATSP0", "ATSH 7E0", "STFCP", "STFAP 7E8,7FF",
+                    "ATSW 00", "ATLP", "ATSI"):
+        first.note(command)
+    first.save()
+
+    # Adapter not reset: probe, protocol check and the filters re-sent
+    adapter = FakeElmSettings(echo=False, protocol="A6")
+    state = ElmResumeState(cache=cache)
+    state.set_device("serial:/dev/ttyUSB0")
+    assert state.resume(adapter.exchange) is True
+    assert adapter.sent == ["ATI", "ATDPN", "ATSH7E0", "STFCP", "STFAP7E8,7FF"]
+    assert state.detected_protocol == "6"
+
+    # Power-cycled adapter: defaults differ only in the settings we changed
+    adapter = FakeElmSettings(echo=True, protocol="0")
+    assert state.resume(adapter.exchange) is True
+    assert state.last_resume_commands[0] == "ATE0"
+    assert set(state.last_resume_commands) == {"ATE0", "ATL0", "ATH1", "ATSPA6", "ATSH7E0", "STFCP",
+                                              "STFAP7E8,7FF"}
+    assert "ATZ" not in adapter.sent
+
+    assert state.resume(FakeElmSettings(alive=False).exchange) is False
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""
+tests/test_isotp.py – ISO-TP segmentation, reassembly and flow control.
+
+Transports are in-memory stand-ins for VCIManager: ``send_to_channel`` and
+``read_message`` exchange J2534Message objects (4-byte CAN ID + payload).
+All tests are marked ``unit``.
+"""
+
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+
+class ScriptedTransport:
+    """Replays scripted frames (payload, or (CAN ID, payload)); records traffic"""
+
+    def __init__(self, frames=(), rx_id=0x7E8):
+        self.frames = deque(frames)
+        self.rx_id = rx_id
+        self.sent = []
+        self.sent_msgs = []
+        self.log = []
+
+    def send_to_channel(self, msg):
+        self.sent.append(bytes(msg.data[4:]))
+        self.sent_msgs.append(msg)
+        self.log.append('tx')
+        return True
+
+    def read_message(self, timeout_ms=1000):
+        from shared.j2534_passthru import J2534Message, J2534Protocol
+
+        if not self.frames:
+            time.sleep(min(timeout_ms, 5) / 1000.0)
+            return None
+        self.log.append('rx')
+        frame = self.frames.popleft()
+        can_id, payload = frame if isinstance(frame, tuple) else (self.rx_id, frame)
+        return J2534Message(J2534Protocol.ISO15765, data=can_id.to_bytes(4, 'big') + payload)
+
+
+class LoopbackBus:
+    """Two ends of a CAN bus; frames sent on one end are read on the other"""
+
+    class End:
+        def __init__(self):
+            self.inbox = deque()
+            self.peer = None
+            self.sent_at = []
+            self.event = threading.Event()
+
+        def send_to_channel(self, msg):
+            from shared.j2534_passthru import J2534Message
+
+            # Frame buffers are reused by the sender; copy like a real driver
+            self.sent_at.append((time.perf_counter(), bytes(msg.data[4:])))
+            self.peer.inbox.append(J2534Message(msg.protocol, msg.tx_flags, bytes(msg.data)))
+            self.peer.event.set()
+            return True
+
+        def read_message(self, timeout_ms=1000):
+            deadline = time.monotonic() + timeout_ms / 1000.0
+            while not self.inbox:
+                self.event.clear()
+                if self.inbox:
+                    break
+                if not self.event.wait(max(0.0, deadline - time.monotonic())):
+                    return None
+            return self.inbox.popleft()
+
+    def __init__(self):
+        self.tester, self.ecu = self.End(), self.End()
+        self.tester.peer, self.ecu.peer = self.ecu, self.tester
+
+
+@pytest.mark.unit
+def test_st_min_encoding():
+    from shared.isotp_handler import decode_st_min, encode_st_min
+
+    assert decode_st_min(0x00) == 0.0
+    assert decode_st_min(0x14) == pytest.approx(0.020)
+    assert decode_st_min(0xF5) == pytest.approx(0.0005)
+    assert decode_st_min(0x80) == pytest.approx(0.127)   # reserved -> max
+    assert decode_st_min(0xFA) == pytest.approx(0.127)
+    assert encode_st_min(0.0003) == 0xF3
+    assert encode_st_min(0.0015) == 0x02                 # rounded up, never shorter
+    assert encode_st_min(1.0) == 0x7F
+
+
+@pytest.mark.unit
+def test_sender_waits_for_fc_after_each_block():
+    from shared.isotp_handler import IsoTpHandler
+
+    # 40 bytes: FF + 5 CFs; the ECU grants blocks of 2 CFs
+    transport = ScriptedTransport([b'\x30\x02\x00', b'\x30\x02\x00', b'\x30\x02\x00'])
+    handler = IsoTpHandler(transport, 0x7E0, 0x7E8)
+    data = bytes(range(40))
+    assert handler.send_data(data)
+
+    assert transport.log == ['tx', 'rx', 'tx', 'tx', 'rx', 'tx', 'tx', 'rx', 'tx']
+    cfs = transport.sent[1:]
+    assert [cf[0] for cf in cfs] == [0x21, 0x22, 0x23, 0x24, 0x25]
+    assert transport.sent[0][2:] + b''.join(cf[1:] for cf in cfs)[:34] == data
+
+
+@pytest.mark.unit
+def test_sender_handles_wait_and_overflow():
+    from shared.isotp_handler import FlowControlConfig, IsoTpHandler
+
+    config = FlowControlConfig(max_wait_frames=2)
+    waits = ScriptedTransport([b'\x31\x00\x00', b'\x31\x00\x00', b'\x30\x00\x00'])
+    assert IsoTpHandler(waits, 0x7E0, 0x7E8, config=config).send_data(bytes(20))
+    assert len(waits.sent) == 3  # FF + 2 CFs
+
+    too_many = ScriptedTransport([b'\x31\x00\x00'] * 3 + [b'\x30\x00\x00'])
+    assert not IsoTpHandler(too_many, 0x7E0, 0x7E8, config=config).send_data(bytes(20))
+    assert len(too_many.sent) == 1
+
+    overflow = ScriptedTransport([b'\x32\x00\x00'])
+    assert not IsoTpHandler(overflow, 0x7E0, 0x7E8, config=config).send_data(bytes(20))
+    assert len(overflow.sent) == 1
+
+
+@pytest.mark.unit
+def test_receiver_advertises_per_ecu_flow_control():
+    from shared.isotp_handler import FlowControlConfig, IsoTpHandler, set_flow_control_config
+
+    data = bytes(range(100))
+    frames = [b'\x10\x64' + data[:6]]
+    for index, offset in enumerate(range(6, 100, 7)):
+        frames.append(bytes([0x20 | ((index + 1) & 0x0F)]) + data[offset:offset + 7])
+
+    set_flow_control_config(0x7E3, FlowControlConfig(block_size=4, st_min=0xF5))
+    transport = ScriptedTransport(frames, rx_id=0x7EB)
+    assert IsoTpHandler(transport, 0x7E3, 0x7EB).receive_data(500) == data
+
+    # 14 CFs in blocks of 4 -> FC after the FF and after CF 4, 8, 12
+    assert transport.sent == [b'\x30\x04\xF5' + b'\xAA' * 5] * 4
+
+    # Oversized messages are refused
+    small = ScriptedTransport([b'\x10\x64' + data[:6]])
+    handler = IsoTpHandler(small, 0x7E0, 0x7E8, config=FlowControlConfig(max_rx_length=64))
+    assert handler.receive_data(200) is None
+    assert small.sent[0][:1] == b'\x32'
+
+    # A sequence number gap aborts the reception
+    gap = ScriptedTransport([frames[0], frames[1], frames[3]])
+    assert IsoTpHandler(gap, 0x7E0, 0x7E8).receive_data(200) is None
+
+
+@pytest.mark.unit
+def test_malformed_single_and_first_frames_are_dropped():
+    from shared.isotp_handler import IsoTpReassembler
+
+    sent = []
+    reassembler = IsoTpReassembler(lambda tx_id, payload: sent.append(payload) or True)
+    malformed = (
+        b'\x00',                       # escaped SF without SF_DL
+        b'\x00\x00',                   # escaped SF_DL 0
+        b'\x00\x0A\x01\x02',           # escaped SF_DL beyond the frame
+        b'\x05\x62\xF1',               # SF_DL beyond the frame
+        b'\x10\x00\x00\x00',           # escape FF without a 32-bit FF_DL
+        b'\x10\x05\x62\xF1\x90\x01\x02\x03',  # FF_DL that fits a Single Frame
+    )
+    for frame in malformed:
+        assert reassembler.feed(0x7E8, frame) is None
+    assert sent == [] and not reassembler.active
+
+    assert reassembler.feed(0x7E8, b'\x00\x02\x7E\x00').data == b'\x7E\x00'
+
+
+@pytest.mark.unit
+def test_loopback_transfer_respects_block_size_and_st_min():
+    from shared.isotp_handler import FlowControlConfig, IsoTpHandler
+
+    bus = LoopbackBus()
+    ecu = IsoTpHandler(bus.ecu, 0x7E8, 0x7E0, config=FlowControlConfig(block_size=8, st_min=0x02))
+    tester = IsoTpHandler(bus.tester, 0x7E0, 0x7E8)
+    data = bytes(i & 0xFF for i in range(300))
+
+    received = {}
+    thread = threading.Thread(target=lambda: received.update(data=ecu.receive_data(3000)))
+    thread.start()
+    assert tester.send_data(data)
+    thread.join(5)
+    assert received['data'] == data
+
+    cf_times = [t for t, frame in bus.tester.sent_at if frame[0] >> 4 == 2]
+    gaps = [b - a for a, b in zip(cf_times, cf_times[1:])]
+    assert len(cf_times) == 42
+    assert min(gaps) >= 0.002
+    fcs = [frame for _, frame in bus.ecu.sent_at]
+    assert len(fcs) == 6  # FF + after CF 8, 16, 24, 32, 40
+
+
+def _segment(data):
+    """FF + CFs of a multi-frame message"""
+    frames = [bytes([0x10 | (len(data) >> 8), len(data) & 0xFF]) + data[:6]]
+    for index, offset in enumerate(range(6, len(data), 7)):
+        frames.append(bytes([0x20 | ((index + 1) & 0x0F)]) + data[offset:offset + 7])
+    return frames
+
+
+@pytest.mark.unit
+def test_functional_request_reassembles_every_ecu():
+    from shared.isotp_handler import FUNCTIONAL_ID_11BIT, IsoTpHandler
+
+    engine = b'\x62\xF1\x90' + b'WVWZZZ1JZXW000001'
+    gearbox = b'\x62\xF1\x90' + b'WVWZZZ1JZXW000002'
+    engine_frames, gearbox_frames = _segment(engine), _segment(gearbox)
+    # Interleaved on the bus, plus a single-frame answer and foreign traffic
+    frames = []
+    for a, b in zip(engine_frames, gearbox_frames):
+        frames += [(0x7E8, a), (0x7E9, b), (0x123, b'\x01\x02')]
+    frames.insert(3, (0x7EA, b'\x03\x7F\x22\x31'))
+
+    transport = ScriptedTransport(frames)
+    handler = IsoTpHandler(transport, FUNCTIONAL_ID_11BIT, None)
+    assert handler.send_data(b'\x22\xF1\x90')
+    assert handler.receive_all(100) == {
+        0x7E8: [engine], 0x7E9: [gearbox], 0x7EA: [b'\x7F\x22\x31'],
+    }
+    # Each ECU got its own flow control on its physical request ID
+    fc_ids = [int.from_bytes(msg.data[:4], 'big') for msg in transport.sent_msgs[1:]]
+    assert fc_ids == [0x7E0, 0x7E1]
+    assert not handler.send_data(bytes(10))  # functional requests are single-frame only
+
+
+@pytest.mark.unit
+def test_29bit_normal_fixed_addressing():
+    from shared.isotp_handler import (
+        CAN_29BIT_ID, FUNCTIONAL_ID_29BIT, IsoTpHandler, physical_ids_29bit, request_id_for
+    )
+
+    assert physical_ids_29bit(0x10) == (0x18DA10F1, 0x18DAF110)
+    assert request_id_for(0x18DAF110) == 0x18DA10F1
+    assert request_id_for(0x7EB) == 0x7E3
+
+    reply = bytes(range(30))
+    frames = [(0x18DAF110, frame) for frame in _segment(reply)]
+    frames.insert(2, (0x18DAF118, b'\x02\x50\x01'))
+    frames.insert(1, (0x18DAF210, b'\x02\x50\x01'))  # addressed to another tester
+
+    transport = ScriptedTransport(frames)
+    handler = IsoTpHandler(transport, FUNCTIONAL_ID_29BIT, None)
+    assert handler.send_data(b'\x10\x01')
+    assert transport.sent_msgs[0].tx_flags == CAN_29BIT_ID
+    assert handler.receive_all(100) == {0x18DAF110: [reply], 0x18DAF118: [b'\x50\x01']}
+    fc = transport.sent_msgs[1]
+    assert int.from_bytes(fc.data[:4], 'big') == 0x18DA10F1 and fc.tx_flags == CAN_29BIT_ID
+
+    # Physical 29-bit handler only takes its own ECU's frames, unmasked
+    transport = ScriptedTransport([(0x7E8, b'\x02\x50\x01'), (0x18DAF110, b'\x02\x50\x03')])
+    request_id, response_id = physical_ids_29bit(0x10)
+    assert IsoTpHandler(transport, request_id, response_id).receive_data(100) == b'\x50\x03'
+
+
+class _FrameSink:
+    """Transport that answers every FF with FC.CTS (BS=0) and drops the rest"""
+
+    def __init__(self):
+        from shared.j2534_passthru import J2534Message, J2534Protocol
+
+        self.frames = 0
+        self.fc = J2534Message(J2534Protocol.ISO15765, data=(0x7E8).to_bytes(4, 'big') + b'\x30\x00\x00')
+
+    def send_to_channel(self, msg):
+        self.frames += 1
+        return True
+
+    def read_message(self, timeout_ms=1000):
+        return self.fc
+
+
+class _FrameSource:
+    """Transport that replays prebuilt frames and ignores what is sent"""
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.index = 0
+
+    def send_to_channel(self, msg):
+        return True
+
+    def read_message(self, timeout_ms=1000):
+        msg = self.messages[self.index]
+        self.index += 1
+        return msg
+
+
+@pytest.mark.benchmark
+def test_isotp_per_frame_overhead():
+    """Segmenting and reassembling a 4095-byte message costs microseconds per frame."""
+    from shared.isotp_handler import IsoTpHandler
+    from shared.j2534_passthru import J2534Message, J2534Protocol
+
+    data = bytes(i & 0xFF for i in range(4095))
+    runs = 20
+
+    sink = _FrameSink()
+    sender = IsoTpHandler(sink, 0x7E0, 0x7E8)
+    start = time.perf_counter()
+    for _ in range(runs):
+        assert sender.send_data(data)
+    tx_us = (time.perf_counter() - start) / sink.frames * 1e6
+
+    header = (0x7E8).to_bytes(4, 'big')
+    messages = [J2534Message(J2534Protocol.ISO15765, data=header + frame) for frame in _segment(data)]
+    receiver = IsoTpHandler(_FrameSource(messages), 0x7E0, 0x7E8)
+    start = time.perf_counter()
+    for _ in range(runs):
+        receiver.transport.index = 0
+        assert receiver.receive_data(1000) == data
+    rx_us = (time.perf_counter() - start) / (runs * len(messages)) * 1e6
+
+    assert sink.frames == runs * len(messages)
+    assert tx_us < 50 and rx_us < 50  # generous bounds for slow CI machines
+
+
+class LoopbackPeer:
+    """
+    Software ECU on the other end of the bus: frames sent to it go straight
+    into an IsoTpReassembler, whose flow control is queued for the sender.
+    """
+
+    def __init__(self, config, ecu_rx_id=0x7E8):
+        from shared.isotp_handler import IsoTpReassembler
+
+        self.inbox = deque()
+        self.frames = 0
+        self.flow_controls = 0
+        self.frame_sizes = set()
+        self.pdus = []
+        self.reassembler = IsoTpReassembler(self._send_flow_control, config_for=lambda _id: config,
+                                            flow_control_id=lambda _id: ecu_rx_id)
+
+    def _send_flow_control(self, can_id, payload):
+        from shared.j2534_passthru import J2534Message, J2534Protocol
+
+        self.flow_controls += 1
+        self.inbox.append(J2534Message(J2534Protocol.ISO15765, data=can_id.to_bytes(4, 'big') + payload))
+        return True
+
+    def send_to_channel(self, msg):
+        self.frames += 1
+        self.frame_sizes.add(len(msg.data) - 4)
+        pdu = self.reassembler.feed(int.from_bytes(msg.data[:4], 'big'), bytes(msg.data[4:]))
+        if pdu is not None:
+            self.pdus.append(pdu.data)
+        return True
+
+    def read_message(self, timeout_ms=1000):
+        return self.inbox.popleft() if self.inbox else None
+
+
+@pytest.mark.unit
+def test_escape_length_and_fd_single_frames():
+    from shared.isotp_handler import FlowControlConfig, IsoTpHandler
+
+    # Classic CAN, 5000 bytes: 32-bit FF_DL with two data bytes in the FF
+    data = bytes(i & 0xFF for i in range(5000))
+    peer = LoopbackPeer(FlowControlConfig(block_size=16, max_rx_length=8192))
+    assert IsoTpHandler(peer, 0x7E0, 0x7E8).send_data(data)
+    assert peer.pdus == [data]
+    assert peer.frames == 1 + -(-(5000 - 2) // 7)
+
+    # The same message is refused by a peer limited to 12-bit lengths
+    refusing = LoopbackPeer(FlowControlConfig())
+    assert not IsoTpHandler(refusing, 0x7E0, 0x7E8).send_data(data)
+
+    # CAN FD: up to 62 bytes fit an escaped single frame, padded to a valid DLC
+    fd = FlowControlConfig(tx_dl=64, padding=None)
+    peer = LoopbackPeer(FlowControlConfig())
+    handler = IsoTpHandler(peer, 0x7E0, 0x7E8, config=fd)
+    assert handler.send_data(bytes(range(21)))
+    assert handler.send_data(bytes(range(62)))
+    assert peer.pdus == [bytes(range(21)), bytes(range(62))]
+    assert peer.frame_sizes == {24, 64}
+
+    # An FD escape-length First Frame is reassembled on receive
+    frames = [b'\x10\x00' + (100).to_bytes(4, 'big') + bytes(range(58))]
+    frames.append(b'\x21' + bytes(range(58, 100)) + b'\xCC' * 5)
+    transport = ScriptedTransport(frames)
+    receiver = IsoTpHandler(transport, 0x7E0, 0x7E8, config=fd)
+    assert receiver.receive_data(200) == bytes(range(100))
+
+
+@pytest.mark.unit
+def test_can_fd_cuts_frames_for_1mb_transfer():
+    """A 1 MB download needs ~9x fewer frames and flow controls with CAN FD"""
+    from shared.isotp_handler import FlowControlConfig, IsoTpHandler
+
+    size = 1024 * 1024
+    data = bytes(i & 0xFF for i in range(size))
+    ecu = FlowControlConfig(block_size=32, max_rx_length=size)
+
+    counts = {}
+    for name, tx_dl in (("classic", 8), ("fd", 64)):
+        peer = LoopbackPeer(ecu)
+        handler = IsoTpHandler(peer, 0x7E0, 0x7E8, config=FlowControlConfig(tx_dl=tx_dl))
+        assert handler.send_data(data)
+        assert peer.pdus == [data]
+        counts[name] = (peer.frames, peer.flow_controls)
+
+    assert counts["classic"][0] == 1 + -(-(size - 2) // 7)     # 149,798 frames
+    assert counts["fd"][0] == 1 + -(-(size - 58) // 63)        # 16,645 frames
+    assert counts["classic"][1] > 8 * counts["fd"][1]
+    # One FC after the First Frame, then one per full block of 32 CFs
+    assert counts["classic"][1] == 1 + (counts["classic"][0] - 2) // 32
+    assert counts["fd"][1] == 1 + (counts["fd"][0] - 2) // 32
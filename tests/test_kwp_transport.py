@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+tests/test_kwp_transport.py – KWP2000 K-line transport against a pty ECU.
+
+The transport talks to a pseudo-terminal; a simulated ECU on the master
+side echoes every byte (as the single K-line wire does), answers with its
+own P2/P1 timing and sees wake-up patterns through the port's
+``break_condition``.  All tests are marked ``unit``.
+"""
+
+import os
+import select
+import sys
+import termios
+import threading
+import time
+import tty
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+ECU_ADDRESS = 0x01
+TESTER = 0xF1
+IDENT = b'\x5A\x9B' + b'038906019LJ 1,9l R4 EDC  SG  1234'
+
+
+class KLineEcu(threading.Thread):
+    """Engine ECU on the master side of a pty"""
+
+    def __init__(self, fd, fast_init=True, bit_ms=60):
+        super().__init__(daemon=True)
+        self.fd = fd
+        self.fast_init = fast_init
+        self.bit_ms = bit_ms
+        self.p2_ms = 25                 # answers after P2min
+        self.p1_ms = 1
+        self.edges = []                 # (time, low) as driven by the tester
+        self.woken = False
+        self.five_baud_address = None
+        self.requests = []
+        self.lock = threading.Lock()
+        self.running = True
+        self.buffer = bytearray()
+
+    def line(self, low):
+        with self.lock:
+            self.edges.append((time.monotonic(), low))
+
+    def _write(self, frame):
+        for byte in frame:
+            os.write(self.fd, bytes([byte]))
+            time.sleep(self.p1_ms / 1000)
+
+    def _frame(self, data, source=ECU_ADDRESS):
+        header = bytes([0x80 | len(data), TESTER, source]) if len(data) <= 63 else bytes([0x80, TESTER, source, len(data)])
+        frame = header + data
+        return frame + bytes([sum(frame) & 0xFF])
+
+    def _edges(self):
+        with self.lock:
+            return list(self.edges)
+
+    def _check_wake_up(self):
+        edges = self._edges()
+        if not edges or not edges[0][1]:
+            return
+        start = edges[0][0]
+        first_low = next((t for t, low in edges[1:] if not low), None)
+        if first_low is None:
+            return
+        if first_low - start < 0.04:                   # TiniL, far shorter than a 5-baud bit
+            with self.lock:
+                self.edges.clear()
+            self.woken = self.fast_init
+            self.wake_up_low_ms = (first_low - start) * 1000
+            return
+        # 5-baud: wait for the stop bit, then sample the middle of each data bit
+        if time.monotonic() < start + 10 * self.bit_ms / 1000:
+            return
+        with self.lock:
+            self.edges.clear()
+
+        def level(t):
+            current = 0
+            for when, low in edges:
+                if when <= t:
+                    current = 0 if low else 1
+            return current
+
+        self.five_baud_address = sum(level(start + (i + 1.5) * self.bit_ms / 1000) << i for i in range(8))
+        if self.five_baud_address != ECU_ADDRESS:
+            return
+        time.sleep(0.03)
+        self._write(b'\x55')
+        time.sleep(0.005)
+        self._write(b'\x8F\x8F')
+        self.expect_inverted_kb2 = True
+
+    def _handle(self, data):
+        self.requests.append(data)
+        time.sleep(self.p2_ms / 1000)
+        sid = data[0]
+        if sid == 0x81:
+            if self.woken:
+                self._write(self._frame(b'\xC1\x8F\x8F'))
+        elif data == b'\x83\x00':
+            # P2min 0, P2max 25 ms, P3min 5 ms, P3max 5 s, P4min 0
+            self._write(self._frame(b'\xC3\x00\x00\x01\x0A\x14\x00'))
+        elif data[:2] == b'\x83\x03':
+            self._write(self._frame(b'\xC3\x03'))
+            self.p2_ms = 2
+        elif data == b'\x1A\x9B':
+            self._write(self._frame(b'\x7F\x1A\x78'))
+            time.sleep(0.1)
+            self._write(self._frame(IDENT))
+        elif data == b'\x21\x01':
+            self._write(self._frame(b'\x61\x01' + bytes(range(80))))
+        elif data == b'\x01\x00':
+            self._write(self._frame(b'\x41\x00\xBE\x3E\xB8\x11', source=0x10))
+            time.sleep(0.003)
+            self._write(self._frame(b'\x41\x00\x80\x00\x00\x00', source=0x18))
+        elif sid == 0x3E:
+            self._write(self._frame(b'\x7E' + data[1:]))
+        elif sid == 0x82:
+            self._write(self._frame(b'\xC2'))
+        else:
+            self._write(self._frame(bytes([0x7F, sid, 0x11])))
+
+    def run(self):
+        self.expect_inverted_kb2 = False
+        while self.running:
+            self._check_wake_up()
+            ready, _, _ = select.select([self.fd], [], [], 0.002)
+            if not ready:
+                continue
+            try:
+                chunk = os.read(self.fd, 256)
+            except OSError:
+                return
+            os.write(self.fd, chunk)                     # K-line echo
+            if self.expect_inverted_kb2:
+                self.expect_inverted_kb2 = False
+                time.sleep(0.03)
+                self._write(bytes([ECU_ADDRESS ^ 0xFF]))
+                continue
+            self.buffer += chunk
+            while self.buffer:
+                length = self.buffer[0] & 0x3F
+                header = 3 if length else 4
+                if len(self.buffer) < header:
+                    break
+                length = length or self.buffer[3]
+                if len(self.buffer) < header + length + 1:
+                    break
+                frame = bytes(self.buffer[:header + length + 1])
+                del self.buffer[:header + length + 1]
+                self._handle(frame[header:-1])
+
+
+class PtyPort:
+    """pyserial subset over the slave side of a pty"""
+
+    def __init__(self, fd, ecu):
+        self.fd = fd
+        self.ecu = ecu
+        self.timeout = None
+        self.baudrate = 9600
+        self._break = False
+
+    @property
+    def break_condition(self):
+        return self._break
+
+    @break_condition.setter
+    def break_condition(self, value):
+        self._break = value
+        self.ecu.line(value)
+
+    def write(self, data):
+        return os.write(self.fd, data)
+
+    def read(self, size=1):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        data = bytearray()
+        while len(data) < size:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+            if not ready:
+                break
+            data += os.read(self.fd, size - len(data))
+        return bytes(data)
+
+    def reset_input_buffer(self):
+        termios.tcflush(self.fd, termios.TCIFLUSH)
+
+
+@pytest.fixture
+def kline(request):
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    tty.setraw(master)
+    ecu = KLineEcu(master, **getattr(request, "param", {}))
+    ecu.start()
+    yield PtyPort(slave, ecu), ecu
+    ecu.running = False
+    ecu.join(1)
+    os.close(slave)
+    os.close(master)
+
+
+@pytest.mark.unit
+def test_fast_init_negotiated_timing_and_pending(kline):
+    from shared.kwp_transport import KwpTransport
+
+    port, ecu = kline
+    transport = KwpTransport(port, target=ECU_ADDRESS)
+    assert transport.connect()
+    assert transport.init_mode == "fast" and transport.key_bytes.is_kwp2000
+    assert 20 <= ecu.wake_up_low_ms <= 40
+    # Switched to the ECU's limits: no 55 ms P3 or 5 ms P4 any more
+    assert (transport.timing.p3_min_ms, transport.timing.p4_min_ms, transport.timing.p2_max_ms) == (5, 0, 25)
+
+    assert transport.request(b'\x21\x01') == b'\x61\x01' + bytes(range(80))   # separate length byte
+    start = time.monotonic()
+    for _ in range(10):
+        assert transport.request(b'\x3E\x01') == b'\x7E\x01'
+    # Less than the default P3min alone would cost per request
+    assert time.monotonic() - start < 10 * 0.055
+
+    # 0x78 extends the wait to P3max, then the real answer
+    assert transport.request(b'\x1A\x9B') == IDENT
+    transport.close()
+    assert ecu.requests[-1] == b'\x82'
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("kline", [{"fast_init": False}], indirect=True)
+def test_five_baud_fallback(kline):
+    from shared.kwp_transport import KwpTransport
+
+    port, ecu = kline
+    transport = KwpTransport(port, target=ECU_ADDRESS, five_baud_bit_ms=ecu.bit_ms)
+    assert transport.connect(negotiate=False)
+    assert transport.init_mode == "5-baud"
+    assert ecu.five_baud_address == ECU_ADDRESS
+    assert ecu.requests == [b'\x81']                  # fast init tried first
+    assert transport.request(b'\x21\x01')[:2] == b'\x61\x01'
+
+
+@pytest.mark.unit
+def test_multiple_responses_and_session_layer(kline):
+    from shared.kwp_transport import KwpTransport
+    from shared.uds_session import UdsSessionManager
+
+    port, ecu = kline
+    transport = KwpTransport(port, target=ECU_ADDRESS)
+    assert transport.connect(negotiate=False)
+
+    answers = transport.request_all(b'\x01\x00')
+    assert [(message.source, message.data[:2]) for message in answers] == [(0x10, b'\x41\x00'), (0x18, b'\x41\x00')]
+
+    # request() takes the first answer; the second is dropped before the next request
+    assert transport.request(b'\x01\x00') == b'\x41\x00\xBE\x3E\xB8\x11'
+    assert transport.request(b'\x21\x01')[:2] == b'\x61\x01'
+
+    manager = UdsSessionManager(transport.send, transport.receive, auto_keep_alive=False)
+    assert manager.request(b'\x1A\x9B', ECU_ADDRESS, ECU_ADDRESS) == IDENT
+
+
+@pytest.mark.unit
+def test_default_target_is_addressed_functionally():
+    from shared.kwp_transport import KwpTransport
+
+    # StartCommunication to the OBD functional address 0x33
+    assert KwpTransport(None)._encode(b'\x81') == bytes.fromhex("C133F18166")
+    assert KwpTransport(None, target=ECU_ADDRESS)._encode(b'\x81')[0] == 0x81
+
+
+@pytest.mark.unit
+def test_idle_reinit_negotiates_timing_again(kline):
+    from shared.kwp_transport import KwpTransport
+
+    port, ecu = kline
+    transport = KwpTransport(port, target=ECU_ADDRESS)
+    assert transport.connect()
+    # Idle past P3max: the next request starts a new init
+    transport._last_activity -= transport.timing.p3_max_ms / 1000 + 1
+    del ecu.requests[:]
+    assert transport.request(b'\x3E\x01') == b'\x7E\x01'
+    assert ecu.requests[:2] == [b'\x81', b'\x83\x00'] and ecu.requests[-1] == b'\x3E\x01'
+    assert (transport.timing.p3_min_ms, transport.timing.p4_min_ms, transport.timing.p2_max_ms) == (5, 0, 25)
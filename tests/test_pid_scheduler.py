@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+tests/test_pid_scheduler.py – Mode 01 PID discovery, decoding and polling.
+
+A simulated ECU advances a fake clock by its response time, so rates can be
+checked deterministically.  All tests are marked ``unit``.
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+
+class SimulatedEcu:
+    """Answers Mode 01 requests; each request costs base + per-PID time"""
+
+    def __init__(self, base_rtt, per_pid=0.002):
+        self.now = 0.0
+        self.base_rtt = base_rtt
+        self.per_pid = per_pid
+        self.requests = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def request(self, data):
+        from shared.obd_pids import PID_DATA_LENGTHS
+
+        self.requests.append(data)
+        pids = list(data[1:])
+        self.now += self.base_rtt + self.per_pid * len(pids)
+        reply = bytearray([0x41])
+        for pid in pids:
+            reply += bytes([pid]) + bytes(PID_DATA_LENGTHS[pid])
+        return bytes(reply)
+
+
+@pytest.mark.unit
+def test_split_and_build_multi_pid():
+    from shared.obd_pids import build_mode01_request, split_mode01_response
+
+    assert build_mode01_request([0x0C, 0x0D, 0x05]) == bytes.fromhex("010C0D05")
+    assert split_mode01_response(bytes.fromhex("410C1AF80D32057B")) == {
+        0x0C: bytes.fromhex("1AF8"), 0x0D: b"\x32", 0x05: b"\x7B"}
+
+
+@pytest.mark.unit
+def test_rates_met_when_budget_allows():
+    """Each PID is polled near its own target rate; requests carry several PIDs."""
+    from shared.pid_scheduler import PidPollScheduler
+
+    ecu = SimulatedEcu(base_rtt=0.02)
+    scheduler = PidPollScheduler(ecu.request, clock=ecu.clock, sleep=ecu.sleep)
+    scheduler.add_pid(0x0C, 20, priority=10)  # RPM
+    scheduler.add_pid(0x0B, 10, priority=8)   # MAP / boost
+    scheduler.add_pid(0x0D, 5, priority=5)    # speed
+    scheduler.add_pid(0x05, 1, priority=1)    # coolant
+    scheduler.run_for(10.0)
+
+    report = scheduler.report()
+    for pid, target in ((0x0C, 20), (0x0B, 10), (0x0D, 5), (0x05, 1)):
+        assert report[pid]['achieved_hz'] == pytest.approx(target, rel=0.25)
+    assert any(len(req) > 2 for req in ecu.requests)  # multi-PID packing used
+
+
+@pytest.mark.unit
+def test_overload_favours_high_priority():
+    """With too little budget, low-priority PIDs are slowed, not the fast ones."""
+    from shared.pid_scheduler import PidPollScheduler
+
+    ecu = SimulatedEcu(base_rtt=0.1, per_pid=0.0)
+    scheduler = PidPollScheduler(ecu.request, max_pids_per_request=1, clock=ecu.clock, sleep=ecu.sleep)
+    scheduler.add_pid(0x0C, 6, priority=10)
+    scheduler.add_pid(0x0B, 3, priority=5)
+    scheduler.add_pid(0x05, 4, priority=1)
+    scheduler.run_for(20.0)
+
+    report = scheduler.report()
+    assert report[0x0C]['achieved_hz'] == pytest.approx(6, rel=0.15)
+    assert report[0x0B]['achieved_hz'] == pytest.approx(3, rel=0.2)
+    assert report[0x05]['achieved_hz'] < 2
+    assert report[0x05]['granted_hz'] < report[0x05]['target_hz']
+
+
+@pytest.mark.unit
+def test_achieved_rate_with_coarse_clock():
+    """Samples sharing one clock tick do not break the rate report."""
+    from shared.pid_scheduler import PidPollScheduler
+
+    ecu = SimulatedEcu(base_rtt=0.0, per_pid=0.0)
+    scheduler = PidPollScheduler(ecu.request, clock=ecu.clock, sleep=ecu.sleep, rate_window=0.05)
+    scheduler.add_pid(0x0C, 20, priority=10)
+    assert scheduler.poll_once()
+    ecu.now = 0.1                             # clock jumped a few ticks: overdue
+    assert scheduler.poll_once() and scheduler.poll_once()
+    assert scheduler.achieved_hz(0x0C) == pytest.approx(2 / 0.05)
+    assert scheduler.report()[0x0C]['achieved_hz'] > 0
+
+
+@pytest.mark.unit
+def test_pid_table_decodes_standard_formulas():
+    from shared.obd_pids import decode_pid, decode_supported_bitmap
+
+    assert decode_pid(0x0C, bytes.fromhex("1AF8")) == 1726.0
+    assert decode_pid(0x05, bytes([123])) == 83
+    assert decode_pid(0x14, bytes([0x50, 0x80])) == (0.4, 0.0)
+    assert decode_pid(0x32, bytes.fromhex("FFFC")) == -1.0  # signed
+    assert decode_pid(0x01, bytes(4)) is None  # bitfield, no formula
+    assert decode_supported_bitmap(0x00, bytes.fromhex("80000001")) == {0x01, 0x20}
+
+
+class HeaderDlcAdapter:
+    """ELM handler configured like HH OBD Advance (ATH1 + ATD1: ``7E8 8 06 41 ...``)"""
+
+    REPLIES = {
+        "0902": "7E8 8 10 14 49 02 01 31 47 31\r7E8 8 21 4A 43 35 34 34 34 52\r7E8 8 22 37 32 35 32 33 36 37\r",
+        "0100": "7E8 8 06 41 00 88 18 00 00 00\r7E9 8 06 41 00 80 00 00 00 00\r",
+        "010C": "7E8 8 04 41 0C 1A F8 00 00 00\r",
+    }
+
+    def __init__(self):
+        from shared.elm_parser import ElmResponseParser
+
+        self.parser = ElmResponseParser(headers=True, dlc=True)
+        self.sent = []
+
+    def execute_obd_command(self, command):
+        self.sent.append(command)
+        reply = self.REPLIES.get(command, "NO DATA\r") + "\r>"
+        return {"success": True, "response": reply, "messages": self.parser.messages(reply)}
+
+
+@pytest.mark.unit
+def test_supported_pids_with_header_and_dlc_lines(tmp_path):
+    """HH's line format feeds discovery, gating and decoding."""
+    from shared.json_cache import JsonCache
+    from shared.pid_discovery import SupportedPidsMixin
+
+    class Handler(SupportedPidsMixin, HeaderDlcAdapter):
+        pass
+
+    handler = Handler()
+    cache = JsonCache("pids.json", path=tmp_path / "pids.json")
+    assert handler.discover_supported_pids(cache=cache) == {0x01, 0x05, 0x0C, 0x0D}
+    assert handler.sent == ["0902", "0100"]
+    assert cache.get("1G1JC5444R7252367") == {"7E8": [0x01, 0x05, 0x0C, 0x0D], "7E9": [0x01]}
+
+    assert handler._pid_supported("010C") and not handler._pid_supported("012F")
+    result = handler.execute_obd_command("010C")
+    assert handler._decode_mode01("010C", result["messages"]) == 1726.0
+
+    handler.forget_supported_pids()
+    assert handler.supported_pids is None and handler._pid_supported("012F")
+
+
+@pytest.mark.unit
+def test_handler_live_data_scheduler_polls_supported_pids(tmp_path):
+    """A handler's live-data poller skips unsupported PIDs and stops with the vehicle."""
+    from shared.json_cache import JsonCache
+    from shared.pid_discovery import SupportedPidsMixin
+
+    class Handler(SupportedPidsMixin, HeaderDlcAdapter):
+        obd_pids = {'rpm': '010C', 'fuel_level': '012F'}
+        REPLIES = dict(HeaderDlcAdapter.REPLIES, **{"010C05": "7E8 8 06 41 0C 1A F8 05 7B 00\r"})
+
+    handler = Handler()
+    handler.discover_supported_pids(cache=JsonCache("pids.json", path=tmp_path / "pids.json"))
+    values = []
+    scheduler = handler.start_live_data({'rpm': (20, 10), 'fuel_level': (1, 0), '0105': (1, 0)},
+                                        on_value=lambda pid, data, t: values.append((pid, data)))
+    assert sorted(scheduler.report()) == [0x05, 0x0C]    # 0x2F is not supported
+    deadline = time.monotonic() + 2
+    while len(set(values)) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert set(values) == {(0x0C, bytes.fromhex("1AF8")), (0x05, bytes([0x7B]))}
+
+    handler.forget_supported_pids()
+    assert handler.live_data_scheduler is None and not scheduler._running
+
+
+@pytest.mark.unit
+def test_supported_pid_discovery_follows_chain_and_caches(tmp_path):
+    """Each ECU's bitmap chain is read once, then served from the cache by VIN."""
+    from shared.json_cache import JsonCache
+    from shared.pid_discovery import discover_supported_pids, supported_union
+    from shared.pid_scheduler import PidPollScheduler
+
+    bitmaps = {
+        0x7E8: {0x00: "BE3FA813", 0x20: "90058001", 0x40: "40000000"},  # ECM: 0x00..0x40
+        0x7E9: {0x00: "98188010"},                                      # TCM: 0x00 only
+    }
+    requests = []
+
+    def request(data):
+        requests.append(data.hex())
+        return [(ecu, bytes.fromhex(f"41{data[1]:02X}{table[data[1]]}"))
+                for ecu, table in bitmaps.items() if data[1] in table]
+
+    cache = JsonCache("pids.json", path=tmp_path / "pids.json")
+    supported = discover_supported_pids(request, vin="1G1JC5444R7252367", cache=cache)
+    assert requests == ["0100", "0120", "0140"]
+    assert 0x0C in supported[0x7E8] and 0x42 in supported[0x7E8]
+    assert supported[0x7E9] == {0x01, 0x04, 0x05, 0x0C, 0x0D, 0x11, 0x1C}
+
+    again = discover_supported_pids(request, vin="1G1JC5444R7252367", cache=cache)
+    assert again == supported and len(requests) == 3
+
+    scheduler = PidPollScheduler(lambda data: None, supported_pids=supported_union(supported))
+    assert scheduler.add_pid(0x0C, 10) is True
+    assert scheduler.add_pid(0x5C, 1) is False  # oil temperature not supported
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+tests/test_seed_key.py – seed/key algorithm registry and SecurityAccess unlock.
+
+A fake ECU hands out seeds (fixed or changing) and checks keys with its own
+algorithm; identification DIDs come from a dictionary.  All tests are
+marked ``unit``.
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+
+class LockedEcu:
+    def __init__(self, mask=0x5A3C, static_seed=True):
+        self.mask = mask
+        self.static_seed = static_seed
+        self.seed = b'\x12\x34\x56\x78'
+        self.requests = []
+
+    def __call__(self, request):
+        self.requests.append(request)
+        if request[1] % 2:
+            if not self.static_seed:
+                self.seed = bytes((b + 1) & 0xFF for b in self.seed)
+            return b'\x67' + request[1:2] + self.seed
+        from shared.seed_key import xor_algorithm
+        if request[2:] == xor_algorithm(self.mask)(self.seed, request[1] - 1):
+            return b'\x67' + request[1:2]
+        return b'\x7F\x27\x35'
+
+
+@pytest.mark.unit
+def test_most_specific_rule_wins_and_resolves_once():
+    from shared.seed_key import SeedKeyRegistry, xor_algorithm
+
+    registry = SeedKeyRegistry()
+    registry.register("supplier", xor_algorithm(0x1111), supplier=b'BOSCH')
+    registry.register("edc17", xor_algorithm(0x5A3C), supplier=b'BOSCH', part_number=b'03L906')
+    registry.register("level3", xor_algorithm(0x2222), levels=(0x03,), match={0xF1A0: b'V2'})
+    assert registry.identification_dids == [0xF187, 0xF18A, 0xF1A0]
+
+    ecu_ids = {0xF18A: b'BOSCH', 0xF187: b'03L906018JJ'}
+    assert registry.resolve(ecu_ids).name == "edc17"
+    assert registry.resolve({0xF18A: b'BOSCH', 0xF187: b'8V0907115'}).name == "supplier"
+    assert registry.resolve({0xF1A0: b'V2'}, level=0x01) is None
+    assert registry.resolve({}) is None
+
+    reads = []
+
+    def identify(dids):
+        reads.append(dids)
+        return ecu_ids
+
+    assert registry.algorithm_for("7E0", identify).name == "edc17"
+    assert registry.algorithm_for("7E0", identify).name == "edc17"
+    assert len(reads) == 1
+
+
+@pytest.mark.unit
+def test_static_seed_key_reused_for_the_session():
+    from shared.seed_key import SeedKeyRegistry, unlock, xor_algorithm
+
+    computed = []
+    registry = SeedKeyRegistry()
+
+    def edc17(seed, level):
+        computed.append(seed)
+        return xor_algorithm(0x5A3C)(seed, level)
+
+    registry.register("edc17", edc17, supplier=b'BOSCH')
+    ecu = LockedEcu()
+    identify = lambda dids: {0xF18A: b'BOSCH'}
+
+    for _ in range(3):
+        assert unlock(ecu, 0x01, "7E0", registry, identify=identify)
+    assert len(computed) == 1
+    assert registry.cached_key("7E0", 0x01, ecu.seed) is not None
+
+    # A changing seed is computed every time; a rejected key is not kept
+    changing = LockedEcu(static_seed=False)
+    assert unlock(changing, 0x01, "7E1", registry, identify=identify)
+    assert unlock(changing, 0x01, "7E1", registry, identify=identify)
+    assert len(computed) == 3
+    assert not unlock(LockedEcu(mask=0x0001), 0x01, "7E2", registry, identify=identify)
+    assert registry.cached_key("7E2", 0x01, ecu.seed) is None
+
+    registry.reset()
+    assert registry.cached_key("7E0", 0x01, ecu.seed) is None
+
+
+@pytest.mark.unit
+def test_unknown_ecu_is_not_unlocked():
+    from shared.seed_key import SeedKeyRegistry, unlock
+
+    ecu = LockedEcu()
+    assert not unlock(ecu, 0x01, "7E0", SeedKeyRegistry(), identify=lambda dids: {})
+    # Seed requested, no key guessed
+    assert [request[1] for request in ecu.requests] == [0x01]
+
+
+@pytest.mark.unit
+def test_identification_is_read_before_the_seed():
+    from shared.seed_key import SeedKeyRegistry, unlock, xor_algorithm
+
+    registry = SeedKeyRegistry()
+    registry.register("edc17", xor_algorithm(0x5A3C), supplier=b'BOSCH')
+    ecu = LockedEcu()
+
+    def identify(dids):
+        for did in dids:
+            ecu.requests.append(b'\x22' + did.to_bytes(2, 'big'))
+        return {0xF18A: b'BOSCH'}
+
+    assert unlock(ecu, 0x01, "7E0", registry, identify=identify)
+    assert [request[:2] for request in ecu.requests] == [b'\x22\xF1', b'\x27\x01', b'\x27\x02']
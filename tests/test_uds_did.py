@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+tests/test_uds_did.py – batched ReadDataByIdentifier (0x22).
+
+A fake ECU answers multi-DID requests up to its own limit, omits DIDs it
+does not support and rejects larger batches with NRC 0x13 or 0x14.
+All tests are marked ``unit``.
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+ECU_DATA = {
+    0xF187: b'8V0907115B',
+    0xF188: b'\x01\x02\x03\x04',
+    0xF189: b'0042',
+    0xF18C: b'SN123456789',
+    0xF190: b'WVWZZZ1KZAW000001',
+    0xF191: b'HW07',
+    0xF195: b'X123',
+}
+
+
+class FakeEcu:
+    def __init__(self, limit, nrc=0x13):
+        self.limit = limit
+        self.nrc = nrc
+        self.requests = []
+
+    def __call__(self, request):
+        self.requests.append(request)
+        dids = [int.from_bytes(request[i:i + 2], 'big') for i in range(1, len(request), 2)]
+        if len(dids) > self.limit:
+            return bytes([0x7F, 0x22, self.nrc])
+        response = bytearray([0x62])
+        for did in dids:
+            if did in ECU_DATA:
+                response += did.to_bytes(2, 'big') + ECU_DATA[did]
+        return bytes(response) if len(response) > 1 else b'\x7F\x22\x31'
+
+
+@pytest.mark.unit
+def test_batched_read_uses_learned_lengths():
+    from shared.uds_did import DidReader, ECU_IDENTIFICATION_DIDS
+
+    ecu = FakeEcu(limit=16)
+    reader = DidReader(ecu)
+    dids = list(ECU_IDENTIFICATION_DIDS) + [0xF1A0]   # last one unsupported
+
+    first = reader.read(dids)
+    assert first == {did: ECU_DATA[did] for did in dids if did in ECU_DATA}
+    first_requests = len(ecu.requests)
+
+    # Lengths learned from the first pass: one request for everything now
+    ecu.requests.clear()
+    assert reader.read(dids) == first
+    assert len(ecu.requests) == 1
+    assert first_requests < 2 * len(dids)
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("nrc", [0x13, 0x14])
+def test_batch_limit_probed_from_nrc(nrc):
+    from shared.uds_did import DidReader
+
+    dids = sorted(ECU_DATA)
+    lengths = {did: len(data) for did, data in ECU_DATA.items()}
+    ecu = FakeEcu(limit=3, nrc=nrc)
+    reader = DidReader(ecu, max_dids=8, lengths=lengths)
+
+    assert reader.read(dids) == ECU_DATA
+    assert reader.max_dids <= 3
+
+    # The probed limit is kept: no more rejected requests
+    ecu.requests.clear()
+    assert reader.read(dids) == ECU_DATA
+    assert len(ecu.requests) == -(-len(dids) // reader.max_dids)
+
+
+@pytest.mark.unit
+def test_split_response_and_decode():
+    from shared.uds_did import decode_did_value, split_read_response
+
+    payload = b'\x62\xF1\x90' + ECU_DATA[0xF190] + b'\xF1\x87' + ECU_DATA[0xF187]
+    assert split_read_response(payload, [0xF190, 0xF187], {0xF190: 17}) == {
+        0xF190: ECU_DATA[0xF190], 0xF187: ECU_DATA[0xF187]}
+    # Unknown length in the middle cannot be walked
+    assert split_read_response(payload, [0xF190, 0xF187], {}) is None
+
+    assert decode_did_value(b'WVWZZZ1KZAW000001') == 'WVWZZZ1KZAW000001'
+    assert decode_did_value(b'\x01\x02') == '0102'
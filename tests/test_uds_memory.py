@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+tests/test_uds_memory.py – bulk memory dump via 0x23 and 0x35/0x36/0x37.
+
+A simulated ECU serves a 512 KB area; it limits 0x23 reads and address
+formats and may refuse RequestUpload.  All tests are marked ``unit``.
+"""
+
+import hashlib
+import io
+import sys
+import zlib
+from collections import deque
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+BASE = 0x80000
+AREA = bytes((i * 7 + (i >> 8)) & 0xFF for i in range(512 * 1024))
+
+
+class MemoryEcu:
+    def __init__(self, max_read=0x400, address_formats=((3, 2),), upload_block=None,
+                 nrc=0x14, lose=()):
+        self.max_read = max_read
+        self.address_formats = set(address_formats)
+        self.upload_block = upload_block          # maxNumberOfBlockLength, None = no 0x35
+        self.nrc = nrc
+        self.lose = set(lose)                     # upload blocks whose first answer is lost
+        self.queue = deque()
+        self.requests = 0
+        self.upload = None
+
+    def send(self, data, tx_id, rx_id):
+        data = bytes(data)
+        self.requests += 1
+        self.queue.append(self._answer(data))
+        if self.queue[-1] is None:
+            self.queue.pop()
+        return True
+
+    def _decode(self, data):
+        fmt = data[0]
+        a, s = fmt & 0x0F, fmt >> 4
+        address = int.from_bytes(data[1:1 + a], 'big')
+        size = int.from_bytes(data[1 + a:1 + a + s], 'big')
+        return (a, s), address, size
+
+    def _answer(self, data):
+        if data[0] == 0x23:
+            fmt, address, size = self._decode(data[1:])
+            if fmt not in self.address_formats:
+                return b'\x7F\x23\x13'
+            if size > self.max_read:
+                return bytes([0x7F, 0x23, self.nrc])
+            if not BASE <= address <= address + size <= BASE + len(AREA):
+                return b'\x7F\x23\x31'
+            return b'\x63' + AREA[address - BASE:address - BASE + size]
+        if data[0] == 0x35:
+            if self.upload_block is None:
+                return b'\x7F\x35\x11'
+            _, address, size = self._decode(data[2:])
+            # next block offset, end offset, expected counter, offset of the last block sent
+            self.upload = [address - BASE, address - BASE + size, 1, None]
+            return b'\x75\x20' + self.upload_block.to_bytes(2, 'big')
+        if data[0] == 0x36:
+            position, end, expected, last = self.upload
+            block = self.upload_block - 2
+            if data[1] == (expected - 1) & 0xFF and last is not None:
+                position = last                   # repeated request: send the same block again
+            elif data[1] != expected:
+                return b'\x7F\x36\x73'
+            else:
+                self.upload = [position + block, end, (expected + 1) & 0xFF, position]
+            if data[1] in self.lose:
+                self.lose.discard(data[1])
+                return None
+            return b'\x76' + data[1:2] + AREA[position:min(position + block, end)]
+        if data[0] == 0x37:
+            return b'\x77'
+        return b'\x7F' + data[:1] + b'\x11'
+
+    def receive(self, tx_id, rx_id, timeout_ms):
+        return self.queue.popleft() if self.queue else None
+
+
+@pytest.mark.unit
+def test_read_by_address_probes_format_and_splits_on_nrc(tmp_path):
+    from shared.uds_memory import MAX_READ_CLASSIC, MemoryDumpEngine
+
+    ecu = MemoryEcu(max_read=0x400, address_formats={(3, 2), (2, 1)})
+    engine = MemoryDumpEngine(ecu.send, ecu.receive, p2_ms=5)
+    target = tmp_path / "cal.bin"
+    report = engine.dump(BASE, len(AREA), target, method="read")
+
+    assert report.success, report.error
+    assert engine.address_format == (3, 2)
+    assert target.read_bytes() == AREA
+    assert report.sha256 == hashlib.sha256(AREA).hexdigest()
+    assert report.crc32 == zlib.crc32(AREA)
+    # 4094 -> 2047 -> 1023 splits, then every read is as large as allowed
+    assert report.splits == 2 and report.read_size == 1023
+    minimum = len(AREA) // 0x400
+    assert report.requests < minimum * 1.01 + 8
+    assert MAX_READ_CLASSIC == 4094
+
+
+@pytest.mark.unit
+def test_upload_preferred_and_lost_block_repeated():
+    from shared.uds_memory import MemoryDumpEngine
+
+    ecu = MemoryEcu(upload_block=0x0FFF, lose={3, 100})
+    engine = MemoryDumpEngine(ecu.send, ecu.receive, p2_ms=5)
+    output = io.BytesIO()
+    report = engine.dump(BASE, len(AREA), output)
+
+    assert report.success, report.error
+    assert report.method == "upload" and report.read_size == 0x0FFD
+    assert output.getvalue() == AREA
+    assert report.requests == -(-len(AREA) // 0x0FFD) + 2
+
+
+@pytest.mark.unit
+def test_auto_falls_back_to_read_and_reports_unreadable_area():
+    from shared.uds_memory import MemoryDumpEngine
+
+    ecu = MemoryEcu(max_read=0xFFF, nrc=0x13)
+    engine = MemoryDumpEngine(ecu.send, ecu.receive, p2_ms=5)
+    output = io.BytesIO()
+    report = engine.dump(BASE + len(AREA) - 4096, 8192, output)
+
+    assert report.method == "read"
+    assert not report.success
+    assert "failed" in report.error
+    assert output.getvalue() == AREA[-4096:]
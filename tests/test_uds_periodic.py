@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+tests/test_uds_periodic.py – periodic DID streaming (0x2C / 0x2A).
+
+A fake ECU accepts dynamic DID definitions and, once 0x2A is received,
+pushes ``6A <pDID> <data>`` messages every few milliseconds.  The stream
+runs through the UDS session layer exactly as on a real channel.
+All tests are marked ``unit``.
+"""
+
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+SOURCE_DIDS = {
+    0x1000: b'\x1F\x40',    # engine speed * 4 -> 2000 rpm
+    0x1001: b'\x5A',        # coolant + 40 -> 50 °C
+    0x1002: b'\x00\x64',    # boost kPa
+    0x1003: b'\x32',        # throttle %
+}
+
+
+class PeriodicEcu:
+    """Answers 0x2C/0x2A and pushes periodic data while enabled"""
+
+    def __init__(self, period=0.005, supports_periodic=True):
+        self.period = period
+        self.supports_periodic = supports_periodic
+        self.requests = []
+        self.defined = {}
+        self.active = []
+        self.next_push = 0.0
+        self.queue = deque()
+        self.cond = threading.Condition()
+
+    def send(self, data, tx_id, rx_id):
+        data = bytes(data)
+        with self.cond:
+            self.requests.append(data)
+            self.queue.append(self._answer(data))
+            self.cond.notify_all()
+        return True
+
+    def _answer(self, data):
+        if data[0] == 0x2C and data[1] == 0x01:
+            if not self.supports_periodic:
+                return b'\x7F\x2C\x11'
+            did = int.from_bytes(data[2:4], 'big')
+            self.defined[did] = [(int.from_bytes(data[i:i + 2], 'big'), data[i + 2], data[i + 3])
+                                 for i in range(4, len(data), 4)]
+            return b'\x6C\x01' + data[2:4]
+        if data[0] == 0x2C and data[1] == 0x03:
+            self.defined.pop(int.from_bytes(data[2:4], 'big'), None)
+            return b'\x6C\x03' + data[2:4]
+        if data[0] == 0x2A:
+            if data[1] == 0x04:
+                self.active = []
+            else:
+                self.active = list(data[2:])
+                self.next_push = time.monotonic()
+            return b'\x6A'
+        return b'\x7F' + data[:1] + b'\x11'
+
+    def _periodic(self, low):
+        payload = bytearray([0x6A, low])
+        for did, position, size in self.defined[0xF200 | low]:
+            payload += SOURCE_DIDS[did][position - 1:position - 1 + size]
+        return bytes(payload)
+
+    def receive(self, tx_id, rx_id, timeout_ms):
+        deadline = time.monotonic() + timeout_ms / 1000.0
+        with self.cond:
+            while True:
+                if self.queue:
+                    return self.queue.popleft()
+                now = time.monotonic()
+                if self.active and now >= self.next_push:
+                    self.next_push += self.period
+                    for low in self.active:
+                        self.queue.append(self._periodic(low))
+                    continue
+                wait = deadline - now
+                if self.active:
+                    wait = min(wait, self.next_push - now)
+                if deadline - now <= 0:
+                    return None
+                self.cond.wait(max(wait, 0.0005))
+
+
+def _signals():
+    from shared.uds_periodic import StreamSignal
+    return [
+        StreamSignal("Engine speed", 0x1000, size=2, scale=0.25, unit="rpm"),
+        StreamSignal("Coolant", 0x1001, offset=-40, unit="°C"),
+        StreamSignal("Boost", 0x1002, size=2, unit="kPa"),
+        StreamSignal("Throttle", 0x1003, unit="%"),
+    ]
+
+
+@pytest.mark.unit
+def test_signals_packed_into_single_frame_dids():
+    from shared.uds_periodic import pack_signals
+
+    definitions = pack_signals(_signals(), max_data=5)
+    assert [d.size for d in definitions] == [5, 1]
+    assert definitions[0].define_request() == bytes.fromhex("2C01F200" "10000102" "10010101" "10020102")
+    assert all(d.size <= 5 for d in pack_signals(_signals(), max_data=3))
+
+
+@pytest.mark.unit
+def test_periodic_stream_through_session_layer():
+    from shared.uds_periodic import PeriodicDidStream, PeriodicRate
+    from shared.uds_session import UdsSessionManager
+
+    ecu = PeriodicEcu(period=0.005)
+    manager = UdsSessionManager(ecu.send, ecu.receive, auto_keep_alive=False)
+    samples = []
+    stream = PeriodicDidStream(lambda data: manager.request(data, 0x7E0, 0x7E8),
+                               on_values=lambda values, ts: samples.append(values))
+    manager.add_listener(0x7E8, stream.feed)
+
+    assert stream.start(_signals(), PeriodicRate.FAST)
+    manager.start_listening(0x7E0, 0x7E8, poll_ms=10)
+    try:
+        time.sleep(0.3)
+        # A regular request still gets through while data is streaming
+        assert manager.request(b'\x22\xF1\x90', 0x7E0, 0x7E8) == b'\x7F\x22\x11'
+        time.sleep(0.1)
+    finally:
+        manager.stop_listening()
+    messages = sum(d.messages for d in stream.definitions.values())
+    assert stream.stop()
+
+    assert stream.values == {"Engine speed": 2000.0, "Coolant": 50.0, "Boost": 100.0, "Throttle": 50.0}
+    # Two periodic DIDs at 5 ms for ~0.4 s, from only a handful of requests
+    assert messages == len(samples) >= 60
+    setup = [r for r in ecu.requests if r[0] in (0x2C, 0x2A)]
+    assert len(setup) == 2 + 1 + 1 + 2    # define x2, start, stop, clear x2
+    assert not ecu.active and not ecu.defined
+
+
+@pytest.mark.unit
+def test_stream_refused_falls_back():
+    from shared.uds_periodic import PeriodicDidStream
+    from shared.uds_session import UdsSessionManager
+
+    ecu = PeriodicEcu(supports_periodic=False)
+    manager = UdsSessionManager(ecu.send, ecu.receive, auto_keep_alive=False)
+    stream = PeriodicDidStream(lambda data: manager.request(data, 0x7E0, 0x7E8))
+    assert not stream.start(_signals())
+    assert not stream.active and not stream.definitions
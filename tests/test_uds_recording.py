@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+tests/test_uds_recording.py – record a UDS conversation and replay it.
+
+A scripted ECU (answers per request, optional delay and 0x78) is recorded
+through the session layer; replays run without it, directly and through
+VCIManager.  All tests are marked ``unit``.
+"""
+
+import sys
+import time
+from collections import deque
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+VIN = b'WVWZZZ1KZAW000001'
+
+
+class ScriptedEcu:
+    def __init__(self, script, delay=0.0):
+        self.script = {request: deque(answers) for request, answers in script.items()}
+        self.delay = delay
+        self.queue = deque()
+
+    def send(self, data, tx_id, rx_id):
+        answers = self.script.get(bytes(data))
+        if answers:
+            self.queue.extend(answers.popleft() if len(answers) > 1 else answers[0])
+        return True
+
+    def receive(self, tx_id, rx_id, timeout_ms):
+        if not self.queue:
+            return None
+        time.sleep(self.delay)
+        return self.queue.popleft()
+
+
+def _record_flow(tmp_path, delay=0.0):
+    from shared.uds_recording import UdsRecorder
+    from shared.uds_session import UdsSessionManager
+
+    ecu = ScriptedEcu({
+        b'\x22\xF1\x90': [[b'\x62\xF1\x90' + VIN]],
+        b'\x19\x02\xFF': [[b'\x59\x02\xFF\x01\x30\x00\x2F'], [b'\x59\x02\xFF']],
+        b'\x14\xFF\xFF\xFF': [[b'\x7F\x14\x78', b'\x54']],
+    }, delay=delay)
+    recorder = UdsRecorder()
+    manager = UdsSessionManager(*recorder.wrap(ecu.send, ecu.receive), auto_keep_alive=False)
+    answers = [manager.request(request, 0x7E0, 0x7E8)
+               for request in (b'\x22\xF1\x90', b'\x19\x02\xFF', b'\x14\xFF\xFF\xFF', b'\x19\x02\xFF')]
+    return recorder.save(tmp_path / "flow.udsrec", vehicle="test"), answers
+
+
+FLOW = (b'\x22\xF1\x90', b'\x19\x02\xFF', b'\x14\xFF\xFF\xFF', b'\x19\x02\xFF')
+
+
+@pytest.mark.unit
+def test_replay_reproduces_flow_without_ecu(tmp_path):
+    from shared.uds_recording import UdsReplayTransport, load_recording
+    from shared.uds_session import UdsSessionManager
+
+    path, recorded = _record_flow(tmp_path)
+    assert recorded[1] != recorded[3]                       # DTCs cleared in between
+    exchanges = load_recording(path)
+    assert [exchange.request for exchange in exchanges] == list(FLOW)
+    assert [data for _, data in exchanges[2].responses] == [b'\x7F\x14\x78', b'\x54']
+
+    replay = UdsReplayTransport(path)
+    manager = UdsSessionManager(replay.send, replay.receive, auto_keep_alive=False)
+    assert [manager.request(request, 0x7E0, 0x7E8) for request in FLOW] == recorded
+    # Polled again: the last recorded answer repeats; other DIDs fall back to the service
+    assert manager.request(b'\x19\x02\xFF', 0x7E0, 0x7E8) == recorded[3]
+    assert manager.request(b'\x22\xF1\x87', 0x7E0, 0x7E8) == recorded[0]
+    assert manager.request(b'\x31\x01\x02\x03', 0x7E0, 0x7E8, timeout_ms=1) is None
+    assert (replay.matched, replay.by_service, replay.unmatched) == (5, 1, 1)
+
+
+@pytest.mark.unit
+def test_timing_faithful_replay(tmp_path):
+    from shared.uds_recording import UdsReplayTransport
+    from shared.uds_session import UdsSessionManager
+
+    path, recorded = _record_flow(tmp_path, delay=0.03)
+    replay = UdsReplayTransport(path, timing=True)
+    manager = UdsSessionManager(replay.send, replay.receive, auto_keep_alive=False)
+
+    start = time.monotonic()
+    assert manager.request(FLOW[0], 0x7E0, 0x7E8) == recorded[0]
+    assert time.monotonic() - start >= 0.025
+    # Shorter than the recorded latency: the request times out as it would have
+    assert manager.request(FLOW[1], 0x7E0, 0x7E8, timeout_ms=5) is None
+
+
+@pytest.mark.unit
+def test_vci_manager_replays_and_records(tmp_path):
+    from AutoDiag.core.vci_manager import VCIManager
+    from shared.uds_recording import load_recording
+
+    path, recorded = _record_flow(tmp_path)
+    manager = VCIManager()
+    assert not manager.connect_replay(tmp_path / "missing.udsrec")
+    assert manager.connect_replay(path)
+    manager.start_recording()
+    try:
+        answers = [manager.send_uds_request(request) for request in FLOW]
+    finally:
+        saved = manager.stop_recording(tmp_path / "again.udsrec")
+        manager.disconnect()
+    assert answers == recorded
+    assert [exchange.request for exchange in load_recording(saved)] == list(FLOW)
+    assert not manager.is_connected()
+
+
+@pytest.mark.unit
+def test_scan_is_recorded_and_replayed(tmp_path):
+    from AutoDiag.core.vci_manager import VCIManager
+    from shared.ecu_scan import READ_DTCS, READ_VIN, physical_scan
+    from shared.uds_recording import UdsRecorder, load_recording
+    from shared.uds_session import UdsSessionManager
+
+    ecus = {tx_id: ScriptedEcu({b'\x3E\x00': [[b'\x7E\x00']],
+                                READ_VIN: [[b'\x62\xF1\x90' + VIN]],
+                                READ_DTCS: [[b'\x59\x02\xFF' + bytes([tx_id & 0x0F, 0x30, 0x00, 0x2F])]]})
+            for tx_id in (0x7E0, 0x7E1)}
+    silent = ScriptedEcu({})
+
+    def send(data, tx_id, rx_id):
+        return ecus.get(tx_id, silent).send(data, tx_id, rx_id)
+
+    def receive(tx_id, rx_id, timeout_ms):
+        return ecus.get(tx_id, silent).receive(tx_id, rx_id, timeout_ms)
+
+    recorder = UdsRecorder()
+    sessions = UdsSessionManager(*recorder.wrap(send, receive), auto_keep_alive=False)
+    scanned = physical_scan(sessions.request, probe_timeout_ms=lambda tx_id, rx_id: 1)
+    assert sorted(scanned) == [0x7E8, 0x7E9]
+    path = recorder.save(tmp_path / "scan.udsrec")
+
+    manager = VCIManager()
+    assert manager.connect_replay(path)
+    manager.start_recording()
+    try:
+        replayed = manager.scan_ecus()
+    finally:
+        saved = manager.stop_recording(tmp_path / "scan-again.udsrec")
+        manager.disconnect()
+    assert {rx: result.responses for rx, result in replayed.items()} == \
+        {rx: result.responses for rx, result in scanned.items()}
+    assert [exchange.request for exchange in load_recording(saved)] == \
+        [exchange.request for exchange in load_recording(path)]
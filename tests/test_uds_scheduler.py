@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+tests/test_uds_scheduler.py – priority classes and request coalescing.
+
+A fake channel records the order in which requests reach the bus and can
+be slowed down so that callers queue up.  All tests are marked ``unit``.
+"""
+
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+
+class FakeChannel:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.sent = []
+
+    def __call__(self, data, tx_id, rx_id, timeout_ms):
+        self.sent.append(bytes(data))
+        time.sleep(self.delay)
+        return bytes([data[0] + 0x40]) + bytes(data[1:])
+
+
+def _start(target, *args, **kwargs):
+    thread = threading.Thread(target=target, args=args, kwargs=kwargs, daemon=True)
+    thread.start()
+    return thread
+
+
+def _wait_queued(scheduler, count):
+    deadline = time.monotonic() + 2
+    while len(scheduler._queue) < count and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+@pytest.mark.unit
+def test_highest_class_goes_next():
+    from shared.uds_scheduler import RequestPriority, UdsRequestScheduler
+
+    channel = FakeChannel()
+    scheduler = UdsRequestScheduler(channel)
+    threads = []
+    with scheduler.turn(RequestPriority.FLASH):
+        for data, priority in [(b'\x3E\x00', RequestPriority.KEEP_ALIVE),
+                               (b'\x22\x10\x00', RequestPriority.LIVE_DATA),
+                               (b'\x19\x02\xFF', RequestPriority.USER),
+                               (b'\x22\x10\x01', RequestPriority.LIVE_DATA)]:
+            threads.append(_start(scheduler.submit, data, 0x7E0, 0x7E8, priority=priority))
+            _wait_queued(scheduler, len(threads))
+        # The holder's own requests run straight through
+        assert scheduler.submit(b'\x36\x01', 0x7E0, 0x7E8, priority=RequestPriority.FLASH) == b'\x76\x01'
+        assert scheduler.busy()
+        assert scheduler.snapshot()["LIVE_DATA"]["queue_depth"] == 2
+    for thread in threads:
+        thread.join(2)
+
+    assert channel.sent == [b'\x36\x01', b'\x19\x02\xFF', b'\x22\x10\x00', b'\x22\x10\x01', b'\x3E\x00']
+    assert not scheduler.busy()
+    stats = scheduler.snapshot()
+    assert stats["LIVE_DATA"]["max_queue_depth"] == 2 and stats["LIVE_DATA"]["queue_depth"] == 0
+    assert stats["KEEP_ALIVE"]["max_wait_ms"] >= stats["USER"]["max_wait_ms"] > 0
+
+
+@pytest.mark.unit
+def test_identical_reads_share_one_transaction():
+    from shared.uds_scheduler import RequestPriority, UdsRequestScheduler
+
+    channel = FakeChannel(delay=0.05)
+    scheduler = UdsRequestScheduler(channel)
+    results = []
+
+    def read(data, priority):
+        results.append(scheduler.submit(data, 0x7E0, 0x7E8, priority=priority))
+
+    threads = [_start(read, b'\x22\xF1\x90', RequestPriority.USER)]
+    time.sleep(0.01)
+    threads += [_start(read, b'\x22\xF1\x90', RequestPriority.LIVE_DATA) for _ in range(3)]
+    # Writes are never coalesced
+    threads += [_start(read, b'\x2E\x01\x00\x01', RequestPriority.USER) for _ in range(2)]
+    for thread in threads:
+        thread.join(2)
+
+    assert channel.sent.count(b'\x22\xF1\x90') == 1
+    assert channel.sent.count(b'\x2E\x01\x00\x01') == 2
+    assert results.count(b'\x62\xF1\x90') == 4
+    assert scheduler.stats[RequestPriority.LIVE_DATA].coalesced == 3
+
+
+@pytest.mark.unit
+def test_queued_request_lifted_by_higher_priority_caller():
+    from shared.uds_scheduler import RequestPriority, UdsRequestScheduler
+
+    channel = FakeChannel()
+    scheduler = UdsRequestScheduler(channel)
+    with scheduler.turn(RequestPriority.FLASH):
+        threads = [_start(scheduler.submit, b'\x22\x20\x00', 0x7E0, 0x7E8, priority=RequestPriority.LIVE_DATA)]
+        _wait_queued(scheduler, 1)
+        threads.append(_start(scheduler.submit, b'\x22\x10\x00', 0x7E0, 0x7E8,
+                              priority=RequestPriority.KEEP_ALIVE))
+        _wait_queued(scheduler, 2)
+        threads.append(_start(scheduler.submit, b'\x22\x10\x00', 0x7E0, 0x7E8, priority=RequestPriority.USER))
+        deadline = time.monotonic() + 2
+        while not scheduler.stats[RequestPriority.USER].coalesced and time.monotonic() < deadline:
+            time.sleep(0.001)
+    for thread in threads:
+        thread.join(2)
+
+    assert channel.sent == [b'\x22\x10\x00', b'\x22\x20\x00']
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+tests/test_uds_session.py – UDS session layer: response pending (0x78),
+session/security tracking and the idle keep-alive.
+
+A scripted ECU answers each request with a list of responses; the fake
+transport records what was sent and the timeout each receive used.
+All tests are marked ``unit``.
+"""
+
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+
+class ScriptedEcu:
+    """Answers requests from a script of request prefix -> [responses]"""
+
+    def __init__(self, script=None, delay=0.0):
+        self.script = dict(script or {})
+        self.delay = delay
+        self.sent = []
+        self.timeouts = []
+        self.queue = deque()
+        self.lock = threading.Lock()
+
+    def send(self, data, tx_id, rx_id):
+        with self.lock:
+            self.sent.append(bytes(data))
+        if data[:2] == b'\x3E\x80':
+            return True  # suppressed positive response
+        for prefix, responses in self.script.items():
+            if bytes(data).startswith(prefix):
+                self.queue.extend(responses)
+                break
+        return True
+
+    def receive(self, tx_id, rx_id, timeout_ms):
+        self.timeouts.append(timeout_ms)
+        if self.delay:
+            time.sleep(self.delay)
+        return self.queue.popleft() if self.queue else None
+
+
+@pytest.mark.unit
+def test_response_pending_waits_with_announced_p2_star():
+    from shared.uds_session import UdsSessionManager
+
+    ecu = ScriptedEcu({
+        # Extended session, P2 = 25 ms, P2* = 300 * 10 ms
+        b'\x10\x03': [b'\x50\x03\x00\x19\x01\x2C'],
+        b'\x31\x01': [b'\x7F\x31\x78', b'\x7F\x31\x78', b'\x71\x01\xFF\x00'],
+    })
+    manager = UdsSessionManager(ecu.send, ecu.receive, auto_keep_alive=False)
+
+    assert manager.request(b'\x10\x03', 0x7E0, 0x7E8) == b'\x50\x03\x00\x19\x01\x2C'
+    session = manager.get_session(0x7E0)
+    assert (session.p2_ms, session.p2_star_ms) == (25, 3000)
+
+    ecu.timeouts.clear()
+    assert manager.request(b'\x31\x01\xFF\x00', 0x7E0, 0x7E8) == b'\x71\x01\xFF\x00'
+    margin = manager.response_margin_ms
+    assert ecu.timeouts == [25 + margin, 3000 + margin, 3000 + margin]
+
+
+@pytest.mark.unit
+def test_pending_limit_and_unrelated_responses():
+    from shared.uds_session import UdsSessionManager
+
+    ecu = ScriptedEcu({
+        b'\x22': [b'\x7E\x00', b'\x62\xF1\x90' + b'V' * 17],   # stray tester present reply first
+        b'\x2E': [b'\x7F\x2E\x78'] * 5,
+    })
+    manager = UdsSessionManager(ecu.send, ecu.receive, max_pending=3, auto_keep_alive=False)
+
+    assert manager.request(b'\x22\xF1\x90').startswith(b'\x62\xF1\x90')
+    assert manager.request(b'\x2E\xF1\x90\x00') is None
+
+
+@pytest.mark.unit
+def test_session_and_security_tracking():
+    from shared.uds_session import DEFAULT_SESSION, UdsSessionManager
+
+    ecu = ScriptedEcu({
+        b'\x10\x03': [b'\x50\x03\x00\x32\x01\xF4'],
+        b'\x27\x01': [b'\x67\x01\x12\x34'],
+        b'\x27\x02': [b'\x67\x02'],
+        b'\x27\x03': [b'\x7F\x27\x35'],
+        b'\x11\x01': [b'\x51\x01'],
+    })
+    manager = UdsSessionManager(ecu.send, ecu.receive, auto_keep_alive=False)
+    session = manager.get_session(0x7E0, 0x7E8)
+
+    manager.request(b'\x10\x03')
+    assert session.session == 0x03 and session.needs_keep_alive
+
+    manager.request(b'\x27\x01')
+    assert session.security_level == 0          # seed alone unlocks nothing
+    manager.request(b'\x27\x02\xAA\xBB')
+    assert session.security_level == 0x01
+    manager.request(b'\x27\x03')
+    assert session.security_level == 0x01       # a refused seed keeps the old level
+
+    manager.request(b'\x11\x01')
+    assert session.session == DEFAULT_SESSION
+    assert session.security_level == 0 and not session.needs_keep_alive
+
+
+@pytest.mark.unit
+def test_keep_alive_only_while_idle():
+    from shared.uds_session import TESTER_PRESENT_SUPPRESSED, UdsSessionManager
+
+    ecu = ScriptedEcu({
+        b'\x10\x03': [b'\x50\x03\x00\x32\x01\xF4'],
+        b'\x22': [b'\x62\xF1\x90\x00'],
+    })
+    manager = UdsSessionManager(ecu.send, ecu.receive, keep_alive_interval=0.1)
+    try:
+        manager.request(b'\x10\x03')
+        assert manager._running                 # started by the non-default session
+
+        # Busy link: a request every 20 ms leaves no idle interval
+        stop_at = time.monotonic() + 0.4
+        while time.monotonic() < stop_at:
+            manager.request(b'\x22\xF1\x90')
+            time.sleep(0.02)
+        assert TESTER_PRESENT_SUPPRESSED not in ecu.sent
+
+        # Idle link: tester present roughly once per interval
+        time.sleep(0.45)
+        keep_alives = ecu.sent.count(TESTER_PRESENT_SUPPRESSED)
+        assert 2 <= keep_alives <= 5
+        assert manager.get_session(0x7E0).keep_alives == keep_alives
+    finally:
+        manager.stop_keep_alive()
+
+
+@pytest.mark.unit
+def test_no_keep_alive_in_default_session():
+    from shared.uds_session import UdsSessionManager
+
+    ecu = ScriptedEcu({b'\x22': [b'\x62\xF1\x90\x00']})
+    manager = UdsSessionManager(ecu.send, ecu.receive, keep_alive_interval=0.05)
+    manager.request(b'\x22\xF1\x90')
+    manager.keep_alive_due(time.monotonic() + 1.0)
+    assert ecu.sent == [b'\x22\xF1\x90']
+    assert not manager._running
+
+
+class LatentEcu:
+    """Answers every request after ``latency`` seconds; None = never answers"""
+
+    def __init__(self, latency=0.01):
+        self.latency = latency
+        self.due = None
+        self.timeouts = []
+
+    def send(self, data, tx_id, rx_id):
+        self.due = None if self.latency is None else (time.monotonic() + self.latency, bytes([data[0] + 0x40]))
+        return True
+
+    def receive(self, tx_id, rx_id, timeout_ms):
+        self.timeouts.append(timeout_ms)
+        if self.due is None or self.due[0] - time.monotonic() > timeout_ms / 1000:
+            time.sleep(timeout_ms / 1000)
+            return None
+        time.sleep(max(0.0, self.due[0] - time.monotonic()))
+        response, self.due = self.due[1], None
+        return response
+
+
+@pytest.mark.unit
+def test_timeout_follows_p2_and_observed_latency():
+    from shared.uds_session import FIRST_CONTACT_TIMEOUT_MS, LATENCY_HEADROOM, UdsSessionManager
+
+    ecu = LatentEcu(latency=0.15)
+    manager = UdsSessionManager(ecu.send, ecu.receive, response_margin_ms=5, auto_keep_alive=False)
+
+    # Not heard from yet: the first request allows for adapter latency, a probe does not
+    assert manager.response_timeout_ms(0x7E1) == FIRST_CONTACT_TIMEOUT_MS + 5
+    assert manager.response_timeout_ms(0x7E1, probe=True) == 50 + 5
+    assert manager.request(b'\x22\xF1\x90', 0x7E1, 0x7E9) == b'\x62'
+    assert ecu.timeouts == [FIRST_CONTACT_TIMEOUT_MS + 5]
+
+    # Once it has answered: P2 plus one grace wait, then a counted timeout
+    ecu.latency = None
+    ecu.timeouts.clear()
+    assert manager.request(b'\x22\xF1\x90', 0x7E1, 0x7E9) is None
+    assert ecu.timeouts == [55, 55 * 3]
+    assert manager.get_session(0x7E1).timeouts == 1
+
+    # Fast ECU: timeout stays at P2 (never below)
+    ecu.latency = 0.005
+    for _ in range(5):
+        assert manager.request(b'\x22\xF1\x90', 0x7E0, 0x7E8) == b'\x62'
+    assert manager.response_timeout_ms(0x7E0) == 55
+
+    # Slower than P2: the miss gets a grace wait, and the timeout widens
+    ecu.latency = 0.08
+    ecu.timeouts.clear()
+    assert manager.request(b'\x22\xF1\x90', 0x7E0, 0x7E8) == b'\x62'
+    assert ecu.timeouts == [55, 55 * 3]
+    widened = manager.response_timeout_ms(0x7E0)
+    assert 80 * LATENCY_HEADROOM + 5 <= widened < 80 * LATENCY_HEADROOM + 5 + 40
+    ecu.timeouts.clear()
+    assert manager.request(b'\x22\xF1\x90', 0x7E0, 0x7E8) == b'\x62'
+    assert ecu.timeouts == [widened]
+
+    # An explicit timeout still wins
+    ecu.timeouts.clear()
+    manager.request(b'\x22\xF1\x90', 0x7E0, 0x7E8, timeout_ms=500)
+    assert ecu.timeouts == [500]